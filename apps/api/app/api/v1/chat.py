@@ -1,100 +1,203 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.responses import StreamingResponse, JSONResponse
-from typing import List, Dict, AsyncGenerator, Optional
+from fastapi import APIRouter, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from typing import List, Dict, AsyncGenerator, Optional, Tuple
 import json
 import asyncio
 import traceback
 import logging
-import tiktoken
 import uuid
-from datetime import datetime
-import redis.asyncio as redis
-from app.core.config import settings, Settings
+from app.core.config import settings
+from app.core.admission import admission_controller, AdmissionRejected, AdmittedStreamingResponse
+from app.core.messages import ChatMessage
+from app.core.pricing import estimate_cost
+from app.core.tasks import task_registry
+from app.core.tokens import count_tokens
 from app.services.router import ModelRouter
+from app.services.conversation_store import get_conversation_store
 from app.services.memory import MemoryManager
-from app.services.subscription import SubscriptionService
+from app.services.providers import get_provider, get_provider_name
+from app.services.subscription import (
+    STORAGE_LIMITS, SubscriptionService, SubscriptionTier, UsageReservation, to_micros, usage_fields
+)
+from app.services.summarizer import ConversationSummarizer
+from app.services.semantic_memory import semantic_memory
 from app.providers.base import BaseProvider
-from app.providers.deepseek import DeepSeekProvider
-from app.providers.glm import GLMProvider
-from app.providers.qwen import QwenProvider
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-memory_manager = MemoryManager()
+memory_manager = get_conversation_store()
+# Summaries need the Redis backend
+summarizer = ConversationSummarizer(memory_manager) if isinstance(memory_manager, MemoryManager) else None
+if summarizer:
+    # Messages trimmed off conversations over their tier's cap are summarized first
+    memory_manager.trim_hook = summarizer.fold_trimmed
 
-# Initialize tiktoken encoder (using cl100k_base which is used by GPT-3.5/4)
-try:
-    encoding = tiktoken.get_encoding("cl100k_base")
-except:
-    encoding = None
-    logger.warning("Failed to initialize tiktoken encoder")
+class ChatRequest(BaseModel):
+    messages: List[ChatMessage]
+    model: str = "auto"
+    temperature: float = 0.7
+    stream: bool = True
+    conversation_id: Optional[str] = None
+    user_id: Optional[str] = None
 
-def count_tokens(text: str) -> int:
-    """Count tokens in text using tiktoken"""
-    if encoding:
-        try:
-            return len(encoding.encode(text))
-        except:
-            # Fallback to rough estimation
-            return len(text) // 4
-    else:
-        # Rough estimation: 1 token ≈ 4 characters
-        return len(text) // 4
+# Map frontend model names to actual model names
+MODEL_MAPPING = {
+    "deepseek": "deepseek-chat",
+    "glm": "glm-4.5",
+    "qwen": "qwen3-235b-a22b"
+}
 
-async def update_token_usage(
+def get_upgrade_message(tier: SubscriptionTier) -> str:
+    """Upsell text appended to usage limit errors"""
+    if tier.value == "FREE":
+        return "Upgrade to Starter ($9.99/mo) for 2,000 messages per month or Pro ($19.99/mo) for unlimited messages."
+    elif tier.value == "STARTER":
+        return "Upgrade to Pro ($19.99/mo) for unlimited messages."
+    return ""
+
+def get_limit_message(tier: SubscriptionTier, reservation: UsageReservation) -> str:
+    """Error message for a user whose request a usage limit denied"""
+    exceeded = reservation.exceeded or "daily"
+    limit = reservation.limit
+    period = "monthly" if exceeded.startswith("monthly") else "daily"
+    if exceeded.endswith("_tokens"):
+        if reservation.remaining:
+            return f"This request needs more than the {reservation.remaining:,} tokens left of your {period} limit of {limit:,} tokens. {get_upgrade_message(tier)}"
+        return f"Usage limit exceeded. You've reached your {period} limit of {limit:,} tokens. {get_upgrade_message(tier)}"
+    if exceeded.endswith("_cost"):
+        return f"Usage limit exceeded. This request would exceed your {period} usage budget of ${limit:.2f}. {get_upgrade_message(tier)}"
+    return f"Usage limit exceeded. You've reached your {limit} message{'s' if limit != 1 else ''} limit. {get_upgrade_message(tier)}"
+
+async def check_quota(subscription_service: SubscriptionService, user_id: str) -> Optional[SubscriptionTier]:
+    """Turn a request away (429) before any work if nothing remains under the user's limits
+    
+    Returns the user's tier, for the reservation made once the request is
+    priced; None if the check failed, in which case the request proceeds.
+    """
+    try:
+        tier = await subscription_service.get_user_tier(user_id)
+        reservation = await subscription_service.check_usage(user_id, tier)
+    except Exception as e:
+        logger.warning(f"Subscription check failed: {e}. Allowing request to proceed.")
+        return None
+    if not reservation.allowed:
+        raise HTTPException(status_code=429, detail=get_limit_message(tier, reservation))
+    return tier
+
+async def resolve_model(
+    model_router: ModelRouter,
+    requested_model: str,
+    messages: List[ChatMessage],
+    user_id: Optional[str] = None
+) -> str:
+    """Route "auto" requests to the best model, otherwise map the frontend model name"""
+    if requested_model == "auto":
+        selected_model_enum, selection_reason = await model_router.select_model(
+            query=messages[-1].content,
+            user_preference=requested_model,
+            context_length=sum(len(m.content) for m in messages),
+            user_id=user_id
+        )
+        logger.info(f"Model selection: {selected_model_enum} (reason: {selection_reason})")
+        return selected_model_enum.value
+    
+    selected_model = MODEL_MAPPING.get(requested_model, requested_model)
+    logger.info(f"Using user-specified model: {requested_model} -> {selected_model}")
+    return selected_model
+
+async def load_context(
+    conversation_id: str,
+    user_id: str
+) -> Tuple[List[ChatMessage], List[ChatMessage]]:
+    """Load stored context as (summary messages, history messages)"""
+    context = await memory_manager.get_chat_context(
+        conversation_id,
+        user_id,
+        include_summary=settings.SUMMARIZATION_ENABLED
+    )
+    summary_messages = [msg for msg in context if msg.summary]
+    context_messages = [msg for msg in context if not msg.summary]
+    return summary_messages, context_messages
+
+def new_turns(stored: List[ChatMessage], sent: List[ChatMessage]) -> List[ChatMessage]:
+    """The turns of sent that follow the stored history
+    
+    Clients send the whole conversation with every message, so sent usually
+    repeats the stored history and ends with the one new user message. The
+    latest point where the stored tail lines up with sent (role and content,
+    as far back as both go) marks where the new turns start; sent is new as
+    a whole if it never does, e.g. when the client sends only new turns.
+    """
+    if not stored:
+        return sent
+    tail = [(msg.role, msg.content) for msg in stored]
+    turns = [(msg.role, msg.content) for msg in sent]
+    for end in range(len(turns), 0, -1):
+        overlap = min(end, len(tail))
+        if turns[end - overlap:end] == tail[-overlap:]:
+            return sent[end:]
+    return sent
+
+async def save_conversation(
+    conversation_id: str,
     user_id: str,
-    input_tokens: int,
-    output_tokens: int,
-    redis_client: redis.Redis,
-    model: str
+    messages: List[ChatMessage],
+    model: str,
+    subscription_service: Optional[SubscriptionService] = None
 ):
-    """Update user's token usage in Redis with model tracking"""
-    if not user_id or user_id == "anonymous":
+    """Store a finished exchange, then compact the conversation if it grew too long
+    
+    With a subscription service, the user's tier's storage limits are kept.
+    """
+    limits = None
+    if subscription_service and settings.STORAGE_LIMITS_ENABLED:
+        limits = STORAGE_LIMITS[await subscription_service.get_user_tier(user_id)]
+    
+    try:
+        logger.info(f"Starting save for conversation {conversation_id}")
+        next_seq = await memory_manager.store_conversation(
+            conversation_id,
+            user_id,
+            messages,
+            model,
+            limits
+        )
+        logger.info(f"Successfully saved conversation {conversation_id}")
+    except Exception as e:
+        logger.error(f"Failed to save conversation {conversation_id}: {e}")
+        return
+    
+    if settings.SEMANTIC_MEMORY_ENABLED and next_seq is not None:
+        # Embedding is slow; it must not hold up summarization
+        task_registry.spawn(
+            index_semantic_memory(conversation_id, user_id, messages, next_seq - len(messages))
+        )
+    
+    if not summarizer:
         return
-        
     try:
-        # Use local timezone to match subscription service
-        date_key = datetime.now().strftime("%Y-%m-%d")
-        usage_key = f"usage:{user_id}:{date_key}"
-        
-        # Increment token counts
-        await redis_client.hincrby(usage_key, "input_tokens", input_tokens)
-        await redis_client.hincrby(usage_key, "output_tokens", output_tokens)
-        await redis_client.hincrby(usage_key, "total_tokens", input_tokens + output_tokens)
-        
-        # Track model-specific usage
-        await redis_client.hincrby(usage_key, f"model:{model}:tokens", input_tokens + output_tokens)
-        
-        # Set expiry to 30 days
-        await redis_client.expire(usage_key, 30 * 24 * 60 * 60)
-        
+        await summarizer.summarize_if_needed(conversation_id, user_id)
     except Exception as e:
-        logger.error(f"Failed to update token usage: {e}")
-
-def get_provider(provider_name: str, settings: Settings) -> BaseProvider:
-    """Get provider instance with proper API key configuration"""
-    if provider_name == "deepseek":
-        return DeepSeekProvider(api_key=settings.DEEPSEEK_API_KEY)
-    elif provider_name == "glm":
-        return GLMProvider(api_key=settings.GLM_API_KEY)
-    elif provider_name == "qwen":
-        return QwenProvider(api_key=settings.QWEN_API_KEY)
-    else:
-        raise ValueError(f"Unknown provider: {provider_name}")
-
-class ChatMessage(BaseModel):
-    role: str
-    content: str
+        logger.error(f"Failed to summarize conversation {conversation_id}: {e}")
 
-class ChatRequest(BaseModel):
-    messages: List[ChatMessage]
-    model: str = "auto"
-    temperature: float = 0.7
-    stream: bool = True
-    conversation_id: Optional[str] = None
-    user_id: Optional[str] = None
+async def index_semantic_memory(
+    conversation_id: str,
+    user_id: str,
+    messages: List[ChatMessage],
+    first_seq: int
+):
+    """Embed a stored exchange for semantic recall"""
+    try:
+        await semantic_memory.index_messages(
+            conversation_id,
+            user_id,
+            [msg.to_dict() for msg in messages],
+            first_seq
+        )
+    except Exception as e:
+        logger.error(f"Failed to embed conversation {conversation_id}: {e}")
 
 async def stream_response(
     provider: BaseProvider,
@@ -103,15 +206,24 @@ async def stream_response(
     temperature: float,
     conversation_id: Optional[str] = None,
     user_id: Optional[str] = None,
-    redis_client: Optional[redis.Redis] = None,
-    subscription_service: Optional[SubscriptionService] = None
+    subscription_service: Optional[SubscriptionService] = None,
+    new_messages: Optional[List[ChatMessage]] = None,
+    reservation: Optional[UsageReservation] = None,
+    input_tokens: Optional[int] = None
 ) -> AsyncGenerator[str, None]:
-    """Stream response from LLM provider with token counting"""
+    """Stream response from LLM provider with token counting
+    
+    new_messages are the turns to append to the stored conversation ahead of
+    the answer; by default every prompt message is treated as new.
+    reservation is the usage counted for the request (see finish_exchange).
+    input_tokens, when already counted, saves counting them again.
+    """
     logger.info(f"stream_response called with model: {model}, provider: {type(provider).__name__}")
     
     # Count input tokens
-    input_text = "".join([msg.content for msg in messages])
-    input_tokens = count_tokens(input_text)
+    if input_tokens is None:
+        input_text = "".join([msg.content for msg in messages])
+        input_tokens = count_tokens(input_text)
     
     full_response = ""
     try:
@@ -127,51 +239,73 @@ async def stream_response(
     finally:
         yield "data: [DONE]\n\n"
         
-        # Count output tokens
-        output_tokens = count_tokens(full_response)
-        
-        # Update token usage if user_id and redis_client provided
-        if user_id and redis_client:
-            asyncio.create_task(
-                update_token_usage(
-                    user_id,
-                    input_tokens,
-                    output_tokens,
-                    redis_client,
-                    model
-                )
-            )
-            
-            # Increment message count for subscription limits
-            if subscription_service and user_id:
-                try:
-                    await subscription_service.increment_usage(user_id)
-                except Exception as e:
-                    logger.warning(f"Failed to increment usage count: {e}")
-        
-        # Store the complete conversation including assistant response if conversation_id provided
-        if conversation_id and full_response and user_id:
-            assistant_message = ChatMessage(role="assistant", content=full_response)
-            all_messages = messages + [assistant_message]
-            logger.info(f"[PRE-TASK] About to create async save task for conversation {conversation_id}")
-            async def save_with_logging():
-                try:
-                    logger.info(f"Starting save for conversation {conversation_id}")
-                    await memory_manager.store_conversation(
-                        conversation_id,
-                        user_id,
-                        all_messages,
-                        model
-                    )
-                    logger.info(f"Successfully saved conversation {conversation_id}")
-                except Exception as e:
-                    logger.error(f"Failed to save conversation {conversation_id}: {e}")
+        await finish_exchange(
+            model,
+            input_tokens,
+            full_response,
+            messages if new_messages is None else new_messages,
+            conversation_id,
+            user_id,
+            subscription_service,
+            reservation
+        )
 
-            asyncio.create_task(save_with_logging())
+async def finish_exchange(
+    model: str,
+    input_tokens: int,
+    response_text: str,
+    new_messages: List[ChatMessage],
+    conversation_id: Optional[str],
+    user_id: Optional[str],
+    subscription_service: Optional[SubscriptionService],
+    reservation: Optional[UsageReservation] = None,
+    cancelled: bool = False
+):
+    """Settle the quota reservation with the usage recorded and store the exchange
+    
+    The message and its estimated input were counted against the user's
+    limits when the request was admitted (reservation). The tokens and cost
+    the exchange used replace the estimate, in the same counters /usage
+    reports; an exchange without an answer (the provider failed) gives the
+    reservation back, unless the client cancelled it. The subscription
+    service also sets the storage limits the exchange is stored under.
+    """
+    # Count output tokens
+    output_tokens = count_tokens(response_text)
+    
+    if subscription_service and user_id and user_id != "anonymous":
+        used = input_tokens + output_tokens
+        cost = estimate_cost(model, input_tokens, output_tokens)
+        fields = usage_fields(model, input_tokens, output_tokens)
+        try:
+            if not (response_text or cancelled):
+                # Nothing was answered: the request doesn't count
+                await subscription_service.refund_usage(user_id, reservation)
+            elif reservation:
+                await subscription_service.settle_usage(user_id, reservation, used, cost, fields)
+            else:
+                # Let through without a reservation: record what it used
+                await subscription_service.increment_usage(user_id, units=0, tokens=used, cost=cost, fields=fields)
+        except Exception as e:
+            logger.warning(f"Failed to settle usage count: {e}")
+    
+    # Append the new turns and the assistant response if conversation_id provided
+    if conversation_id and response_text and user_id:
+        assistant_message = ChatMessage(role="assistant", content=response_text)
+        all_messages = new_messages + [assistant_message]
+        logger.info(f"[PRE-TASK] About to create async save task for conversation {conversation_id}")
+        task_registry.spawn(
+            save_conversation(conversation_id, user_id, all_messages, model, subscription_service)
+        )
 
 @router.post("/completions")
 async def chat_completions(request: ChatRequest, req: Request):
     """Main chat endpoint with intelligent routing"""
+    # Shed load before doing any work
+    ticket = await admission_controller.acquire(request.user_id)
+    stream_holds_ticket = False
+    reservation: Optional[UsageReservation] = None
+    answered = False
     try:
         # Get model router with Redis connection
         model_router = ModelRouter(redis_client=req.app.state.redis)
@@ -179,80 +313,33 @@ async def chat_completions(request: ChatRequest, req: Request):
         # Initialize subscription service
         subscription_service = SubscriptionService(redis_client=req.app.state.redis)
         
-        # Check usage limits if user_id is provided
-        remaining_messages = -1  # -1 means unlimited
-        if request.user_id:
-            try:
-                allowed, remaining, limit = await subscription_service.check_usage_limit(request.user_id)
-                remaining_messages = remaining
-                
-                if not allowed:
-                    # Determine appropriate upgrade message based on current tier
-                    tier = await subscription_service.get_user_tier(request.user_id)
-                    upgrade_message = ""
-                    if tier.value == "FREE":
-                        upgrade_message = "Upgrade to Starter ($9.99/mo) for 2,000 messages per month or Pro ($19.99/mo) for unlimited messages."
-                    elif tier.value == "STARTER":
-                        upgrade_message = "Upgrade to Pro ($19.99/mo) for unlimited messages."
-                    
-                    raise HTTPException(
-                        status_code=429,
-                        detail=f"Usage limit exceeded. You've reached your {limit} message{'s' if limit != 1 else ''} limit. {upgrade_message}"
-                    )
-            except HTTPException:
-                # Re-raise HTTP exceptions (like 429 rate limit)
-                raise
-            except Exception as e:
-                # Log error but don't block if subscription check fails
-                logger.warning(f"Subscription check failed: {e}. Allowing request to proceed.")
-        
         # Generate conversation_id if not provided
         if not request.conversation_id:
             request.conversation_id = str(uuid.uuid4())
             logger.info(f"Generated new conversation_id: {request.conversation_id}")
         
+        # Deny users with nothing left before loading context and routing
+        tier = await check_quota(subscription_service, request.user_id) if request.user_id else None
+        
         # Keep as ChatMessage objects
         messages = request.messages
+        new_messages = request.messages
         
-        # Get conversation context if conversation_id provided
+        # Get conversation context if conversation_id provided, taking only
+        # the turns it doesn't hold yet from the request
         if request.conversation_id and request.user_id:
-            context = await memory_manager.get_context(
+            summary_messages, context_messages = await load_context(
                 request.conversation_id,
                 request.user_id
             )
-            # Convert context dicts to ChatMessage objects and prepend
-            context_messages = [ChatMessage(**msg) for msg in context]
-            messages = context_messages + messages
+            new_messages = new_turns(context_messages, request.messages)
+            messages = summary_messages + context_messages + new_messages
         
         # Route to best model
-        if request.model == "auto":
-            selected_model_enum, selection_reason = await model_router.select_model(
-                query=messages[-1].content,
-                user_preference=request.model,
-                context_length=sum(len(m.content) for m in messages)
-            )
-            logger.info(f"Model selection: {selected_model_enum} (reason: {selection_reason})")
-            logger.info(f"Model value: {selected_model_enum.value}")
-            selected_model = selected_model_enum.value
-            logger.info(f"Selected model string: {selected_model}")
-        else:
-            # Map frontend model names to actual model names
-            model_mapping = {
-                "deepseek": "deepseek-chat",
-                "glm": "glm-4.5",
-                "qwen": "qwen3-235b-a22b"
-            }
-            selected_model = model_mapping.get(request.model, request.model)
-            logger.info(f"Using user-specified model: {request.model} -> {selected_model}")
+        selected_model = await resolve_model(model_router, request.model, messages, request.user_id)
         
         # Get provider
-        # Extract provider name from model string
-        # Special handling: qwen3-2507 → qwen (not qwen3)
-        # Standard format: deepseek-chat → deepseek, glm-4.5 → glm
-        if selected_model.startswith("qwen3"):
-            provider_name = "qwen"  # Map qwen3-* models to qwen provider
-        else:
-            provider_name = selected_model.split("-")[0]  # Standard extraction
+        provider_name = get_provider_name(selected_model)
         logger.info(f"Provider name extracted: {provider_name}")
         try:
             provider = get_provider(provider_name, settings)
@@ -261,12 +348,44 @@ async def chat_completions(request: ChatRequest, req: Request):
             logger.error(f"Failed to get provider: {e}")
             raise HTTPException(400, str(e))
         
+        # Count input tokens
+        input_text = "".join([msg.content for msg in messages])
+        input_tokens = count_tokens(input_text)
+        
+        # Count the message and its input against usage limits if user_id is provided
+        remaining_messages = -1  # -1 means unlimited
+        if request.user_id:
+            try:
+                tier = tier or await subscription_service.get_user_tier(request.user_id)
+                reservation = await subscription_service.reserve_usage(
+                    request.user_id,
+                    tier,
+                    tokens=input_tokens,
+                    cost=estimate_cost(selected_model, input_tokens)
+                )
+                remaining_messages = reservation.remaining
+                
+                if not reservation.allowed:
+                    # Upgrade message based on current tier
+                    raise HTTPException(
+                        status_code=429,
+                        detail=get_limit_message(tier, reservation)
+                    )
+            except HTTPException:
+                # Re-raise HTTP exceptions (like 429 rate limit)
+                raise
+            except Exception as e:
+                # Log error but don't block if subscription check fails
+                logger.warning(f"Subscription check failed: {e}. Allowing request to proceed.")
+        
         # Note: Conversation will be stored after response completes
         
         # Stream or return response
         logger.info(f"About to call provider with model: {selected_model}, streaming: {request.stream}")
         if request.stream:
-            return StreamingResponse(
+            # The response holds the slot until it has been sent
+            stream_holds_ticket = True
+            return AdmittedStreamingResponse(
                 stream_response(
                     provider, 
                     messages, 
@@ -274,9 +393,12 @@ async def chat_completions(request: ChatRequest, req: Request):
                     request.temperature,
                     request.conversation_id,
                     request.user_id if request.user_id else "anonymous",
-                    req.app.state.redis,
-                    subscription_service
+                    subscription_service,
+                    new_messages,
+                    reservation,
+                    input_tokens
                 ),
+                ticket,
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
@@ -287,53 +409,23 @@ async def chat_completions(request: ChatRequest, req: Request):
             )
         else:
             # Non-streaming response
-            # Count input tokens
-            input_text = "".join([msg.content for msg in messages])
-            input_tokens = count_tokens(input_text)
-            
             response = await provider.complete(messages, selected_model, request.temperature)
+            answered = True
             
             # Count output tokens
             output_tokens = count_tokens(response.content)
             
-            # Update token usage if user_id provided
-            if request.user_id:
-                asyncio.create_task(
-                    update_token_usage(
-                        request.user_id,
-                        input_tokens,
-                        output_tokens,
-                        req.app.state.redis,
-                        selected_model
-                    )
-                )
-                
-                # Increment message count for subscription limits
-                try:
-                    await subscription_service.increment_usage(request.user_id)
-                except Exception as e:
-                    logger.warning(f"Failed to increment usage count: {e}")
-            
-            # Store the complete conversation including assistant response if conversation_id provided
-            if request.conversation_id and request.user_id:
-                assistant_message = ChatMessage(role="assistant", content=response.content)
-                all_messages = messages + [assistant_message]
-                
-                logger.info(f"[PRE-TASK] About to create async save task for conversation {request.conversation_id}")
-                async def save_with_logging():
-                    try:
-                        logger.info(f"Starting save for conversation {request.conversation_id}")
-                        await memory_manager.store_conversation(
-                            request.conversation_id,
-                            request.user_id if request.user_id else "anonymous",
-                            all_messages,
-                            selected_model
-                        )
-                        logger.info(f"Successfully saved conversation {request.conversation_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to save conversation {request.conversation_id}: {e}")
-                
-                asyncio.create_task(save_with_logging())
+            # Count what the answer used and store the exchange
+            await finish_exchange(
+                selected_model,
+                input_tokens,
+                response.content,
+                new_messages,
+                request.conversation_id,
+                request.user_id,
+                subscription_service,
+                reservation
+            )
             
             return JSONResponse(
                 content={
@@ -364,6 +456,543 @@ async def chat_completions(request: ChatRequest, req: Request):
         logger.error(f"Error in chat completion: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not stream_holds_ticket:
+            ticket.release()
+            # The request failed before an answer: its message doesn't count
+            if reservation and not answered:
+                try:
+                    await subscription_service.refund_usage(request.user_id, reservation)
+                except Exception as e:
+                    logger.warning(f"Failed to refund usage count: {e}")
+
+class CompareRequest(BaseModel):
+    messages: List[ChatMessage]
+    models: List[str] = ["deepseek", "glm", "qwen"]
+    temperature: float = 0.7
+    conversation_id: Optional[str] = None
+    user_id: Optional[str] = None
+
+def get_branch_conversation_id(conversation_id: str, comparison_id: str, model: str) -> str:
+    """Conversation id under which one model's answer of a comparison is stored
+    
+    Every comparison gets fresh branches of the conversation (see
+    MemoryManager.fork_conversation), sharing its stored history.
+    """
+    return f"{conversation_id}:{comparison_id}:{model}"
+
+async def stream_comparison(
+    providers: Dict[str, BaseProvider],
+    messages: List[ChatMessage],
+    history: List[ChatMessage],
+    temperature: float,
+    conversation_id: str,
+    user_id: Optional[str],
+    subscription_service: Optional[SubscriptionService],
+    new_messages: Optional[List[ChatMessage]] = None,
+    reservation: Optional[UsageReservation] = None,
+    input_tokens: Optional[int] = None
+) -> AsyncGenerator[str, None]:
+    """Stream several providers concurrently, multiplexed into one SSE stream
+    
+    Every event carries the model it belongs to. Each model's answer is stored
+    in its own branch conversation after the history that led to it: a
+    branch of the stored conversation holding only new_messages and the
+    answer, or a copy of history where the conversation can't be branched.
+    
+    reservation holds the usage counted for the comparison: each model's
+    input, settled or given back as its model answers or fails (see
+    finish_exchange), and the messages: one per model, each given back with
+    its model's input, or, by default, one given back if no model answers.
+    """
+    comparison_id = uuid.uuid4().hex[:8]
+    if input_tokens is None:
+        input_tokens = count_tokens("".join([msg.content for msg in messages]))
+    per_model_quota = settings.COMPARE_QUOTA_MODE == "per_model"
+    branch_reservations = {
+        model: reservation._replace(
+            units=1 if per_model_quota else 0,
+            tokens=input_tokens,
+            cost_micros=to_micros(estimate_cost(model, input_tokens))
+        ) if reservation and reservation.allowed else None
+        for model in providers
+    }
+    answered = set()
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    branches = {model: get_branch_conversation_id(conversation_id, comparison_id, model) for model in providers}
+    stored = {model: history for model in providers}
+    can_branch = isinstance(memory_manager, MemoryManager)
+    if can_branch and user_id and new_messages is not None and len(history) > len(new_messages):
+        for model, branch_id in branches.items():
+            try:
+                await memory_manager.fork_conversation(conversation_id, user_id, branch_id=branch_id)
+                stored[model] = new_messages
+            except Exception as e:
+                logger.warning(f"Failed to branch conversation {conversation_id}, storing a copy: {e}")
+    
+    async def run_branch(model: str, provider: BaseProvider):
+        full_response = ""
+        try:
+            async for chunk in provider.stream(messages, model, temperature):
+                full_response += chunk
+                await queue.put({"model": model, "content": chunk})
+            await queue.put({"model": model, "done": True})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put({"model": model, "error": str(e)})
+        finally:
+            if full_response:
+                answered.add(model)
+            await finish_exchange(
+                model,
+                input_tokens,
+                full_response,
+                stored[model],
+                branches[model] if user_id else None,
+                user_id,
+                subscription_service,
+                branch_reservations[model]
+            )
+    
+    tasks = [
+        asyncio.create_task(run_branch(model, provider))
+        for model, provider in providers.items()
+    ]
+    completed = False
+    try:
+        data = json.dumps({"branches": branches})
+        yield f"data: {data}\n\n"
+        
+        pending = len(tasks)
+        while pending:
+            event = await queue.get()
+            if "done" in event or "error" in event:
+                pending -= 1
+            yield f"data: {json.dumps(event)}\n\n"
+        
+        yield "data: [DONE]\n\n"
+        completed = True
+    finally:
+        # Stop branches still streaming if the client went away; finished
+        # branches are left to complete their usage accounting and storage
+        if not completed:
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # A comparison counts as a single message unless configured per model
+        if not per_model_quota and not answered and subscription_service and user_id and reservation:
+            try:
+                # The branches gave back their input
+                await subscription_service.refund_usage(user_id, reservation._replace(tokens=0, cost_micros=0))
+            except Exception as e:
+                logger.warning(f"Failed to refund usage count: {e}")
+
+@router.post("/completions/compare")
+async def compare_completions(request: CompareRequest, req: Request):
+    """Answer the same prompt with several models side by side"""
+    # A comparison takes a single admission slot
+    ticket = await admission_controller.acquire(request.user_id)
+    stream_holds_ticket = False
+    reservation: Optional[UsageReservation] = None
+    try:
+        model_router = ModelRouter(redis_client=req.app.state.redis)
+        subscription_service = SubscriptionService(redis_client=req.app.state.redis)
+        
+        if not request.messages:
+            raise HTTPException(status_code=400, detail="No messages provided")
+        
+        requested_models = list(dict.fromkeys(request.models))
+        if not requested_models or len(requested_models) > settings.COMPARE_MAX_MODELS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Compare between 1 and {settings.COMPARE_MAX_MODELS} models"
+            )
+        
+        if not request.conversation_id:
+            request.conversation_id = str(uuid.uuid4())
+        
+        # Deny users with nothing left before loading context and routing
+        tier = await check_quota(subscription_service, request.user_id) if request.user_id else None
+        
+        # Load context once for every branch
+        messages = request.messages
+        new_messages = request.messages
+        history = messages
+        if request.user_id:
+            summary_messages, context_messages = await load_context(
+                request.conversation_id,
+                request.user_id
+            )
+            new_messages = new_turns(context_messages, request.messages)
+            history = context_messages + new_messages
+            messages = summary_messages + history
+        
+        providers = {}
+        for requested_model in requested_models:
+            selected_model = await resolve_model(model_router, requested_model, messages, request.user_id)
+            if selected_model in providers:
+                continue
+            try:
+                providers[selected_model] = get_provider(get_provider_name(selected_model), settings)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+        
+        # Count the comparison against usage limits once, for every model it needs
+        # and the input every model is sent
+        input_tokens = count_tokens("".join([msg.content for msg in messages]))
+        remaining_messages = -1  # -1 means unlimited
+        if request.user_id:
+            needed = len(providers) if settings.COMPARE_QUOTA_MODE == "per_model" else 1
+            try:
+                tier = tier or await subscription_service.get_user_tier(request.user_id)
+                reservation = await subscription_service.reserve_usage(
+                    request.user_id,
+                    tier,
+                    units=needed,
+                    tokens=input_tokens * len(providers),
+                    cost=sum(estimate_cost(model, input_tokens) for model in providers)
+                )
+                remaining_messages = reservation.remaining
+                
+                if not reservation.allowed:
+                    raise HTTPException(
+                        status_code=429,
+                        detail=f"Comparing {needed} models needs {needed} messages but only {reservation.remaining} remain. {get_upgrade_message(tier)}"
+                        if reservation.exceeded in ("daily", "monthly") and reservation.remaining else
+                        get_limit_message(tier, reservation)
+                    )
+            except HTTPException:
+                raise
+            except Exception as e:
+                # Log error but don't block if subscription check fails
+                logger.warning(f"Subscription check failed: {e}. Allowing request to proceed.")
+        
+        stream_holds_ticket = True
+        return AdmittedStreamingResponse(
+            stream_comparison(
+                providers,
+                messages,
+                history,
+                request.temperature,
+                request.conversation_id,
+                request.user_id,
+                subscription_service,
+                new_messages,
+                reservation,
+                input_tokens
+            ),
+            ticket,
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Selected-Model": ",".join(providers),
+                "X-Messages-Remaining": str(remaining_messages),
+                "X-Conversation-Id": request.conversation_id
+            }
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in compare completion: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not stream_holds_ticket:
+            ticket.release()
+            # The comparison failed before streaming: its messages don't count
+            if reservation:
+                try:
+                    await subscription_service.refund_usage(request.user_id, reservation)
+                except Exception as e:
+                    logger.warning(f"Failed to refund usage count: {e}")
+
+class ChatSession:
+    """Per-connection state for the WebSocket chat endpoint
+    
+    The tier and conversation context are loaded once and then kept up to
+    date locally, so each message skips the lookups that every /completions
+    request repeats. Each message is counted against the user's limits as
+    it starts, in one round trip shared with the user's other sessions.
+    """
+    
+    def __init__(self, websocket: WebSocket, user_id: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.redis_client = websocket.app.state.redis
+        self.model_router = ModelRouter(redis_client=self.redis_client)
+        self.subscription_service = SubscriptionService(redis_client=self.redis_client)
+        self.tier: Optional[SubscriptionTier] = None
+        self.remaining_messages = -1  # -1 means unlimited
+        self.limit: Optional[int] = None
+        self.contexts: Dict[str, Tuple[List[ChatMessage], List[ChatMessage]]] = {}
+        self.generations: Dict[str, asyncio.Task] = {}
+        self.max_context_messages = 20
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+    
+    async def send(self, payload: Dict):
+        """Send a frame; generations share one socket so sends are serialized"""
+        if self.closed:
+            return
+        async with self._send_lock:
+            await self.websocket.send_json(payload)
+    
+    async def load_quota(self):
+        """Fetch tier and remaining messages from the subscription service"""
+        self.tier = await self.subscription_service.get_user_tier(self.user_id)
+        allowed, remaining, limit = await self.subscription_service.check_usage_limit(self.user_id, self.tier)
+        self.remaining_messages = remaining
+        self.limit = limit
+        return allowed
+    
+    async def send_limit(self, message_id: str, reservation: UsageReservation):
+        """Tell the client a message was denied by the user's limits"""
+        await self.send({
+            "type": "error",
+            "id": message_id,
+            "status": 429,
+            "error": get_limit_message(self.tier or SubscriptionTier.FREE, reservation)
+        })
+    
+    async def check_message(self) -> Optional[UsageReservation]:
+        """Check the user's limits before any work on a message: the denial, or None to go on"""
+        try:
+            if self.tier is None:
+                self.tier = await self.subscription_service.get_user_tier(self.user_id)
+            reservation = await self.subscription_service.check_usage(self.user_id, self.tier)
+        except Exception as e:
+            logger.warning(f"Subscription check failed: {e}. Allowing message to proceed.")
+            return None
+        return None if reservation.allowed else reservation
+    
+    async def reserve_message(self, model: str, input_tokens: int) -> Tuple[bool, Optional[UsageReservation]]:
+        """Count a message and its input against the user's limits: (allowed, reservation to settle)"""
+        try:
+            # The tier couldn't be loaded with the session: fetch it once here
+            if self.tier is None:
+                self.tier = await self.subscription_service.get_user_tier(self.user_id)
+            reservation = await self.subscription_service.reserve_usage(
+                self.user_id,
+                self.tier,
+                tokens=input_tokens,
+                cost=estimate_cost(model, input_tokens)
+            )
+        except Exception as e:
+            # Don't block if subscription check fails
+            logger.warning(f"Subscription check failed: {e}. Allowing message to proceed.")
+            return True, None
+        if reservation.allowed:
+            self.remaining_messages = reservation.remaining
+            self.limit = reservation.limit
+        return reservation.allowed, reservation
+    
+    async def get_context(self, conversation_id: str) -> Tuple[List[ChatMessage], List[ChatMessage]]:
+        """Get (summary, history) for a conversation, loading it on first use"""
+        if conversation_id not in self.contexts:
+            self.contexts[conversation_id] = await load_context(conversation_id, self.user_id)
+        return self.contexts[conversation_id]
+    
+    def append_context(self, conversation_id: str, messages: List[ChatMessage]):
+        """Add a finished exchange to the cached context"""
+        summary_messages, context_messages = self.contexts.get(conversation_id, ([], []))
+        context_messages = (context_messages + messages)[-self.max_context_messages:]
+        self.contexts[conversation_id] = (summary_messages, context_messages)
+    
+    async def generate(self, message_id: str, request: ChatRequest):
+        """Quota-check and run one generation, streaming its chunks tagged with message_id"""
+        # Deny users with nothing left before loading context and routing
+        denied = await self.check_message()
+        if denied:
+            await self.send_limit(message_id, denied)
+            return
+        
+        conversation_id = request.conversation_id
+        summary_messages, context_messages = await self.get_context(conversation_id)
+        new_messages = new_turns(context_messages, request.messages)
+        messages = summary_messages + context_messages + new_messages
+        
+        selected_model = await resolve_model(self.model_router, request.model, messages, self.user_id)
+        provider = get_provider(get_provider_name(selected_model), settings)
+        
+        input_tokens = count_tokens("".join([msg.content for msg in messages]))
+        allowed, reservation = await self.reserve_message(selected_model, input_tokens)
+        if not allowed:
+            await self.send_limit(message_id, reservation)
+            return
+        
+        await self.send({
+            "type": "start",
+            "id": message_id,
+            "conversation_id": conversation_id,
+            "model": selected_model,
+            "messages_remaining": self.remaining_messages
+        })
+        
+        full_response = ""
+        try:
+            async for chunk in provider.stream(messages, selected_model, request.temperature):
+                full_response += chunk
+                await self.send({"type": "chunk", "id": message_id, "content": chunk})
+        except asyncio.CancelledError:
+            # Cancelled generations still count against usage but are not stored
+            await finish_exchange(
+                selected_model, input_tokens, full_response, new_messages, None,
+                self.user_id, self.subscription_service, reservation, cancelled=True
+            )
+            raise
+        except Exception as e:
+            await self.send({"type": "error", "id": message_id, "error": str(e)})
+        else:
+            await self.send({"type": "done", "id": message_id})
+        
+        await finish_exchange(
+            selected_model, input_tokens, full_response, new_messages, conversation_id,
+            self.user_id, self.subscription_service, reservation
+        )
+        if full_response:
+            self.append_context(
+                conversation_id,
+                new_messages + [ChatMessage(role="assistant", content=full_response)]
+            )
+    
+    async def run_generation(self, message_id: str, request: ChatRequest):
+        """Task wrapper that admits and reports errors for one generation"""
+        try:
+            try:
+                ticket = await admission_controller.acquire(self.user_id)
+            except AdmissionRejected as e:
+                await self.send({
+                    "type": "error",
+                    "id": message_id,
+                    "status": e.status_code,
+                    "retry_after": e.retry_after,
+                    "error": e.detail
+                })
+                return
+            
+            async with ticket:
+                await self.generate(message_id, request)
+        except Exception as e:
+            logger.error(f"WebSocket generation {message_id} failed: {e}")
+            try:
+                await self.send({"type": "error", "id": message_id, "error": str(e)})
+            except Exception:
+                pass
+        finally:
+            self.generations.pop(message_id, None)
+    
+    async def handle_message(self, frame: Dict):
+        """Validate a "message" frame and start its generation"""
+        message_id = str(frame.get("id") or uuid.uuid4())
+        if message_id in self.generations:
+            await self.send({"type": "error", "id": message_id, "error": "Duplicate message id"})
+            return
+        
+        try:
+            request = ChatRequest(
+                messages=frame.get("messages", []),
+                model=frame.get("model", "auto"),
+                temperature=frame.get("temperature", 0.7),
+                conversation_id=frame.get("conversation_id") or str(uuid.uuid4()),
+                user_id=self.user_id
+            )
+        except Exception as e:
+            await self.send({"type": "error", "id": message_id, "error": f"Invalid message: {e}"})
+            return
+        if not request.messages:
+            await self.send({"type": "error", "id": message_id, "error": "No messages provided"})
+            return
+        
+        self.generations[message_id] = asyncio.create_task(
+            self.run_generation(message_id, request)
+        )
+    
+    async def cancel_all(self):
+        """Cancel every running generation (used when the socket closes)"""
+        tasks = list(self.generations.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def wait_all(self):
+        """Let running generations finish without a client to stream to"""
+        await asyncio.gather(*self.generations.values(), return_exceptions=True)
+
+@router.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """Persistent chat connection multiplexing concurrent generations
+    
+    The first frame must be {"type": "auth", "user_id": ...}. After that the
+    client sends {"type": "message", "id", "conversation_id", "messages",
+    "model", "temperature"} and {"type": "cancel", "id"} frames; the server
+    answers with start/chunk/done/error/cancelled frames tagged with the
+    message id.
+    """
+    await websocket.accept()
+    
+    try:
+        auth = await asyncio.wait_for(websocket.receive_json(), timeout=10)
+    except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        await websocket.close(code=1008)
+        return
+    
+    user_id = auth.get("user_id") if auth.get("type") == "auth" else None
+    if not user_id:
+        await websocket.send_json({"type": "error", "error": "User ID required"})
+        await websocket.close(code=1008)
+        return
+    
+    session = ChatSession(websocket, user_id)
+    try:
+        await session.load_quota()
+    except Exception as e:
+        # Log error but don't block if subscription check fails
+        logger.warning(f"Subscription check failed: {e}. Allowing session to proceed.")
+    
+    await session.send({
+        "type": "ready",
+        "tier": session.tier.value if session.tier else None,
+        "messages_remaining": session.remaining_messages
+    })
+    
+    keep_generations = False
+    try:
+        while True:
+            try:
+                frame = await websocket.receive_json()
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict):
+                await session.send({"type": "error", "error": "Invalid JSON frame"})
+                continue
+            
+            frame_type = frame.get("type")
+            if frame_type == "message":
+                await session.handle_message(frame)
+            elif frame_type == "cancel":
+                message_id = str(frame.get("id"))
+                task = session.generations.get(message_id)
+                if task and task.cancel():
+                    await session.send({"type": "cancelled", "id": message_id})
+            elif frame_type == "ping":
+                await session.send({"type": "pong"})
+            else:
+                await session.send({"type": "error", "error": f"Unknown frame type: {frame_type}"})
+    except WebSocketDisconnect as e:
+        logger.info(f"WebSocket closed for user {user_id} (code {e.code})")
+        # 1012 means the server is restarting: let running generations finish
+        # so their answers are stored; the shutdown drain waits for them
+        keep_generations = e.code == 1012
+    finally:
+        session.closed = True
+        if keep_generations:
+            await session.wait_all()
+        else:
+            await session.cancel_all()
 
 @router.get("/models")
 async def list_models(request: Request):
@@ -1,13 +1,25 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
-from typing import List, Dict, Optional, Any
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Dict, Optional, Any
 import json
 import logging
+from app.core.config import settings
+from app.core.messages import ChatMessage
+from app.services.conversation_store import get_conversation_store
 from app.services.memory import MemoryManager
+from app.services.providers import get_provider
+from app.services.semantic_memory import semantic_memory
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
-memory_manager = MemoryManager()
+memory_manager = get_conversation_store()
+
+def redis_memory() -> MemoryManager:
+    """The conversation store, for endpoints only the Redis backend supports"""
+    if not isinstance(memory_manager, MemoryManager):
+        raise HTTPException(status_code=404, detail="Not supported by the configured memory backend")
+    return memory_manager
 
 class ConversationMessage(BaseModel):
     role: str
@@ -15,35 +27,231 @@ class ConversationMessage(BaseModel):
     timestamp: Optional[str] = None
     model: Optional[str] = None
 
+@router.get("/search")
+async def search_conversations(
+    user_id: str,
+    q: str,
+    request: Request,
+    limit: int = 20,
+    offset: int = 0,
+    prefix: bool = True
+) -> Dict[str, Any]:
+    """Full-text search over the user's messages, ranked by relevance"""
+    try:
+        if not user_id:
+            raise HTTPException(status_code=401, detail="User ID required")
+        
+        limit = max(1, min(limit, 100))
+        offset = max(0, offset)
+        found = await redis_memory().search(
+            user_id=user_id,
+            query=q,
+            limit=limit,
+            offset=offset,
+            prefix=prefix
+        )
+        
+        return {
+            "query": q,
+            "results": found["results"],
+            "count": len(found["results"]),
+            "total": found["total"],
+            "offset": offset,
+            "limit": limit,
+            "has_more": offset + limit < found["total"]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching conversations: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/related")
+async def related_messages(
+    user_id: str,
+    q: str,
+    request: Request,
+    k: int = 5,
+    conversation_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Past messages semantically closest to a text, most similar first
+    
+    Pass conversation_id to leave out the conversation the text comes from.
+    """
+    try:
+        if not user_id:
+            raise HTTPException(status_code=401, detail="User ID required")
+        if not settings.SEMANTIC_MEMORY_ENABLED:
+            raise HTTPException(status_code=404, detail="Semantic memory is not enabled")
+        
+        k = max(1, min(k, 50))
+        hits = await semantic_memory.related(
+            user_id=user_id,
+            query=q,
+            k=k,
+            exclude_conversation_id=conversation_id
+        )
+        results = await redis_memory().get_documents(user_id, hits)
+        
+        return {
+            "query": q,
+            "results": results,
+            "count": len(results)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error finding related messages: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/export")
+async def export_conversations(
+    user_id: str,
+    request: Request
+) -> StreamingResponse:
+    """Download every conversation of the user, archived ones included, as NDJSON
+    
+    See MemoryManager.export_conversations for the line format. The body is
+    streamed as it is read, so exports of any size take constant memory;
+    a download without its final "end" line is incomplete.
+    """
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User ID required")
+    
+    return StreamingResponse(
+        redis_memory().export_conversations(user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="conversations-{user_id}.ndjson"'}
+    )
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """Lines of a streamed request body"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+@router.post("/import")
+async def import_conversations(
+    user_id: str,
+    request: Request
+) -> Dict[str, Any]:
+    """Load conversations from an NDJSON export into the user's history
+    
+    The body is read as it streams in and written in pipelined batches.
+    Conversations the user already has are skipped, so a failed import can
+    be retried with the same file.
+    """
+    try:
+        if not user_id:
+            raise HTTPException(status_code=401, detail="User ID required")
+        
+        totals = await redis_memory().import_conversations(user_id, _ndjson_lines(request))
+        return {"user_id": user_id, **totals}
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid export: {e}")
+    except Exception as e:
+        logger.error(f"Error importing conversations: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{conversation_id}/messages")
 async def get_conversation_messages(
     conversation_id: str,
     user_id: str,
     request: Request,
-    limit: int = 50
+    limit: int = 50,
+    before: Optional[int] = None,
+    after: Optional[int] = None
 ) -> Dict[str, Any]:
-    """Get messages for a specific conversation"""
+    """Get a page of a conversation's messages, oldest first
+    
+    Without cursors, returns the newest messages. Pass a page's "before"
+    cursor as before= for the page of older messages, or the newest page's
+    "after" cursor as after= for just the messages added since (empty when
+    there are none; keep polling with the same cursor). Cursors are message
+    sequence numbers, so they stay valid as the conversation grows.
+    """
     try:
         if not user_id:
             raise HTTPException(status_code=401, detail="User ID required")
         
-        # Get messages from memory manager
-        messages = await memory_manager.get_context(
+        limit = max(1, min(limit, 200))
+        page = await redis_memory().get_message_page(
             conversation_id=conversation_id,
             user_id=user_id,
-            max_messages=limit
+            limit=limit,
+            before=before,
+            after=after
         )
+        messages = page["messages"]
         
         return {
             "conversation_id": conversation_id,
             "messages": messages,
-            "count": len(messages)
+            "count": len(messages),
+            "has_more": page["has_more"],
+            "before": page["first"] if page["first"] is not None else before,
+            "after": page["last"] if page["last"] is not None else after
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching conversation messages: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class BranchRequest(BaseModel):
+    fork: Optional[int] = None
+    branch_id: Optional[str] = None
+
+@router.post("/{conversation_id}/branches")
+async def create_branch(
+    conversation_id: str,
+    user_id: str,
+    branch: BranchRequest,
+    request: Request
+) -> Dict[str, Any]:
+    """Branch a conversation, to edit a message or regenerate a reply
+    
+    The branch shares the messages with seqs below fork (all of them by
+    default) without copying them. To edit a message, fork at its seq and
+    send the edited message to /chat/completions with the branch's id as
+    conversation_id; to regenerate a reply, fork at the seq of the message
+    it answered and send that message again.
+    """
+    try:
+        if not user_id:
+            raise HTTPException(status_code=401, detail="User ID required")
+        
+        forked = await redis_memory().fork_conversation(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            fork=branch.fork,
+            branch_id=branch.branch_id
+        )
+        return {
+            "conversation_id": forked["id"],
+            "parent": forked["parent"],
+            "fork": forked["fork"]
+        }
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error branching conversation: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/")
 async def list_conversations(
     user_id: str,
@@ -86,6 +294,8 @@ async def delete_conversation(
             conversation_id=conversation_id,
             user_id=user_id
         )
+        if settings.SEMANTIC_MEMORY_ENABLED:
+            await semantic_memory.delete_conversation(user_id, conversation_id)
         
         return {"message": "Conversation deleted successfully"}
         
@@ -122,10 +332,6 @@ Return ONLY the title, no quotes, no explanation. Examples:
 
 Title:"""
         
-        # Import required modules
-        from app.core.config import settings
-        from app.api.v1.chat import get_provider, ChatMessage
-        
         # Use DeepSeek for reliable title generation
         provider = get_provider("deepseek", settings)
         
@@ -140,12 +346,8 @@ Title:"""
         
         title = response.content.strip()[:50] if response.content else f"Chat {conversation_id[:8]}"
         
-        # Save title to Redis conversation metadata
-        redis_client = request.app.state.redis
-        conv_key = f"conv:meta:{user_id}:{conversation_id}"
-        
-        await redis_client.hset(conv_key, "title", title)
-        await redis_client.hset(conv_key, "last_message", messages[0].get("content", ""))
+        # Save title to the conversation's listing record
+        await memory_manager.set_title(conversation_id, user_id, title)
         
         logger.info(f"Generated title '{title}' for conversation {conversation_id}")
         
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, HTTPException, Request, Header
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 from pydantic import BaseModel
 import stripe
+import asyncio
 import json
 from app.core.config import settings
 from app.core.database import get_supabase_client
+from app.services.tier_cache import tier_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -63,6 +65,15 @@ async def create_checkout_session(request: SubscribeRequest):
         logger.error(f"Error creating checkout session: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create checkout session")
 
+async def invalidate_tiers(request: Request, user_ids: List[str], tier: str):
+    """Make the new tier of users take effect in every worker right away"""
+    for user_id in user_ids:
+        try:
+            await tier_cache.invalidate(request.app.state.redis, user_id, tier)
+        except Exception as e:
+            # Cached tiers expire after TIER_CACHE_TTL regardless
+            logger.error(f"Failed to invalidate cached tier of user {user_id}: {str(e)}")
+
 @router.post("/webhook")
 async def stripe_webhook(
     request: Request,
@@ -108,17 +119,22 @@ async def stripe_webhook(
         # Update database
         try:
             supabase = get_supabase_client()
-            result = supabase.table('user_profiles').update({
-                'subscription_tier': tier,
-                'stripe_customer_id': stripe_customer_id,
-                'stripe_subscription_id': stripe_subscription_id
-            }).eq('id', user_id).execute()
+            result = await asyncio.to_thread(
+                supabase.table('user_profiles').update({
+                    'subscription_tier': tier,
+                    'stripe_customer_id': stripe_customer_id,
+                    'stripe_subscription_id': stripe_subscription_id
+                }).eq('id', user_id).execute
+            )
                 
             logger.info(f"Updated user {user_id} to tier {tier}")
             
         except Exception as e:
             logger.error(f"Failed to update user subscription: {str(e)}")
             # Don't raise - Stripe will retry
+            return {"status": "success"}
+        
+        await invalidate_tiers(request, [user_id], tier)
     
     elif event["type"] == "customer.subscription.deleted":
         # Handle subscription cancellation
@@ -127,13 +143,19 @@ async def stripe_webhook(
         
         try:
             supabase = get_supabase_client()
-            result = supabase.table('user_profiles').update({
-                'subscription_tier': 'FREE'
-            }).eq('stripe_subscription_id', stripe_subscription_id).execute()
+            result = await asyncio.to_thread(
+                supabase.table('user_profiles').update({
+                    'subscription_tier': 'FREE'
+                }).eq('stripe_subscription_id', stripe_subscription_id).execute
+            )
                 
             logger.info(f"Downgraded subscription {stripe_subscription_id} to FREE")
             
         except Exception as e:
             logger.error(f"Failed to downgrade subscription: {str(e)}")
+            return {"status": "success"}
+        
+        # The update returns the downgraded profiles
+        await invalidate_tiers(request, [row["id"] for row in result.data or [] if row.get("id")], "FREE")
     
     return {"status": "success"}
\ No newline at end of file
@@ -4,20 +4,14 @@ from datetime import datetime, timedelta
 import redis.asyncio as redis
 from pydantic import BaseModel
 import logging
+from app.core.pricing import MODEL_PRICING, model_prices
+from app.core.redis_keys import UserKeys, glob_escape, read_keys
+from app.services.purge import unlink_matching
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Model pricing per million tokens
-MODEL_PRICING = {
-    "deepseek-chat": {"input": 0.14, "output": 0.28},  # $0.14/$0.28 per million
-    "deepseek-coder": {"input": 0.14, "output": 0.28},
-    "glm-4-plus": {"input": 0.05, "output": 0.05},     # $0.05/$0.05 per million
-    "glm-4-flash": {"input": 0.0001, "output": 0.0001}, # $0.0001/$0.0001 per million
-    "qwen3-235b-a22b": {"input": 2.80, "output": 2.80}, # $2.80/$2.80 per million
-}
-
 class ModelUsage(BaseModel):
     tokens: int
     cost: float
@@ -55,21 +49,7 @@ async def get_redis_client(request: Request) -> redis.Redis:
 
 async def calculate_cost(tokens: int, model: str, token_type: str = "output") -> float:
     """Calculate cost based on tokens and model"""
-    # Extract base model name (e.g., "deepseek-chat" from any variant)
-    base_model = model.split("-")[0] + "-" + model.split("-")[1] if "-" in model else model
-    
-    # Find pricing - check exact match first, then try to find partial match
-    pricing = MODEL_PRICING.get(model)
-    if not pricing:
-        # Try to find a model that starts with the base name
-        for model_key, model_pricing in MODEL_PRICING.items():
-            if model_key.startswith(base_model):
-                pricing = model_pricing
-                break
-    
-    if not pricing:
-        # Default to average pricing if model not found
-        pricing = {"input": 0.5, "output": 0.5}
+    pricing = model_prices(model)
     
     # Calculate cost (price per million tokens)
     price_per_token = pricing[token_type] / 1_000_000
@@ -105,13 +85,13 @@ async def get_usage_stats(
         current_date = start_date
         while current_date <= end_date:
             date_key = current_date.strftime("%Y-%m-%d")
-            usage_key = f"usage:{target_user}:{date_key}"
+            usage_key = read_keys(target_user).usage(date_key)
             
             # Get usage data from Redis
             usage_data = await redis_client.hgetall(usage_key)
             
             # Get message count for this day
-            messages_key = f"usage:{target_user}:{date_key}:messages"
+            messages_key = read_keys(target_user).usage_messages(date_key)
             daily_messages = await redis_client.get(messages_key)
             daily_messages = int(daily_messages) if daily_messages else 0
             
@@ -136,9 +116,12 @@ async def get_usage_stats(
                                 model_totals[model_name] = 0
                             model_totals[model_name] += tokens
                 
-                # Calculate cost based on model usage
+                # The cost counted against quotas; estimated from model usage
+                # for days recorded without it
                 daily_total_cost = 0.0
-                if day_model_usage:
+                if usage_data and "cost" in usage_data:
+                    daily_total_cost = int(usage_data["cost"]) / 1_000_000
+                elif day_model_usage:
                     # Use actual model usage for cost calculation
                     for model, tokens in day_model_usage.items():
                         # Use average of input/output pricing for simplicity
@@ -248,20 +231,15 @@ async def clear_usage_data(
     redis_client = await get_redis_client(request)
     
     try:
-        # Find all usage keys for the user
-        pattern = f"usage:{user_id}:*"
-        keys = []
-        async for key in redis_client.scan_iter(match=pattern):
-            keys.append(key)
-        
-        # Delete all found keys
-        if keys:
-            await redis_client.delete(*keys)
+        # Unlink usage keys (in either key layout) in bounded batches as they are found
+        deleted = 0
+        for tagged in (False, True):
+            deleted += await unlink_matching(redis_client, UserKeys(glob_escape(user_id), tagged).usage("*"))
         
         return {
             "status": "success",
-            "deleted_keys": len(keys),
-            "message": f"Deleted {len(keys)} usage records for user {user_id}"
+            "deleted_keys": deleted,
+            "message": f"Deleted {deleted} usage records for user {user_id}"
         }
         
     except Exception as e:
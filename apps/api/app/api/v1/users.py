@@ -0,0 +1,46 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from typing import Dict, Any
+import logging
+from app.services.purge import user_purger
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+@router.post("/{user_id}/purge")
+async def purge_user_data(
+    request: Request,
+    user_id: str,
+    confirm: bool = Query(False, description="Confirm deletion")
+) -> JSONResponse:
+    """Delete everything stored about a user (admin only)
+
+    Conversations (hot and archived), their metadata, summaries, search
+    index and semantic vectors, usage counters and routing decisions are
+    deleted by a background job. Poll GET /users/{user_id}/purge for
+    progress; calling this again resumes a failed or interrupted purge.
+    """
+    if not confirm:
+        raise HTTPException(
+            status_code=400,
+            detail="Please set confirm=true to delete all data of this user"
+        )
+
+    try:
+        progress = await user_purger.start(user_id)
+        return JSONResponse(status_code=202, content=progress)
+
+    except Exception as e:
+        logger.error(f"Error starting purge: {e}")
+        raise HTTPException(status_code=500, detail="Failed to start purge")
+
+@router.get("/{user_id}/purge")
+async def get_purge_progress(
+    request: Request,
+    user_id: str
+) -> Dict[str, Any]:
+    """Progress of a user's data purge (admin only)"""
+    progress = await user_purger.progress(user_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No purge found for this user")
+    return progress
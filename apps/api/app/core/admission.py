@@ -0,0 +1,250 @@
+from typing import Dict, Optional
+from collections import deque
+import asyncio
+import logging
+import time
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.core.metrics import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUED,
+    ADMISSION_REJECTED,
+    ADMISSION_QUEUE_WAIT
+)
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(HTTPException):
+    """Raised when a request is shed; carries a Retry-After header"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)}
+        )
+        self.retry_after = retry_after
+
+class AdmissionTicket:
+    """An admission slot held by one generation; release() is idempotent
+
+    Holders release it with async with or try/finally; a streaming response
+    takes it over through AdmittedStreamingResponse.
+    """
+
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self.user_id)
+
+    async def __aenter__(self) -> "AdmissionTicket":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def __del__(self):
+        # Last resort only: every holder releases its ticket, so reaching
+        # this is a bug to fix, and the slot was held until collected
+        if not self.released:
+            logger.warning(f"Admission ticket of {self.user_id} was never released; releasing it on collection")
+            self.release()
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Streaming response holding an admission ticket until it has been sent
+
+    The ticket is released when the response finishes, fails or the client
+    disconnects, even if its stream was never started.
+    """
+
+    def __init__(self, content, ticket: AdmissionTicket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        async with self.ticket:
+            await super().__call__(scope, receive, send)
+
+class AdmissionController:
+    """Bounds concurrent chat generations globally and per user
+
+    Requests beyond the global limit wait in a short FIFO queue. The allowed
+    wait is adaptive in the style of CoDel: normally a request may wait up to
+    ADMISSION_QUEUE_INTERVAL_MS, but once the queue has not been empty for a
+    whole interval (a standing queue, i.e. sustained overload) the wait drops
+    to ADMISSION_QUEUE_TARGET_MS so excess load is shed fast instead of
+    piling up. Users over their own limit get 429 immediately.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_per_user: int,
+        max_queue: int,
+        queue_target_ms: int,
+        queue_interval_ms: int,
+        retry_after: int
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_target = queue_target_ms / 1000
+        self.queue_interval = queue_interval_ms / 1000
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.per_user: Dict[str, int] = {}
+        self.waiters: deque = deque()
+        self.queue_empty_since = time.monotonic()
+        self.rejected = {"user_limit": 0, "queue_full": 0, "queue_timeout": 0, "draining": 0}
+        self.draining = False
+
+    def _overloaded(self) -> bool:
+        """True while a standing queue has persisted for a full interval"""
+        return bool(self.waiters) and time.monotonic() - self.queue_empty_since > self.queue_interval
+
+    def _reject(self, reason: str, status_code: int, detail: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(reason=reason).inc()
+        return AdmissionRejected(status_code, detail, self.retry_after)
+
+    def _update_gauges(self):
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+        ADMISSION_QUEUED.set(len(self.waiters))
+
+    async def acquire(self, user_id: Optional[str]) -> AdmissionTicket:
+        """Wait for a generation slot or raise AdmissionRejected"""
+        user_id = user_id or "anonymous"
+
+        if self.draining:
+            raise self._reject("draining", 503, "Server is restarting, please retry")
+
+        if self.per_user.get(user_id, 0) >= self.max_per_user:
+            raise self._reject(
+                "user_limit",
+                429,
+                f"Too many concurrent requests. At most {self.max_per_user} responses can be generated at once."
+            )
+
+        self.per_user[user_id] = self.per_user.get(user_id, 0) + 1
+
+        # Fast path: free capacity and nobody queued ahead of us
+        if self.in_flight < self.max_in_flight and not self.waiters:
+            self.in_flight += 1
+            self._update_gauges()
+            ADMISSION_QUEUE_WAIT.observe(0)
+            return AdmissionTicket(self, user_id)
+
+        if len(self.waiters) >= self.max_queue:
+            self._forget_user(user_id)
+            raise self._reject("queue_full", 503, "Server is busy, please retry shortly")
+
+        timeout = self.queue_target if self._overloaded() else self.queue_interval
+        if not self.waiters:
+            self.queue_empty_since = time.monotonic()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self._update_gauges()
+        started = time.monotonic()
+        try:
+            granted = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                # Slot was handed over just as we gave up; pass it on
+                self._release(user_id)
+            else:
+                waiter.cancel()
+                self._remove_waiter(waiter)
+                self._forget_user(user_id)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject("queue_timeout", 503, "Server is busy, please retry shortly")
+
+        if not granted:
+            # Woken up by start_draining() rather than handed a slot
+            self._forget_user(user_id)
+            raise self._reject("draining", 503, "Server is restarting, please retry")
+
+        ADMISSION_QUEUE_WAIT.observe(time.monotonic() - started)
+        return AdmissionTicket(self, user_id)
+
+    def _remove_waiter(self, waiter: asyncio.Future):
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not self.waiters:
+            self.queue_empty_since = time.monotonic()
+        self._update_gauges()
+
+    def _forget_user(self, user_id: str):
+        count = self.per_user.get(user_id, 0) - 1
+        if count > 0:
+            self.per_user[user_id] = count
+        else:
+            self.per_user.pop(user_id, None)
+
+    def _release(self, user_id: str):
+        self._forget_user(user_id)
+
+        # Hand the slot straight to the oldest live waiter
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                if not self.waiters:
+                    self.queue_empty_since = time.monotonic()
+                self._update_gauges()
+                return
+
+        self.queue_empty_since = time.monotonic()
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def start_draining(self):
+        """Reject new and queued requests; generations already running continue"""
+        self.draining = True
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(False)
+        self.queue_empty_since = time.monotonic()
+        self._update_gauges()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait until no generation holds a slot; False if the timeout passed first"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight > 0:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    def stats(self) -> Dict:
+        """Current load, for health checks and autoscalers"""
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "utilization": round(self.in_flight / self.max_in_flight, 3) if self.max_in_flight else 0,
+            "overloaded": self._overloaded(),
+            "draining": self.draining,
+            "rejected": dict(self.rejected)
+        }
+
+admission_controller = AdmissionController(
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    max_per_user=settings.ADMISSION_MAX_PER_USER,
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    queue_target_ms=settings.ADMISSION_QUEUE_TARGET_MS,
+    queue_interval_ms=settings.ADMISSION_QUEUE_INTERVAL_MS,
+    retry_after=settings.ADMISSION_RETRY_AFTER
+)
@@ -22,16 +22,101 @@ class Settings(BaseSettings):
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379"
+    REDIS_MAX_CONNECTIONS: int = 50  # Shared pool size per worker
+    REDIS_POOL_TIMEOUT: float = 5  # Seconds to wait for a free connection
+    REDIS_SOCKET_TIMEOUT: float = 5
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 5
+    REDIS_SOCKET_KEEPALIVE: bool = True
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # Seconds idle before a connection is pinged
+    REDIS_PROTOCOL: int = 2  # 3 for RESP3
+    REDIS_HIREDIS: bool = True  # Use the hiredis parser when it is installed
+    REDIS_CLUSTER: bool = False  # REDIS_URL names a Redis Cluster node; needs the "tagged" key layout
+    REDIS_KEY_LAYOUT: str = "legacy"  # "legacy", "migrating", "migrated" or "tagged" (see app.core.redis_keys)
+    KEY_MIGRATION_SCAN_COUNT: int = 1000  # Keys per SCAN page when copying or removing legacy keys
+    
+    # Conversation summarization
+    SUMMARIZATION_ENABLED: bool = False
+    SUMMARIZATION_TOKEN_THRESHOLD: int = 4000  # Unsummarized tokens before compacting
+    SUMMARIZATION_KEEP_RECENT: int = 10  # Recent messages always sent verbatim
+    
+    # Conversation search (BM25)
+    SEARCH_BM25_K1: float = 1.2
+    SEARCH_BM25_B: float = 0.75
+    SEARCH_MAX_PREFIX_EXPANSIONS: int = 20  # Indexed terms matched per query prefix
+    SEARCH_MAX_POSTINGS: int = 2000  # Postings a query scores, shared by its matched terms
+    
+    # Stored message encoding (reads accept every encoding)
+    MESSAGE_ENCODING: str = "msgpack"  # "msgpack", or "json" while older workers still run
+    MESSAGE_COMPRESSION_MIN_BYTES: int = 1024  # zstd-compress longer contents; 0 disables
+    
+    # Per-worker context cache (invalidated across workers through Redis pub/sub)
+    CONTEXT_CACHE_ENABLED: bool = True
+    CONTEXT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # Estimated size cap per worker
+    CONTEXT_CACHE_MESSAGES: int = 50  # Newest messages kept per conversation
+    
+    # Subscription tier cache (per worker and in Redis; the Stripe webhook invalidates it)
+    TIER_CACHE_TTL: int = 300  # Seconds a tier read from Supabase is trusted
+    TIER_CACHE_REFRESH_AFTER: int = 240  # Older tiers are reloaded in the background when used
+    TIER_CACHE_MAX_ENTRIES: int = 100000  # Users kept per worker
+    
+    # Conversation archive (cold tier in Postgres at DATABASE_URL)
+    ARCHIVE_ENABLED: bool = False
+    ARCHIVE_IDLE_SECONDS: int = 2 * 24 * 60 * 60  # Idle time before archiving; keep below the 7-day Redis TTL
+    ARCHIVE_INTERVAL_SECONDS: int = 300  # Between archiver passes
+    ARCHIVE_BATCH_SIZE: int = 200  # Conversations per bulk write
+    ARCHIVE_POOL_SIZE: int = 5  # Postgres connections per worker
+    
+    # Per-tier caps on stored conversations (see STORAGE_LIMITS in app.services.subscription)
+    STORAGE_LIMITS_ENABLED: bool = True
+    STORAGE_TRIM_RATIO: float = 0.9  # A cap that is exceeded is trimmed down to this share of it
+    
+    # Conversation branches (edits, regenerations, comparisons) share their parent's messages
+    BRANCH_MAX_DEPTH: int = 32  # Branches of branches; bounds the ancestors a read walks
+    
+    # Conversation memory backend (see app.services.conversation_store)
+    MEMORY_BACKEND: str = "redis"  # "redis", or "sqlite" for one SQLite file on a single node
+    SQLITE_PATH: str = "data/memory.db"
+    SQLITE_WRITE_BATCH: int = 64  # Writes committed per transaction by the writer thread
+    SQLITE_READERS: int = 4  # Reader threads, each with its own connection
+    
+    # Whole-user data purges (background jobs, resumable)
+    PURGE_BATCH_SIZE: int = 500  # Keys per UNLINK
+    PURGE_SCAN_COUNT: int = 1000  # SCAN COUNT hint while looking for a user's keys
+    PURGE_STATE_TTL: int = 30 * 24 * 60 * 60  # How long a finished purge's report is kept
+    
+    # Admission control
+    ADMISSION_MAX_IN_FLIGHT: int = 200  # Concurrent generations per worker
+    ADMISSION_MAX_PER_USER: int = 4
+    ADMISSION_MAX_QUEUE: int = 50
+    ADMISSION_QUEUE_TARGET_MS: int = 50  # Max queue wait once a standing queue builds up
+    ADMISSION_QUEUE_INTERVAL_MS: int = 500  # Max queue wait otherwise
+    ADMISSION_RETRY_AFTER: int = 2  # Seconds, sent with 429/503 responses
+    
+    # Graceful shutdown, started by SIGTERM while the server still listens
+    # (keep the orchestrator's grace period, e.g. Kubernetes
+    # terminationGracePeriodSeconds, longer than all three together)
+    SHUTDOWN_DRAIN_TIMEOUT: int = 30  # Seconds running generations may finish
+    SHUTDOWN_HEALTH_GRACE: int = 5  # Min seconds /health reports draining before listeners close
+    SHUTDOWN_FLUSH_TIMEOUT: int = 10  # Seconds pending background writes may finish
+    
+    # Multi-model compare
+    COMPARE_MAX_MODELS: int = 3
+    COMPARE_QUOTA_MODE: str = "per_model"  # "per_model" or "single"
     
     # LLM API Keys
     DEEPSEEK_API_KEY: str
     GLM_API_KEY: str
     QWEN_API_KEY: str
     
-    # Vector DB
-    PINECONE_API_KEY: str
-    PINECONE_ENV: str
-    PINECONE_INDEX: str = "cmdshift-main"
+    # Semantic memory (local vector index)
+    SEMANTIC_MEMORY_ENABLED: bool = False
+    EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBEDDING_DIM: int = 384  # Must match EMBEDDING_MODEL
+    EMBEDDING_CONCURRENCY: int = 1  # Embedding batches run at once per worker
+    SEMANTIC_MIN_CHARS: int = 20  # Shorter messages are not embedded
+    VECTOR_INDEX_BACKEND: str = "local"
+    VECTOR_INDEX_DIR: str = "data/vectors"
+    VECTOR_INDEX_DTYPE: str = "int8"  # "int8" or "float32"
     
     # Monitoring
     SENTRY_DSN: Optional[str] = None
@@ -52,6 +137,8 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         case_sensitive = True
+        # Tolerate settings that were removed (e.g. PINECONE_*) in old .env files
+        extra = "ignore"
 
 @lru_cache()
 def get_settings():
@@ -1,9 +1,19 @@
+from typing import Optional
 from supabase import create_client, Client
 from app.core.config import settings
 
+_client: Optional[Client] = None
+
 def get_supabase_client() -> Client:
-    """Get Supabase client instance"""
-    return create_client(
-        settings.SUPABASE_URL,
-        settings.SUPABASE_SERVICE_KEY
-    )
\ No newline at end of file
+    """The worker's Supabase client, created on first use
+
+    The client is synchronous: call it from a thread (asyncio.to_thread),
+    not on the event loop.
+    """
+    global _client
+    if _client is None:
+        _client = create_client(
+            settings.SUPABASE_URL,
+            settings.SUPABASE_SERVICE_KEY
+        )
+    return _client
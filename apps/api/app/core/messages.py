@@ -0,0 +1,90 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+@dataclass(slots=True)
+class ChatMessage:
+    """A chat message, as requests, conversation memory and providers share it
+
+    Requests set only role and content (pydantic validates ChatRequest into
+    this class directly, ignoring any other field). Messages read from memory
+    also carry what was stored with them: id, timestamp, the model that
+    answered, seq, extra fields, or summary for the rolling summary.
+
+    Messages read from memory may be shared with the context cache, and
+    payload() is built once per message: treat messages as read-only.
+    """
+
+    role: str
+    content: str
+    id: Optional[str] = field(default=None, init=False)
+    timestamp: Optional[str] = field(default=None, init=False)
+    model: Optional[str] = field(default=None, init=False)
+    seq: Optional[int] = field(default=None, init=False)
+    summary: bool = field(default=False, init=False)
+    extra: Optional[Dict] = field(default=None, init=False)
+    _payload: Optional[Dict] = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def stored(
+        cls,
+        role: str,
+        content: str,
+        id: Optional[str] = None,
+        timestamp: Optional[str] = None,
+        model: Optional[str] = None,
+        seq: Optional[int] = None,
+        extra: Optional[Dict] = None
+    ) -> "ChatMessage":
+        """A message read from memory"""
+        msg = cls(role, content)
+        msg.id = id
+        msg.timestamp = timestamp
+        msg.model = model
+        msg.seq = seq
+        msg.extra = extra
+        return msg
+
+    @classmethod
+    def summary_of(cls, content: str) -> "ChatMessage":
+        """The system message standing for the messages a summary folded"""
+        msg = cls("system", content)
+        msg.summary = True
+        return msg
+
+    @classmethod
+    def from_dict(cls, msg: Dict) -> "ChatMessage":
+        """A message from its dict form (to_dict, or JSON stored by earlier versions)"""
+        if msg.get("summary"):
+            return cls.summary_of(msg.get("content", ""))
+        extra = {k: v for k, v in msg.items() if k not in DICT_FIELDS} or None
+        return cls.stored(
+            msg.get("role", "user"), msg.get("content", ""),
+            msg.get("id"), msg.get("timestamp"), msg.get("model"), msg.get("seq"), extra
+        )
+
+    def to_dict(self) -> Dict:
+        """The dict form returned by get_context, as message_codec.decode_message builds it"""
+        if self.summary:
+            return {"role": self.role, "content": self.content, "summary": True}
+        msg = {"role": self.role, "content": self.content}
+        if self.extra:
+            msg.update(self.extra)
+        if self.id is not None:
+            msg["id"] = self.id
+        if self.timestamp is not None:
+            msg["timestamp"] = self.timestamp
+        msg["model"] = self.model
+        msg["seq"] = self.seq
+        return msg
+
+    def payload(self) -> Dict:
+        """The message as sent to a provider, built on first use
+
+        The content string is shared, not copied, and a message served from
+        the context cache on every turn builds its payload only once.
+        """
+        if self._payload is None:
+            self._payload = {"role": self.role, "content": self.content}
+        return self._payload
+
+DICT_FIELDS = frozenset(("role", "content", "id", "timestamp", "model", "seq", "summary"))
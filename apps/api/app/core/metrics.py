@@ -0,0 +1,133 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Admission control
+ADMISSION_IN_FLIGHT = Gauge(
+    "cmdshift_admission_in_flight",
+    "Chat generations currently holding an admission slot"
+)
+ADMISSION_QUEUED = Gauge(
+    "cmdshift_admission_queued",
+    "Chat requests waiting for an admission slot"
+)
+ADMISSION_REJECTED = Counter(
+    "cmdshift_admission_rejected_total",
+    "Chat requests shed by admission control",
+    ["reason"]
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "cmdshift_admission_queue_wait_seconds",
+    "Time admitted requests spent waiting for a slot",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+# Redis connection pool
+REDIS_POOL_CONNECTIONS = Gauge(
+    "cmdshift_redis_pool_connections",
+    "Connections in the shared Redis pool, by state",
+    ["state"]
+)
+REDIS_POOL_MAX_CONNECTIONS = Gauge(
+    "cmdshift_redis_pool_max_connections",
+    "Size limit of the shared Redis pool"
+)
+REDIS_POOL_WAIT = Histogram(
+    "cmdshift_redis_pool_wait_seconds",
+    "Time spent waiting for a connection from the shared Redis pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+REDIS_POOL_EXHAUSTED = Counter(
+    "cmdshift_redis_pool_exhausted_total",
+    "Commands that gave up waiting for a Redis connection"
+)
+
+# Context cache
+CONTEXT_CACHE_REQUESTS = Counter(
+    "cmdshift_context_cache_requests_total",
+    "Context lookups in the per-worker cache, by result",
+    ["result"]
+)
+CONTEXT_CACHE_EVICTIONS = Counter(
+    "cmdshift_context_cache_evictions_total",
+    "Conversations dropped from the context cache, by reason",
+    ["reason"]
+)
+CONTEXT_CACHE_ENTRIES = Gauge(
+    "cmdshift_context_cache_entries",
+    "Conversations held in the context cache"
+)
+CONTEXT_CACHE_BYTES = Gauge(
+    "cmdshift_context_cache_bytes",
+    "Estimated size of the context cache"
+)
+
+# Subscription tier cache
+TIER_CACHE_REQUESTS = Counter(
+    "cmdshift_tier_cache_requests_total",
+    "Subscription tier lookups, by where the tier was found",
+    ["result"]
+)
+TIER_LOOKUP_DURATION = Histogram(
+    "cmdshift_tier_lookup_seconds",
+    "Time to look up a user's subscription tier, by where it was found",
+    ["result"],
+    buckets=(0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+TIER_CACHE_REFRESHES = Counter(
+    "cmdshift_tier_cache_refreshes_total",
+    "Tiers reloaded from Supabase, by outcome",
+    ["outcome"]
+)
+
+# Conversation archive
+CONVERSATIONS_ARCHIVED = Counter(
+    "cmdshift_conversations_archived_total",
+    "Idle conversations moved from Redis to the Postgres archive"
+)
+CONVERSATIONS_REHYDRATED = Counter(
+    "cmdshift_conversations_rehydrated_total",
+    "Archived conversations loaded back into Redis on access"
+)
+ARCHIVE_REHYDRATE_DURATION = Histogram(
+    "cmdshift_archive_rehydrate_seconds",
+    "Time to load an archived conversation back into Redis",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+# Per-tier storage caps
+STORAGE_MESSAGES_TRIMMED = Counter(
+    "cmdshift_storage_messages_trimmed_total",
+    "Oldest messages dropped from conversations over their tier's cap"
+)
+STORAGE_CONVERSATIONS_EVICTED = Counter(
+    "cmdshift_storage_conversations_evicted_total",
+    "Conversations moved out of Redis to bring a user under their tier's caps, by action",
+    ["action"]
+)
+
+# User data purges
+PURGE_KEYS_DELETED = Counter(
+    "cmdshift_purge_keys_deleted_total",
+    "Redis keys removed by user data purges",
+    ["family"]
+)
+PURGES_COMPLETED = Counter(
+    "cmdshift_purges_completed_total",
+    "User data purges run to completion"
+)
+
+# Graceful shutdown
+DRAIN_DURATION = Gauge(
+    "cmdshift_drain_duration_seconds",
+    "Duration of each phase of the last shutdown drain",
+    ["phase"]
+)
+DRAIN_GENERATIONS = Gauge(
+    "cmdshift_drain_generations",
+    "Generations in flight when draining started, by outcome",
+    ["outcome"]
+)
+DRAIN_BACKGROUND_TASKS = Gauge(
+    "cmdshift_drain_background_tasks",
+    "Background writes pending when flushing started, by outcome",
+    ["outcome"]
+)
@@ -0,0 +1,31 @@
+from typing import Dict
+
+# Model pricing per million tokens
+MODEL_PRICING = {
+    "deepseek-chat": {"input": 0.14, "output": 0.28},  # $0.14/$0.28 per million
+    "deepseek-coder": {"input": 0.14, "output": 0.28},
+    "glm-4-plus": {"input": 0.05, "output": 0.05},     # $0.05/$0.05 per million
+    "glm-4-flash": {"input": 0.0001, "output": 0.0001}, # $0.0001/$0.0001 per million
+    "qwen3-235b-a22b": {"input": 2.80, "output": 2.80}, # $2.80/$2.80 per million
+}
+
+# For models without pricing of their own
+DEFAULT_PRICING = {"input": 0.5, "output": 0.5}
+
+def model_prices(model: str) -> Dict[str, float]:
+    """A model's prices per million tokens: its own, a variant's of the same family, or the default"""
+    pricing = MODEL_PRICING.get(model)
+    if pricing:
+        return pricing
+    # Extract base model name (e.g., "deepseek-chat" from any variant)
+    parts = model.split("-")
+    base_model = parts[0] + "-" + parts[1] if len(parts) > 1 else model
+    for model_key, model_pricing in MODEL_PRICING.items():
+        if model_key.startswith(base_model):
+            return model_pricing
+    return DEFAULT_PRICING
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int = 0) -> float:
+    """Cost in dollars of an exchange with a model"""
+    pricing = model_prices(model)
+    return (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1_000_000
@@ -0,0 +1,200 @@
+from typing import Dict, List, NamedTuple, Optional
+import re
+from app.core.config import settings
+
+# Per-user keys come in two layouts:
+#
+#   legacy  the user id as a plain segment, e.g. conv:<user>:<conversation>
+#   tagged  the user id as a hash tag, e.g. conv:{<user>}:<conversation>, so
+#           all keys of a user map to one Redis Cluster slot and can be used
+#           together in Lua scripts and transactions
+#
+# REDIS_KEY_LAYOUT moves a deployment from one to the other while it serves:
+#
+#   legacy     read and write legacy keys
+#   migrating  write both layouts, read legacy. Once every worker runs in
+#              this mode, migrate_redis_keys.py copies the existing keys
+#   migrated   write both layouts, read tagged. Legacy keys stay current,
+#              so going back to "migrating" loses nothing
+#   tagged     read and write tagged keys only (required with REDIS_CLUSTER);
+#              migrate_redis_keys.py --cleanup removes the legacy keys
+KEY_LAYOUTS = ("legacy", "migrating", "migrated", "tagged")
+
+# Prefixes of the per-user key families (longest first where they overlap);
+# the user segment follows the prefix
+USER_KEY_PREFIXES = (
+    ("conv:meta:", "meta"),
+    ("conv:summary:lock:", "summaries"),
+    ("conv:summary:", "summaries"),
+    ("conv:", "conversations"),
+    ("user_convs:", "index"),
+    ("user_conv_records:", "index"),
+    ("archived_convs:", "index"),
+    ("user_bytes:", "index"),
+    ("search:", "search"),
+    ("usage:", "usage"),
+    ("routing_decision:", "routing"),
+)
+
+def glob_escape(text: str) -> str:
+    """text as a literal in a SCAN MATCH pattern"""
+    return re.sub(r"([\\*?\[\]])", r"\\\1", text)
+
+class UserKeys:
+    """Redis keys of one user's data, in one layout"""
+
+    __slots__ = ("user_id", "tagged", "segment")
+
+    def __init__(self, user_id: str, tagged: bool):
+        self.user_id = user_id
+        self.tagged = tagged
+        self.segment = "{" + user_id + "}" if tagged else user_id
+
+    def conversation(self, conversation_id: str) -> str:
+        """List of a conversation's stored messages"""
+        return f"conv:{self.segment}:{conversation_id}"
+
+    def meta(self, conversation_id: str) -> str:
+        """Hash of a conversation's next "seq" (and title, before listing records)"""
+        return f"conv:meta:{self.segment}:{conversation_id}"
+
+    def summary(self, conversation_id: str) -> str:
+        return f"conv:summary:{self.segment}:{conversation_id}"
+
+    @property
+    def lineage_prefixes(self) -> List[str]:
+        """Prefixes of the conversation, meta and summary keys, for scripts walking a branch's ancestors
+        
+        A branch's ancestors are only known as a Lua script reads their
+        records, so their keys are built in the script from these prefixes
+        rather than declared in KEYS (as search postings are built from
+        search_keys()["postings"]). Every key built this way is one of the
+        user's own, in the user's segment: in the tagged layout it shares the
+        hash tag, and so the slot and node, of the keys the script declares,
+        and ACL key patterns granting the user's key families cover it. A
+        script must never be given another user's prefixes.
+        """
+        return [self.conversation(""), self.meta(""), self.summary("")]
+
+    def summary_lock(self, conversation_id: str) -> str:
+        return f"conv:summary:lock:{self.segment}:{conversation_id}"
+
+    @property
+    def conversations(self) -> str:
+        """Sorted set of conversation ids by last update"""
+        return f"user_convs:{self.segment}"
+
+    @property
+    def records(self) -> str:
+        """Hash of conversation listing records"""
+        return f"user_conv_records:{self.segment}"
+
+    @property
+    def archived(self) -> str:
+        """Set of conversation ids moved to the archive"""
+        return f"archived_convs:{self.segment}"
+
+    @property
+    def stored_bytes(self) -> str:
+        """Counter of the bytes of the user's stored messages"""
+        return f"user_bytes:{self.segment}"
+
+    def search(self) -> Dict[str, str]:
+        """Keys of the search index (see app.services.search)
+
+        Each indexed message is a document "{conversation_id}:{seq}". Every
+        term has a postings sorted set ("postings" + term) scoring documents
+        by term frequency, plus a fraction below 1 favouring short documents;
+        "terms" holds all terms for prefix lookups by lex range.
+        """
+        return {
+            "postings": f"search:{self.segment}:t:",
+            "terms": f"search:{self.segment}:terms",
+            "lengths": f"search:{self.segment}:lengths",
+            "stats": f"search:{self.segment}:stats",
+        }
+
+    def usage(self, date_key: str) -> str:
+        """Hash of a day's token usage
+        
+        "total_tokens" and "cost" (micro-dollars) are counted against quotas,
+        reservations included; answers add "input_tokens", "output_tokens"
+        and "model:{model}:tokens".
+        """
+        return f"usage:{self.segment}:{date_key}"
+
+    def usage_messages(self, date_key: str) -> str:
+        """Counter of a day's messages"""
+        return f"usage:{self.segment}:{date_key}:messages"
+
+    @property
+    def usage_monthly(self) -> str:
+        return f"usage:{self.segment}:monthly"
+
+    @property
+    def usage_monthly_spend(self) -> str:
+        """Hash of the month's "total_tokens" and "cost", as the day's usage hash counts them"""
+        return f"usage:{self.segment}:monthly_spend"
+
+    @property
+    def tier(self) -> str:
+        """Cached subscription tier (see app.services.tier_cache)"""
+        return f"usage:{self.segment}:tier"
+
+    def routing_decision(self, millis: int) -> str:
+        return f"routing_decision:{self.segment}:{millis}"
+
+def reads_tagged() -> bool:
+    """Whether reads use the tagged layout"""
+    return settings.REDIS_KEY_LAYOUT in ("migrated", "tagged")
+
+def writes_both() -> bool:
+    """Whether writes go to both layouts"""
+    return settings.REDIS_KEY_LAYOUT in ("migrating", "migrated")
+
+def read_keys(user_id: str) -> UserKeys:
+    """A user's keys in the layout reads come from"""
+    return UserKeys(user_id, reads_tagged())
+
+def write_keys(user_id: str) -> List[UserKeys]:
+    """A user's keys in every layout writes go to, the read layout first"""
+    primary = read_keys(user_id)
+    if not writes_both():
+        return [primary]
+    return [primary, UserKeys(user_id, not primary.tagged)]
+
+class UserKey(NamedTuple):
+    """A per-user key split into its parts"""
+    prefix: str
+    family: str
+    user_id: str
+    tagged: bool
+    rest: str
+
+    def in_layout(self, tagged: bool) -> str:
+        """The same key in a layout"""
+        segment = "{" + self.user_id + "}" if tagged else self.user_id
+        return self.prefix + segment + self.rest
+
+def parse_user_key(key: str) -> Optional[UserKey]:
+    """Split a per-user key of either layout, or None for other keys
+
+    Legacy keys are assumed to have user ids without ":", as everywhere
+    keys are split. Only the conversation index keys end with the user.
+    """
+    for prefix, family in USER_KEY_PREFIXES:
+        if not key.startswith(prefix):
+            continue
+        rest = key[len(prefix):]
+        if rest.startswith("{"):
+            end = rest.find("}")
+            if end < 0:
+                return None
+            parsed = UserKey(prefix, family, rest[1:end], True, rest[end + 1:])
+        else:
+            user_id, separator, tail = rest.partition(":")
+            parsed = UserKey(prefix, family, user_id, False, separator + tail)
+        if not parsed.user_id or (parsed.family == "index") != (parsed.rest == ""):
+            return None
+        return parsed
+    return None
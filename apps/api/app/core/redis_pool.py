@@ -0,0 +1,219 @@
+from typing import Dict, Optional, Union
+import asyncio
+import logging
+import time
+import redis.asyncio as redis
+from redis.asyncio.cluster import ClusterPipeline, RedisCluster
+from redis.asyncio.connection import (
+    BlockingConnectionPool,
+    HIREDIS_AVAILABLE,
+    _AsyncRESP2Parser,
+    _AsyncRESP3Parser
+)
+from redis.exceptions import ConnectionError
+from app.core.config import settings
+from app.core.redis_keys import KEY_LAYOUTS
+from app.core.metrics import (
+    REDIS_POOL_CONNECTIONS,
+    REDIS_POOL_MAX_CONNECTIONS,
+    REDIS_POOL_WAIT,
+    REDIS_POOL_EXHAUSTED
+)
+
+logger = logging.getLogger(__name__)
+
+def is_cluster(client) -> bool:
+    """Whether a client (or pipeline) talks to a Redis Cluster"""
+    return isinstance(client, (RedisCluster, ClusterPipeline))
+
+def open_pubsub(client: Union[redis.Redis, RedisCluster], **kwargs) -> redis.client.PubSub:
+    """A PubSub of the client
+
+    The cluster client has none; PUBLISH reaches every node of a cluster, so
+    a connection to one of them receives everything.
+    """
+    if is_cluster(client):
+        node = client.get_default_node()
+        return redis.Redis(
+            host=node.host,
+            port=node.port,
+            username=node.connection_kwargs.get("username"),
+            password=node.connection_kwargs.get("password"),
+            decode_responses=True
+        ).pubsub(**kwargs)
+    return client.pubsub(**kwargs)
+
+# The redis-py release whose BlockingConnectionPool internals the pool below
+# relies on; requirements.txt pins it
+REDIS_PY_VERSION = "5.0.1"
+
+def pool_counts(pool) -> Dict[str, int]:
+    """Connections of a pool in use and idle
+
+    redis-py keeps them in private attributes, which differ between its
+    standalone and cluster pools and between releases; anything missing
+    counts as 0 rather than failing health checks and metrics.
+    """
+    if hasattr(pool, "_in_use_connections"):
+        in_use = len(pool._in_use_connections)
+        idle = len(getattr(pool, "_available_connections", ()))
+    else:
+        # Cluster nodes track every connection and the idle ones
+        idle = len(getattr(pool, "_free", ()))
+        in_use = max(len(getattr(pool, "_connections", ())) - idle, 0)
+    return {"in_use": in_use, "idle": idle}
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """Blocking pool that records how long commands wait for a connection
+
+    With redis-py REDIS_PY_VERSION only the wait for a free slot happens
+    under the pool's condition; the connection is established outside it.
+    That release connects while holding the condition and then tries to
+    re-acquire it to release a connection that failed to connect, which
+    deadlocks until the pool timeout and leaks the slot. The fix reads the
+    pool's internals, so with any other release the wait is measured around
+    the public get_connection instead.
+    """
+
+    async def _reserve_connection(self):
+        async with self._condition:
+            await self._condition.wait_for(self.can_get_connection)
+            try:
+                connection = self._available_connections.pop()
+            except IndexError:
+                connection = self.make_connection()
+            self._in_use_connections.add(connection)
+            return connection
+
+    async def get_connection(self, command_name, *keys, **options):
+        if redis.__version__ != REDIS_PY_VERSION:
+            return await self._timed_get_connection(command_name, *keys, **options)
+
+        started = time.monotonic()
+        try:
+            connection = await asyncio.wait_for(self._reserve_connection(), self.timeout)
+        except asyncio.TimeoutError as err:
+            REDIS_POOL_EXHAUSTED.inc()
+            raise ConnectionError("No connection available.") from err
+        REDIS_POOL_WAIT.observe(time.monotonic() - started)
+
+        try:
+            await self.ensure_connection(connection)
+        except BaseException:
+            await self.release(connection)
+            raise
+        return connection
+
+    async def _timed_get_connection(self, command_name, *keys, **options):
+        """The stock get_connection, timed; its wait includes connecting"""
+        started = time.monotonic()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except ConnectionError as err:
+            if str(err) == "No connection available.":
+                REDIS_POOL_EXHAUSTED.inc()
+            raise
+        REDIS_POOL_WAIT.observe(time.monotonic() - started)
+        return connection
+
+class RedisConnectionManager:
+    """Owns the one Redis connection pool of a worker
+
+    The app, MemoryManager, SubscriptionService and ModelRouter all share the
+    client returned by get_client(). Connections are capped at
+    REDIS_MAX_CONNECTIONS; when all are busy, commands wait up to
+    REDIS_POOL_TIMEOUT for one instead of failing straight away.
+
+    With REDIS_CLUSTER the client is a RedisCluster, which keeps a pool of
+    up to REDIS_MAX_CONNECTIONS per node and fails instead of waiting when
+    one is exhausted.
+    """
+
+    def __init__(self):
+        self.pool: Optional[InstrumentedConnectionPool] = None
+        self.client: Optional[Union[redis.Redis, RedisCluster]] = None
+
+    def _parser_class(self):
+        """hiredis when enabled and installed, otherwise the pure Python parser"""
+        if settings.REDIS_HIREDIS and HIREDIS_AVAILABLE:
+            from redis.asyncio.connection import _AsyncHiredisParser
+            return _AsyncHiredisParser
+        if settings.REDIS_HIREDIS:
+            logger.info("hiredis is not installed, using the Python Redis parser")
+        return _AsyncRESP3Parser if settings.REDIS_PROTOCOL == 3 else _AsyncRESP2Parser
+
+    def get_client(self) -> Union[redis.Redis, RedisCluster]:
+        """Get the shared client, creating the pool on first use"""
+        if self.client is None and settings.REDIS_KEY_LAYOUT not in KEY_LAYOUTS:
+            raise ValueError(f"Unknown REDIS_KEY_LAYOUT {settings.REDIS_KEY_LAYOUT!r}")
+        if self.client is None and settings.REDIS_CLUSTER:
+            self.client = self._cluster_client()
+        elif self.client is None:
+            self.pool = InstrumentedConnectionPool.from_url(
+                settings.REDIS_URL,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+                socket_keepalive=settings.REDIS_SOCKET_KEEPALIVE,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                protocol=settings.REDIS_PROTOCOL,
+                parser_class=self._parser_class(),
+                decode_responses=True
+            )
+            self.client = redis.Redis(connection_pool=self.pool)
+
+            pool = self.pool
+            REDIS_POOL_MAX_CONNECTIONS.set(pool.max_connections)
+            REDIS_POOL_CONNECTIONS.labels(state="in_use").set_function(
+                lambda: pool_counts(pool)["in_use"]
+            )
+            REDIS_POOL_CONNECTIONS.labels(state="idle").set_function(
+                lambda: pool_counts(pool)["idle"]
+            )
+        return self.client
+
+    def _cluster_client(self) -> RedisCluster:
+        if settings.REDIS_KEY_LAYOUT != "tagged":
+            # Other layouts spread a user's keys over slots
+            raise ValueError("REDIS_CLUSTER needs REDIS_KEY_LAYOUT=tagged; migrate the keys first")
+        return RedisCluster.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            socket_keepalive=settings.REDIS_SOCKET_KEEPALIVE,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+            protocol=settings.REDIS_PROTOCOL,
+            decode_responses=True
+        )
+
+    async def close(self):
+        """Close the client and every pooled connection"""
+        if self.client is None:
+            return
+        await self.client.aclose()
+        if self.pool is not None:
+            await self.pool.disconnect()
+        self.client = None
+        self.pool = None
+
+    def stats(self) -> Dict:
+        """Current pool usage, for health checks"""
+        if is_cluster(self.client):
+            nodes = self.client.get_nodes()
+            counts = [pool_counts(node) for node in nodes]
+            return {
+                "in_use": sum(count["in_use"] for count in counts),
+                "idle": sum(count["idle"] for count in counts),
+                "max_connections": settings.REDIS_MAX_CONNECTIONS * len(nodes),
+                "nodes": len(nodes)
+            }
+        if self.pool is None:
+            return {"in_use": 0, "idle": 0, "max_connections": settings.REDIS_MAX_CONNECTIONS}
+        return {
+            **pool_counts(self.pool),
+            "max_connections": self.pool.max_connections
+        }
+
+redis_manager = RedisConnectionManager()
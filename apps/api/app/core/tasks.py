@@ -0,0 +1,62 @@
+from typing import Coroutine, Dict, Optional, Set
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class TaskRegistry:
+    """Tracks detached background work (conversation saves, usage updates)
+
+    Tasks spawned here are kept referenced until they finish, and can be
+    flushed on shutdown instead of being dropped with the event loop.
+    """
+
+    def __init__(self):
+        self.tasks: Set[asyncio.Task] = set()
+        self.completed = 0
+        self.failed = 0
+
+    def spawn(self, coro: Coroutine, name: Optional[str] = None) -> asyncio.Task:
+        """Run a coroutine in the background and track it"""
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.failed += 1
+            logger.error(f"Background task {task.get_name()} failed: {task.exception()}")
+        else:
+            self.completed += 1
+
+    async def drain(self, timeout: float) -> Dict[str, int]:
+        """Wait for pending tasks (including ones they spawn) up to timeout
+
+        Tasks still running at the deadline are cancelled.
+        """
+        deadline = time.monotonic() + timeout
+        pending_at_start = len(self.tasks)
+        completed_before = self.completed + self.failed
+
+        while self.tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.wait(set(self.tasks), timeout=remaining)
+
+        abandoned = len(self.tasks)
+        for task in list(self.tasks):
+            task.cancel()
+
+        return {
+            "pending": pending_at_start,
+            "flushed": self.completed + self.failed - completed_before,
+            "abandoned": abandoned
+        }
+
+task_registry = TaskRegistry()
@@ -0,0 +1,23 @@
+import logging
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Initialize tiktoken encoder (using cl100k_base which is used by GPT-3.5/4)
+try:
+    encoding = tiktoken.get_encoding("cl100k_base")
+except:
+    encoding = None
+    logger.warning("Failed to initialize tiktoken encoder")
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text using tiktoken"""
+    if encoding:
+        try:
+            return len(encoding.encode(text))
+        except:
+            # Fallback to rough estimation
+            return len(text) // 4
+    else:
+        # Rough estimation: 1 token ≈ 4 characters
+        return len(text) // 4
@@ -1,33 +1,129 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-import redis.asyncio as redis
+import asyncio
+import logging
+import time
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from app.core.config import settings
-from app.api.v1 import chat, usage, stripe, conversations
+from app.core.admission import admission_controller
+from app.core.tasks import task_registry
+from app.core.redis_pool import redis_manager
+from app.core.metrics import DRAIN_DURATION, DRAIN_GENERATIONS, DRAIN_BACKGROUND_TASKS
+from app.api.v1 import chat, usage, stripe, conversations, users
+from app.services.archive import ConversationArchiver, conversation_archive
+from app.services.context_cache import context_cache
+from app.services.conversation_store import close_conversation_store
+from app.services.memory import MemoryManager
+from app.services.purge import user_purger
+from app.services.tier_cache import tier_cache
+from app.providers.base import close_shared_clients
 import sentry_sdk
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
-# Global Redis client
-redis_client = None
+logger = logging.getLogger(__name__)
+
+# Started once, on SIGTERM by app.server.DrainingServer or else by the lifespan shutdown
+generations_drain = None
+
+async def drain_generations():
+    """Reject new generations and wait up to SHUTDOWN_DRAIN_TIMEOUT for running ones"""
+    started = time.monotonic()
+    admission_controller.start_draining()
+    in_flight = admission_controller.in_flight
+    idle = await admission_controller.wait_idle(settings.SHUTDOWN_DRAIN_TIMEOUT)
+    cut = 0 if idle else admission_controller.in_flight
+    return {"in_flight": in_flight, "cut": cut, "seconds": time.monotonic() - started}
+
+def start_drain():
+    """Start draining generations, or return the drain already under way"""
+    global generations_drain
+    if generations_drain is None:
+        generations_drain = asyncio.ensure_future(drain_generations())
+    return generations_drain
+
+async def drain():
+    """Drain the worker before closing its connections
+    
+    New generations are rejected first, running ones may finish until
+    SHUTDOWN_DRAIN_TIMEOUT, then pending background writes are flushed until
+    SHUTDOWN_FLUSH_TIMEOUT. When SIGTERM already drained the generations
+    (see app.server.DrainingServer) only the flush is left. Returns the drain
+    metrics.
+    """
+    generations = await start_drain()
+    generations_done = time.monotonic()
+    in_flight, cut = generations["in_flight"], generations["cut"]
+    
+    # Flush detached saves and usage updates
+    writes = await task_registry.drain(settings.SHUTDOWN_FLUSH_TIMEOUT)
+    finished = time.monotonic()
+    
+    report = {
+        "generations_in_flight": in_flight,
+        "generations_completed": in_flight - cut,
+        "generations_cut": cut,
+        "background_writes_pending": writes["pending"],
+        "background_writes_flushed": writes["flushed"],
+        "background_writes_abandoned": writes["abandoned"],
+        "generations_seconds": round(generations["seconds"], 3),
+        "flush_seconds": round(finished - generations_done, 3),
+        "total_seconds": round(generations["seconds"] + finished - generations_done, 3)
+    }
+    
+    DRAIN_DURATION.labels(phase="generations").set(generations["seconds"])
+    DRAIN_DURATION.labels(phase="flush").set(finished - generations_done)
+    DRAIN_GENERATIONS.labels(outcome="completed").set(in_flight - cut)
+    DRAIN_GENERATIONS.labels(outcome="cut").set(cut)
+    DRAIN_BACKGROUND_TASKS.labels(outcome="flushed").set(writes["flushed"])
+    DRAIN_BACKGROUND_TASKS.labels(outcome="abandoned").set(writes["abandoned"])
+    
+    return report
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle"""
-    # Startup
-    global redis_client
-    redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-    
-    # Store Redis client in app state
-    app.state.redis = redis_client
+    # Startup: one Redis pool shared by the app and every service
+    app.state.redis = redis_manager.get_client()
     
     # Initialize Sentry if configured
     if settings.SENTRY_DSN:
         sentry_sdk.init(dsn=settings.SENTRY_DSN)
     
+    # Serve recent context from memory while invalidations are received
+    context_cache.start(app.state.redis)
+    # Likewise subscription tiers
+    tier_cache.start(app.state.redis)
+    
+    # Move idle conversations to the Postgres archive in the background
+    archiver = None
+    if settings.ARCHIVE_ENABLED:
+        archiver = ConversationArchiver(MemoryManager())
+        archiver.start()
+    
+    # Pick up user data purges left unfinished by stopped workers
+    try:
+        resumed = await user_purger.resume_interrupted()
+        if resumed:
+            logger.info(f"Resumed {resumed} interrupted user data purges")
+    except Exception as e:
+        logger.warning(f"Could not resume user data purges: {e}")
+    
     yield
     
-    # Shutdown
-    await redis_client.close()
+    # Shutdown: drain first, then close connections in dependency order
+    if archiver:
+        await archiver.stop()
+    await user_purger.stop()
+    report = await drain()
+    logger.info(f"Shutdown drain complete: {report}")
+    await close_shared_clients()
+    await context_cache.stop()
+    await tier_cache.stop()
+    await close_conversation_store()
+    await conversation_archive.close()
+    await redis_manager.close()
 
 # Create FastAPI app
 app = FastAPI(
@@ -54,7 +150,8 @@ app.add_middleware(
         "X-Messages-Remaining", 
         "X-Selected-Model",
         "X-Message-Count",
-        "X-Request-Id"
+        "X-Request-Id",
+        "Retry-After"
     ],
 )
 
@@ -69,9 +166,16 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    if admission_controller.draining:
+        # Tell load balancers to stop routing here while in-flight work drains
+        return JSONResponse(
+            status_code=503,
+            content={"status": "draining", "load": admission_controller.stats()}
+        )
+    
     try:
-        # Check Redis connection
-        await redis_client.ping()
+        # Check Redis connection; bounded so health stays fast under overload
+        await asyncio.wait_for(redis_manager.get_client().ping(), timeout=1)
         redis_status = "healthy"
     except Exception:
         redis_status = "unhealthy"
@@ -81,11 +185,26 @@ async def health_check():
         "version": settings.VERSION,
         "services": {
             "redis": redis_status
-        }
+        },
+        "redis_pool": redis_manager.stats(),
+        "context_cache": context_cache.stats(),
+        "tier_cache": tier_cache.stats(),
+        "load": admission_controller.stats()
     }
 
+@app.get("/load")
+async def load():
+    """Current chat load of this worker, for autoscalers"""
+    return admission_controller.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Include routers
 app.include_router(chat.router, prefix="/api/v1", tags=["chat"])
 app.include_router(usage.router, prefix="/api/v1", tags=["usage"])
 app.include_router(stripe.router, prefix="/api/v1/stripe", tags=["stripe"])
-app.include_router(conversations.router, prefix="/api/v1/conversations", tags=["conversations"])
\ No newline at end of file
+app.include_router(conversations.router, prefix="/api/v1/conversations", tags=["conversations"])
+app.include_router(users.router, prefix="/api/v1/users", tags=["users"])
\ No newline at end of file
@@ -5,9 +5,14 @@ import json
 import time
 import logging
 from dataclasses import dataclass
+from app.core.messages import ChatMessage
 
 logger = logging.getLogger(__name__)
 
+# HTTP clients shared by all provider instances, keyed by base URL, so that
+# connection pools (and their TLS sessions) outlive a single request
+_shared_clients: Dict[str, httpx.AsyncClient] = {}
+
 @dataclass
 class ProviderConfig:
     """Configuration for a provider"""
@@ -18,12 +23,6 @@ class ProviderConfig:
     headers: Optional[Dict] = None
     timeout: int = 60
 
-@dataclass
-class ChatMessage:
-    """Standard chat message format"""
-    role: str
-    content: str
-
 @dataclass
 class ChatResponse:
     """Standard chat response format"""
@@ -39,17 +38,14 @@ class BaseProvider(ABC):
     
     def __init__(self, config: ProviderConfig):
         self.config = config
-        self.client = httpx.AsyncClient(
-            base_url=config.base_url,
-            headers=config.headers or {},
-            timeout=httpx.Timeout(config.timeout)
-        )
+        self.client = get_shared_client(config)
     
     async def __aenter__(self):
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
+        # The HTTP client is shared; it is closed by close_shared_clients()
+        pass
     
     @abstractmethod
     def transform_messages(self, messages: List[ChatMessage]) -> List[Dict]:
@@ -173,4 +169,23 @@ class BaseProvider(ABC):
     def estimate_tokens(self, text: str) -> int:
         """Estimate token count (rough approximation)"""
         # Rough estimation: 1 token ≈ 4 characters
-        return len(text) // 4
\ No newline at end of file
+        return len(text) // 4
+
+def get_shared_client(config: ProviderConfig) -> httpx.AsyncClient:
+    """Get the shared HTTP client for a provider's base URL"""
+    client = _shared_clients.get(config.base_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=config.base_url,
+            headers=config.headers or {},
+            timeout=httpx.Timeout(config.timeout)
+        )
+        _shared_clients[config.base_url] = client
+    return client
+
+async def close_shared_clients():
+    """Close all shared provider HTTP clients"""
+    clients = list(_shared_clients.values())
+    _shared_clients.clear()
+    for client in clients:
+        await client.aclose()
\ No newline at end of file
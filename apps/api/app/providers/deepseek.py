@@ -32,13 +32,7 @@ class DeepSeekProvider(BaseProvider):
     
     def transform_messages(self, messages: List[ChatMessage]) -> List[Dict]:
         """Transform to DeepSeek message format"""
-        return [
-            {
-                "role": msg.role,
-                "content": msg.content
-            }
-            for msg in messages
-        ]
+        return [msg.payload() for msg in messages]
     
     def build_request_payload(
         self,
@@ -97,13 +97,7 @@ class QwenProvider(BaseProvider):
     def transform_messages(self, messages: List[ChatMessage]) -> List[Dict]:
         """Transform to Qwen message format"""
         # Qwen uses a different structure for messages
-        return [
-            {
-                "role": msg.role,
-                "content": msg.content
-            }
-            for msg in messages
-        ]
+        return [msg.payload() for msg in messages]
     
     def build_request_payload(
         self,
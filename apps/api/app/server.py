@@ -0,0 +1,65 @@
+"""
+Run the API with a uvicorn server that drains generations on SIGTERM before
+it stops listening: python -m app.server [--host HOST] [--port PORT]
+"""
+
+from typing import Optional
+import argparse
+import asyncio
+import logging
+import signal
+import uvicorn
+from app.core.config import settings
+from app.main import start_drain
+
+logger = logging.getLogger(__name__)
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains in-flight generations before it stops listening
+
+    uvicorn closes its listeners as soon as it handles SIGTERM, and reaches
+    the lifespan shutdown only once connections have closed, so a drain
+    started there is never seen by load balancers or by streams still
+    running. On the first SIGTERM this server keeps listening: /health turns
+    503 and new generations are rejected right away, and uvicorn's exit runs
+    once running generations finished (or SHUTDOWN_DRAIN_TIMEOUT passed) and
+    /health reported draining for at least SHUTDOWN_HEALTH_GRACE. Other
+    signals, and a second SIGTERM, exit as uvicorn does.
+    """
+
+    def __init__(self, config: uvicorn.Config):
+        super().__init__(config)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.draining = False
+        self.hand_over: Optional[asyncio.Task] = None
+
+    async def serve(self, sockets=None):
+        self.loop = asyncio.get_running_loop()
+        await super().serve(sockets)
+
+    def handle_exit(self, sig, frame):
+        if sig != signal.SIGTERM or self.loop is None or self.draining:
+            super().handle_exit(sig, frame)
+            return
+        self.draining = True
+        logger.info("SIGTERM received, draining before shutdown")
+        # Signal handlers may run outside the loop (uvicorn >= 0.29)
+        self.loop.call_soon_threadsafe(self._start_hand_over, sig, frame)
+
+    def _start_hand_over(self, sig, frame):
+        self.hand_over = self.loop.create_task(self._exit_when_drained(sig, frame))
+
+    async def _exit_when_drained(self, sig, frame):
+        await asyncio.gather(start_drain(), asyncio.sleep(settings.SHUTDOWN_HEALTH_GRACE))
+        logger.info("Generations drained, shutting the server down")
+        super().handle_exit(sig, frame)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the CmdShift API, draining generations on SIGTERM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    DrainingServer(uvicorn.Config("app.main:app", host=args.host, port=args.port)).run()
+
+if __name__ == "__main__":
+    main()
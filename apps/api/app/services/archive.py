@@ -0,0 +1,266 @@
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import random
+import time
+import asyncpg
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Messages are archived as stored in Redis (message_codec frames or legacy
+# JSON), keyed by list position, so rehydration pushes back the same bytes.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_conversations (
+    user_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    record JSONB NOT NULL,
+    summary JSONB,
+    next_seq INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (user_id, conversation_id)
+);
+CREATE INDEX IF NOT EXISTS archived_conversations_user_updated
+    ON archived_conversations (user_id, updated_at DESC);
+CREATE TABLE IF NOT EXISTS archived_messages (
+    user_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    payload BYTEA NOT NULL,
+    PRIMARY KEY (user_id, conversation_id, position)
+);
+"""
+
+CONVERSATION_COLUMNS = ["user_id", "conversation_id", "record", "summary", "next_seq", "updated_at", "archived_at"]
+MESSAGE_COLUMNS = ["user_id", "conversation_id", "position", "payload"]
+
+# Rows of the given (user id, conversation id) pairs
+DELETE_CONVERSATIONS = """
+DELETE FROM {table} t
+USING unnest($1::text[], $2::text[]) AS k(user_id, conversation_id)
+WHERE t.user_id = k.user_id AND t.conversation_id = k.conversation_id
+"""
+
+class ConversationArchive:
+    """Cold tier of conversation memory in Postgres (DATABASE_URL)
+
+    Conversations idle for ARCHIVE_IDLE_SECONDS are moved here in batches by
+    the archiver and removed from Redis; MemoryManager pulls one back into
+    Redis the first time it is accessed again.
+    """
+
+    def __init__(self, dsn: Optional[str] = None, pool_size: Optional[int] = None):
+        self.dsn = dsn or settings.DATABASE_URL
+        self.pool_size = pool_size or settings.ARCHIVE_POOL_SIZE
+        self.pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        async with self._pool_lock:
+            if self.pool is None:
+                pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+                async with pool.acquire() as conn:
+                    await conn.execute(SCHEMA)
+                self.pool = pool
+        return self.pool
+
+    async def store(self, conversations: List[Dict]):
+        """Write conversations (replacing earlier archives of them) in one transaction
+
+        Each conversation is a dict with user_id, conversation_id, record,
+        summary, next_seq, updated_at (epoch seconds) and messages (raw list
+        items). Rows are bulk-loaded with COPY.
+        """
+        if not conversations:
+            return
+        archived_at = datetime.now(timezone.utc)
+        users = [conv["user_id"] for conv in conversations]
+        conv_ids = [conv["conversation_id"] for conv in conversations]
+
+        conversation_rows = []
+        message_rows = []
+        for conv in conversations:
+            conversation_rows.append((
+                conv["user_id"],
+                conv["conversation_id"],
+                json.dumps(conv["record"]),
+                json.dumps(conv["summary"]) if conv["summary"] else None,
+                conv["next_seq"],
+                datetime.fromtimestamp(conv["updated_at"], timezone.utc),
+                archived_at
+            ))
+            message_rows.extend(
+                (conv["user_id"], conv["conversation_id"], position, payload)
+                for position, payload in enumerate(conv["messages"])
+            )
+
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(DELETE_CONVERSATIONS.format(table="archived_messages"), users, conv_ids)
+                await conn.execute(DELETE_CONVERSATIONS.format(table="archived_conversations"), users, conv_ids)
+                await conn.copy_records_to_table(
+                    "archived_conversations", records=conversation_rows, columns=CONVERSATION_COLUMNS
+                )
+                if message_rows:
+                    await conn.copy_records_to_table(
+                        "archived_messages", records=message_rows, columns=MESSAGE_COLUMNS
+                    )
+
+    async def load(self, user_id: str, conversation_id: str) -> Optional[Dict]:
+        """An archived conversation in the shape given to store, or None"""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT record, summary, next_seq, updated_at FROM archived_conversations "
+                "WHERE user_id = $1 AND conversation_id = $2",
+                user_id, conversation_id
+            )
+            if row is None:
+                return None
+            payloads = await conn.fetch(
+                "SELECT payload FROM archived_messages "
+                "WHERE user_id = $1 AND conversation_id = $2 ORDER BY position",
+                user_id, conversation_id
+            )
+        return {
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "record": json.loads(row["record"]),
+            "summary": json.loads(row["summary"]) if row["summary"] else None,
+            "next_seq": row["next_seq"],
+            "updated_at": row["updated_at"].timestamp(),
+            "messages": [payload["payload"] for payload in payloads]
+        }
+
+    async def list_conversations(self, user_id: str, limit: int) -> List[Tuple[str, float, Dict]]:
+        """(conversation id, updated at, listing record) of the most recent archived conversations"""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT conversation_id, updated_at, record FROM archived_conversations "
+                "WHERE user_id = $1 ORDER BY updated_at DESC LIMIT $2",
+                user_id, limit
+            )
+        return [(row["conversation_id"], row["updated_at"].timestamp(), json.loads(row["record"])) for row in rows]
+
+    async def iter_conversations(self, user_id: str, batch_size: int) -> AsyncIterator[Dict]:
+        """Every archived conversation of a user, in the shape given to store
+
+        Conversations are read a page of batch_size at a time (keyset
+        pagination on the conversation id), each page with two queries.
+        """
+        pool = await self._get_pool()
+        after = ""
+        while True:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT conversation_id, record, summary, next_seq, updated_at FROM archived_conversations "
+                    "WHERE user_id = $1 AND conversation_id > $2 ORDER BY conversation_id LIMIT $3",
+                    user_id, after, batch_size
+                )
+                if not rows:
+                    return
+                conv_ids = [row["conversation_id"] for row in rows]
+                payloads = await conn.fetch(
+                    "SELECT conversation_id, payload FROM archived_messages "
+                    "WHERE user_id = $1 AND conversation_id = ANY($2::text[]) ORDER BY conversation_id, position",
+                    user_id, conv_ids
+                )
+
+            messages: Dict[str, List[bytes]] = {conv_id: [] for conv_id in conv_ids}
+            for payload in payloads:
+                messages[payload["conversation_id"]].append(payload["payload"])
+            for row in rows:
+                yield {
+                    "user_id": user_id,
+                    "conversation_id": row["conversation_id"],
+                    "record": json.loads(row["record"]),
+                    "summary": json.loads(row["summary"]) if row["summary"] else None,
+                    "next_seq": row["next_seq"],
+                    "updated_at": row["updated_at"].timestamp(),
+                    "messages": messages[row["conversation_id"]]
+                }
+            after = conv_ids[-1]
+
+    async def delete(self, conversations: List[Tuple[str, str]]):
+        """Remove (user id, conversation id) pairs from the archive"""
+        if not conversations:
+            return
+        users = [user_id for user_id, _ in conversations]
+        conv_ids = [conv_id for _, conv_id in conversations]
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(DELETE_CONVERSATIONS.format(table="archived_messages"), users, conv_ids)
+                await conn.execute(DELETE_CONVERSATIONS.format(table="archived_conversations"), users, conv_ids)
+
+    async def delete_user(self, user_id: str) -> int:
+        """Remove every archived conversation of a user; returns how many there were"""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM archived_messages WHERE user_id = $1", user_id)
+                status = await conn.execute("DELETE FROM archived_conversations WHERE user_id = $1", user_id)
+        # Status is "DELETE <rows>"
+        return int(status.split()[-1])
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+class ConversationArchiver:
+    """Background loop moving idle conversations from Redis to the archive
+
+    Every worker runs the loop, but a Redis lock lets only one of them make
+    each pass. Passes are write-behind: nothing on the request path waits on
+    Postgres except rehydrating an archived conversation.
+    """
+
+    lock_key = "archiver:lock"
+
+    def __init__(self, memory_manager, interval: Optional[float] = None):
+        self.memory_manager = memory_manager
+        self.interval = interval or settings.ARCHIVE_INTERVAL_SECONDS
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run(), name="conversation-archiver")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run_once(self) -> Optional[Dict[str, int]]:
+        """Make one pass if no other worker holds the lock"""
+        redis_client = await self.memory_manager._get_redis()
+        if not await redis_client.set(self.lock_key, "1", nx=True, ex=max(1, int(self.interval))):
+            return None
+        started = time.monotonic()
+        totals = await self.memory_manager.archive_idle_conversations()
+        logger.info(f"Archived {totals['archived']} idle conversations "
+                    f"({totals['messages']} messages) in {time.monotonic() - started:.1f}s")
+        return totals
+
+    async def _run(self):
+        while True:
+            # Jittered so workers started together don't contend for the lock
+            await asyncio.sleep(self.interval * random.uniform(0.5, 1.0))
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Archiver pass failed: {e}")
+
+conversation_archive = ConversationArchive()
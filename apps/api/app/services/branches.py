@@ -0,0 +1,66 @@
+from typing import Dict, Optional
+from datetime import datetime
+import uuid
+from app.core.config import settings
+from app.core.redis_keys import write_keys
+
+class ConversationBranches:
+    """Branches of conversations in a MemoryManager's Redis
+
+    A branch stores only its own messages and reads the ones it shares from
+    its ancestors (see READ_VIEW_SCRIPT in memory_scripts); the manager's
+    reads, writes and eviction follow the lineage from there.
+    """
+
+    def __init__(self, memory_manager):
+        self.memory_manager = memory_manager
+
+    async def fork(
+        self,
+        conversation_id: str,
+        user_id: str,
+        fork: Optional[int] = None,
+        branch_id: Optional[str] = None
+    ) -> Dict:
+        """Start a branch of a conversation (see MemoryManager.fork_conversation)"""
+        manager = self.memory_manager
+        await manager._get_redis()
+        branch_id = branch_id or uuid.uuid4().hex
+        calls = [
+            ([
+                keys.conversation(conversation_id),
+                keys.meta(conversation_id),
+                keys.summary(conversation_id),
+                keys.conversation(branch_id),
+                keys.meta(branch_id),
+                keys.summary(branch_id),
+                keys.conversations,
+                keys.records,
+                keys.archived
+            ], [
+                conversation_id,
+                branch_id,
+                "" if fork is None else fork,
+                manager.memory_ttl,
+                datetime.utcnow().timestamp(),
+                datetime.utcnow().isoformat(),
+                settings.BRANCH_MAX_DEPTH,
+                *keys.lineage_prefixes
+            ])
+            for keys in write_keys(user_id)
+        ]
+        forked = (await manager._run_script(manager.fork_script, calls))[0]
+        if len(forked) == 1 and int(forked[0]) == -4:
+            if not manager.archive:
+                raise RuntimeError(f"Conversation {conversation_id} is archived but ARCHIVE_ENABLED is off")
+            await manager._rehydrate(user_id, conversation_id)
+            forked = (await manager._run_script(manager.fork_script, calls))[0]
+        if len(forked) == 1:
+            raise ValueError({
+                -1: f"Conversation {branch_id} already exists",
+                -2: f"Fork {fork} is outside conversation {conversation_id}",
+                -3: f"Branches nest at most {settings.BRANCH_MAX_DEPTH} levels deep"
+            }.get(int(forked[0]), f"Conversation {conversation_id} can't be branched"))
+
+        parent, fork = forked
+        return {"id": branch_id, "parent": parent, "fork": int(fork)}
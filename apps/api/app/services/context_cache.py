@@ -0,0 +1,244 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import uuid
+import redis.asyncio as redis
+from app.core.config import settings
+from app.core.messages import ChatMessage
+from app.core.redis_pool import open_pubsub
+from app.core.metrics import CONTEXT_CACHE_BYTES, CONTEXT_CACHE_ENTRIES, CONTEXT_CACHE_EVICTIONS, CONTEXT_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "context:invalidate"
+
+# Rough per-message overhead of a decoded ChatMessage beyond its content
+MESSAGE_OVERHEAD_BYTES = 250
+
+class _Entry:
+    """Recent context of one conversation
+
+    messages  the newest stored messages (at most CONTEXT_CACHE_MESSAGES), shared
+              with every reader: ChatMessages are read-only
+    length    the stored list length, so tails can be told from whole lists
+    summary   the parsed rolling summary, or None
+    """
+
+    __slots__ = ("messages", "length", "summary", "size")
+
+    def __init__(self, messages: List[ChatMessage], length: int, summary: Optional[Dict]):
+        self.messages = messages
+        self.length = length
+        self.summary = summary
+        self.size = sum(self.message_size(msg) for msg in messages)
+
+    @staticmethod
+    def message_size(msg: ChatMessage) -> int:
+        return len(msg.content or "") + MESSAGE_OVERHEAD_BYTES
+
+    def covers(self, max_messages: int) -> bool:
+        return len(self.messages) >= max_messages or len(self.messages) == self.length
+
+class ContextCache:
+    """Per-worker LRU of decoded recent conversation context
+
+    Entries are updated write-through by the worker's own appends and
+    dropped when any worker publishes an invalidation for the conversation
+    (appends, summaries, compaction, deletion). Publishes happen
+    inside the Lua scripts and pipelines of the writes themselves, so they
+    cost no extra round trip.
+
+    Lookups are only served while this worker is subscribed to
+    invalidations: without the subscription, another worker's write could
+    go unnoticed. After the subscription drops, the cache starts empty.
+    Memory is capped at CONTEXT_CACHE_MAX_BYTES of (estimated) message
+    size, evicting least recently used conversations.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, max_messages: Optional[int] = None):
+        self.max_bytes = max_bytes if max_bytes is not None else settings.CONTEXT_CACHE_MAX_BYTES
+        self.max_messages = max_messages or settings.CONTEXT_CACHE_MESSAGES
+        self.entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Tells this worker's own invalidations apart from other workers'
+        self.origin = uuid.uuid4().hex
+        self.generation = 0
+        self.subscribed = False
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+
+        CONTEXT_CACHE_ENTRIES.set_function(lambda: len(self.entries))
+        CONTEXT_CACHE_BYTES.set_function(lambda: self.size)
+
+    @property
+    def active(self) -> bool:
+        return settings.CONTEXT_CACHE_ENABLED and self.subscribed
+
+    def invalidation_message(self, user_id: str, conversation_id: str) -> str:
+        """Payload published on INVALIDATION_CHANNEL by a write to a conversation"""
+        return json.dumps({"origin": self.origin, "user_id": user_id, "conversation_id": conversation_id})
+
+    def get(self, user_id: str, conversation_id: str, max_messages: int) -> Optional[_Entry]:
+        """The conversation's entry if it holds the newest max_messages messages"""
+        if not self.active:
+            return None
+        entry = self.entries.get((user_id, conversation_id))
+        if entry is None or not entry.covers(max_messages):
+            self.misses += 1
+            CONTEXT_CACHE_REQUESTS.labels(result="miss").inc()
+            return None
+        self.entries.move_to_end((user_id, conversation_id))
+        self.hits += 1
+        CONTEXT_CACHE_REQUESTS.labels(result="hit").inc()
+        return entry
+
+    def put(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[ChatMessage],
+        length: int,
+        summary: Optional[Dict],
+        generation: int
+    ):
+        """Cache context read from Redis
+
+        generation is the value of self.generation before the read; if any
+        invalidation arrived since, the read may be stale and is not cached.
+        """
+        if not self.active or generation != self.generation:
+            return
+        self._store((user_id, conversation_id), _Entry(messages[-self.max_messages:], length, summary))
+
+    def append(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[ChatMessage],
+        next_seq: int,
+        generation: int
+    ):
+        """Write through messages just appended, now ending at next_seq
+
+        A conversation created by these messages gets a new entry, unless an
+        invalidation arrived since generation was read before the write:
+        another write may have followed it. An existing entry missed another
+        write if it doesn't end right before them, and is dropped.
+        """
+        key = (user_id, conversation_id)
+        entry = self.entries.get(key)
+        first_seq = next_seq - len(messages)
+        stale = generation != self.generation
+        # Reads that started before this write must not be cached
+        self.generation += 1
+        if entry is None:
+            if first_seq == 0 and self.active and not stale:
+                self._store(key, _Entry(list(messages[-self.max_messages:]), next_seq, None))
+            return
+
+        last_seq = entry.messages[-1].seq if entry.messages else None
+        if last_seq is None or last_seq + 1 != first_seq:
+            self.discard(user_id, conversation_id)
+            return
+        self._store(key, _Entry((entry.messages + list(messages))[-self.max_messages:], entry.length + len(messages), entry.summary))
+
+    def discard(self, user_id: str, conversation_id: str, reason: str = "write"):
+        self.generation += 1
+        entry = self.entries.pop((user_id, conversation_id), None)
+        if entry is not None:
+            self.size -= entry.size
+            CONTEXT_CACHE_EVICTIONS.labels(reason=reason).inc()
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.size = 0
+
+    def _store(self, key: Tuple[str, str], entry: _Entry):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous.size
+        if entry.size > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            CONTEXT_CACHE_EVICTIONS.labels(reason="capacity").inc()
+
+    def start(self, redis_client: redis.Redis):
+        """Subscribe to invalidations in the background"""
+        if self.task is None and settings.CONTEXT_CACHE_ENABLED:
+            self.stopping = False
+            self.task = asyncio.create_task(self._listen(redis_client), name="context-cache-invalidations")
+
+    async def stop(self):
+        if self.task is not None:
+            # The flag ends the loop even if a poll swallows the cancellation
+            self.stopping = True
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.subscribed = False
+        self.clear()
+
+    async def _listen(self, redis_client: redis.Redis):
+        backoff = 0.5
+        while not self.stopping:
+            pubsub = open_pubsub(redis_client, ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                self.clear()
+                self.subscribed = True
+                backoff = 0.5
+                while not self.stopping:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._on_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Context cache invalidations interrupted: {e}")
+            finally:
+                # Invalidations may be missed until subscribed again
+                self.subscribed = False
+                self.clear()
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            if not self.stopping:
+                await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _on_message(self, data):
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if message.get("origin") != self.origin:
+            self.discard(message["user_id"], message["conversation_id"], reason="invalidation")
+
+    def stats(self) -> Dict:
+        """Cache usage, for health checks"""
+        requests = self.hits + self.misses
+        return {
+            "enabled": settings.CONTEXT_CACHE_ENABLED,
+            "subscribed": self.subscribed,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 4) if requests else None
+        }
+
+context_cache = ContextCache()
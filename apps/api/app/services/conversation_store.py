@@ -0,0 +1,92 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Union
+from app.core.config import settings
+from app.core.messages import ChatMessage
+
+class ConversationStore(ABC):
+    """Storage backend of conversation memory
+
+    The operations chat needs, implemented by MemoryManager (Redis, the
+    default) and SQLiteConversationStore (one SQLite file, for single-node
+    deployments). MEMORY_BACKEND picks the one get_conversation_store
+    returns. Rolling summaries, branches, paging, export and the archive
+    are MemoryManager's alone.
+
+    Messages are ChatMessages or dicts with at least "role" and "content";
+    stored ones also carry "id", "timestamp", "model" and "seq", their
+    position in the conversation.
+    """
+
+    @abstractmethod
+    async def get_context(
+        self,
+        conversation_id: str,
+        user_id: str,
+        max_messages: int = 20,
+        include_summary: bool = False
+    ) -> List[Dict]:
+        """The newest max_messages stored messages of a conversation, oldest first"""
+
+    async def get_chat_context(
+        self,
+        conversation_id: str,
+        user_id: str,
+        max_messages: int = 20,
+        include_summary: bool = False
+    ) -> List[ChatMessage]:
+        """get_context as ChatMessages, for the chat API and providers"""
+        context = await self.get_context(conversation_id, user_id, max_messages, include_summary)
+        return [ChatMessage.from_dict(msg) for msg in context]
+
+    @abstractmethod
+    async def store_conversation(
+        self,
+        conversation_id: str,
+        user_id: str,
+        messages: List[Union[ChatMessage, Dict]],
+        model: str,
+        limits: Optional[Dict] = None
+    ) -> Optional[int]:
+        """Append the messages without a "seq"; returns the next seq (None if nothing was stored)
+
+        limits are a tier's STORAGE_LIMITS, kept after the write.
+        """
+
+    @abstractmethod
+    async def get_user_conversations(self, user_id: str, limit: int = 20) -> List[Dict]:
+        """The user's most recently updated conversations, newest first"""
+
+    @abstractmethod
+    async def search_memories(self, user_id: str, query: str, limit: int = 10) -> List[Dict]:
+        """The user's messages best matching query, as conversation_id, message and score"""
+
+    @abstractmethod
+    async def set_title(self, conversation_id: str, user_id: str, title: str):
+        """Set the title a conversation is listed under"""
+
+    @abstractmethod
+    async def clear_conversation(self, conversation_id: str, user_id: str):
+        """Delete a conversation"""
+
+    async def close(self):
+        """Release the backend's connections"""
+
+_store: Optional[ConversationStore] = None
+
+def get_conversation_store() -> ConversationStore:
+    """The worker's conversation store, of the MEMORY_BACKEND configured"""
+    global _store
+    if _store is None:
+        if settings.MEMORY_BACKEND == "sqlite":
+            from app.services.sqlite_store import SQLiteConversationStore
+            _store = SQLiteConversationStore()
+        else:
+            from app.services.memory import MemoryManager
+            _store = MemoryManager()
+    return _store
+
+async def close_conversation_store():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
@@ -0,0 +1,125 @@
+from typing import Dict, List, Optional
+from datetime import datetime
+import logging
+import redis.asyncio as redis
+from app.core.config import settings
+from app.core.redis_keys import glob_escape, parse_user_key
+from app.core.redis_pool import is_cluster, redis_manager
+
+logger = logging.getLogger(__name__)
+
+class KeyMigration:
+    """Moves per-user keys from the legacy to the tagged layout (see app.core.redis_keys)
+
+    Rollout, without downtime:
+
+      1. REDIS_KEY_LAYOUT=migrating on every worker: writes go to both
+         layouts, reads stay on legacy keys
+      2. backfill: every legacy key is copied over its tagged twin
+      3. REDIS_KEY_LAYOUT=migrated: reads move to tagged keys, legacy keys
+         are still written, so step 3 can be undone
+      4. REDIS_KEY_LAYOUT=tagged, then cleanup removes the legacy keys
+      5. Move the data to a Redis Cluster and set REDIS_CLUSTER
+
+    The backfill SCANs the keyspace KEY_MIGRATION_SCAN_COUNT keys at a time
+    and copies each page's legacy keys with COPY ... REPLACE (atomic per key,
+    TTL kept) in one MULTI, together with a checkpoint of the SCAN cursor in
+    the hash key_migration:state; an interrupted backfill resumes from it.
+    Workers write both layouts in one MULTI too, so no write lands between
+    a copy and its source. COPY can't cross cluster slots: migrate on a
+    single Redis before sharding.
+
+    With a user id, only that user's keys are migrated (to try the rollout
+    on a few users first); its backfill checkpoints to its own hash.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None, user_id: Optional[str] = None):
+        self.redis_client = redis_client
+        self.user_id = user_id
+        self.match = f"*{glob_escape(user_id)}*" if user_id else None
+        self.state_key = f"key_migration:state:{user_id}" if user_id else "key_migration:state"
+
+    def _get_redis(self) -> redis.Redis:
+        if self.redis_client is None:
+            self.redis_client = redis_manager.get_client()
+        if is_cluster(self.redis_client):
+            raise RuntimeError("Keys can't be migrated on Redis Cluster; migrate before sharding")
+        return self.redis_client
+
+    async def backfill(self) -> Dict[str, int]:
+        """Copy every legacy key to the tagged layout, resuming an interrupted run
+
+        Returns the numbers of keys scanned and copied by the whole run.
+        """
+        if settings.REDIS_KEY_LAYOUT not in ("migrating", "migrated"):
+            raise RuntimeError("Backfill with REDIS_KEY_LAYOUT=migrating on every worker, or writes are lost")
+        redis_client = self._get_redis()
+        state = await redis_client.hgetall(self.state_key)
+        cursor = int(state.get("cursor", 0))
+        if not state:
+            await redis_client.hset(self.state_key, mapping={
+                "cursor": 0,
+                "scanned": 0,
+                "copied": 0,
+                "started_at": datetime.utcnow().isoformat()
+            })
+
+        while True:
+            cursor, keys = await redis_client.scan(cursor, match=self.match, count=settings.KEY_MIGRATION_SCAN_COUNT)
+            legacy = self._legacy_keys(keys)
+            async with redis_client.pipeline(transaction=True) as pipe:
+                for key, tagged in legacy:
+                    pipe.copy(key, tagged, replace=True)
+                pipe.hincrby(self.state_key, "scanned", len(keys))
+                pipe.hincrby(self.state_key, "copied", len(legacy))
+                pipe.hset(self.state_key, "cursor", cursor)
+                await pipe.execute()
+            if cursor == 0:
+                break
+
+        state = await redis_client.hgetall(self.state_key)
+        await redis_client.delete(self.state_key)
+        totals = {"scanned": int(state["scanned"]), "copied": int(state["copied"])}
+        logger.info(f"Key backfill copied {totals['copied']} of {totals['scanned']} keys")
+        return totals
+
+    async def verify(self) -> Dict[str, int]:
+        """Count legacy keys and those of them without a tagged twin"""
+        redis_client = self._get_redis()
+        totals = {"legacy": 0, "missing": 0}
+        cursor = None
+        while cursor != 0:
+            cursor, keys = await redis_client.scan(cursor or 0, match=self.match, count=settings.KEY_MIGRATION_SCAN_COUNT)
+            legacy = self._legacy_keys(keys)
+            if not legacy:
+                continue
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for _, tagged in legacy:
+                    pipe.exists(tagged)
+                found = await pipe.execute()
+            totals["legacy"] += len(legacy)
+            totals["missing"] += found.count(0)
+        return totals
+
+    async def cleanup(self) -> int:
+        """UNLINK every legacy key once no worker uses them; returns how many"""
+        if settings.REDIS_KEY_LAYOUT != "tagged":
+            raise RuntimeError("Remove legacy keys only with REDIS_KEY_LAYOUT=tagged on every worker")
+        redis_client = self._get_redis()
+        deleted = 0
+        cursor = None
+        while cursor != 0:
+            cursor, keys = await redis_client.scan(cursor or 0, match=self.match, count=settings.KEY_MIGRATION_SCAN_COUNT)
+            legacy = [key for key, _ in self._legacy_keys(keys)]
+            if legacy:
+                deleted += await redis_client.unlink(*legacy)
+        return deleted
+
+    def _legacy_keys(self, keys: List[str]) -> List[tuple]:
+        """(legacy key, tagged twin) of the per-user keys in legacy layout"""
+        pairs = []
+        for key in keys:
+            parsed = parse_user_key(key)
+            if parsed is not None and not parsed.tagged and self.user_id in (None, parsed.user_id):
+                pairs.append((key, parsed.in_layout(True)))
+        return pairs
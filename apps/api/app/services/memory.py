@@ -1,94 +1,1099 @@
-from typing import List, Dict, Optional
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 import json
+import logging
+import time
+import uuid
 from datetime import datetime, timedelta
 import redis.asyncio as redis
+from redis.exceptions import NoScriptError
 from app.core.config import settings
+from app.core.messages import ChatMessage
+from app.core.redis_keys import (
+    UserKey,
+    UserKeys,
+    parse_user_key,
+    read_keys,
+    reads_tagged,
+    write_keys,
+    writes_both
+)
+from app.core.redis_pool import is_cluster, redis_manager
+from app.core.metrics import (
+    ARCHIVE_REHYDRATE_DURATION,
+    CONVERSATIONS_ARCHIVED,
+    CONVERSATIONS_REHYDRATED,
+    STORAGE_CONVERSATIONS_EVICTED,
+    STORAGE_MESSAGES_TRIMMED
+)
+from app.services.archive import ConversationArchive, conversation_archive
+from app.services.branches import ConversationBranches
+from app.services.context_cache import INVALIDATION_CHANNEL, context_cache
+from app.services.conversation_store import ConversationStore
+from app.services.message_codec import (
+    decode_chat_message,
+    decode_message,
+    encode_body,
+    encode_json_body,
+    encode_message
+)
+from app.services.memory_scripts import (
+    APPEND_MESSAGES_SCRIPT,
+    DROP_RECORD_SCRIPT,
+    EVICT_SCRIPT,
+    FORK_SCRIPT,
+    IMPORT_SCRIPT,
+    LIST_CONVERSATIONS_SCRIPT,
+    MATERIALIZE_SCRIPT,
+    READ_VIEW_SCRIPT,
+    RESIZE_RECORD_SCRIPT,
+    RESTORE_SCRIPT,
+    TRIM_MESSAGES_SCRIPT,
+    UPDATE_RECORD_SCRIPT,
+    script_call
+)
+from app.services.search import REINDEX_SCRIPT, SEARCH_SCRIPT, term_frequencies, tokenize
+from app.services.transfer import ConversationTransfer
 
-class MemoryManager:
-    def __init__(self):
-        self.redis_client = None
+logger = logging.getLogger(__name__)
+
+class MemoryManager(ConversationStore):
+    """Conversation memory in Redis
+    
+    Every public method costs a constant number of round trips regardless of
+    how many messages or conversations it touches: commands are batched into
+    pipelines, and appends run as a Lua script.
+    
+    Messages are stored in the compact encoding of message_codec and read
+    as raw bytes (NEVER_DECODE) whatever the client's decode_responses, so
+    messages stored as JSON by earlier versions stay readable.
+    
+    With an archive (ARCHIVE_ENABLED), idle conversations move to Postgres
+    and are rehydrated transparently when read or appended to. Only hot
+    conversations are searchable.
+    
+    Keys come from app.core.redis_keys: reads use the layout of
+    REDIS_KEY_LAYOUT, writes go to every layout it writes while keys are
+    migrated, the read layout's result deciding. Writes to several layouts
+    run in one MULTI.
+    
+    Writes given a tier's storage limits keep the user under them: the
+    oldest messages of a long conversation are trimmed, after trim_hook
+    (the summarizer, in the chat API) has seen them, and the least recently
+    updated conversations move to the archive, or are deleted without one.
+    
+    A branch (fork_conversation) stores only its own messages and reads the
+    ones it shares from its ancestors, copy-on-write: conversations with
+    branches are never evicted, and clearing one copies what its branches
+    share into them first.
+    
+    The Lua scripts live in memory_scripts; forking (ConversationBranches)
+    and export and import (ConversationTransfer) work through the manager
+    from their own modules.
+    """
+    
+    def __init__(
+        self,
+        redis_client: Optional[redis.Redis] = None,
+        archive: Optional[ConversationArchive] = None,
+        trim_hook: Optional[Callable[[str, str, List[Dict]], Awaitable[bool]]] = None
+    ):
+        self.redis_client = redis_client
+        self.archive = archive or (conversation_archive if settings.ARCHIVE_ENABLED else None)
+        # Called with (user id, conversation id, messages) before the oldest
+        # messages of a conversation are trimmed; False keeps them for now
+        self.trim_hook = trim_hook
         self.memory_ttl = 7 * 24 * 60 * 60  # 7 days in seconds
+        self.max_write_retries = 5
+        self.append_script = None
+        self.update_record_script = None
+        self.list_script = None
+        self.search_script = None
+        self.evict_script = None
+        self.restore_script = None
+        self.import_script = None
+        self.trim_script = None
+        self.fork_script = None
+        self.view_script = None
+        self.branches = ConversationBranches(self)
+        self.transfer = ConversationTransfer(self)
         
     async def _get_redis(self) -> redis.Redis:
-        """Get or create Redis connection"""
+        """Get the Redis client, the worker's shared pool unless one was injected"""
         if not self.redis_client:
-            self.redis_client = redis.from_url(
-                settings.REDIS_URL,
-                decode_responses=True
-            )
+            self.redis_client = redis_manager.get_client()
+        if self.append_script is None:
+            self.append_script = self.redis_client.register_script(APPEND_MESSAGES_SCRIPT)
+            self.update_record_script = self.redis_client.register_script(UPDATE_RECORD_SCRIPT)
+            self.list_script = self.redis_client.register_script(LIST_CONVERSATIONS_SCRIPT)
+            self.search_script = self.redis_client.register_script(SEARCH_SCRIPT)
+            self.evict_script = self.redis_client.register_script(EVICT_SCRIPT)
+            self.restore_script = self.redis_client.register_script(RESTORE_SCRIPT)
+            self.import_script = self.redis_client.register_script(IMPORT_SCRIPT)
+            self.trim_script = self.redis_client.register_script(TRIM_MESSAGES_SCRIPT)
+            self.fork_script = self.redis_client.register_script(FORK_SCRIPT)
+            self.view_script = self.redis_client.register_script(READ_VIEW_SCRIPT)
         return self.redis_client
     
+    def _pipeline(self, redis_client: redis.Redis, transaction: bool = False):
+        """A pipeline of the client, as a MULTI transaction if asked and possible
+        
+        The cluster client sends no MULTI. A user's keys share one slot in the
+        tagged layout, so a cluster pipeline of them still makes one round
+        trip to one node, only not atomically.
+        """
+        return redis_client.pipeline(transaction=transaction and not is_cluster(redis_client))
+    
+    async def _queue_script(self, pipe, script, keys: List, args: List):
+        """Queue a call of a registered script in a pipeline"""
+        if is_cluster(pipe) or pipe.is_transaction:
+            # Sent as EVAL: a script cache miss inside MULTI can't be retried,
+            # and cluster pipelines don't retry one at all
+            pipe.eval(script.script, len(keys), *keys, *args)
+        else:
+            await script(keys=keys, args=args, client=pipe)
+    
+    async def _run_script(self, script, calls: List[Tuple[List, List]]) -> List:
+        """Run a script once per (keys, args), one call per key layout written
+        
+        Several calls (while keys are migrated) run in one MULTI, so the
+        migration never copies a key between them. Returns their results.
+        """
+        if len(calls) == 1:
+            keys, args = calls[0]
+            return [await script(keys=keys, args=args)]
+        redis_client = await self._get_redis()
+        async with self._pipeline(redis_client, transaction=True) as pipe:
+            for keys, args in calls:
+                await self._queue_script(pipe, script, keys, args)
+            return await pipe.execute()
+    
+    async def _run_raw(self, script, keys: List, args: List) -> List[bytes]:
+        """Run a registered script returning stored messages, left undecoded (NEVER_DECODE)"""
+        redis_client = await self._get_redis()
+        try:
+            return await redis_client.execute_command(
+                "EVALSHA", script.sha, len(keys), *keys, *args, NEVER_DECODE=True
+            )
+        except NoScriptError:
+            # As a Script object does: load it for the next calls
+            script.sha = await redis_client.script_load(script.script)
+            return await redis_client.execute_command(
+                "EVALSHA", script.sha, len(keys), *keys, *args, NEVER_DECODE=True
+            )
+    
+    async def _read_view(
+        self,
+        user_id: str,
+        conversation_id: str,
+        low: int = 0,
+        high: int = -1,
+        count: int = 0
+    ) -> List[bytes]:
+        """Raw messages of a conversation with seqs from low to high, with a branch's shared ones
+        
+        With count, only the newest count of them. One round trip.
+        """
+        await self._get_redis()
+        keys = read_keys(user_id)
+        return await self._run_raw(self.view_script, [keys.records], [
+            conversation_id, low, high, count, settings.BRANCH_MAX_DEPTH, *keys.lineage_prefixes[:2]
+        ])
+    
     async def get_context(
         self,
         conversation_id: str,
         user_id: str,
-        max_messages: int = 20
+        max_messages: int = 20,
+        include_summary: bool = False
     ) -> List[Dict[str, str]]:
-        """Retrieve conversation context from memory"""
+        """Retrieve conversation context from memory, as dicts (see get_chat_context)"""
+        return [msg.to_dict() for msg in await self.get_chat_context(
+            conversation_id, user_id, max_messages, include_summary
+        )]
+    
+    async def get_chat_context(
+        self,
+        conversation_id: str,
+        user_id: str,
+        max_messages: int = 20,
+        include_summary: bool = False
+    ) -> List[ChatMessage]:
+        """Retrieve conversation context from memory
+        
+        With include_summary, messages already folded into the rolling summary
+        are replaced by a single system message carrying that summary.
+        
+        Recent context is served from the worker's context cache when it holds
+        enough of the conversation; misses read a bit more than asked for
+        (CONTEXT_CACHE_MESSAGES) to fill it. A branch whose own messages fall
+        short reads the rest from its ancestors in one more round trip.
+        
+        Messages are decoded straight into ChatMessages and cached as they
+        are: a cache hit returns the cached messages themselves.
+        """
         try:
+            cached = context_cache.get(user_id, conversation_id, max_messages)
+            if cached is not None:
+                return self._build_context(
+                    cached.messages[-max_messages:], cached.length,
+                    cached.summary if include_summary else None
+                )
+            
             redis_client = await self._get_redis()
-            key = f"conv:{user_id}:{conversation_id}"
+            keys = read_keys(user_id)
+            key = keys.conversation(conversation_id)
+            caching = context_cache.active
+            generation = context_cache.generation
+            fetch = max(max_messages, context_cache.max_messages) if caching and max_messages > 0 else max_messages
             
-            # Get recent messages
-            messages = await redis_client.lrange(key, -max_messages, -1)
+            # Get recent messages and the listing record, plus the summary and
+            # list length if needed
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.execute_command("LRANGE", key, -fetch, -1, NEVER_DECODE=True)
+                pipe.hget(keys.records, conversation_id)
+                if include_summary or caching:
+                    pipe.hgetall(keys.summary(conversation_id))
+                    pipe.llen(key)
+                if self.archive:
+                    pipe.sismember(keys.archived, conversation_id)
+                results = await pipe.execute()
             
-            # Parse JSON messages
-            context = []
-            for msg in messages:
-                try:
-                    context.append(json.loads(msg))
-                except json.JSONDecodeError:
-                    continue
-                    
-            return context
+            if self.archive and results[-1] and not results[0]:
+                # Archived: load it back into Redis and read it from there
+                await self._rehydrate(user_id, conversation_id)
+                return await self.get_chat_context(conversation_id, user_id, max_messages, include_summary)
+            
+            raw_messages, record = results[0], self._load_record(results[1])
+            summary, length = None, len(raw_messages)
+            if include_summary or caching:
+                summary, length = self._parse_summary(results[2]), results[3]
+            if record.get("parent") and (fetch <= 0 or len(raw_messages) < fetch):
+                # A branch with all its own messages read: its shared ones
+                # come before them
+                first_seq = int(record.get("message_count", 0)) - len(raw_messages)
+                shared = await self._read_view(
+                    user_id, conversation_id, 0, first_seq - 1, fetch - len(raw_messages) if fetch > 0 else 0
+                )
+                raw_messages = shared + raw_messages
+                length = int(record.get("message_count", 0))
+            
+            messages = [msg for msg in map(decode_chat_message, raw_messages) if msg is not None]
+            if caching:
+                context_cache.put(user_id, conversation_id, messages, length, summary, generation)
+            
+            if max_messages > 0:
+                messages = messages[-max_messages:]
+            return self._build_context(messages, length, summary if include_summary else None)
             
         except Exception as e:
-            print(f"Error retrieving context: {e}")
+            logger.error(f"Error retrieving context: {e}")
             return []
     
-    async def store_conversation(
+    def _build_context(
+        self,
+        messages: List[ChatMessage],
+        length: int,
+        summary: Optional[Dict]
+    ) -> List[ChatMessage]:
+        """Context from the newest messages of a list of length messages"""
+        if not summary:
+            return list(messages)
+        # Drop messages the summary already covers: seqs below "covered"
+        # (list positions, for messages stored before seqs)
+        first_index = length - len(messages)
+        context = [ChatMessage.summary_of(f"Summary of the earlier conversation:\n{summary['content']}")]
+        context.extend(
+            msg for i, msg in enumerate(messages)
+            if (msg.seq if msg.seq is not None else first_index + i) >= summary["covered"]
+        )
+        return context
+    
+    async def get_messages(
         self,
         conversation_id: str,
         user_id: str,
-        messages: List[Dict[str, str]],
-        model: str
-    ):
-        """Store conversation messages in memory"""
+        start: int = 0,
+        end: int = -1
+    ) -> List[Dict]:
+        """Get the stored messages with seqs from start to end (-1 for the newest)
+        
+        A branch's include the ones it shares with its ancestors. One round
+        trip; an empty result takes a second with an archive, to tell an
+        archived conversation.
+        """
         try:
             redis_client = await self._get_redis()
-            key = f"conv:{user_id}:{conversation_id}"
+            raw_messages = await self._read_view(user_id, conversation_id, start, end)
+            
+            if self.archive and not raw_messages and await redis_client.sismember(
+                read_keys(user_id).archived, conversation_id
+            ):
+                await self._rehydrate(user_id, conversation_id)
+                return await self.get_messages(conversation_id, user_id, start, end)
+            
+            return [msg for msg in map(decode_message, raw_messages) if msg is not None]
+            
+        except Exception as e:
+            logger.error(f"Error retrieving messages: {e}")
+            return []
+    
+    async def get_message_page(
+        self,
+        conversation_id: str,
+        user_id: str,
+        limit: int = 50,
+        before: Optional[int] = None,
+        after: Optional[int] = None
+    ) -> Dict:
+        """A page of messages relative to sequence number cursors
+        
+        A message's seq is its list position plus the number of messages
+        trimmed off the list's head (next seq - length, 0 for lists never
+        trimmed), so any page is one bounded LRANGE (reading one message
+        more, to tell whether there are more), and a second one for a cursor
+        into a trimmed list:
+        
+        - after: the oldest messages with seq > after, i.e. the messages
+          added since a client last looked (bounded by before, if given)
+        - before: the newest messages with seq < before, to scroll back
+        - neither: the newest messages
+        
+        A branch's pages run on into the messages it shares with its
+        ancestors, read by seq in one more round trip.
+        
+        Returns the "messages" (oldest first), the seqs of the "first" and
+        "last" of them (None for an empty page) and "has_more", whether
+        more messages lie beyond the page in the direction read.
+        """
+        cursor = after is not None or before is not None
+        start, end = self._page_range(limit, before, after, 0)
+        if cursor and end < start:
+            return {"messages": [], "first": None, "last": None, "has_more": False}
+        
+        redis_client = await self._get_redis()
+        keys = read_keys(user_id)
+        key = keys.conversation(conversation_id)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.execute_command("LRANGE", key, start, end, NEVER_DECODE=True)
+            pipe.llen(key)
+            pipe.hget(keys.meta(conversation_id), "seq")
+            pipe.hget(keys.records, conversation_id)
+            if self.archive:
+                pipe.sismember(keys.archived, conversation_id)
+            results = await pipe.execute()
+        raw_messages, length = results[0], results[1]
+        
+        if self.archive and results[-1] and not length:
+            await self._rehydrate(user_id, conversation_id)
+            return await self.get_message_page(conversation_id, user_id, limit, before, after)
+        
+        if self._load_record(results[3]).get("parent"):
+            if after is not None:
+                high = after + limit + 1 if before is None else min(after + limit + 1, before - 1)
+                raw_messages = await self._read_view(user_id, conversation_id, after + 1, high)
+            else:
+                raw_messages = await self._read_view(
+                    user_id, conversation_id, 0, before - 1 if before is not None else -1, limit + 1
+                )
+            has_more = len(raw_messages) > limit
+            if has_more:
+                raw_messages = raw_messages[:limit] if after is not None else raw_messages[1:]
+            messages = [msg for msg in map(decode_message, raw_messages) if msg is not None]
+            return {
+                "messages": messages,
+                "first": messages[0].get("seq") if messages else None,
+                "last": messages[-1].get("seq") if messages else None,
+                "has_more": has_more
+            }
+        
+        head = self._head(results[2], length)
+        if head and cursor:
+            # Trimmed: read the positions the cursors stand for
+            start, end = self._page_range(limit, before, after, head)
+            raw_messages = []
+            if end >= start:
+                raw_messages = await redis_client.execute_command("LRANGE", key, start, end, NEVER_DECODE=True)
+        
+        first = (start if start >= 0 else max(0, length + start)) + head
+        has_more = len(raw_messages) > limit
+        if has_more:
+            # The extra message is the one furthest from the cursor
+            if after is not None:
+                raw_messages = raw_messages[:limit]
+            else:
+                raw_messages = raw_messages[1:]
+                first += 1
+        
+        messages = [msg for msg in map(decode_message, raw_messages) if msg is not None]
+        return {
+            "messages": messages,
+            "first": first if raw_messages else None,
+            "last": first + len(raw_messages) - 1 if raw_messages else None,
+            "has_more": has_more
+        }
+    
+    def _page_range(
+        self,
+        limit: int,
+        before: Optional[int],
+        after: Optional[int],
+        head: int
+    ) -> Tuple[int, int]:
+        """List positions of a page, one message more than limit, in a list trimmed by head"""
+        if after is not None:
+            start = max(0, after + 1 - head)
+            end = start + limit
+            if before is not None:
+                end = min(end, before - 1 - head)
+        elif before is not None:
+            end = before - 1 - head
+            start = max(0, end - limit)
+        else:
+            start, end = -(limit + 1), -1
+        return start, end
+    
+    def _head(self, next_seq: Optional[str], length: int) -> int:
+        """Messages trimmed off the head of a list, from its meta "seq" and length"""
+        return max(0, int(next_seq) - length) if next_seq is not None else 0
+    
+    async def get_summary(
+        self,
+        conversation_id: str,
+        user_id: str
+    ) -> Optional[Dict]:
+        """Get the rolling summary of a conversation, if one exists
+        
+        Returns a dict with the summary "content" and "covered": messages
+        with lower seqs are folded into it.
+        """
+        redis_client = await self._get_redis()
+        summary_key = read_keys(user_id).summary(conversation_id)
+        
+        return self._parse_summary(await redis_client.hgetall(summary_key))
+    
+    def _parse_summary(self, data: Dict[str, str]) -> Optional[Dict]:
+        """Turn a raw summary hash into the dict returned by get_summary"""
+        if not data or "content" not in data:
+            return None
+            
+        return {
+            "content": data["content"],
+            "covered": int(data.get("covered", 0))
+        }
+    
+    async def store_summary(
+        self,
+        conversation_id: str,
+        user_id: str,
+        content: str,
+        covered: int
+    ):
+        """Store the rolling summary of a conversation"""
+        redis_client = await self._get_redis()
+        
+        async with self._pipeline(redis_client, transaction=True) as pipe:
+            for keys in write_keys(user_id):
+                summary_key = keys.summary(conversation_id)
+                pipe.hset(summary_key, mapping={
+                    "content": content,
+                    "covered": covered,
+                    "updated_at": datetime.utcnow().isoformat()
+                })
+                pipe.expire(summary_key, self.memory_ttl)
+            self._publish_invalidation(pipe, user_id, conversation_id)
+            await pipe.execute()
+        context_cache.discard(user_id, conversation_id)
+    
+    async def store_conversation(
+        self,
+        conversation_id: str,
+        user_id: str,
+        messages: List[Union[ChatMessage, Dict]],
+        model: str,
+        limits: Optional[Dict] = None
+    ) -> Optional[int]:
+        """Append new messages to a conversation
+        
+        Only new turns are appended: messages that already carry a "seq" (as
+        returned by get_context) are skipped, so passing stored context back in
+        never duplicates it. Each stored message gets an "id" and a "seq".
+        Sequence allocation, the append, TTLs, the conversation index and the
+        conversation's listing record are updated atomically in a single Lua
+        script call, which also invalidates the conversation in other workers'
+        context caches; this worker's is updated write-through.
+        
+        limits are a tier's STORAGE_LIMITS; a write that takes the user over
+        one of them costs a few more round trips to get back under it (see
+        _enforce_limits).
+        
+        Returns the conversation's next sequence number.
+        """
+        try:
+            await self._get_redis()
             
-            # Store each message
+            timestamp = datetime.utcnow().isoformat()
+            compact = settings.MESSAGE_ENCODING == "msgpack"
+            stored = []
+            encoded = []
+            documents = []
+            last_message = None
             for msg in messages:
-                # Convert ChatMessage objects to dict if needed
-                if hasattr(msg, 'dict'):
-                    msg_dict = msg.dict()
-                else:
-                    msg_dict = msg
-                    
-                # Add metadata
+                msg_dict = msg.to_dict() if isinstance(msg, ChatMessage) else msg
+                
+                # Already stored
+                if msg_dict.get("seq") is not None:
+                    continue
+                
+                # Add metadata; the script adds the "seq"
                 msg_with_meta = {
-                    **msg_dict,
-                    "timestamp": datetime.utcnow().isoformat(),
+                    **{k: v for k, v in msg_dict.items() if k != "seq"},
+                    "id": msg_dict.get("id") or uuid.uuid4().hex,
+                    "timestamp": timestamp,
                     "model": model if msg_dict["role"] == "assistant" else None
                 }
-                
-                # Push to Redis list
-                await redis_client.rpush(key, json.dumps(msg_with_meta))
+                encoded.append(encode_body(msg_with_meta) if compact else encode_json_body(msg_with_meta))
+                documents.append(self._search_document(msg_with_meta))
+                stored.append(msg_with_meta)
+                last_message = msg_with_meta
+            
+            if not encoded:
+                return None
             
-            # Set TTL on the key
-            await redis_client.expire(key, self.memory_ttl)
+            calls = []
+            score = datetime.utcnow().timestamp()
+            generation = context_cache.generation
+            for i, keys in enumerate(write_keys(user_id)):
+                search = keys.search()
+                calls.append(script_call([
+                    ({
+                        "list": keys.conversation(conversation_id),
+                        "meta": keys.meta(conversation_id),
+                        "conversations": keys.conversations,
+                        "records": keys.records,
+                        "archived": keys.archived
+                    }, {
+                        "ttl": self.memory_ttl,
+                        "id": conversation_id,
+                        "score": score,
+                        "updated_at": timestamp,
+                        "last_message": last_message.get("content", "")[:100],
+                        "role": last_message.get("role", "unknown"),
+                        "encoding": "msgpack" if compact else "json"
+                    }),
+                    (
+                        {"terms": search["terms"], "lengths": search["lengths"], "stats": search["stats"]},
+                        {"postings": search["postings"], "documents": documents}
+                    ),
+                    ({"stored_bytes": keys.stored_bytes}, {}),
+                    ({}, {"max_depth": settings.BRANCH_MAX_DEPTH, "prefixes": keys.lineage_prefixes}),
+                    # Invalidated once, by the read layout's call
+                    ({}, {
+                        "channel": INVALIDATION_CHANNEL,
+                        "message": context_cache.invalidation_message(user_id, conversation_id)
+                    } if settings.CONTEXT_CACHE_ENABLED and i == 0 else {})
+                ], encoded))
+            appended = (await self._run_script(self.append_script, calls))[0]
+            if int(appended[0]) < 0:
+                # Archived: continue it after its stored history
+                if not self.archive:
+                    raise RuntimeError(f"Conversation {conversation_id} is archived but ARCHIVE_ENABLED is off")
+                await self._rehydrate(user_id, conversation_id)
+                appended = (await self._run_script(self.append_script, calls))[0]
+            next_seq, length, conversations, stored_bytes = map(int, appended)
             
-            # Update conversation index
-            index_key = f"user_convs:{user_id}"
-            await redis_client.zadd(
-                index_key,
-                {conversation_id: datetime.utcnow().timestamp()}
+            first_seq = next_seq - len(stored)
+            context_cache.append(
+                user_id, conversation_id,
+                [ChatMessage.from_dict({**msg, "seq": first_seq + i}) for i, msg in enumerate(stored)],
+                next_seq,
+                generation
             )
-            await redis_client.expire(index_key, self.memory_ttl)
             
         except Exception as e:
-            print(f"Error storing conversation: {e}")
+            logger.error(f"Error storing conversation: {e}")
+            return None
+        
+        if limits:
+            try:
+                await self._enforce_limits(user_id, conversation_id, limits, length, conversations, stored_bytes)
+            except Exception as e:
+                # Stored all the same; the next write tries again
+                logger.warning(f"Error enforcing storage limits: {e}")
+        return next_seq
+    
+    async def fork_conversation(
+        self,
+        conversation_id: str,
+        user_id: str,
+        fork: Optional[int] = None,
+        branch_id: Optional[str] = None
+    ) -> Dict:
+        """Start a branch of a conversation, to edit a message or regenerate a reply
+        
+        The branch shares the conversation's messages with seqs below fork
+        (all of them by default) and continues from there: with fork the seq
+        of an edited message, appending the edit to the branch leaves the
+        original untouched. Nothing is copied; the branch stores only the
+        messages written to it, and reads the shared ones from the
+        conversation (see READ_VIEW_SCRIPT), however the conversation goes on.
+        A fork within a branch's shared messages branches the ancestor they
+        belong to. Branches nest up to BRANCH_MAX_DEPTH levels.
+        
+        Returns the branch's "id", the "parent" it branched and the "fork".
+        Raises ValueError for a fork outside the conversation, a branch id
+        in use or branches nested too deep.
+        """
+        return await self.branches.fork(conversation_id, user_id, fork, branch_id)
+    
+    async def _enforce_limits(
+        self,
+        user_id: str,
+        conversation_id: str,
+        limits: Dict,
+        length: int,
+        conversations: int,
+        stored_bytes: int
+    ):
+        """Bring a user just written to back under a tier's storage limits
+        
+        A cap that is exceeded is brought down to STORAGE_TRIM_RATIO of it,
+        so the work is done once every few writes rather than on each. The
+        conversation written to is trimmed to its message cap; then, while
+        the user is over the conversation or byte cap, the least recently
+        updated other conversations leave Redis (see _evict_oldest). A single
+        conversation is only ever bounded by the message cap.
+        """
+        ratio = settings.STORAGE_TRIM_RATIO
+        max_messages = limits.get("messages_per_conversation")
+        if max_messages and length > max_messages:
+            stored_bytes -= await self._trim_messages(user_id, conversation_id, length - int(max_messages * ratio))
+        
+        max_conversations = limits.get("conversations")
+        max_bytes = limits.get("bytes")
+        excess_conversations = conversations - int(max_conversations * ratio) if max_conversations else 0
+        excess_bytes = stored_bytes - int(max_bytes * ratio) if max_bytes else 0
+        if (max_conversations and conversations > max_conversations) or (max_bytes and stored_bytes > max_bytes):
+            await self._evict_oldest(user_id, conversation_id, excess_conversations, excess_bytes)
+    
+    async def _trim_messages(self, user_id: str, conversation_id: str, count: int) -> int:
+        """Drop the oldest count messages of a conversation, once trim_hook agrees
+        
+        Returns the bytes freed. The messages are read and handed to the hook
+        first, so none is dropped before it is summarized or kept elsewhere;
+        if the list changed at its head meanwhile, nothing is trimmed.
+        """
+        redis_client = await self._get_redis()
+        layouts = write_keys(user_id)
+        raw_messages = await redis_client.execute_command(
+            "LRANGE", layouts[0].conversation(conversation_id), 0, count - 1, NEVER_DECODE=True
+        )
+        if not raw_messages:
+            return 0
+        messages = [msg for msg in map(decode_message, raw_messages) if msg is not None]
+        if self.trim_hook and not await self.trim_hook(user_id, conversation_id, messages):
+            return 0
+        
+        size = sum(len(raw) for raw in raw_messages)
+        documents = self._search_documents(conversation_id, messages)
+        for i, keys in enumerate(layouts):
+            search = keys.search()
+            trimmed = await self._run_script(self.trim_script, [([
+                keys.conversation(conversation_id),
+                keys.records,
+                keys.stored_bytes,
+                search["terms"], search["lengths"], search["stats"]
+            ], [
+                len(raw_messages),
+                raw_messages[-1],
+                conversation_id,
+                size,
+                search["postings"],
+                documents,
+                # The other layout's copy follows the read layout's
+                1 if i else 0,
+                INVALIDATION_CHANNEL if settings.CONTEXT_CACHE_ENABLED and i == 0 else "",
+                context_cache.invalidation_message(user_id, conversation_id)
+            ])])
+            if not trimmed[0]:
+                return 0
+        
+        context_cache.discard(user_id, conversation_id, reason="trim")
+        STORAGE_MESSAGES_TRIMMED.inc(len(raw_messages))
+        return size
+    
+    async def _evict_oldest(
+        self,
+        user_id: str,
+        conversation_id: str,
+        excess_conversations: int,
+        excess_bytes: int
+    ):
+        """Move a user's least recently updated conversations out of Redis
+        
+        Conversations other than conversation_id, and other than those with
+        branches, are taken oldest first from the conversation index until
+        excess_conversations of them and excess_bytes of messages (by their
+        listing records) are chosen. They
+        are archived with an archive, deleted without; ones that expired
+        meanwhile only leave the index. Costs a round trip per page of the
+        index read and per ARCHIVE_BATCH_SIZE conversations moved.
+        """
+        redis_client = await self._get_redis()
+        keys = read_keys(user_id)
+        page = settings.ARCHIVE_BATCH_SIZE
+        
+        entries: List[Tuple[str, str, float]] = []
+        offset = 0
+        while excess_conversations > 0 or excess_bytes > 0:
+            index = await redis_client.zrange(keys.conversations, offset, offset + page - 1, withscores=True)
+            index = [(conv_id, score) for conv_id, score in index if conv_id != conversation_id]
+            if not index:
+                break
+            records = await redis_client.hmget(keys.records, [conv_id for conv_id, _ in index])
+            for (conv_id, score), record in zip(index, records):
+                if excess_conversations <= 0 and excess_bytes <= 0:
+                    break
+                record = self._load_record(record)
+                if record.get("branches"):
+                    continue
+                entries.append((user_id, conv_id, score))
+                excess_conversations -= 1
+                excess_bytes -= record.get("bytes", 0)
+            offset += page
+        
+        for start in range(0, len(entries), page):
+            conversations = await self._read_conversations(entries[start:start + page])
+            stored = [conv for conv in conversations if conv["messages"]]
+            dropped = conversations
+            if self.archive and stored:
+                archived = await self._archive_conversations(stored)
+                STORAGE_CONVERSATIONS_EVICTED.labels(action="archived").inc(archived["archived"])
+                dropped = [conv for conv in conversations if not conv["messages"]]
+            evicted = await self._evict_everywhere(dropped, archived=False)
+            STORAGE_CONVERSATIONS_EVICTED.labels(action="deleted").inc(sum(1 for done in evicted if done))
+    
+    async def compact_conversation(
+        self,
+        conversation_id: str,
+        user_id: str,
+        dry_run: bool = False
+    ) -> Dict[str, int]:
+        """De-duplicate a conversation stored by re-pushing its full history
+        
+        Rewrites the list with contiguous sequence numbers in the current
+        message encoding, re-indexes it for search and drops the rolling
+        summary, whose position bookkeeping no longer applies. While keys are
+        migrated, each layout is compacted from its own copy. Branches and
+        conversations with branches are left as they are: their seqs tie
+        them together.
+        """
+        redis_client = await self._get_redis()
+        if is_cluster(redis_client):
+            raise RuntimeError("Compaction needs WATCH, which the Redis Cluster client lacks")
+        
+        keys = read_keys(user_id)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hget(keys.records, conversation_id)
+            pipe.llen(keys.conversation(conversation_id))
+            record, length = await pipe.execute()
+        record = self._load_record(record)
+        if record.get("parent") or record.get("branches"):
+            return {"before": length, "after": length}
+        
+        result = None
+        for keys in [read_keys(user_id)] if dry_run else write_keys(user_id):
+            compacted = await self._compact_layout(redis_client, keys, conversation_id, dry_run)
+            result = result or compacted
+        return result
+    
+    async def _compact_layout(
+        self,
+        redis_client: redis.Redis,
+        keys: UserKeys,
+        conversation_id: str,
+        dry_run: bool
+    ) -> Dict[str, int]:
+        """Compact a conversation in one key layout"""
+        user_id = keys.user_id
+        key = keys.conversation(conversation_id)
+        meta_key = keys.meta(conversation_id)
+        summary_key = keys.summary(conversation_id)
+        records_key = keys.records
+        search = keys.search()
+        
+        async with redis_client.pipeline(transaction=True) as pipe:
+            for attempt in range(self.max_write_retries):
+                try:
+                    await pipe.watch(key, meta_key)
+                    raw_messages = await pipe.execute_command("LRANGE", key, 0, -1, NEVER_DECODE=True)
+                    ttl = await pipe.ttl(key)
+                    
+                    messages = [msg for msg in map(decode_message, raw_messages) if msg is not None]
+                    
+                    compacted = self._dedupe_messages(messages)
+                    result = {"before": len(raw_messages), "after": len(compacted)}
+                    if dry_run or not raw_messages:
+                        await pipe.reset()
+                        return result
+                    
+                    compacted = [
+                        {**msg, "id": msg.get("id") or uuid.uuid4().hex, "seq": seq}
+                        for seq, msg in enumerate(compacted)
+                    ]
+                    
+                    encoded = [self._encode_stored(msg) for msg in compacted]
+                    pipe.multi()
+                    pipe.delete(key, summary_key)
+                    if encoded:
+                        pipe.rpush(key, *encoded)
+                        pipe.expire(key, ttl if ttl > 0 else self.memory_ttl)
+                    pipe.hset(meta_key, "seq", len(compacted))
+                    pipe.expire(meta_key, ttl if ttl > 0 else self.memory_ttl)
+                    # Sent as EVAL: a script cache miss inside MULTI can't be retried
+                    pipe.eval(
+                        UPDATE_RECORD_SCRIPT, 1, records_key,
+                        conversation_id, self.memory_ttl, json.dumps({"message_count": len(compacted)})
+                    )
+                    pipe.eval(
+                        RESIZE_RECORD_SCRIPT, 2, records_key, keys.stored_bytes,
+                        conversation_id, self.memory_ttl, sum(len(raw) for raw in encoded)
+                    )
+                    pipe.eval(
+                        REINDEX_SCRIPT, 3, search["terms"], search["lengths"], search["stats"],
+                        search["postings"],
+                        self.memory_ttl,
+                        self._search_documents(conversation_id, messages),
+                        self._search_documents(conversation_id, compacted)
+                    )
+                    self._publish_invalidation(pipe, user_id, conversation_id)
+                    await pipe.execute()
+                    context_cache.discard(user_id, conversation_id)
+                    return result
+                except redis.WatchError:
+                    continue
+        
+        raise RuntimeError(f"Too much write contention on conversation {conversation_id}")
+    
+    async def compact_all_conversations(
+        self,
+        user_id: Optional[str] = None,
+        dry_run: bool = False
+    ) -> Dict[str, int]:
+        """Compact every stored conversation (or every conversation of one user)"""
+        redis_client = await self._get_redis()
+        pattern = read_keys(user_id).conversation("*") if user_id else "conv:*"
+        tagged = reads_tagged()
+        
+        totals = {"conversations": 0, "changed": 0, "before": 0, "after": 0}
+        async for key in redis_client.scan_iter(match=pattern, count=500):
+            # Skip metadata, summaries, summary locks and the other layout's copies
+            parsed = parse_user_key(key)
+            if parsed is None or parsed.family != "conversations" or parsed.tagged != tagged:
+                continue
+            
+            result = await self.compact_conversation(parsed.rest[1:], parsed.user_id, dry_run=dry_run)
+            totals["conversations"] += 1
+            totals["before"] += result["before"]
+            totals["after"] += result["after"]
+            if result["after"] != result["before"]:
+                totals["changed"] += 1
+        
+        return totals
+    
+    def _dedupe_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Rebuild the real message sequence of a legacy conversation list
+        
+        Each legacy write appended the context it was given (the last
+        messages of the list at that time), then the request's messages and
+        the reply, all stamped within the same instant. Clients sending the
+        whole conversation with every message re-sent its history in the
+        request; others sent only the new turn. Writes are told apart by
+        timestamp gaps. Of each write, the context (a tail of the list so
+        far) and the re-sent history (a run of the conversation rebuilt so
+        far, in order) are dropped; the last user turn and what follows are
+        new however they read. Messages written with a sequence number were
+        never duplicated.
+        """
+        writes: List[List[Dict]] = []
+        previous = None
+        for msg in messages:
+            try:
+                stamped = datetime.fromisoformat(msg.get("timestamp"))
+            except (TypeError, ValueError):
+                stamped = None
+            
+            same_write = (
+                writes
+                and msg.get("seq") is None
+                and writes[-1][-1].get("seq") is None
+                and stamped is not None
+                and previous is not None
+                and abs((stamped - previous).total_seconds()) < 1
+            )
+            if same_write:
+                writes[-1].append(msg)
+            else:
+                writes.append([msg])
+            previous = stamped
+        
+        stored: List[tuple] = []  # the list as written, duplicates included
+        history: List[tuple] = []  # the conversation rebuilt so far
+        compacted = []
+        for write in writes:
+            turns = [(msg.get("role"), msg.get("content")) for msg in write]
+            start = 0
+            if write[0].get("seq") is None:
+                new = max((i for i, (role, _) in enumerate(turns) if role == "user"), default=len(turns) - 1)
+                # The context: the longest prefix that is a tail of the list
+                start = next(
+                    size for size in range(min(new, len(stored)), -1, -1)
+                    if turns[:size] == stored[len(stored) - size:]
+                )
+                # The re-sent history: what follows, while it walks the
+                # rebuilt conversation in order
+                position = 0
+                while start < new:
+                    try:
+                        position = history.index(turns[start], position) + 1
+                    except ValueError:
+                        break
+                    start += 1
+            compacted.extend(write[start:])
+            history.extend(turns[start:])
+            stored.extend(turns)
+        
+        return compacted
+    
+    def _publish_invalidation(self, pipe, user_id: str, conversation_id: str):
+        """Queue the message dropping a conversation from other workers' context caches"""
+        if settings.CONTEXT_CACHE_ENABLED:
+            pipe.publish(INVALIDATION_CHANNEL, context_cache.invalidation_message(user_id, conversation_id))
+    
+    def _encode_stored(self, msg: Dict) -> bytes:
+        """A message with its seq, in the configured encoding"""
+        if settings.MESSAGE_ENCODING == "msgpack":
+            return encode_message(msg, msg["seq"])
+        return encode_json_body(msg) + f',"seq":{msg["seq"]}}}'.encode()
+    
+    def _search_document(self, msg: Dict) -> Dict:
+        """Length and term frequencies of a message for the search index"""
+        length, terms = term_frequencies(msg.get("content") or "")
+        return {"len": length, "terms": terms}
+    
+    def _search_documents(self, conversation_id: str, messages: List[Dict]) -> str:
+        """JSON search documents of the stored messages (those with a seq)"""
+        return json.dumps([
+            {"id": f"{conversation_id}:{msg['seq']}", **self._search_document(msg)}
+            for msg in messages
+            if msg.get("seq") is not None
+        ])
+    
+    async def search(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = 10,
+        offset: int = 0,
+        prefix: bool = True
+    ) -> Dict:
+        """Full-text search through the user's conversation history
+        
+        Messages are ranked with BM25 over the per-user inverted index kept
+        up to date by store_conversation. With prefix, every query term also
+        matches longer terms starting with it. Only the SEARCH_MAX_POSTINGS
+        highest scored postings are ranked (see SEARCH_SCRIPT), so a query
+        costs the same however long the history.
+        Returns the page of results and the total number of messages ranked.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return {"results": [], "total": 0}
+        
+        await self._get_redis()
+        keys = read_keys(user_id)
+        search = keys.search()
+        
+        ranked = await self.search_script(
+            keys=[search["terms"], search["lengths"], search["stats"], keys.conversations],
+            args=[
+                search["postings"],
+                settings.SEARCH_BM25_K1,
+                settings.SEARCH_BM25_B,
+                offset,
+                limit,
+                settings.SEARCH_MAX_PREFIX_EXPANSIONS,
+                1 if prefix else 0,
+                datetime.utcnow().timestamp() - self.memory_ttl,
+                settings.SEARCH_MAX_POSTINGS,
+                *terms
+            ]
+        )
+        total, page = int(ranked[0]), ranked[1:]
+        
+        hits = [(page[i], float(page[i + 1])) for i in range(0, len(page), 2)]
+        return {"results": await self.get_documents(user_id, hits), "total": total}
+    
+    async def get_documents(
+        self,
+        user_id: str,
+        hits: List[Tuple[str, float]]
+    ) -> List[Dict]:
+        """Resolve (document id, score) hits to stored messages in one round trip
+        
+        Document ids are "{conversation_id}:{seq}"; a message's seq is its list
+        position, plus the messages trimmed off the head of the list: hits in
+        trimmed conversations take a second round trip. Hits whose message no
+        longer exists are dropped.
+        """
+        documents = []
+        for doc_id, score in hits:
+            conv_id, seq = doc_id.rsplit(":", 1)
+            documents.append((conv_id, int(seq), score))
+        if not documents:
+            return []
+        
+        redis_client = await self._get_redis()
+        keys = read_keys(user_id)
+        conv_ids = list(dict.fromkeys(conv_id for conv_id, _, _ in documents))
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for conv_id, seq, _ in documents:
+                pipe.execute_command("LINDEX", keys.conversation(conv_id), seq, NEVER_DECODE=True)
+            for conv_id in conv_ids:
+                pipe.hget(keys.meta(conv_id), "seq")
+                pipe.llen(keys.conversation(conv_id))
+            results = await pipe.execute()
+        messages = results[:len(documents)]
+        heads = {
+            conv_id: self._head(results[len(documents) + 2 * i], results[len(documents) + 2 * i + 1])
+            for i, conv_id in enumerate(conv_ids)
+        }
+        
+        trimmed = [i for i, (conv_id, _, _) in enumerate(documents) if heads[conv_id]]
+        for i in trimmed:
+            messages[i] = None
+        # Documents of trimmed messages were removed with them
+        trimmed = [i for i in trimmed if documents[i][1] >= heads[documents[i][0]]]
+        if trimmed:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for i in trimmed:
+                    conv_id, seq, _ = documents[i]
+                    pipe.execute_command(
+                        "LINDEX", keys.conversation(conv_id), seq - heads[conv_id], NEVER_DECODE=True
+                    )
+                for i, msg in zip(trimmed, await pipe.execute()):
+                    messages[i] = msg
+        
+        results = []
+        for (conv_id, seq, score), msg in zip(documents, map(decode_message, messages)):
+            if msg is None:
+                continue
+            results.append({
+                "conversation_id": conv_id,
+                "message": msg,
+                "score": round(score, 4)
+            })
+        
+        return results
     
     async def search_memories(
         self,
@@ -98,37 +1103,9 @@ class MemoryManager:
     ) -> List[Dict]:
         """Search through user's conversation history"""
         try:
-            redis_client = await self._get_redis()
-            
-            # Get all user conversations
-            index_key = f"user_convs:{user_id}"
-            conv_ids = await redis_client.zrange(index_key, 0, -1)
-            
-            results = []
-            for conv_id in conv_ids:
-                key = f"conv:{user_id}:{conv_id}"
-                messages = await redis_client.lrange(key, 0, -1)
-                
-                # Search through messages
-                for msg_str in messages:
-                    try:
-                        msg = json.loads(msg_str)
-                        if query.lower() in msg.get("content", "").lower():
-                            results.append({
-                                "conversation_id": conv_id,
-                                "message": msg,
-                                "score": 1.0  # TODO: Implement proper scoring
-                            })
-                            
-                            if len(results) >= limit:
-                                return results
-                    except:
-                        continue
-                        
-            return results
-            
+            return (await self.search(user_id, query, limit=limit))["results"]
         except Exception as e:
-            print(f"Error searching memories: {e}")
+            logger.error(f"Error searching memories: {e}")
             return []
     
     async def get_user_conversations(
@@ -136,69 +1113,445 @@ class MemoryManager:
         user_id: str,
         limit: int = 20
     ) -> List[Dict]:
-        """Get list of user's recent conversations"""
+        """Get list of user's recent conversations
+        
+        Reads the listing records kept up to date by store_conversation and
+        set_title in a single script call. Conversations stored before records
+        existed get theirs built once from the message list. Archived
+        conversations are listed too, from the archive. Branches name their
+        "parent" and "fork".
+        """
         try:
-            redis_client = await self._get_redis()
-            index_key = f"user_convs:{user_id}"
+            await self._get_redis()
+            keys = read_keys(user_id)
             
-            # Get recent conversation IDs
-            conv_ids = await redis_client.zrevrange(
-                index_key, 0, limit - 1, withscores=True
-            )
+            # Skip conversations whose messages have expired
+            min_score = datetime.utcnow().timestamp() - self.memory_ttl
+            entries = await self.list_script(keys=[keys.conversations, keys.records], args=[min_score, 0, limit])
+            
+            rows = []
+            for i in range(0, len(entries), 3):
+                conv_id, timestamp, record = entries[i], float(entries[i + 1]), entries[i + 2]
+                try:
+                    record = json.loads(record) if record else None
+                except json.JSONDecodeError:
+                    record = None
+                rows.append((conv_id, timestamp, record))
+            
+            missing = [conv_id for conv_id, _, record in rows if not record or "last_message" not in record]
+            if missing:
+                backfilled = await self._backfill_records(user_id, missing)
+                rows = [
+                    (conv_id, timestamp, backfilled.get(conv_id, record))
+                    for conv_id, timestamp, record in rows
+                ]
+            
+            if self.archive:
+                try:
+                    archived = await self.archive.list_conversations(user_id, limit)
+                except Exception as e:
+                    logger.warning(f"Error listing archived conversations: {e}")
+                    archived = []
+                hot = {conv_id for conv_id, _, _ in rows}
+                rows = sorted(
+                    rows + [
+                        (conv_id, timestamp, {**record, "archived": True})
+                        for conv_id, timestamp, record in archived
+                        if conv_id not in hot
+                    ],
+                    key=lambda row: row[1],
+                    reverse=True
+                )[:limit]
             
             conversations = []
-            for conv_id, timestamp in conv_ids:
-                # Get last message for preview
-                key = f"conv:{user_id}:{conv_id}"
-                last_msg = await redis_client.lindex(key, -1)
+            for conv_id, timestamp, record in rows:
+                if not record or "last_message" not in record:
+                    continue
                 
-                # Get metadata (title) if it exists
-                meta_key = f"conv:meta:{user_id}:{conv_id}"
-                title = await redis_client.hget(meta_key, "title")
+                # Use generated title if available, otherwise use last message preview
+                conv_title = record.get("title")
+                if not conv_title:
+                    last_content = record["last_message"] or "New Conversation"
+                    conv_title = last_content[:50] + ("..." if len(last_content) > 50 else "")
                 
-                if last_msg:
-                    try:
-                        msg = json.loads(last_msg)
-                        
-                        # Use generated title if available, otherwise use last message preview
-                        conv_title = title if title else None
-                        if not conv_title:
-                            # Fallback to last message preview
-                            last_content = msg.get("content", "New Conversation")
-                            conv_title = last_content[:50] + ("..." if len(last_content) > 50 else "")
-                        
-                        conversations.append({
-                            "id": conv_id,
-                            "title": conv_title,
-                            "last_message": msg.get("content", "")[:100],
-                            "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
-                            "role": msg.get("role", "unknown")
-                        })
-                    except:
-                        continue
+                conversations.append({
+                    "id": conv_id,
+                    "title": conv_title,
+                    "last_message": record["last_message"],
+                    "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+                    "role": record.get("role", "unknown"),
+                    "message_count": record.get("message_count", 0),
+                    "archived": record.get("archived", False),
+                    "parent": record.get("parent"),
+                    "fork": record.get("fork")
+                })
                         
             return conversations
             
         except Exception as e:
-            print(f"Error getting conversations: {e}")
+            logger.error(f"Error getting conversations: {e}")
             return []
     
+    async def _backfill_records(
+        self,
+        user_id: str,
+        conversation_ids: List[str]
+    ) -> Dict[str, Dict]:
+        """Build listing records for conversations stored before they existed"""
+        redis_client = await self._get_redis()
+        keys = read_keys(user_id)
+        
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for conv_id in conversation_ids:
+                pipe.execute_command("LINDEX", keys.conversation(conv_id), -1, NEVER_DECODE=True)
+                pipe.llen(keys.conversation(conv_id))
+                pipe.hget(keys.meta(conv_id), "title")
+            results = await pipe.execute()
+        
+        records = {}
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for i, conv_id in enumerate(conversation_ids):
+                last_msg, count, title = results[3 * i:3 * i + 3]
+                msg = decode_message(last_msg)
+                if msg is None:
+                    continue
+                
+                record = {
+                    "last_message": msg.get("content", "")[:100],
+                    "role": msg.get("role", "unknown"),
+                    "message_count": count,
+                    "updated_at": msg.get("timestamp")
+                }
+                if title:
+                    record["title"] = title
+                records[conv_id] = record
+                for layout in write_keys(user_id):
+                    pipe.eval(
+                        UPDATE_RECORD_SCRIPT, 1, layout.records,
+                        conv_id, self.memory_ttl, json.dumps(record)
+                    )
+            await pipe.execute()
+        
+        return records
+    
+    async def set_title(
+        self,
+        conversation_id: str,
+        user_id: str,
+        title: str
+    ):
+        """Set a conversation's title in its listing record"""
+        await self._get_redis()
+        fields = json.dumps({"title": title})
+        
+        await self._run_script(self.update_record_script, [
+            ([keys.records], [conversation_id, self.memory_ttl, fields])
+            for keys in write_keys(user_id)
+        ])
+    
     async def clear_conversation(
         self,
         conversation_id: str,
         user_id: str
     ):
-        """Clear a specific conversation from memory"""
+        """Clear a specific conversation from memory
+        
+        Its branches keep the messages they share with it: those are copied
+        into them first (MATERIALIZE_SCRIPT), archived branches being
+        rehydrated for it.
+        """
         try:
             redis_client = await self._get_redis()
+            layouts = write_keys(user_id)
+            
+            if self.archive:
+                await self.archive.delete([(user_id, conversation_id)])
             
-            # Delete conversation
-            key = f"conv:{user_id}:{conversation_id}"
-            await redis_client.delete(key)
+            # The stored messages tell which search postings to remove
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for keys in layouts:
+                    pipe.execute_command("LRANGE", keys.conversation(conversation_id), 0, -1, NEVER_DECODE=True)
+                    pipe.hget(keys.records, conversation_id)
+                stored = await pipe.execute()
+            branches = self._load_record(stored[1]).get("branches") or []
+            if branches and self.archive:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for branch_id in branches:
+                        pipe.sismember(layouts[0].archived, branch_id)
+                    archived = await pipe.execute()
+                for branch_id, is_archived in zip(branches, archived):
+                    if is_archived:
+                        await self._rehydrate(user_id, branch_id)
             
-            # Remove from index
-            index_key = f"user_convs:{user_id}"
-            await redis_client.zrem(index_key, conversation_id)
+            async with self._pipeline(redis_client, transaction=True) as pipe:
+                for i, keys in enumerate(layouts):
+                    raw_messages = stored[2 * i]
+                    messages = [msg for msg in map(decode_message, raw_messages) if msg is not None]
+                    search = keys.search()
+                    documents = self._search_documents(conversation_id, messages)
+                    for branch_id in branches:
+                        pipe.eval(
+                            MATERIALIZE_SCRIPT, 9,
+                            keys.conversation(conversation_id), keys.meta(conversation_id),
+                            keys.conversation(branch_id), keys.meta(branch_id),
+                            keys.records, keys.stored_bytes,
+                            search["terms"], search["lengths"], search["stats"],
+                            conversation_id, branch_id, self.memory_ttl, search["postings"], documents
+                        )
+                    pipe.eval(
+                        REINDEX_SCRIPT, 3, search["terms"], search["lengths"], search["stats"],
+                        search["postings"], self.memory_ttl, documents, "[]"
+                    )
+                    
+                    # Delete conversation
+                    pipe.unlink(
+                        keys.conversation(conversation_id), keys.meta(conversation_id), keys.summary(conversation_id)
+                    )
+                    
+                    # Remove from index
+                    pipe.zrem(keys.conversations, conversation_id)
+                    pipe.eval(DROP_RECORD_SCRIPT, 2, keys.records, keys.stored_bytes, conversation_id)
+                    pipe.srem(keys.archived, conversation_id)
+                for cleared in [conversation_id, *branches]:
+                    self._publish_invalidation(pipe, user_id, cleared)
+                await pipe.execute()
+            for cleared in [conversation_id, *branches]:
+                context_cache.discard(user_id, cleared)
             
         except Exception as e:
-            print(f"Error clearing conversation: {e}")
\ No newline at end of file
+            logger.error(f"Error clearing conversation: {e}")
+    
+    def _tier_keys(self, keys: UserKeys, conversation_id: str) -> List[str]:
+        """Keys the archive scripts move a conversation in and out of"""
+        search = keys.search()
+        return [
+            keys.conversation(conversation_id),
+            keys.meta(conversation_id),
+            keys.summary(conversation_id),
+            keys.conversations,
+            keys.records,
+            keys.archived,
+            search["terms"],
+            search["lengths"],
+            search["stats"],
+            keys.stored_bytes
+        ]
+    
+    async def archive_idle_conversations(self, user_id: Optional[str] = None) -> Dict[str, int]:
+        """Move conversations idle for ARCHIVE_IDLE_SECONDS to the archive
+        
+        Conversation indexes (of every user, or of one user) are scanned a
+        page at a time, on every node of a cluster; idle conversations are
+        archived in batches of ARCHIVE_BATCH_SIZE.
+        """
+        if not self.archive:
+            raise RuntimeError("No conversation archive configured")
+        
+        redis_client = await self._get_redis()
+        now = datetime.utcnow().timestamp()
+        cutoff = now - settings.ARCHIVE_IDLE_SECONDS
+        # Older conversations have already expired from Redis
+        min_score = now - self.memory_ttl
+        batch_size = settings.ARCHIVE_BATCH_SIZE
+        
+        totals = {"archived": 0, "skipped": 0, "messages": 0}
+        batch: List[Tuple[str, str, float]] = []
+        index_keys: List[UserKey] = []
+        tagged = reads_tagged()
+        
+        async def archive(final: bool):
+            nonlocal batch, index_keys
+            if index_keys:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for index_key in index_keys:
+                        pipe.zrangebyscore(index_key.in_layout(tagged), min_score, cutoff, withscores=True)
+                    pages = await pipe.execute()
+                for index_key, idle in zip(index_keys, pages):
+                    batch.extend((index_key.user_id, conv_id, score) for conv_id, score in idle)
+                index_keys = []
+            while len(batch) >= batch_size or (final and batch):
+                result = await self._archive_batch(batch[:batch_size])
+                batch = batch[batch_size:]
+                for field in totals:
+                    totals[field] += result[field]
+        
+        pattern = read_keys(user_id).conversations if user_id else "user_convs:*"
+        async for key in redis_client.scan_iter(match=pattern, count=500):
+            parsed = parse_user_key(key)
+            # The other layout's copy is archived along with the read layout's
+            if parsed is None or parsed.family != "index" or parsed.tagged != tagged:
+                continue
+            index_keys.append(parsed)
+            if len(index_keys) >= 500:
+                await archive(False)
+        await archive(True)
+        
+        return totals
+    
+    async def _archive_batch(self, entries: List[Tuple[str, str, float]]) -> Dict[str, int]:
+        """Archive (user id, conversation id, index score) conversations
+        
+        The conversations are read in one round trip, written to Postgres in
+        one transaction, then evicted from Redis; a conversation written to
+        in the meantime stays in Redis and its archived copy is dropped.
+        Conversations with branches stay in Redis.
+        """
+        conversations = [
+            conv for conv in await self._read_conversations(entries)
+            if conv["messages"] and not conv["record"].get("branches")
+        ]
+        if not conversations:
+            # Cleared or expired; nothing to archive
+            return {"archived": 0, "skipped": 0, "messages": 0}
+        return await self._archive_conversations(conversations)
+    
+    async def _read_conversations(self, entries: List[Tuple[str, str, float]]) -> List[Dict]:
+        """Read (user id, conversation id, index score) conversations to evict, in one round trip
+        
+        Conversations cleared or expired come back without messages.
+        """
+        redis_client = await self._get_redis()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id, conv_id, _ in entries:
+                keys = read_keys(user_id)
+                pipe.execute_command("LRANGE", keys.conversation(conv_id), 0, -1, NEVER_DECODE=True)
+                pipe.hgetall(keys.summary(conv_id))
+                pipe.hget(keys.meta(conv_id), "seq")
+                pipe.hget(keys.records, conv_id)
+            results = await pipe.execute()
+        
+        conversations = []
+        for i, (user_id, conv_id, score) in enumerate(entries):
+            raw_messages, summary, seq, record = results[4 * i:4 * i + 4]
+            messages = [msg for msg in map(decode_message, raw_messages) if msg is not None]
+            try:
+                record = json.loads(record) if record else {}
+            except json.JSONDecodeError:
+                record = {}
+            if "last_message" not in record and messages:
+                record.update({
+                    "last_message": messages[-1].get("content", "")[:100],
+                    "role": messages[-1].get("role", "unknown"),
+                    "message_count": len(raw_messages),
+                    "updated_at": messages[-1].get("timestamp")
+                })
+            conversations.append({
+                "user_id": user_id,
+                "conversation_id": conv_id,
+                "record": record,
+                "summary": summary or None,
+                "next_seq": int(seq) if seq is not None else len(raw_messages),
+                "updated_at": score,
+                "messages": raw_messages,
+                "documents": self._search_documents(conv_id, messages)
+            })
+        return conversations
+    
+    async def _archive_conversations(self, conversations: List[Dict]) -> Dict[str, int]:
+        """Write conversations read by _read_conversations to the archive and evict them"""
+        await self.archive.store(conversations)
+        
+        evicted = await self._evict_everywhere(conversations, archived=True)
+        skipped = [
+            (conv["user_id"], conv["conversation_id"])
+            for conv, done in zip(conversations, evicted)
+            if not done
+        ]
+        await self.archive.delete(skipped)
+        
+        archived = len(conversations) - len(skipped)
+        CONVERSATIONS_ARCHIVED.inc(archived)
+        return {
+            "archived": archived,
+            "skipped": len(skipped),
+            "messages": sum(len(conv["messages"]) for conv, done in zip(conversations, evicted) if done)
+        }
+    
+    async def _evict_everywhere(self, conversations: List[Dict], archived: bool) -> List:
+        """Evict conversations from every layout written; returns the read layout's results"""
+        if not conversations:
+            return []
+        evicted = await self._evict(conversations, 0, archived)
+        done = [conv for conv, evict in zip(conversations, evicted) if evict]
+        if done and writes_both():
+            # The other layout's copy goes unchecked: the read layout's tells
+            # whether the conversation was written to
+            await self._evict(done, 1, archived)
+        return evicted
+    
+    async def _evict(self, conversations: List[Dict], layout: int, archived: bool) -> List:
+        """Run the evict script for conversations in one of the layouts written"""
+        redis_client = await self._get_redis()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for conv in conversations:
+                keys = write_keys(conv["user_id"])[layout]
+                await self._queue_script(pipe, self.evict_script, self._tier_keys(keys, conv["conversation_id"]), [
+                    conv["conversation_id"],
+                    conv["updated_at"],
+                    len(conv["messages"]),
+                    keys.search()["postings"],
+                    conv["documents"],
+                    1 if layout else 0,
+                    1 if archived else 0
+                ])
+            return await pipe.execute()
+    
+    async def _rehydrate(self, user_id: str, conversation_id: str):
+        """Load an archived conversation back into Redis
+        
+        Afterwards the conversation is no longer marked archived, whether this
+        call, another worker, or nobody (no archived copy) restored it.
+        """
+        started = time.monotonic()
+        redis_client = await self._get_redis()
+        conv = await self.archive.load(user_id, conversation_id)
+        if conv is None:
+            async with self._pipeline(redis_client, transaction=True) as pipe:
+                for keys in write_keys(user_id):
+                    pipe.srem(keys.archived, conversation_id)
+                await pipe.execute()
+            return
+        
+        messages = [msg for msg in map(decode_message, conv["messages"]) if msg is not None]
+        documents = self._search_documents(conversation_id, messages)
+        score = datetime.utcnow().timestamp()
+        restored = await self._run_script(self.restore_script, [
+            (self._tier_keys(keys, conversation_id), [
+                conversation_id,
+                self.memory_ttl,
+                score,
+                json.dumps({**conv["record"], "bytes": sum(len(raw) for raw in conv["messages"])}),
+                json.dumps(conv["summary"]) if conv["summary"] else "",
+                conv["next_seq"],
+                keys.search()["postings"],
+                documents,
+                *conv["messages"]
+            ])
+            for keys in write_keys(user_id)
+        ])
+        if restored[0]:
+            await self.archive.delete([(user_id, conversation_id)])
+            CONVERSATIONS_REHYDRATED.inc()
+            ARCHIVE_REHYDRATE_DURATION.observe(time.monotonic() - started)
+    
+    def _load_record(self, record: Optional[str]) -> Dict:
+        try:
+            return json.loads(record) if record else {}
+        except json.JSONDecodeError:
+            return {}
+    
+    def export_conversations(self, user_id: str, batch_size: int = 200) -> AsyncIterator[str]:
+        """Stream every conversation of a user as NDJSON (see ConversationTransfer.export_conversations)"""
+        return self.transfer.export_conversations(user_id, batch_size)
+    
+    async def import_conversations(
+        self,
+        user_id: str,
+        lines: AsyncIterable[Union[str, bytes]],
+        batch_size: int = 200
+    ) -> Dict[str, int]:
+        """Write conversations from an export_conversations stream to a user
+        
+        See ConversationTransfer.import_conversations.
+        """
+        return await self.transfer.import_conversations(user_id, lines, batch_size)
@@ -0,0 +1,590 @@
+from typing import Dict, List, Tuple
+import json
+from app.services.search import INDEX_APPENDED_LUA, INDEX_FUNCTIONS_LUA
+
+# Listing records as Lua tables; taking a deleted branch off its parent's
+# list of branches (see MemoryManager.fork_conversation).
+#
+# Scripts walking a branch's lineage (APPEND_MESSAGES_SCRIPT refreshing the
+# ancestors' TTLs, FORK_SCRIPT, READ_VIEW_SCRIPT) find the ancestors in the
+# records as they go, so they build the ancestors' keys from the user's
+# key prefixes (UserKeys.lineage_prefixes) instead of declaring them: those
+# keys share the declared keys' hash tag, so Redis Cluster holds them on
+# the node running the script. Keep it that way: a script is only ever
+# given the prefixes of the user whose keys it declares.
+BRANCH_FUNCTIONS_LUA = """
+local function load_record(records_key, conversation_id)
+    local record = redis.call('HGET', records_key, conversation_id)
+    return record and cjson.decode(record) or {}
+end
+
+local function detach(records_key, conversation_id, record)
+    if not record['parent'] then
+        return
+    end
+    local parent = redis.call('HGET', records_key, record['parent'])
+    if not parent then
+        return
+    end
+    parent = cjson.decode(parent)
+    local kept = {}
+    for _, id in ipairs(parent['branches'] or {}) do
+        if id ~= conversation_id then
+            kept[#kept + 1] = id
+        end
+    end
+    parent['branches'] = kept
+    redis.call('HSET', records_key, record['parent'], cjson.encode(parent))
+end
+"""
+
+# Composed scripts serve several features in one call without sharing
+# argument slots: each part of the call is a JSON object in its own ARGV
+# slot, its keys declared in KEYS under names (see script_call), and the
+# script reads it as a table with script_part(slot).
+SCRIPT_PARTS_LUA = """
+local function script_part(slot)
+    local part = cjson.decode(ARGV[slot])
+    local keys = {}
+    for name, index in pairs(part['keys'] or {}) do
+        keys[name] = KEYS[index]
+    end
+    part['keys'] = keys
+    return part
+end
+"""
+
+def script_call(parts: List[Tuple[Dict[str, str], Dict]], values: List = ()) -> Tuple[List, List]:
+    """KEYS and ARGV of a call of a composed script
+
+    parts are (named keys, arguments) pairs, in the ARGV slots the script
+    reads them from; values follow them as they are (encoded messages).
+    """
+    keys, args = [], []
+    for part_keys, part_args in parts:
+        slots = {}
+        for name, key in part_keys.items():
+            keys.append(key)
+            slots[name] = len(keys)
+        args.append(json.dumps({**part_args, "keys": slots}))
+    return keys, args + list(values)
+
+# Storage caps: a conversation record's "bytes" (counted from the whole list
+# the first time, for lists written before sizes were tracked) and the
+# user's total the caps are checked against.
+# Part: keys stored_bytes
+STORED_BYTES_LUA = """
+local function count_bytes(record, list_key, items)
+    local size = 0
+    for _, item in ipairs(items) do
+        size = size + #item
+    end
+    if not record['bytes'] then
+        record['bytes'] = 0
+        for _, item in ipairs(redis.call('LRANGE', list_key, 0, -1)) do
+            size = size + #item
+        end
+    end
+    record['bytes'] = record['bytes'] + size
+    return size
+end
+
+local function add_stored_bytes(storage, size, ttl)
+    local stored_bytes = redis.call('INCRBY', storage['keys']['stored_bytes'], size)
+    redis.call('EXPIRE', storage['keys']['stored_bytes'], ttl)
+    return stored_bytes
+end
+"""
+
+# Branches: writing to a branch keeps the messages it shares alive by
+# refreshing its ancestors' TTLs with its own, up to max depth ancestors.
+# Part: max_depth, prefixes (UserKeys.lineage_prefixes)
+REFRESH_LINEAGE_LUA = """
+local function refresh_lineage(branches, records_key, record, ttl)
+    local ancestor, depth = record, 0
+    while ancestor['parent'] and depth < branches['max_depth'] do
+        for _, prefix in ipairs(branches['prefixes']) do
+            redis.call('EXPIRE', prefix .. ancestor['parent'], ttl)
+        end
+        ancestor = load_record(records_key, ancestor['parent'])
+        depth = depth + 1
+    end
+end
+"""
+
+# Context caches: tells other workers the conversation changed.
+# Part: channel and message, or nothing for no invalidation
+PUBLISH_INVALIDATION_LUA = """
+local function publish_invalidation(invalidation)
+    if invalidation['channel'] then
+        redis.call('PUBLISH', invalidation['channel'], invalidation['message'])
+    end
+end
+"""
+
+# Appends messages to a conversation in one round trip. Sequence numbers come
+# from the meta hash (lists written before they existed start at their length).
+# Messages arrive encoded without their seq so the script can add the one it
+# allocates without decoding them: msgpack bodies get the frame header (see
+# message_codec), JSON objects come without their closing brace. The
+# conversation's listing record is updated in the same call, and so are the
+# features in the other parts: the search index, stored bytes, branch
+# lineage and context caches.
+# Returns the next seq, the list length, the number of indexed conversations
+# and the user's stored bytes; {-1} without writing if the conversation is
+# archived.
+# Parts (see script_call):
+#   1 conversation: keys list, meta, conversations, records, archived;
+#     ttl, id, score, updated_at, last_message, role, encoding
+#     ("msgpack"/"json")
+#   2 search (INDEX_APPENDED_LUA), 3 storage (STORED_BYTES_LUA),
+#   4 branches (REFRESH_LINEAGE_LUA), 5 invalidation (PUBLISH_INVALIDATION_LUA)
+# ARGV after the parts: message...
+APPEND_MESSAGES_SCRIPT = (
+    SCRIPT_PARTS_LUA + INDEX_APPENDED_LUA + STORED_BYTES_LUA + BRANCH_FUNCTIONS_LUA
+    + REFRESH_LINEAGE_LUA + PUBLISH_INVALIDATION_LUA + """
+local function pack_uint(n)
+    if n < 128 then
+        return string.char(n)
+    elseif n < 65536 then
+        return string.char(0xcd, math.floor(n / 256), n % 256)
+    end
+    return string.char(0xce, math.floor(n / 16777216) % 256, math.floor(n / 65536) % 256, math.floor(n / 256) % 256, n % 256)
+end
+
+local conversation = script_part(1)
+local keys, id, ttl = conversation['keys'], conversation['id'], conversation['ttl']
+
+if redis.call('SISMEMBER', keys['archived'], id) == 1 then
+    return {-1}
+end
+
+local next_seq = redis.call('HGET', keys['meta'], 'seq')
+if next_seq then
+    next_seq = tonumber(next_seq)
+else
+    next_seq = redis.call('LLEN', keys['list'])
+end
+
+local items = {}
+for i = 6, #ARGV do
+    local seq = next_seq + #items
+    if conversation['encoding'] == 'msgpack' then
+        items[#items + 1] = string.char(1) .. pack_uint(seq) .. ARGV[i]
+    else
+        items[#items + 1] = ARGV[i] .. ',"seq":' .. seq .. '}'
+    end
+end
+
+local record = load_record(keys['records'], id)
+local size = count_bytes(record, keys['list'], items)
+redis.call('RPUSH', keys['list'], unpack(items))
+index_appended(script_part(2), id, next_seq, ttl)
+next_seq = next_seq + #items
+
+redis.call('HSET', keys['meta'], 'seq', next_seq)
+redis.call('EXPIRE', keys['list'], ttl)
+redis.call('EXPIRE', keys['meta'], ttl)
+redis.call('ZADD', keys['conversations'], conversation['score'], id)
+redis.call('EXPIRE', keys['conversations'], ttl)
+
+record['last_message'] = conversation['last_message']
+record['role'] = conversation['role']
+record['message_count'] = next_seq
+record['updated_at'] = conversation['updated_at']
+redis.call('HSET', keys['records'], id, cjson.encode(record))
+redis.call('EXPIRE', keys['records'], ttl)
+
+refresh_lineage(script_part(4), keys['records'], record, ttl)
+local stored_bytes = add_stored_bytes(script_part(3), size, ttl)
+publish_invalidation(script_part(5))
+return {next_seq, redis.call('LLEN', keys['list']), redis.call('ZCARD', keys['conversations']), stored_bytes}
+"""
+)
+
+# Takes a size off the user's stored bytes, never below zero (the total may
+# have expired before the conversations it counted)
+RELEASE_BYTES_LUA = """
+local function release_bytes(key, size)
+    size = tonumber(size) or 0
+    if size > 0 and redis.call('EXISTS', key) == 1 and redis.call('DECRBY', key, size) < 0 then
+        redis.call('SET', key, 0, 'KEEPTTL')
+    end
+end
+"""
+
+# Drops the oldest messages of a conversation over its tier's cap, unless the
+# head of the list changed since they were read. Their search documents go
+# with them and the sizes shrink to match. Seqs are kept, so a trimmed list
+# starts at seq next seq - length (and the summary's "covered" seq still
+# holds).
+# KEYS: conversation list, user conversation records, user stored bytes,
+#       search terms, search lengths, search stats
+# ARGV: number of messages, the last of them as read, conversation id, their
+#       size in bytes, search postings prefix, JSON search documents of
+#       them, "1" to skip the check (as EVICT_SCRIPT), context cache
+#       invalidation channel ("" for none) and message
+TRIM_MESSAGES_SCRIPT = INDEX_FUNCTIONS_LUA + RELEASE_BYTES_LUA + """
+local count = tonumber(ARGV[1])
+if ARGV[7] ~= '1' and redis.call('LINDEX', KEYS[1], count - 1) ~= ARGV[2] then
+    return 0
+end
+redis.call('LTRIM', KEYS[1], count, -1)
+unindex_docs(ARGV[5], KEYS[4], KEYS[5], KEYS[6], cjson.decode(ARGV[6]))
+
+local record = redis.call('HGET', KEYS[2], ARGV[3])
+if record then
+    record = cjson.decode(record)
+    record['bytes'] = math.max(0, (record['bytes'] or 0) - tonumber(ARGV[4]))
+    redis.call('HSET', KEYS[2], ARGV[3], cjson.encode(record))
+end
+release_bytes(KEYS[3], ARGV[4])
+if ARGV[8] ~= '' then
+    redis.call('PUBLISH', ARGV[8], ARGV[9])
+end
+return 1
+"""
+
+# Merges fields into a conversation's listing record, creating it if needed.
+# KEYS: user conversation records
+# ARGV: conversation id, ttl, JSON object of fields
+UPDATE_RECORD_SCRIPT = """
+local record = redis.call('HGET', KEYS[1], ARGV[1])
+record = record and cjson.decode(record) or {}
+for field, value in pairs(cjson.decode(ARGV[3])) do
+    record[field] = value
+end
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(record))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Sets the size of a rewritten conversation in its listing record and moves
+# the user's stored bytes by the difference.
+# KEYS: user conversation records, user stored bytes
+# ARGV: conversation id, ttl, size in bytes
+RESIZE_RECORD_SCRIPT = RELEASE_BYTES_LUA + """
+local record = redis.call('HGET', KEYS[1], ARGV[1])
+record = record and cjson.decode(record) or {}
+local change = tonumber(ARGV[3]) - (record['bytes'] or 0)
+record['bytes'] = tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(record))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if change > 0 then
+    redis.call('INCRBY', KEYS[2], change)
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+else
+    release_bytes(KEYS[2], -change)
+end
+return 1
+"""
+
+# Drops a conversation's listing record, taking its size off the user's
+# stored bytes and a branch off its parent's branches.
+# KEYS: user conversation records, user stored bytes
+# ARGV: conversation id
+DROP_RECORD_SCRIPT = RELEASE_BYTES_LUA + BRANCH_FUNCTIONS_LUA + """
+local record = redis.call('HGET', KEYS[1], ARGV[1])
+if record then
+    record = cjson.decode(record)
+    release_bytes(KEYS[2], record['bytes'])
+    detach(KEYS[1], ARGV[1], record)
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+# Reads a page of the conversation index with each conversation's listing
+# record, without touching the message lists. Conversations last written
+# before min score have expired.
+# KEYS: user conversation index, user conversation records
+# ARGV: min score, offset, count
+# Returns: id, score, record (false if missing) for each conversation
+LIST_CONVERSATIONS_SCRIPT = """
+local entries = redis.call('ZREVRANGEBYSCORE', KEYS[1], '+inf', ARGV[1], 'WITHSCORES', 'LIMIT', ARGV[2], ARGV[3])
+if #entries == 0 then
+    return {}
+end
+
+local ids = {}
+for i = 1, #entries, 2 do
+    ids[#ids + 1] = entries[i]
+end
+local records = redis.call('HMGET', KEYS[2], unpack(ids))
+
+local result = {}
+for i = 1, #ids do
+    result[#result + 1] = ids[i]
+    result[#result + 1] = entries[2 * i]
+    result[#result + 1] = records[i]
+end
+return result
+"""
+
+# Removes a conversation from Redis, unless it was written to since it was
+# read or has branches sharing its messages. Once copied to the archive, its
+# id joins the user's archived set, which tells reads and appends to
+# rehydrate it; otherwise (over a storage cap without an archive, or
+# expired) it is gone, and no longer a branch of its parent.
+# KEYS: conversation keys (see MemoryManager._tier_keys)
+# ARGV: conversation id, index score and list length when read, search
+#       postings prefix, JSON search documents of its messages, "1" to skip
+#       the check (the copy in a second key layout, once the first is
+#       evicted), "1" if archived
+EVICT_SCRIPT = INDEX_FUNCTIONS_LUA + RELEASE_BYTES_LUA + BRANCH_FUNCTIONS_LUA + """
+local record = load_record(KEYS[5], ARGV[1])
+if ARGV[6] ~= '1' then
+    local score = redis.call('ZSCORE', KEYS[4], ARGV[1])
+    if not score or tonumber(score) ~= tonumber(ARGV[2]) or redis.call('LLEN', KEYS[1]) ~= tonumber(ARGV[3]) then
+        return 0
+    end
+    if next(record['branches'] or {}) then
+        return 0
+    end
+end
+unindex_docs(ARGV[4], KEYS[7], KEYS[8], KEYS[9], cjson.decode(ARGV[5]))
+release_bytes(KEYS[10], record['bytes'])
+if ARGV[7] ~= '1' then
+    detach(KEYS[5], ARGV[1], record)
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+if ARGV[7] == '1' then
+    redis.call('SADD', KEYS[6], ARGV[1])
+end
+return 1
+"""
+
+# Writes a whole conversation: its messages, seq, summary, index entry,
+# listing record (with its "bytes", added to the user's stored bytes) and
+# search documents. Shared by the restore and import scripts below, after
+# their own checks.
+# KEYS: conversation keys (see MemoryManager._tier_keys)
+# ARGV: conversation id, ttl, index score, JSON listing record, JSON summary
+#       ("" if none), next seq, search postings prefix, JSON search
+#       documents, message...
+LOAD_CONVERSATION_LUA = """
+for i = 9, #ARGV, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('HSET', KEYS[2], 'seq', ARGV[6])
+if ARGV[5] ~= '' then
+    for field, value in pairs(cjson.decode(ARGV[5])) do
+        redis.call('HSET', KEYS[3], field, value)
+    end
+    redis.call('EXPIRE', KEYS[3], ARGV[2])
+end
+redis.call('ZADD', KEYS[4], ARGV[3], ARGV[1])
+redis.call('HSET', KEYS[5], ARGV[1], ARGV[4])
+index_docs(ARGV[7], KEYS[7], KEYS[8], KEYS[9], ARGV[2], cjson.decode(ARGV[8]))
+redis.call('INCRBY', KEYS[10], cjson.decode(ARGV[4])['bytes'] or 0)
+for _, i in ipairs({1, 2, 4, 5, 10}) do
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+# Loads an archived conversation back into Redis, unless another worker
+# already did. The conversation counts as just updated.
+# KEYS, ARGV: as LOAD_CONVERSATION_LUA
+RESTORE_SCRIPT = INDEX_FUNCTIONS_LUA + """
+if redis.call('SREM', KEYS[6], ARGV[1]) == 0 then
+    return 0
+end
+""" + LOAD_CONVERSATION_LUA
+
+# Writes an imported conversation, unless the user already has one with
+# its id (in Redis or archived).
+# KEYS, ARGV: as LOAD_CONVERSATION_LUA
+IMPORT_SCRIPT = INDEX_FUNCTIONS_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 1 or redis.call('SISMEMBER', KEYS[6], ARGV[1]) == 1 then
+    return 0
+end
+""" + LOAD_CONVERSATION_LUA
+
+# Starts a branch sharing the first fork messages of a conversation (all of
+# them without a fork). Only the branch's own messages will be stored: its
+# listing record points at the parent and fork, and its seqs continue from
+# the fork. Forking within a branch's shared messages branches the ancestor
+# they belong to instead, so every branch reads at most one ancestor per
+# level. The parent's summary is copied if it covers shared messages only,
+# and the ancestors' TTLs are refreshed.
+# Returns the parent branched and the fork, or {code}: -1 branch id taken,
+# -2 fork out of range, -3 too deep, -4 conversation archived.
+# KEYS: conversation list, meta and summary, branch list, meta and summary,
+#       user conversation index, user conversation records, user archived
+#       conversations
+# ARGV: conversation id, branch id, fork ("" for the whole conversation),
+#       ttl, index score, updated at, max branch depth, lineage key prefixes
+#       (conversation, meta, summary)
+FORK_SCRIPT = BRANCH_FUNCTIONS_LUA + """
+if redis.call('SISMEMBER', KEYS[9], ARGV[1]) == 1 then
+    return {-4}
+end
+if redis.call('HEXISTS', KEYS[8], ARGV[2]) == 1 or redis.call('EXISTS', KEYS[4], KEYS[5]) > 0 then
+    return {-1}
+end
+local length = redis.call('LLEN', KEYS[1])
+local next_seq = tonumber(redis.call('HGET', KEYS[2], 'seq') or length)
+local fork = next_seq
+if ARGV[3] ~= '' then
+    fork = tonumber(ARGV[3])
+end
+if fork < 1 or fork > next_seq then
+    return {-2}
+end
+
+local record = load_record(KEYS[8], ARGV[1])
+local title = record['title']
+local parent = ARGV[1]
+while record['parent'] and fork <= record['fork'] do
+    parent = record['parent']
+    record = load_record(KEYS[8], parent)
+end
+local lineage, ancestor = {parent}, record
+while ancestor['parent'] do
+    if #lineage >= tonumber(ARGV[7]) then
+        return {-3}
+    end
+    lineage[#lineage + 1] = ancestor['parent']
+    ancestor = load_record(KEYS[8], ancestor['parent'])
+end
+
+local branches = record['branches'] or {}
+branches[#branches + 1] = ARGV[2]
+record['branches'] = branches
+redis.call('HSET', KEYS[8], parent, cjson.encode(record))
+redis.call('HSET', KEYS[8], ARGV[2], cjson.encode({
+    parent = parent, fork = fork, title = title, last_message = '', role = 'unknown',
+    message_count = fork, updated_at = ARGV[6], bytes = 0
+}))
+redis.call('HSET', KEYS[5], 'seq', fork)
+redis.call('EXPIRE', KEYS[5], ARGV[4])
+local covered = redis.call('HGET', KEYS[3], 'covered')
+if covered and tonumber(covered) <= fork then
+    redis.call('HSET', KEYS[6], unpack(redis.call('HGETALL', KEYS[3])))
+    redis.call('EXPIRE', KEYS[6], ARGV[4])
+end
+redis.call('ZADD', KEYS[7], ARGV[5], ARGV[2])
+redis.call('EXPIRE', KEYS[7], ARGV[4])
+redis.call('EXPIRE', KEYS[8], ARGV[4])
+for _, id in ipairs(lineage) do
+    for i = 8, 10 do
+        redis.call('EXPIRE', ARGV[i] .. id, ARGV[4])
+    end
+end
+return {parent, fork}
+"""
+
+# Reads a conversation's messages by seq, following a branch into the
+# messages it shares with its ancestors: each ancestor gives the seqs below
+# the fork into it that its own list holds. A list trimmed past its fork
+# has lost its shared messages too.
+# KEYS: user conversation records
+# ARGV: conversation id, lowest seq, highest seq (-1 for the newest), max
+#       messages (0 for all, else the newest), max branch depth, lineage
+#       key prefixes (conversation, meta)
+# Returns the messages, oldest first
+READ_VIEW_SCRIPT = BRANCH_FUNCTIONS_LUA + """
+local id = ARGV[1]
+local low, wanted = tonumber(ARGV[2]), tonumber(ARGV[4])
+local limited = wanted > 0
+local stop = tonumber(ARGV[3]) + 1
+local chunks = {}
+for depth = 0, tonumber(ARGV[5]) do
+    local key = ARGV[6] .. id
+    local length = redis.call('LLEN', key)
+    local next_seq = tonumber(redis.call('HGET', ARGV[7] .. id, 'seq') or length)
+    local head = math.max(0, next_seq - length)
+    if stop <= 0 or stop > next_seq then
+        stop = next_seq
+    end
+    local first = math.max(head, low)
+    if limited then
+        first = math.max(first, stop - wanted)
+    end
+    if stop > first then
+        chunks[#chunks + 1] = redis.call('LRANGE', key, first - head, stop - 1 - head)
+        wanted = wanted - (stop - first)
+    end
+    local record = load_record(KEYS[1], id)
+    if (limited and wanted <= 0) or not record['parent'] or head > record['fork'] then
+        break
+    end
+    id, stop = record['parent'], math.min(stop, record['fork'])
+    if stop <= low then
+        break
+    end
+end
+
+local messages = {}
+for i = #chunks, 1, -1 do
+    for _, msg in ipairs(chunks[i]) do
+        messages[#messages + 1] = msg
+    end
+end
+return messages
+"""
+
+# Copies the messages a branch shares with a conversation about to be
+# cleared into the branch, which then branches that conversation's parent
+# (if it shared its messages too) or stands alone.
+# KEYS: conversation list and meta, branch list and meta, user conversation
+#       records, user stored bytes, search terms, search lengths, search
+#       stats
+# ARGV: conversation id, branch id, ttl, search postings prefix, JSON search
+#       documents of the conversation's messages
+MATERIALIZE_SCRIPT = INDEX_FUNCTIONS_LUA + BRANCH_FUNCTIONS_LUA + """
+local record = load_record(KEYS[5], ARGV[2])
+if record['parent'] ~= ARGV[1] or redis.call('EXISTS', KEYS[4]) == 0 then
+    return 0
+end
+local fork = record['fork']
+local parent = load_record(KEYS[5], ARGV[1])
+local length = redis.call('LLEN', KEYS[1])
+local head = math.max(0, tonumber(redis.call('HGET', KEYS[2], 'seq') or length) - length)
+local branch_length = redis.call('LLEN', KEYS[3])
+local branch_head = tonumber(redis.call('HGET', KEYS[4], 'seq')) - branch_length
+
+local items = {}
+if fork > head and branch_head <= fork then
+    items = redis.call('LRANGE', KEYS[1], 0, fork - head - 1)
+end
+local newest_first = {}
+local size = 0
+for i = #items, 1, -1 do
+    newest_first[#newest_first + 1] = items[i]
+    size = size + #items[i]
+end
+for i = 1, #newest_first, 1000 do
+    redis.call('LPUSH', KEYS[3], unpack(newest_first, i, math.min(i + 999, #newest_first)))
+end
+local docs = {}
+for _, doc in ipairs(cjson.decode(ARGV[5])) do
+    local seq = tonumber(string.match(doc.id, ':(%d+)$'))
+    if #items > 0 and seq >= head and seq < fork then
+        doc.id = ARGV[2] .. ':' .. seq
+        docs[#docs + 1] = doc
+    end
+end
+index_docs(ARGV[4], KEYS[7], KEYS[8], KEYS[9], ARGV[3], docs)
+
+record['parent'], record['fork'] = nil, nil
+if parent['parent'] and head <= parent['fork'] then
+    record['parent'], record['fork'] = parent['parent'], parent['fork']
+    local grandparent = load_record(KEYS[5], parent['parent'])
+    local branches = grandparent['branches'] or {}
+    branches[#branches + 1] = ARGV[2]
+    grandparent['branches'] = branches
+    redis.call('HSET', KEYS[5], parent['parent'], cjson.encode(grandparent))
+end
+record['bytes'] = (record['bytes'] or 0) + size
+redis.call('HSET', KEYS[5], ARGV[2], cjson.encode(record))
+if size > 0 then
+    redis.call('INCRBY', KEYS[6], size)
+    redis.call('EXPIRE', KEYS[6], ARGV[3])
+    redis.call('EXPIRE', KEYS[3], ARGV[3])
+end
+return 1
+"""
@@ -0,0 +1,178 @@
+from typing import Dict, Optional, Tuple, Union
+from datetime import datetime, timedelta
+import json
+import logging
+import msgpack
+from app.core.config import settings
+from app.core.messages import ChatMessage
+
+try:
+    import zstandard
+except ImportError:  # Compression is optional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Stored messages are either legacy JSON objects (first byte "{") or frames:
+#
+#   version byte | msgpack uint seq | msgpack map of the message
+#
+# The seq comes first and on its own so the append script can frame a message
+# with the seq it allocates without decoding it. Field names are short codes:
+#
+#   r  role, an int for the common roles (a str otherwise)
+#   c  content, a str, or bin when zstd-compressed
+#   i  id, 16 raw bytes for hex uuids (a str otherwise)
+#   t  timestamp, int microseconds since the epoch (a str if not ISO)
+#   m  model, omitted when None
+#   x  map of any other fields, under their own names
+FRAME_V1 = 1
+
+ROLE_CODES = {"user": 0, "assistant": 1, "system": 2}
+ROLES = {code: role for role, code in ROLE_CODES.items()}
+FIELD_CODES = {"role": "r", "content": "c", "id": "i", "timestamp": "t", "model": "m"}
+
+EPOCH = datetime(1970, 1, 1)
+
+if zstandard is not None:
+    _compressor = zstandard.ZstdCompressor(level=3)
+    _decompressor = zstandard.ZstdDecompressor()
+
+def compression_available() -> bool:
+    return zstandard is not None
+
+def _encode_timestamp(value):
+    if isinstance(value, str):
+        try:
+            stamped = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        # Only naive timestamps round-trip through an offset from the epoch
+        if stamped.tzinfo is None and stamped.isoformat() == value:
+            return (stamped - EPOCH) // timedelta(microseconds=1)
+    return value
+
+def _encode_id(value):
+    if isinstance(value, str) and len(value) == 32:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+    return value
+
+def _encode_content(value):
+    if isinstance(value, str) and zstandard is not None and settings.MESSAGE_COMPRESSION_MIN_BYTES > 0:
+        raw = value.encode()
+        if len(raw) >= settings.MESSAGE_COMPRESSION_MIN_BYTES:
+            compressed = _compressor.compress(raw)
+            if len(compressed) < len(raw):
+                return compressed
+    return value
+
+def encode_body(msg: Dict) -> bytes:
+    """The msgpack map of a message, without its seq"""
+    body = {}
+    extra = {}
+    for field, value in msg.items():
+        if field == "seq":
+            continue
+        if field not in FIELD_CODES:
+            extra[field] = value
+        elif field == "role":
+            body["r"] = ROLE_CODES.get(value, value)
+        elif field == "content":
+            body["c"] = _encode_content(value)
+        elif field == "id":
+            body["i"] = _encode_id(value)
+        elif field == "timestamp":
+            body["t"] = _encode_timestamp(value)
+        elif value is not None or field != "model":
+            body[FIELD_CODES[field]] = value
+    if extra:
+        body["x"] = extra
+    return msgpack.packb(body, use_bin_type=True)
+
+def encode_message(msg: Dict, seq: int) -> bytes:
+    """A stored message as written by the current version"""
+    return bytes([FRAME_V1]) + msgpack.packb(seq) + encode_body(msg)
+
+def encode_json_body(msg: Dict) -> bytes:
+    """A legacy JSON message without its closing brace (the seq goes last)"""
+    return json.dumps({k: v for k, v in msg.items() if k != "seq"})[:-1].encode()
+
+def _unpack_frame(data: bytes) -> Tuple[int, Dict]:
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(memoryview(data)[1:])
+    seq = unpacker.unpack()
+    return seq, unpacker.unpack()
+
+def _decode_role(body: Dict) -> str:
+    role = body.get("r")
+    return ROLES.get(role, role) if isinstance(role, int) else role
+
+def _decode_content(content):
+    if isinstance(content, bytes):
+        if zstandard is None:
+            raise ValueError("Message content is zstd-compressed but zstandard is not installed")
+        return _decompressor.decompress(content).decode()
+    return content
+
+def _decode_id(body: Dict) -> Optional[str]:
+    value = body.get("i")
+    return value.hex() if isinstance(value, bytes) else value
+
+def _decode_timestamp(body: Dict) -> Optional[str]:
+    stamped = body.get("t")
+    return (EPOCH + timedelta(microseconds=stamped)).isoformat() if isinstance(stamped, int) else stamped
+
+def _decode_frame(data: bytes) -> Dict:
+    seq, body = _unpack_frame(data)
+    msg = {"role": _decode_role(body)}
+    if "c" in body:
+        msg["content"] = _decode_content(body["c"])
+
+    msg.update(body.get("x", {}))
+
+    if "i" in body:
+        msg["id"] = _decode_id(body)
+    if "t" in body:
+        msg["timestamp"] = _decode_timestamp(body)
+    msg["model"] = body.get("m")
+    msg["seq"] = seq
+    return msg
+
+def decode_message(data: Union[bytes, str, None]) -> Optional[Dict]:
+    """A stored message in any version, or None if it is unreadable"""
+    if not data:
+        return None
+    try:
+        if isinstance(data, str) or data[0] == ord("{"):
+            return json.loads(data)
+        if data[0] == FRAME_V1:
+            return _decode_frame(data)
+        logger.warning(f"Unknown stored message version {data[0]}")
+    except Exception as e:
+        logger.warning(f"Unreadable stored message: {e}")
+    return None
+
+def decode_chat_message(data: Union[bytes, str, None]) -> Optional[ChatMessage]:
+    """A stored message in any version as a ChatMessage, or None if it is unreadable
+
+    Frames are read straight into the message's slots, without building
+    the dict decode_message returns.
+    """
+    if not data:
+        return None
+    try:
+        if isinstance(data, str) or data[0] == ord("{"):
+            return ChatMessage.from_dict(json.loads(data))
+        if data[0] == FRAME_V1:
+            seq, body = _unpack_frame(data)
+            return ChatMessage.stored(
+                _decode_role(body), _decode_content(body.get("c", "")),
+                _decode_id(body), _decode_timestamp(body), body.get("m"), seq, body.get("x")
+            )
+        logger.warning(f"Unknown stored message version {data[0]}")
+    except Exception as e:
+        logger.warning(f"Unreadable stored message: {e}")
+    return None
@@ -0,0 +1,24 @@
+from app.core.config import Settings
+from app.providers.base import BaseProvider
+from app.providers.deepseek import DeepSeekProvider
+from app.providers.glm import GLMProvider
+from app.providers.qwen import QwenProvider
+
+def get_provider(provider_name: str, settings: Settings) -> BaseProvider:
+    """Get provider instance with proper API key configuration"""
+    if provider_name == "deepseek":
+        return DeepSeekProvider(api_key=settings.DEEPSEEK_API_KEY)
+    elif provider_name == "glm":
+        return GLMProvider(api_key=settings.GLM_API_KEY)
+    elif provider_name == "qwen":
+        return QwenProvider(api_key=settings.QWEN_API_KEY)
+    else:
+        raise ValueError(f"Unknown provider: {provider_name}")
+
+def get_provider_name(model: str) -> str:
+    """Extract provider name from model string"""
+    # Special handling: qwen3-2507 → qwen (not qwen3)
+    # Standard format: deepseek-chat → deepseek, glm-4.5 → glm
+    if model.startswith("qwen3"):
+        return "qwen"  # Map qwen3-* models to qwen provider
+    return model.split("-")[0]  # Standard extraction
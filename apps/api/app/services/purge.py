@@ -0,0 +1,290 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import logging
+import uuid
+import redis.asyncio as redis
+from app.core.config import settings
+from app.core.metrics import PURGE_KEYS_DELETED, PURGES_COMPLETED
+from app.core.redis_keys import glob_escape, parse_user_key, read_keys
+from app.core.redis_pool import is_cluster
+from app.services.context_cache import context_cache
+from app.services.memory import MemoryManager
+from app.services.semantic_memory import semantic_memory
+
+logger = logging.getLogger(__name__)
+
+# A purge runs these stages in order; the stage reached is checkpointed in the
+# job hash, so an interrupted purge resumes where it stopped.
+#
+#   archive  the user's archived conversations in Postgres
+#   vectors  the user's semantic memory vectors
+#   keys     every Redis key of the user in either key layout (see
+#            key_family), found with SCAN and removed with UNLINK in batches
+STAGES = ("archive", "vectors", "keys", "done")
+
+FAMILIES = ("conversations", "meta", "summaries", "index", "search", "usage", "routing")
+
+# Seconds a worker may go without checkpointing before another takes over
+LEASE_SECONDS = 60
+
+def key_family(key: str, user_id: str) -> Optional[str]:
+    """Which family of the user's data a Redis key belongs to, if any"""
+    parsed = parse_user_key(key)
+    if parsed is None or parsed.user_id != user_id:
+        return None
+    return parsed.family
+
+async def unlink_matching(redis_client: redis.Redis, pattern: str, batch_size: Optional[int] = None) -> int:
+    """UNLINK every key matching a SCAN pattern, batch_size keys per command
+
+    Keys are unlinked as they are found, so memory and the size of each
+    command stay bounded however many keys match.
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    deleted = 0
+    batch: List[str] = []
+    async for key in redis_client.scan_iter(match=pattern, count=settings.PURGE_SCAN_COUNT):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += await redis_client.unlink(*batch)
+            batch = []
+    if batch:
+        deleted += await redis_client.unlink(*batch)
+    return deleted
+
+class UserDataPurger:
+    """Background jobs deleting everything stored about a user
+
+    A job's progress lives in the hash purge:job:{user_id}, so it can be
+    read from any worker and survives restarts. The worker running a job
+    holds the lease purge:lease:{user_id}, renewed at every checkpoint; a
+    job whose lease lapsed (its worker died) is resumed by the next start
+    call or worker startup. Finished jobs keep their report for
+    PURGE_STATE_TTL.
+
+    Redis keys are found with a SCAN of the whole keyspace for the user id,
+    PURGE_SCAN_COUNT keys per call, and removed with UNLINK (freed off the
+    main thread) at most PURGE_BATCH_SIZE keys per command, so Redis never
+    blocks on a large user. Each page is unlinked and checkpointed in one
+    transaction. A resumed scan is followed by one full pass, as a SCAN
+    cursor may not survive a Redis restart. On Redis Cluster only the node
+    holding the user's hash slot is scanned, and pages are pipelined
+    rather than transactions.
+
+    Data written while a purge runs may survive it: purge users who can no
+    longer write (deleted or deactivated accounts).
+    """
+
+    def __init__(self, memory_manager: Optional[MemoryManager] = None):
+        self.memory_manager = memory_manager or MemoryManager()
+        self.worker_id = uuid.uuid4().hex
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def state_key(self, user_id: str) -> str:
+        return f"purge:job:{user_id}"
+
+    def lease_key(self, user_id: str) -> str:
+        return f"purge:lease:{user_id}"
+
+    async def start(self, user_id: str) -> Dict:
+        """Start a purge of the user in the background, or resume an interrupted one
+
+        A running purge is left alone; a finished one is started over.
+        Returns the job's progress.
+        """
+        redis_client = await self.memory_manager._get_redis()
+        key = self.state_key(user_id)
+        state = await redis_client.hgetall(key)
+        now = datetime.utcnow().isoformat()
+
+        if not state or state.get("status") == "done":
+            async with redis_client.pipeline(transaction=not is_cluster(redis_client)) as pipe:
+                pipe.delete(key)
+                pipe.hset(key, mapping={
+                    "status": "running",
+                    "stage": STAGES[0],
+                    "cursor": 0,
+                    "scanned": 0,
+                    "started_at": now,
+                    "updated_at": now
+                })
+                await pipe.execute()
+        elif state.get("status") == "failed":
+            await redis_client.hset(key, mapping={"status": "running", "updated_at": now})
+            await redis_client.hdel(key, "error")
+
+        if user_id not in self.tasks:
+            self.tasks[user_id] = asyncio.create_task(self._run(user_id), name=f"purge-{user_id}")
+        return await self.progress(user_id)
+
+    async def resume_interrupted(self) -> int:
+        """Restart running purges whose worker went away; returns how many"""
+        redis_client = await self.memory_manager._get_redis()
+        resumed = 0
+        async for key in redis_client.scan_iter(match="purge:job:*", count=settings.PURGE_SCAN_COUNT):
+            user_id = key[len("purge:job:"):]
+            if await redis_client.hget(key, "status") != "running":
+                continue
+            if await redis_client.exists(self.lease_key(user_id)):
+                continue
+            await self.start(user_id)
+            resumed += 1
+        return resumed
+
+    async def stop(self):
+        """Cancel running purges; they resume from their last checkpoint"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    async def progress(self, user_id: str) -> Optional[Dict]:
+        """A purge's report, or None if the user was never purged"""
+        redis_client = await self.memory_manager._get_redis()
+        state = await redis_client.hgetall(self.state_key(user_id))
+        if not state:
+            return None
+
+        deleted = {family: int(state.get(f"deleted:{family}", 0)) for family in FAMILIES}
+        scanned = int(state.get("scanned", 0))
+        estimated = int(state.get("estimated_keys", 0))
+        if state["stage"] == "done":
+            fraction = 1.0
+        elif state["stage"] == "keys" and estimated:
+            fraction = min(scanned / estimated, 0.99)
+        else:
+            fraction = 0.0
+        return {
+            "user_id": user_id,
+            "status": state["status"],
+            "stage": state["stage"],
+            "progress": round(fraction, 4),
+            "keys_deleted": sum(deleted.values()),
+            "keys_deleted_by_family": deleted,
+            "keys_scanned": scanned,
+            "archived_conversations_deleted": int(state.get("archived", 0)),
+            "vectors_deleted": int(state.get("vectors", 0)),
+            "started_at": state.get("started_at"),
+            "updated_at": state.get("updated_at"),
+            "finished_at": state.get("finished_at"),
+            "error": state.get("error")
+        }
+
+    async def run(self, user_id: str) -> Optional[Dict]:
+        """Run (or resume) a started purge in the foreground
+
+        Returns the job's progress, or None if another worker holds its lease.
+        """
+        redis_client = await self.memory_manager._get_redis()
+        key = self.state_key(user_id)
+        if not await redis_client.set(self.lease_key(user_id), self.worker_id, nx=True, ex=LEASE_SECONDS):
+            return None
+
+        try:
+            state = await redis_client.hgetall(key)
+            if state.get("status") != "running":
+                return await self.progress(user_id)
+
+            for stage in STAGES[STAGES.index(state["stage"]):]:
+                if stage == "archive":
+                    archive = self.memory_manager.archive
+                    removed = await archive.delete_user(user_id) if archive else 0
+                    await self._checkpoint(user_id, {"stage": "vectors", "archived": removed})
+                elif stage == "vectors":
+                    removed = await semantic_memory.delete_user(user_id) if settings.SEMANTIC_MEMORY_ENABLED else 0
+                    await self._checkpoint(user_id, {"stage": "keys", "vectors": removed})
+                elif stage == "keys":
+                    await self._purge_keys(user_id, int(state.get("cursor", 0)))
+                    await self._checkpoint(user_id, {
+                        "stage": "done",
+                        "status": "done",
+                        "finished_at": datetime.utcnow().isoformat()
+                    })
+                    await redis_client.expire(key, settings.PURGE_STATE_TTL)
+                    PURGES_COMPLETED.inc()
+            return await self.progress(user_id)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Purge of user {user_id} failed: {e}")
+            await redis_client.hset(key, mapping={"status": "failed", "error": str(e)})
+            return await self.progress(user_id)
+        finally:
+            try:
+                if await redis_client.get(self.lease_key(user_id)) == self.worker_id:
+                    await redis_client.delete(self.lease_key(user_id))
+            except Exception:
+                pass
+
+    async def _run(self, user_id: str):
+        try:
+            await self.run(user_id)
+        finally:
+            self.tasks.pop(user_id, None)
+
+    async def _checkpoint(self, user_id: str, fields: Dict):
+        redis_client = await self.memory_manager._get_redis()
+        async with redis_client.pipeline(transaction=not is_cluster(redis_client)) as pipe:
+            pipe.hset(self.state_key(user_id), mapping={**fields, "updated_at": datetime.utcnow().isoformat()})
+            pipe.expire(self.lease_key(user_id), LEASE_SECONDS)
+            await pipe.execute()
+
+    async def _purge_keys(self, user_id: str, cursor: int):
+        """SCAN the keyspace from cursor, unlinking the user's keys page by page"""
+        full_pass = cursor == 0
+        redis_client = await self.memory_manager._get_redis()
+        key = self.state_key(user_id)
+        pattern = f"*{glob_escape(user_id)}*"
+        cluster = is_cluster(redis_client)
+        node = {}
+        if cluster:
+            # Every key of the user is in the slot of its hash tag
+            node = {"target_nodes": redis_client.get_node_from_key(read_keys(user_id).conversations)}
+        await redis_client.hset(key, "estimated_keys", await redis_client.dbsize(**node))
+
+        while True:
+            cursor, keys = await redis_client.scan(cursor, match=pattern, count=settings.PURGE_SCAN_COUNT, **node)
+            if cluster:
+                # Cursors come by node name
+                cursor = cursor[node["target_nodes"].name]
+            owned: List[Tuple[str, str]] = []
+            for found in keys:
+                family = key_family(found, user_id)
+                if family is not None:
+                    owned.append((found, family))
+
+            done = cursor == 0 and full_pass
+            if cursor == 0:
+                # A pass resumed from a saved cursor is followed by a full one
+                full_pass = True
+
+            conversation_ids = list(dict.fromkeys(
+                parse_user_key(found).rest[1:] for found, family in owned if family == "conversations"
+            ))
+            counts: Dict[str, int] = {}
+            for _, family in owned:
+                counts[family] = counts.get(family, 0) + 1
+
+            async with redis_client.pipeline(transaction=not cluster) as pipe:
+                for i in range(0, len(owned), settings.PURGE_BATCH_SIZE):
+                    pipe.unlink(*[found for found, _ in owned[i:i + settings.PURGE_BATCH_SIZE]])
+                for family, count in counts.items():
+                    pipe.hincrby(key, f"deleted:{family}", count)
+                pipe.hincrby(key, "scanned", settings.PURGE_SCAN_COUNT)
+                pipe.hset(key, mapping={"cursor": cursor, "updated_at": datetime.utcnow().isoformat()})
+                pipe.expire(self.lease_key(user_id), LEASE_SECONDS)
+                for conversation_id in conversation_ids:
+                    self.memory_manager._publish_invalidation(pipe, user_id, conversation_id)
+                await pipe.execute()
+
+            for conversation_id in conversation_ids:
+                context_cache.discard(user_id, conversation_id)
+            for family, count in counts.items():
+                PURGE_KEYS_DELETED.labels(family=family).inc(count)
+            if done:
+                return
+
+user_purger = UserDataPurger()
@@ -4,6 +4,7 @@ import json
 import time
 import os
 from app.core.config import settings
+from app.core.redis_keys import read_keys
 import redis.asyncio as redis
 
 class ModelType(Enum):
@@ -84,7 +85,8 @@ class ModelRouter:
         self,
         query: str,
         user_preference: Optional[str] = None,
-        context_length: int = 0
+        context_length: int = 0,
+        user_id: Optional[str] = None
     ) -> tuple[ModelType, str]:
         """Select optimal model based on query analysis"""
         
@@ -154,7 +156,7 @@ class ModelRouter:
         
         
         # Cache the routing decision for analytics
-        await self._cache_routing_decision(query, task_type, best_model, scores)
+        await self._cache_routing_decision(query, task_type, best_model, scores, user_id)
         
         return best_model, f"task_match_{task_type.value}"
     
@@ -163,9 +165,14 @@ class ModelRouter:
         query: str,
         task_type: TaskType,
         selected_model: ModelType,
-        scores: Dict[ModelType, float]
+        scores: Dict[ModelType, float],
+        user_id: Optional[str] = None
     ):
-        """Cache routing decision for analytics"""
+        """Cache routing decision for analytics
+        
+        Decisions are keyed by user (when known) so a user's data purge can
+        find them: they hold a preview of the query.
+        """
         decision = {
             "query_preview": query[:100],
             "task_type": task_type.value,
@@ -175,9 +182,24 @@ class ModelRouter:
         }
         
         # Store in Redis with 7-day expiry
-        key = f"routing_decision:{int(time.time() * 1000)}"
+        if user_id:
+            key = read_keys(user_id).routing_decision(int(time.time() * 1000))
+        else:
+            key = f"routing_decision:{int(time.time() * 1000)}"
         await self.redis.setex(key, 7 * 24 * 3600, json.dumps(decision))
     
+    def get_cheapest_model(self) -> Optional[ModelType]:
+        """Get the cheapest model that has an API key configured"""
+        models_with_keys = [
+            (model, config) for model, config in self.models.items()
+            if config["api_key"] is not None and not config["api_key"].startswith("your-")
+        ]
+
+        if not models_with_keys:
+            return None
+
+        return min(models_with_keys, key=lambda x: x[1]["cost"])[0]
+
     async def get_fallback_model(self, failed_model: ModelType) -> Optional[ModelType]:
         """Get fallback model when primary fails"""
         # Return the next cheapest available model
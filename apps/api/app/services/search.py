@@ -0,0 +1,186 @@
+from typing import Dict, List, Tuple
+import re
+
+# Words too common to be worth a postings list
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in is it its me my no not
+of on or so that the their them then there these they this to was we were what
+when which who will with you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 40
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens of a text, without stopwords and 1-letter tokens"""
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if 1 < len(token) <= MAX_TOKEN_LENGTH and token not in STOPWORDS
+    ]
+
+def term_frequencies(text: str) -> Tuple[int, Dict[str, int]]:
+    """Document length and term frequencies of a message, as indexed"""
+    tokens = tokenize(text)
+    frequencies: Dict[str, int] = {}
+    for token in tokens:
+        frequencies[token] = frequencies.get(token, 0) + 1
+    return len(tokens), frequencies
+
+# Lua functions shared by the scripts that write the index. Documents are
+# {id, len, terms = {term = frequency}} tables. A posting scores its term's
+# frequency plus a fraction below 1 shrinking with the document's length, so
+# a term's highest scores come in about BM25's order (see SEARCH_SCRIPT).
+# The index keys are those of UserKeys.search; postings keys are built in
+# the scripts from their prefix rather than declared, which Redis Cluster
+# allows as the user's hash tag keeps them in the slot of the declared keys.
+INDEX_FUNCTIONS_LUA = """
+local function index_docs(postings_prefix, terms_key, lengths_key, stats_key, ttl, docs)
+    local total_length = 0
+    for _, doc in ipairs(docs) do
+        for term, frequency in pairs(doc.terms) do
+            redis.call('ZADD', postings_prefix .. term, frequency + 1 / (2 + doc.len), doc.id)
+            redis.call('EXPIRE', postings_prefix .. term, ttl)
+            redis.call('ZADD', terms_key, 0, term)
+        end
+        redis.call('HSET', lengths_key, doc.id, doc.len)
+        total_length = total_length + doc.len
+    end
+    if #docs > 0 then
+        redis.call('HINCRBY', stats_key, 'docs', #docs)
+        redis.call('HINCRBY', stats_key, 'length', total_length)
+        redis.call('EXPIRE', terms_key, ttl)
+        redis.call('EXPIRE', lengths_key, ttl)
+        redis.call('EXPIRE', stats_key, ttl)
+    end
+end
+
+local function unindex_docs(postings_prefix, terms_key, lengths_key, stats_key, docs)
+    for _, doc in ipairs(docs) do
+        local length = redis.call('HGET', lengths_key, doc.id)
+        if length then
+            for term, _ in pairs(doc.terms) do
+                redis.call('ZREM', postings_prefix .. term, doc.id)
+                if redis.call('EXISTS', postings_prefix .. term) == 0 then
+                    redis.call('ZREM', terms_key, term)
+                end
+            end
+            redis.call('HDEL', lengths_key, doc.id)
+            redis.call('HINCRBY', stats_key, 'docs', -1)
+            redis.call('HINCRBY', stats_key, 'length', -tonumber(length))
+        end
+    end
+end
+"""
+
+# Indexes the documents of messages appended from first seq on, for
+# APPEND_MESSAGES_SCRIPT.
+# Part: keys terms, lengths, stats (UserKeys.search); postings (the prefix),
+# documents (length and terms of each message)
+INDEX_APPENDED_LUA = INDEX_FUNCTIONS_LUA + """
+local function index_appended(search, conversation_id, first_seq, ttl)
+    local keys = search['keys']
+    for i, doc in ipairs(search['documents']) do
+        doc.id = conversation_id .. ':' .. (first_seq + i - 1)
+    end
+    index_docs(search['postings'], keys['terms'], keys['lengths'], keys['stats'], ttl, search['documents'])
+end
+"""
+
+# Replaces documents in the index in one call (compaction, deletion).
+# KEYS: terms, lengths, stats
+# ARGV: postings prefix, ttl, JSON documents to remove, JSON documents to add
+REINDEX_SCRIPT = INDEX_FUNCTIONS_LUA + """
+unindex_docs(ARGV[1], KEYS[1], KEYS[2], KEYS[3], cjson.decode(ARGV[3]))
+index_docs(ARGV[1], KEYS[1], KEYS[2], KEYS[3], ARGV[2], cjson.decode(ARGV[4]))
+return 1
+"""
+
+# Ranks documents with BM25. Each query term matches itself and, with prefix
+# matching, up to max expansions indexed terms starting with it; a document
+# scores the best of its matches for every query term. Documents of expired
+# or deleted conversations are skipped.
+# The work is bounded whatever the size of the history: the matched terms
+# share max postings, each reading only its highest scored postings (at
+# least a page's worth), so only those documents are scored and sorted.
+# Document frequencies still count the whole postings lists.
+# KEYS: terms, lengths, stats, user conversation index
+# ARGV: postings prefix, k1, b, offset, count, max expansions, prefix (1/0),
+#       min conversation score, max postings, query term...
+# Returns: live documents ranked, then id, score for each document of the page
+SEARCH_SCRIPT = """
+local stats = redis.call('HMGET', KEYS[3], 'docs', 'length')
+local n_docs = tonumber(stats[1]) or 0
+if n_docs <= 0 then
+    return {0}
+end
+local avg_length = math.max(tonumber(stats[2]) or 0, 1) / n_docs
+local k1, b = tonumber(ARGV[2]), tonumber(ARGV[3])
+local offset, count = tonumber(ARGV[4]), tonumber(ARGV[5])
+
+local expansions, matched = {}, 0
+for i = 10, #ARGV do
+    local query_term = ARGV[i]
+    local terms = {query_term}
+    if ARGV[7] == '1' then
+        terms = redis.call('ZRANGEBYLEX', KEYS[1], '[' .. query_term, '[' .. query_term .. '\\255', 'LIMIT', 0, ARGV[6])
+    end
+    expansions[#expansions + 1] = terms
+    matched = matched + #terms
+end
+local per_term = math.max(offset + count, math.floor(tonumber(ARGV[9]) / math.max(matched, 1)))
+
+local scores, lengths = {}, {}
+for _, terms in ipairs(expansions) do
+    local best = {}
+    for _, term in ipairs(terms) do
+        local df = redis.call('ZCARD', ARGV[1] .. term)
+        if df > 0 then
+            local idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            local postings = redis.call('ZRANGE', ARGV[1] .. term, 0, per_term - 1, 'REV', 'WITHSCORES')
+            for j = 1, #postings, 2 do
+                local doc = postings[j]
+                local tf = math.floor(tonumber(postings[j + 1]))
+                local length = lengths[doc]
+                if length == nil then
+                    length = tonumber(redis.call('HGET', KEYS[2], doc)) or avg_length
+                    lengths[doc] = length
+                end
+                local score = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+                if (best[doc] or 0) < score then
+                    best[doc] = score
+                end
+            end
+        end
+    end
+    for doc, score in pairs(best) do
+        scores[doc] = (scores[doc] or 0) + score
+    end
+end
+
+local live, ranked = {}, {}
+local min_score = tonumber(ARGV[8])
+for doc, score in pairs(scores) do
+    local conversation_id = string.match(doc, '^(.*):%d+$')
+    if live[conversation_id] == nil then
+        local updated = redis.call('ZSCORE', KEYS[4], conversation_id)
+        live[conversation_id] = updated ~= false and tonumber(updated) >= min_score
+    end
+    if live[conversation_id] then
+        ranked[#ranked + 1] = {doc, score}
+    end
+end
+table.sort(ranked, function(x, y)
+    if x[2] ~= y[2] then
+        return x[2] > y[2]
+    end
+    return x[1] < y[1]
+end)
+
+local result = {#ranked}
+for i = offset + 1, math.min(offset + count, #ranked) do
+    result[#result + 1] = ranked[i][1]
+    result[#result + 1] = tostring(ranked[i][2])
+end
+return result
+"""
@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import threading
+import numpy as np
+from app.core.config import settings
+from app.services.vector_index import BaseVectorIndex, get_vector_index
+
+logger = logging.getLogger(__name__)
+
+class SentenceTransformerEmbedder:
+    """Embeds texts with a local sentence-transformers model on CPU
+
+    The model is loaded on first use, and encoding runs in a worker thread so
+    the event loop keeps serving requests.
+    """
+
+    def __init__(self, model_name: str, dim: int, batch_size: int = 32):
+        self.model_name = model_name
+        self.dim = dim
+        self.batch_size = batch_size
+        self.model = None
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        with self._load_lock:
+            if self.model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(self.model_name, device="cpu")
+                model_dim = model.get_sentence_embedding_dimension()
+                if model_dim != self.dim:
+                    raise ValueError(
+                        f"{self.model_name} produces {model_dim}-dimensional embeddings, "
+                        f"but EMBEDDING_DIM is {self.dim}"
+                    )
+                self.model = model
+        return self.model
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self._load().encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return vectors.astype(np.float32)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized embeddings, one row per text"""
+        return await asyncio.to_thread(self._encode, texts)
+
+class SemanticMemory:
+    """Embeds stored messages and recalls semantically related ones
+
+    Messages are embedded in the background after they are stored and kept in
+    the configured vector index (VECTOR_INDEX_BACKEND) under their document
+    id "{conversation_id}:{seq}", so hits resolve to stored messages.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[SentenceTransformerEmbedder] = None,
+        index: Optional[BaseVectorIndex] = None
+    ):
+        self._embedder = embedder
+        self._index = index
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def embedder(self) -> SentenceTransformerEmbedder:
+        if self._embedder is None:
+            self._embedder = SentenceTransformerEmbedder(settings.EMBEDDING_MODEL, settings.EMBEDDING_DIM)
+        return self._embedder
+
+    @property
+    def index(self) -> BaseVectorIndex:
+        if self._index is None:
+            self._index = get_vector_index(settings, settings.EMBEDDING_DIM)
+        return self._index
+
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        # Bound concurrent encodes so background indexing can't starve the CPU
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.EMBEDDING_CONCURRENCY)
+        async with self._semaphore:
+            return await self.embedder.embed(texts)
+
+    async def index_messages(
+        self,
+        conversation_id: str,
+        user_id: str,
+        messages: List[Dict],
+        first_seq: int
+    ) -> int:
+        """Embed newly stored messages; messages[i] was stored with seq first_seq + i"""
+        doc_ids, texts = [], []
+        for offset, msg in enumerate(messages):
+            content = (msg.get("content") or "").strip()
+            if len(content) < settings.SEMANTIC_MIN_CHARS:
+                continue
+            doc_ids.append(f"{conversation_id}:{first_seq + offset}")
+            texts.append(content)
+
+        if not texts:
+            return 0
+
+        vectors = await self._embed(texts)
+        await self.index.add(user_id, doc_ids, vectors)
+        return len(doc_ids)
+
+    async def related(
+        self,
+        user_id: str,
+        query: str,
+        k: int = 5,
+        exclude_conversation_id: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """Top-k (document id, similarity) of the user's messages closest to a text"""
+        vectors = await self._embed([query])
+        return await self.index.search(user_id, vectors[0], k, exclude_conversation_id)
+
+    async def delete_conversation(self, user_id: str, conversation_id: str) -> int:
+        return await self.index.delete_conversation(user_id, conversation_id)
+
+    async def delete_user(self, user_id: str) -> int:
+        return await self.index.delete_user(user_id)
+
+semantic_memory = SemanticMemory()
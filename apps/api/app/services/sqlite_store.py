@@ -0,0 +1,465 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from app.core.config import settings
+from app.core.messages import ChatMessage
+from app.services.conversation_store import ConversationStore
+from app.services.message_codec import decode_chat_message, decode_message, encode_message
+from app.services.search import tokenize
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    title TEXT,
+    last_message TEXT NOT NULL DEFAULT '',
+    role TEXT NOT NULL DEFAULT 'unknown',
+    next_seq INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, conversation_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (user_id, updated_at DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    UNIQUE (user_id, conversation_id, seq)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# Statements are constant strings, so each connection prepares them once
+# and reuses them from its statement cache
+SELECT_NEXT_SEQ = "SELECT next_seq FROM conversations WHERE user_id = ? AND conversation_id = ?"
+INSERT_MESSAGE = """
+INSERT INTO messages (user_id, conversation_id, seq, content, payload) VALUES (?, ?, ?, ?, ?)
+"""
+UPSERT_CONVERSATION = """
+INSERT INTO conversations (user_id, conversation_id, last_message, role, next_seq, bytes, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, conversation_id) DO UPDATE SET
+    last_message = excluded.last_message,
+    role = excluded.role,
+    next_seq = excluded.next_seq,
+    bytes = bytes + excluded.bytes,
+    updated_at = excluded.updated_at
+"""
+SELECT_HEAD = "SELECT MIN(seq) FROM messages WHERE user_id = ? AND conversation_id = ?"
+SELECT_TRIMMED_BYTES = """
+SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM messages
+WHERE user_id = ? AND conversation_id = ? AND seq < ?
+"""
+DELETE_TRIMMED = "DELETE FROM messages WHERE user_id = ? AND conversation_id = ? AND seq < ?"
+RELEASE_BYTES = "UPDATE conversations SET bytes = bytes - ? WHERE user_id = ? AND conversation_id = ?"
+SELECT_USAGE = "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM conversations WHERE user_id = ?"
+SELECT_OLDEST = """
+SELECT conversation_id, bytes FROM conversations
+WHERE user_id = ? AND conversation_id != ? ORDER BY updated_at
+"""
+UPDATE_TITLE = "UPDATE conversations SET title = ? WHERE user_id = ? AND conversation_id = ?"
+DELETE_MESSAGES = "DELETE FROM messages WHERE user_id = ? AND conversation_id = ?"
+DELETE_CONVERSATION = "DELETE FROM conversations WHERE user_id = ? AND conversation_id = ?"
+SELECT_CONTEXT = """
+SELECT payload FROM messages WHERE user_id = ? AND conversation_id = ?
+ORDER BY seq DESC LIMIT ?
+"""
+SELECT_CONVERSATIONS = """
+SELECT conversation_id, title, last_message, role, next_seq, updated_at FROM conversations
+WHERE user_id = ? ORDER BY updated_at DESC LIMIT ?
+"""
+SELECT_MATCHES = """
+SELECT m.conversation_id, m.payload, bm25(messages_fts) AS rank
+FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+WHERE messages_fts MATCH ? AND m.user_id = ?
+ORDER BY rank LIMIT ?
+"""
+
+def _connect(path: str) -> sqlite3.Connection:
+    # Autocommit mode: transactions are opened explicitly by the writer
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+def _resolve(future: asyncio.Future, result, error: Optional[BaseException]):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class _Writer:
+    """The store's one writing connection, on a thread of its own
+
+    Jobs queued from the event loop are drained in batches of up to
+    SQLITE_WRITE_BATCH, each batch committed as one transaction: concurrent
+    writes share a single WAL sync. Every job runs under a savepoint, so one
+    that fails is rolled back alone.
+    """
+
+    def __init__(self, path: str, batch_size: int):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.jobs = queue.SimpleQueue()
+        self.ready = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, job: Callable, *args) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.jobs.put((job, args, loop, future))
+        return future
+
+    def stop(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _run(self):
+        try:
+            conn = _connect(self.path)
+            conn.executescript(SCHEMA)
+        except BaseException as e:
+            self.error = e
+            self.ready.set()
+            return
+        self.ready.set()
+
+        stopping = False
+        while not stopping:
+            batch = [self.jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = batch[:batch.index(None)]
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[Tuple]):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, args, _, _ in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((job(conn, *args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    outcomes.append((None, e))
+                conn.execute("RELEASE job")
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(None, e)] * len(batch)
+        for (_, _, loop, future), (result, error) in zip(batch, outcomes):
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversation memory in one SQLite file, for single-node deployments
+
+    The database is in WAL mode: reads run on a pool of SQLITE_READERS
+    threads, each with its own connection, concurrently with the single
+    writer thread (see _Writer), so the event loop never blocks on disk.
+    Messages are stored in message_codec's encoding with their seq, and
+    indexed for search in an FTS5 table ranked by BM25.
+
+    There is no TTL: conversations stay until cleared or evicted by a
+    tier's storage limits, which trim long conversations without a
+    summary. Summaries, branches, paging, export and the archive need
+    the Redis backend (MemoryManager).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.SQLITE_PATH
+        self._writer: Optional[_Writer] = None
+        self._readers: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if self._writer is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        writer = _Writer(self.path, settings.SQLITE_WRITE_BATCH)
+        # Readers need the schema the writer creates
+        writer.ready.wait()
+        if writer.error is not None:
+            raise writer.error
+        self._writer = writer
+        self._readers = ThreadPoolExecutor(
+            max_workers=max(1, settings.SQLITE_READERS), thread_name_prefix="sqlite-reader"
+        )
+
+    async def _write(self, job: Callable, *args):
+        self._start()
+        return await self._writer.submit(job, *args)
+
+    async def _read(self, query: Callable, *args):
+        self._start()
+        return await asyncio.get_running_loop().run_in_executor(self._readers, self._run_read, query, args)
+
+    def _run_read(self, query: Callable, args: Tuple):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+            with self._lock:
+                self._connections.append(conn)
+        return query(conn, *args)
+
+    async def get_context(
+        self,
+        conversation_id: str,
+        user_id: str,
+        max_messages: int = 20,
+        include_summary: bool = False
+    ) -> List[Dict]:
+        return [msg.to_dict() for msg in await self.get_chat_context(conversation_id, user_id, max_messages)]
+
+    async def get_chat_context(
+        self,
+        conversation_id: str,
+        user_id: str,
+        max_messages: int = 20,
+        include_summary: bool = False
+    ) -> List[ChatMessage]:
+        """The newest max_messages messages, oldest first (there are no summaries)"""
+        def query(conn):
+            limit = max_messages if max_messages > 0 else -1
+            return conn.execute(SELECT_CONTEXT, (user_id, conversation_id, limit)).fetchall()
+
+        try:
+            rows = await self._read(query)
+        except Exception as e:
+            logger.error(f"Error retrieving context: {e}")
+            return []
+        messages = [decode_chat_message(payload) for payload, in reversed(rows)]
+        return [msg for msg in messages if msg is not None]
+
+    async def store_conversation(
+        self,
+        conversation_id: str,
+        user_id: str,
+        messages: List[Union[ChatMessage, Dict]],
+        model: str,
+        limits: Optional[Dict] = None
+    ) -> Optional[int]:
+        """Append new messages to a conversation
+
+        Messages that already carry a "seq" are skipped. Seqs are allocated,
+        the messages and their search index written, the listing updated and
+        the storage limits kept in one transaction.
+
+        Returns the conversation's next sequence number.
+        """
+        timestamp = datetime.utcnow().isoformat()
+        stored = []
+        for msg in messages:
+            msg_dict = msg.to_dict() if isinstance(msg, ChatMessage) else msg
+            if msg_dict.get("seq") is not None:
+                continue
+            stored.append({
+                **{k: v for k, v in msg_dict.items() if k != "seq"},
+                "id": msg_dict.get("id") or uuid.uuid4().hex,
+                "timestamp": timestamp,
+                "model": model if msg_dict["role"] == "assistant" else None
+            })
+        if not stored:
+            return None
+
+        try:
+            return await self._write(
+                self._append, user_id, conversation_id, stored, datetime.utcnow().timestamp(), limits
+            )
+        except Exception as e:
+            logger.error(f"Error storing conversation: {e}")
+            return None
+
+    @staticmethod
+    def _append(
+        conn: sqlite3.Connection,
+        user_id: str,
+        conversation_id: str,
+        stored: List[Dict],
+        updated_at: float,
+        limits: Optional[Dict]
+    ) -> int:
+        row = conn.execute(SELECT_NEXT_SEQ, (user_id, conversation_id)).fetchone()
+        first_seq = row[0] if row else 0
+        rows = []
+        size = 0
+        for i, msg in enumerate(stored):
+            payload = encode_message(msg, first_seq + i)
+            size += len(payload)
+            content = msg.get("content")
+            rows.append((user_id, conversation_id, first_seq + i, content if isinstance(content, str) else "", payload))
+        conn.executemany(INSERT_MESSAGE, rows)
+
+        next_seq = first_seq + len(stored)
+        last_message = stored[-1]
+        conn.execute(UPSERT_CONVERSATION, (
+            user_id, conversation_id,
+            (last_message.get("content") or "")[:100], last_message.get("role", "unknown"),
+            next_seq, size, updated_at
+        ))
+        if limits:
+            SQLiteConversationStore._enforce_limits(conn, user_id, conversation_id, limits, next_seq)
+        return next_seq
+
+    @staticmethod
+    def _enforce_limits(conn: sqlite3.Connection, user_id: str, conversation_id: str, limits: Dict, next_seq: int):
+        """Bring the user back under a tier's storage limits, as MemoryManager._enforce_limits does
+
+        A cap that is exceeded is brought down to STORAGE_TRIM_RATIO of it:
+        the oldest messages of the conversation written to are dropped, then
+        the least recently updated other conversations.
+        """
+        ratio = settings.STORAGE_TRIM_RATIO
+        max_messages = limits.get("messages_per_conversation")
+        if max_messages:
+            head = conn.execute(SELECT_HEAD, (user_id, conversation_id)).fetchone()[0]
+            if head is not None and next_seq - head > max_messages:
+                keep_from = next_seq - int(max_messages * ratio)
+                released = conn.execute(SELECT_TRIMMED_BYTES, (user_id, conversation_id, keep_from)).fetchone()[0]
+                conn.execute(DELETE_TRIMMED, (user_id, conversation_id, keep_from))
+                conn.execute(RELEASE_BYTES, (released, user_id, conversation_id))
+
+        max_conversations = limits.get("conversations")
+        max_bytes = limits.get("bytes")
+        if not max_conversations and not max_bytes:
+            return
+        conversations, stored_bytes = conn.execute(SELECT_USAGE, (user_id,)).fetchone()
+        if not ((max_conversations and conversations > max_conversations) or (max_bytes and stored_bytes > max_bytes)):
+            return
+        excess_conversations = conversations - int(max_conversations * ratio) if max_conversations else 0
+        excess_bytes = stored_bytes - int(max_bytes * ratio) if max_bytes else 0
+        evicted = []
+        for conv_id, size in conn.execute(SELECT_OLDEST, (user_id, conversation_id)).fetchall():
+            if excess_conversations <= 0 and excess_bytes <= 0:
+                break
+            evicted.append((user_id, conv_id))
+            excess_conversations -= 1
+            excess_bytes -= size
+        conn.executemany(DELETE_MESSAGES, evicted)
+        conn.executemany(DELETE_CONVERSATION, evicted)
+
+    async def get_user_conversations(self, user_id: str, limit: int = 20) -> List[Dict]:
+        """The user's most recently updated conversations, in MemoryManager's format"""
+        def query(conn):
+            return conn.execute(SELECT_CONVERSATIONS, (user_id, limit)).fetchall()
+
+        try:
+            rows = await self._read(query)
+        except Exception as e:
+            logger.error(f"Error getting conversations: {e}")
+            return []
+
+        conversations = []
+        for conv_id, title, last_message, role, next_seq, updated_at in rows:
+            if not title:
+                last_content = last_message or "New Conversation"
+                title = last_content[:50] + ("..." if len(last_content) > 50 else "")
+            conversations.append({
+                "id": conv_id,
+                "title": title,
+                "last_message": last_message,
+                "timestamp": datetime.fromtimestamp(updated_at).isoformat(),
+                "role": role,
+                "message_count": next_seq,
+                "archived": False,
+                "parent": None,
+                "fork": None
+            })
+        return conversations
+
+    async def search_memories(self, user_id: str, query: str, limit: int = 10) -> List[Dict]:
+        """Full-text search of the user's messages, ranked by FTS5's BM25
+
+        Query terms are tokenized as MemoryManager.search does, and each
+        matches longer terms starting with it.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return []
+        # Tokens are word characters only, safe to quote
+        match = " OR ".join(f'"{term}"*' for term in terms)
+
+        def search(conn):
+            return conn.execute(SELECT_MATCHES, (match, user_id, limit)).fetchall()
+
+        try:
+            rows = await self._read(search)
+        except Exception as e:
+            logger.error(f"Error searching memories: {e}")
+            return []
+
+        results = []
+        for conv_id, payload, rank in rows:
+            msg = decode_message(payload)
+            if msg is None:
+                continue
+            # bm25() is negated: lower is better
+            results.append({"conversation_id": conv_id, "message": msg, "score": round(-rank, 4)})
+        return results
+
+    async def set_title(self, conversation_id: str, user_id: str, title: str):
+        def update(conn):
+            conn.execute(UPDATE_TITLE, (title, user_id, conversation_id))
+
+        await self._write(update)
+
+    async def clear_conversation(self, conversation_id: str, user_id: str):
+        def clear(conn):
+            conn.execute(DELETE_MESSAGES, (user_id, conversation_id))
+            conn.execute(DELETE_CONVERSATION, (user_id, conversation_id))
+
+        try:
+            await self._write(clear)
+        except Exception as e:
+            logger.error(f"Error clearing conversation: {e}")
+
+    async def close(self):
+        """Stop the writer once its queued writes are committed, and close every connection"""
+        if self._writer is None:
+            return
+        writer, readers = self._writer, self._readers
+        self._writer = self._readers = None
+        await asyncio.to_thread(writer.stop)
+        readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
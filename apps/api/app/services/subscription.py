@@ -1,55 +1,230 @@
-from typing import Tuple, Optional, Dict
+from typing import List, NamedTuple, Tuple, Optional, Dict, Union
 from datetime import datetime
 import redis.asyncio as redis
 from enum import Enum
 import logging
-from supabase import create_client, Client
-from app.core.config import settings
+from app.core.database import get_supabase_client
+from app.core.redis_keys import read_keys, write_keys
+from app.services.tier_cache import tier_cache
 
 logger = logging.getLogger(__name__)
 
+DAILY_USAGE_TTL = 86400  # 24 hours
+MONTHLY_USAGE_TTL = 2592000  # 30 days
+
+# Quotas count messages, tokens (input and output) and cost in
+# micro-dollars (integers, so Redis adds them up exactly).
+# Checks the daily and monthly limits on messages, tokens and cost, and
+# adds amounts to the counters of both periods, in one atomic call: a
+# request's reservation can't be split by a concurrent one of the same
+# user. Tokens and cost are counted in the day's usage hash, which /usage
+# reports from, so refunds and settlements show there too. A request is denied where less than its amount (at least one)
+# remains under a limit; denied requests write nothing. Without limits it
+# only adds, so it also settles and refunds reservations: negative
+# amounts give back what was reserved, never taking a counter below zero
+# (it may have been reset since). Settlements also add the answer's
+# breakdown (see usage_fields) to the day's usage hash.
+# Returns {1, messages remaining after the amounts, message limit, 0} or
+# {0, what remains under the limit hit, that limit, its index among the
+# limits}; remaining and the message limit are -1 without message limits,
+# and the message limit reported is the daily one where the tier has both.
+# KEYS: day's message counter, month's message counter, day's usage hash,
+#       month's spend hash, for each key layout written (the read layout
+#       first, whose counters are checked)
+# ARGV: messages, tokens, cost to add; daily and monthly limits on
+#       messages, tokens and cost ("" for none); daily TTL, monthly TTL;
+#       then field, amount pairs to add to the day's usage hash
+USAGE_SCRIPT = """
+local amounts = {tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])}
+local used = {
+    tonumber(redis.call('GET', KEYS[1]) or '0'),
+    tonumber(redis.call('GET', KEYS[2]) or '0'),
+    tonumber(redis.call('HGET', KEYS[3], 'total_tokens') or '0'),
+    tonumber(redis.call('HGET', KEYS[4], 'total_tokens') or '0'),
+    tonumber(redis.call('HGET', KEYS[3], 'cost') or '0'),
+    tonumber(redis.call('HGET', KEYS[4], 'cost') or '0')
+}
+local remaining = -1
+local limit = -1
+for i = 1, 6 do
+    local cap = ARGV[3 + i]
+    if cap ~= '' then
+        cap = tonumber(cap)
+        local amount = amounts[math.floor((i + 1) / 2)]
+        local left = math.max(cap - used[i], 0)
+        if left < math.max(amount, 1) then
+            return {0, left, cap, i}
+        end
+        if i <= 2 then
+            if remaining < 0 or left - amount < remaining then
+                remaining = left - amount
+            end
+            if limit < 0 then
+                limit = cap
+            end
+        end
+    end
+end
+
+local function add(key, field, amount, ttl)
+    if amount == 0 then
+        return
+    end
+    if amount < 0 then
+        local current = field and redis.call('HGET', key, field) or redis.call('GET', key)
+        amount = math.max(amount, -tonumber(current or '0'))
+        if amount == 0 then
+            return
+        end
+    end
+    if field then
+        redis.call('HINCRBY', key, field, amount)
+    else
+        redis.call('INCRBY', key, amount)
+    end
+    if amount > 0 then
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+
+-- The day's usage hash is kept as long as /usage reports
+for i = 1, #KEYS, 4 do
+    add(KEYS[i], false, amounts[1], ARGV[10])
+    add(KEYS[i + 1], false, amounts[1], ARGV[11])
+    add(KEYS[i + 2], 'total_tokens', amounts[2], ARGV[11])
+    add(KEYS[i + 3], 'total_tokens', amounts[2], ARGV[11])
+    add(KEYS[i + 2], 'cost', amounts[3], ARGV[11])
+    add(KEYS[i + 3], 'cost', amounts[3], ARGV[11])
+    for j = 12, #ARGV, 2 do
+        add(KEYS[i + 2], ARGV[j], tonumber(ARGV[j + 1]), ARGV[11])
+    end
+end
+return {1, remaining, limit, 0}
+"""
+
 class SubscriptionTier(Enum):
     FREE = "FREE"
     STARTER = "STARTER"
     PRO = "PRO"
     BUSINESS = "BUSINESS"
 
-# Tier limits configuration
+# Tier limits configuration: messages ("daily", "monthly"), input and
+# output tokens, and upstream cost in dollars at app.core.pricing's prices
+# (None for no limit). "unlimited" is about messages.
 TIER_LIMITS = {
     SubscriptionTier.FREE: {
         "daily": 50,
         "monthly": 1500,  # 50 * 30
+        "daily_tokens": 200_000,
+        "monthly_tokens": 3_000_000,
+        "daily_cost": 0.10,
+        "monthly_cost": 1.50,
         "unlimited": False
     },
     SubscriptionTier.STARTER: {
         "daily": None,  # No daily limit
         "monthly": 2000,
+        "daily_tokens": None,
+        "monthly_tokens": 20_000_000,
+        "daily_cost": None,
+        "monthly_cost": 10.00,
         "unlimited": False
     },
     SubscriptionTier.PRO: {
         "daily": None,
         "monthly": None,
+        "daily_tokens": None,
+        "monthly_tokens": None,
+        "daily_cost": None,
+        "monthly_cost": None,
         "unlimited": True
     },
     SubscriptionTier.BUSINESS: {
         "daily": None,
         "monthly": None,
+        "daily_tokens": None,
+        "monthly_tokens": None,
+        "daily_cost": None,
+        "monthly_cost": None,
         "unlimited": True
     }
 }
 
+# TIER_LIMITS keys in the order of the usage script's limits
+QUOTA_LIMITS = ("daily", "monthly", "daily_tokens", "monthly_tokens", "daily_cost", "monthly_cost")
+
+def to_micros(dollars: float) -> int:
+    """A cost as counted by quotas"""
+    return round(dollars * 1_000_000)
+
+def has_quotas(limits: Dict) -> bool:
+    """Whether a tier limits anything"""
+    return any(limits[key] is not None for key in QUOTA_LIMITS)
+
+def usage_fields(model: str, input_tokens: int, output_tokens: int) -> Dict[str, int]:
+    """An answer's breakdown in the day's usage hash, as /usage reports it"""
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        f"model:{model}:tokens": input_tokens + output_tokens
+    }
+
+# Caps on what a user keeps in conversation memory (see MemoryManager.store_conversation):
+# messages per conversation (the oldest are trimmed, after the summarizer has
+# folded them in), conversations (the least recently updated are archived, or
+# deleted without an archive) and bytes of stored messages
+STORAGE_LIMITS = {
+    SubscriptionTier.FREE: {
+        "messages_per_conversation": 500,
+        "conversations": 100,
+        "bytes": 10 * 1024 * 1024
+    },
+    SubscriptionTier.STARTER: {
+        "messages_per_conversation": 2000,
+        "conversations": 500,
+        "bytes": 100 * 1024 * 1024
+    },
+    SubscriptionTier.PRO: {
+        "messages_per_conversation": 10000,
+        "conversations": 2000,
+        "bytes": 1024 * 1024 * 1024
+    },
+    SubscriptionTier.BUSINESS: {
+        "messages_per_conversation": 20000,
+        "conversations": 5000,
+        "bytes": 4 * 1024 * 1024 * 1024
+    }
+}
+
+class UsageReservation(NamedTuple):
+    """The outcome of SubscriptionService.reserve_usage
+
+    remaining counts the messages left after this reservation, and limit is
+    the message limit; -1 and None mean unlimited. When denied, exceeded
+    names the limit hit (a TIER_LIMITS key), and remaining and limit are
+    what remained under it and its value (dollars for cost). A denied
+    reservation holds nothing.
+
+    The reservation holds units messages, tokens and cost_micros (the
+    pre-flight estimate) on date_key's counters, until settled or refunded.
+    """
+    allowed: bool
+    remaining: Union[int, float]
+    limit: Optional[Union[int, float]]
+    date_key: str
+    units: int
+    tokens: int = 0
+    cost_micros: int = 0
+    exceeded: Optional[str] = None
+
 class SubscriptionService:
     def __init__(self, redis_client: redis.Redis):
         self.redis_client = redis_client
-        # Initialize Supabase client
-        self.supabase: Client = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_SERVICE_KEY
-        )
+        self.usage_script = redis_client.register_script(USAGE_SCRIPT)
         
     async def get_user_tier(self, user_id: str) -> SubscriptionTier:
         """
-        Get user's subscription tier from Supabase database.
+        Get user's subscription tier, from the tier cache or Supabase.
         """
         # Return FREE tier for anonymous users
         if not user_id or user_id == "anonymous":
@@ -64,77 +239,194 @@ class SubscriptionService:
             return SubscriptionTier.FREE
         
         try:
-            # Query user_profiles table for subscription tier
-            response = self.supabase.table("user_profiles").select("subscription_tier").eq("id", user_id).execute()
-            
-            if response.data and len(response.data) > 0:
-                tier_value = response.data[0].get("subscription_tier", "FREE")
-                # Convert string to enum, defaulting to FREE if invalid
-                try:
-                    return SubscriptionTier(tier_value)
-                except ValueError:
-                    logger.warning(f"Invalid subscription tier '{tier_value}' for user {user_id}, defaulting to FREE")
-                    return SubscriptionTier.FREE
-            else:
-                # User not found in profiles table, return FREE tier
-                logger.info(f"User {user_id} not found in user_profiles, defaulting to FREE tier")
-                return SubscriptionTier.FREE
-                
+            tier_value = await tier_cache.get(self.redis_client, user_id, self._query_tier)
         except Exception as e:
             logger.error(f"Error fetching user tier from Supabase: {e}")
             # In case of any error, default to FREE tier to avoid blocking users
             return SubscriptionTier.FREE
+        
+        # Convert string to enum, defaulting to FREE if invalid
+        try:
+            return SubscriptionTier(tier_value)
+        except ValueError:
+            logger.warning(f"Invalid subscription tier '{tier_value}' for user {user_id}, defaulting to FREE")
+            return SubscriptionTier.FREE
+    
+    @staticmethod
+    def _query_tier(user_id: str) -> str:
+        """The user's tier in Supabase; blocking, so the tier cache runs it in a thread"""
+        # Query user_profiles table for subscription tier
+        response = get_supabase_client().table("user_profiles").select("subscription_tier").eq("id", user_id).execute()
+        
+        if response.data and len(response.data) > 0:
+            return response.data[0].get("subscription_tier") or "FREE"
+        
+        # User not found in profiles table, return FREE tier
+        logger.info(f"User {user_id} not found in user_profiles, defaulting to FREE tier")
+        return SubscriptionTier.FREE.value
     
-    async def get_usage_count(self, user_id: str) -> Dict[str, int]:
-        """Get current usage counts for a user"""
+    async def get_usage_count(self, user_id: str) -> Dict[str, Union[int, float]]:
+        """Get current usage counts for a user (messages, tokens, cost in dollars), in one round trip"""
         # Use local timezone for user-friendly daily resets
         today = datetime.now().strftime("%Y-%m-%d")
         
-        # Get daily message count from dedicated counter
-        daily_messages_key = f"usage:{user_id}:{today}:messages"
-        daily_messages = await self.redis_client.get(daily_messages_key)
-        daily_messages = int(daily_messages) if daily_messages else 0
-        
-        # If no message counter exists, estimate from token usage
-        if daily_messages == 0:
-            daily_key = f"usage:{user_id}:{today}"
-            daily_data = await self.redis_client.hgetall(daily_key)
-            
-            if daily_data:
-                # Count messages as number of entries (simplified - could track actual message count)
-                input_tokens = int(daily_data.get("input_tokens", 0))
-                output_tokens = int(daily_data.get("output_tokens", 0))
-                # Rough estimate: 1 message ≈ 500 tokens average
-                daily_messages = (input_tokens + output_tokens) // 500
-        
-        # Get monthly usage
-        monthly_key = f"usage:{user_id}:monthly"
-        monthly_messages = await self.redis_client.get(monthly_key)
-        monthly_messages = int(monthly_messages) if monthly_messages else 0
+        # The counters the usage script checks limits against
+        keys = read_keys(user_id)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(keys.usage_messages(today))
+            pipe.get(keys.usage_monthly)
+            pipe.hmget(keys.usage(today), "total_tokens", "cost")
+            pipe.hmget(keys.usage_monthly_spend, "total_tokens", "cost")
+            daily_messages, monthly_messages, daily_spend, monthly_spend = await pipe.execute()
         
         return {
-            "daily": daily_messages,
-            "monthly": monthly_messages
+            "daily": int(daily_messages or 0),
+            "monthly": int(monthly_messages or 0),
+            "daily_tokens": int(daily_spend[0] or 0),
+            "monthly_tokens": int(monthly_spend[0] or 0),
+            "daily_cost": int(daily_spend[1] or 0) / 1_000_000,
+            "monthly_cost": int(monthly_spend[1] or 0) / 1_000_000
         }
     
-    async def increment_usage(self, user_id: str) -> None:
-        """Increment usage counters for a user"""
+    def _counter_keys(self, user_id: str, date_key: str) -> List[str]:
+        """Message counters, usage and spend hashes of a day and the month, in every key layout written"""
+        counters = []
+        for keys in write_keys(user_id):
+            counters += [
+                keys.usage_messages(date_key),
+                keys.usage_monthly,
+                keys.usage(date_key),
+                keys.usage_monthly_spend
+            ]
+        return counters
+    
+    async def _run_usage(
+        self,
+        user_id: str,
+        date_key: str,
+        units: int,
+        tokens: int,
+        cost_micros: int,
+        limits: Optional[Dict] = None,
+        fields: Optional[Dict[str, int]] = None
+    ) -> List[int]:
+        """Run the usage script: check limits (if any) and add the amounts (and fields to the day's usage hash)"""
+        limit_args = []
+        for key in QUOTA_LIMITS:
+            value = limits[key] if limits else None
+            if value is None:
+                limit_args.append("")
+            else:
+                limit_args.append(to_micros(value) if key.endswith("_cost") else value)
+        return await self.usage_script(
+            keys=self._counter_keys(user_id, date_key),
+            args=[
+                units, tokens, cost_micros, *limit_args, DAILY_USAGE_TTL, MONTHLY_USAGE_TTL,
+                *[item for field in (fields or {}).items() for item in field]
+            ]
+        )
+    
+    async def reserve_usage(
+        self,
+        user_id: str,
+        tier: Optional[SubscriptionTier] = None,
+        units: int = 1,
+        tokens: int = 0,
+        cost: float = 0.0
+    ) -> UsageReservation:
+        """
+        Check the user's limits and count units messages, tokens and cost against them, atomically.
+        
+        tokens and cost (in dollars) are the request's estimate before it is
+        sent (its input); settle_usage replaces them with what the answer
+        used. One round trip. Unlimited tiers are counted too (for usage
+        stats). A reservation for a request that then fails is given back
+        with refund_usage; with nothing to reserve the limits are only
+        checked.
+        """
+        if tier is None:
+            tier = await self.get_user_tier(user_id)
         # Use local timezone for user-friendly daily resets
         today = datetime.now().strftime("%Y-%m-%d")
+        cost_micros = to_micros(cost)
         
-        # Increment daily counter (stored with daily usage data)
-        daily_key = f"usage:{user_id}:{today}:messages"
-        await self.redis_client.incr(daily_key)
-        await self.redis_client.expire(daily_key, 86400)  # Expire after 24 hours
+        allowed, remaining, limit, exceeded = await self._run_usage(
+            user_id, today, units, tokens, cost_micros, TIER_LIMITS[tier]
+        )
+        if not allowed:
+            exceeded = QUOTA_LIMITS[int(exceeded) - 1]
+            if exceeded.endswith("_cost"):
+                remaining, limit = int(remaining) / 1_000_000, int(limit) / 1_000_000
+            return UsageReservation(False, remaining, limit, today, 0, exceeded=exceeded)
+        return UsageReservation(
+            True,
+            int(remaining),
+            None if int(limit) < 0 else int(limit),
+            today,
+            units,
+            tokens,
+            cost_micros
+        )
+    
+    async def check_usage(self, user_id: str, tier: Optional[SubscriptionTier] = None) -> UsageReservation:
+        """
+        Check the user's limits without counting anything, as a reservation that holds nothing.
+        
+        Denied where nothing remains under a limit, so a request can be turned
+        away before the work that prices it (context, routing); what it then
+        needs is reserved with reserve_usage. One round trip, none for tiers
+        without quotas.
+        """
+        if tier is None:
+            tier = await self.get_user_tier(user_id)
+        if not has_quotas(TIER_LIMITS[tier]):
+            return UsageReservation(True, -1, None, datetime.now().strftime("%Y-%m-%d"), 0)
+        return await self.reserve_usage(user_id, tier, units=0)
+    
+    async def settle_usage(
+        self,
+        user_id: str,
+        reservation: Optional[UsageReservation],
+        tokens: int,
+        cost: float,
+        fields: Optional[Dict[str, int]] = None
+    ) -> None:
+        """Count what an answered request used (tokens, cost in dollars) in place of its reservation's estimate
         
-        # Increment monthly counter
-        monthly_key = f"usage:{user_id}:monthly"
-        await self.redis_client.incr(monthly_key)
-        await self.redis_client.expire(monthly_key, 2592000)  # Expire after 30 days
+        Counted on the reservation's day, over the limits if need be: the
+        answer was already sent. fields (see usage_fields) are added to the
+        day's usage hash in the same call.
+        """
+        if not reservation or not reservation.allowed:
+            return
+        tokens -= reservation.tokens
+        cost_micros = to_micros(cost) - reservation.cost_micros
+        if tokens or cost_micros or fields:
+            await self._run_usage(user_id, reservation.date_key, 0, tokens, cost_micros, fields=fields)
+    
+    async def refund_usage(self, user_id: str, reservation: Optional[UsageReservation]) -> None:
+        """Give back what a reservation holds, after its request failed"""
+        if not reservation or not (reservation.units or reservation.tokens or reservation.cost_micros):
+            return
+        await self._run_usage(
+            user_id, reservation.date_key, -reservation.units, -reservation.tokens, -reservation.cost_micros
+        )
+    
+    async def increment_usage(
+        self,
+        user_id: str,
+        units: int = 1,
+        tokens: int = 0,
+        cost: float = 0.0,
+        fields: Optional[Dict[str, int]] = None
+    ) -> None:
+        """Increment usage counters for a user, whatever their limits"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        await self._run_usage(user_id, today, units, tokens, to_micros(cost), fields=fields)
     
     async def check_usage_limit(self, user_id: str, tier: Optional[SubscriptionTier] = None) -> Tuple[bool, int, Optional[int]]:
         """
-        Check if user has exceeded their usage limit.
+        Check if user has exceeded their usage limit, without counting a message.
         
         Returns:
             Tuple of (allowed: bool, remaining: int, limit: Optional[int])
@@ -142,56 +434,8 @@ class SubscriptionService:
             - remaining: Number of messages remaining (or -1 if unlimited)
             - limit: The applicable limit (daily or monthly, or None if unlimited)
         """
-        # Get user tier if not provided
-        if tier is None:
-            tier = await self.get_user_tier(user_id)
-        
-        # Get tier limits
-        limits = TIER_LIMITS[tier]
-        
-        # If unlimited tier, always allow
-        if limits["unlimited"]:
-            return (True, -1, None)
-        
-        # Get current usage
-        usage = await self.get_usage_count(user_id)
-        
-        # Check daily limit first (if applicable)
-        if limits["daily"] is not None:
-            daily_limit = limits["daily"]
-            daily_used = usage["daily"]
-            daily_remaining = max(0, daily_limit - daily_used)
-            
-            if daily_used >= daily_limit:
-                return (False, 0, daily_limit)
-            
-            # If daily limit is OK, check monthly
-            if limits["monthly"] is not None:
-                monthly_limit = limits["monthly"]
-                monthly_used = usage["monthly"]
-                monthly_remaining = max(0, monthly_limit - monthly_used)
-                
-                if monthly_used >= monthly_limit:
-                    return (False, 0, monthly_limit)
-                
-                # Return the most restrictive remaining count
-                return (True, min(daily_remaining, monthly_remaining), daily_limit)
-            else:
-                return (True, daily_remaining, daily_limit)
-        
-        # Check monthly limit only
-        elif limits["monthly"] is not None:
-            monthly_limit = limits["monthly"]
-            monthly_used = usage["monthly"]
-            monthly_remaining = max(0, monthly_limit - monthly_used)
-            
-            if monthly_used >= monthly_limit:
-                return (False, 0, monthly_limit)
-            
-            return (True, monthly_remaining, monthly_limit)
-        
-        # No limits defined (shouldn't happen)
-        return (True, -1, None)
+        reservation = await self.check_usage(user_id, tier)
+        return (reservation.allowed, reservation.remaining, reservation.limit)
     
     async def get_usage_summary(self, user_id: str) -> Dict:
         """Get detailed usage summary for a user"""
@@ -203,20 +447,17 @@ class SubscriptionService:
             "tier": tier.value,
             "usage": usage,
             "limits": {
-                "daily": limits["daily"],
-                "monthly": limits["monthly"],
+                **{key: limits[key] for key in QUOTA_LIMITS},
                 "unlimited": limits["unlimited"]
             },
             "remaining": {}
         }
         
         # Calculate remaining
-        if not limits["unlimited"]:
-            if limits["daily"] is not None:
-                summary["remaining"]["daily"] = max(0, limits["daily"] - usage["daily"])
-            if limits["monthly"] is not None:
-                summary["remaining"]["monthly"] = max(0, limits["monthly"] - usage["monthly"])
-        else:
+        for key in QUOTA_LIMITS:
+            if limits[key] is not None:
+                summary["remaining"][key] = max(0, limits[key] - usage[key])
+        if limits["unlimited"]:
             summary["remaining"]["unlimited"] = True
         
         return summary
@@ -226,6 +467,7 @@ class SubscriptionService:
         pattern = "usage:*:*:messages"
         count = 0
         
+        # Tokens and cost are kept per day in the hashes /usage reports from
         async for key in self.redis_client.scan_iter(match=pattern):
             await self.redis_client.delete(key)
             count += 1
@@ -235,12 +477,12 @@ class SubscriptionService:
     
     async def reset_monthly_usage(self) -> int:
         """Reset monthly usage counters for all users (for cron job)"""
-        pattern = "usage:*:monthly"
         count = 0
         
-        async for key in self.redis_client.scan_iter(match=pattern):
-            await self.redis_client.delete(key)
-            count += 1
+        for pattern in ("usage:*:monthly", "usage:*:monthly_spend"):
+            async for key in self.redis_client.scan_iter(match=pattern):
+                await self.redis_client.delete(key)
+                count += 1
         
         logger.info(f"Reset monthly usage for {count} users")
         return count
\ No newline at end of file
@@ -0,0 +1,195 @@
+from typing import List, Dict, Optional
+import logging
+import uuid
+from app.core.config import settings
+from app.core.messages import ChatMessage
+from app.core.redis_keys import read_keys
+from app.core.tokens import count_tokens
+from app.services.memory import MemoryManager
+from app.services.providers import get_provider, get_provider_name
+from app.services.router import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an AI assistant.
+
+Existing summary:
+{summary}
+
+New messages to fold into the summary:
+{messages}
+
+Write the updated summary. Keep facts, decisions, names, code identifiers and open questions the assistant will need later. Be concise and write plain prose, no preamble.
+
+Updated summary:"""
+
+# Releases a summary lock only if it is still the holder's (it may have
+# expired and been taken by another summarizer meanwhile)
+# KEYS: lock
+# ARGV: holder token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class ConversationSummarizer:
+    """Compacts older conversation turns into a rolling summary
+
+    Runs after a response has been streamed. Once the messages not yet covered
+    by the summary exceed SUMMARIZATION_TOKEN_THRESHOLD tokens, everything but
+    the most recent SUMMARIZATION_KEEP_RECENT messages is folded into the
+    stored summary using the cheapest configured model. Each run only sends the
+    previous summary plus the newly covered messages upstream.
+
+    fold_trimmed is the memory manager's trim hook: messages trimmed off a
+    conversation over its tier's cap are folded in first, if the summary
+    doesn't cover them yet.
+
+    Both take the conversation's summary lock before reading the summary
+    and the messages it folds, so two workers never fold the same window.
+    """
+
+    def __init__(self, memory_manager: MemoryManager):
+        self.memory_manager = memory_manager
+        self.lock_ttl = 120  # seconds
+
+    async def summarize_if_needed(
+        self,
+        conversation_id: str,
+        user_id: str
+    ) -> bool:
+        """Update the conversation summary if the unsummarized tail is too long"""
+        if not settings.SUMMARIZATION_ENABLED:
+            return False
+
+        # Only one summarizer per conversation at a time
+        token = await self._acquire_lock(conversation_id, user_id)
+        if not token:
+            return False
+
+        try:
+            summary = await self.memory_manager.get_summary(conversation_id, user_id)
+            covered = summary["covered"] if summary else 0
+
+            pending = await self.memory_manager.get_messages(conversation_id, user_id, start=covered)
+            pending_tokens = sum(count_tokens(msg.get("content", "")) for msg in pending)
+            if pending_tokens < settings.SUMMARIZATION_TOKEN_THRESHOLD:
+                return False
+
+            to_fold = pending[:-settings.SUMMARIZATION_KEEP_RECENT] if settings.SUMMARIZATION_KEEP_RECENT else pending
+            if not to_fold:
+                return False
+
+            content = await self._fold(summary, to_fold)
+            if not content:
+                return False
+
+            await self.memory_manager.store_summary(
+                conversation_id,
+                user_id,
+                content,
+                self._covered_after(to_fold, covered + len(to_fold))
+            )
+            logger.info(f"Summarized {len(to_fold)} messages of conversation {conversation_id}")
+            return True
+
+        finally:
+            await self._release_lock(conversation_id, user_id, token)
+
+    async def fold_trimmed(
+        self,
+        user_id: str,
+        conversation_id: str,
+        messages: List[Dict]
+    ) -> bool:
+        """Fold the oldest messages of a conversation in before they are trimmed
+
+        Returns whether they may be dropped: not while another summarizer
+        holds the conversation's lock (the next write retries). A failed
+        summary doesn't hold the trim back, so the cap holds whatever the
+        summary model does; the messages are then lost from the context.
+        """
+        if not settings.SUMMARIZATION_ENABLED:
+            return True
+
+        token = await self._acquire_lock(conversation_id, user_id)
+        if not token:
+            return False
+
+        try:
+            summary = await self.memory_manager.get_summary(conversation_id, user_id)
+            covered = summary["covered"] if summary else 0
+            to_fold = [msg for i, msg in enumerate(messages) if msg.get("seq", i) >= covered]
+            if not to_fold:
+                return True
+
+            content = await self._fold(summary, to_fold)
+            if content:
+                await self.memory_manager.store_summary(
+                    conversation_id, user_id, content, self._covered_after(messages, len(messages))
+                )
+                logger.info(f"Summarized {len(to_fold)} trimmed messages of conversation {conversation_id}")
+            else:
+                logger.warning(f"Trimming {len(to_fold)} unsummarized messages of conversation {conversation_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to summarize trimmed messages of conversation {conversation_id}: {e}")
+            return True
+        finally:
+            await self._release_lock(conversation_id, user_id, token)
+
+    async def _acquire_lock(self, conversation_id: str, user_id: str) -> Optional[str]:
+        """Take the conversation's summary lock: the holder's token, or None if it is taken"""
+        redis_client = await self.memory_manager._get_redis()
+        token = uuid.uuid4().hex
+        lock_key = read_keys(user_id).summary_lock(conversation_id)
+        if not await redis_client.set(lock_key, token, nx=True, ex=self.lock_ttl):
+            return None
+        return token
+
+    async def _release_lock(self, conversation_id: str, user_id: str, token: str):
+        redis_client = await self.memory_manager._get_redis()
+        lock_key = read_keys(user_id).summary_lock(conversation_id)
+        try:
+            await redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            # The lock expires by itself
+            logger.warning(f"Failed to release summary lock of conversation {conversation_id}: {e}")
+
+    def _covered_after(self, folded: List[Dict], default: int) -> int:
+        """The summary's "covered" seq once folded (the oldest messages) are in it"""
+        seq = folded[-1].get("seq") if folded else None
+        return seq + 1 if seq is not None else default
+
+    async def _fold(self, summary: Optional[Dict], messages: List[Dict]) -> Optional[str]:
+        """The summary with messages folded in, written by the cheapest model"""
+        model_router = ModelRouter(redis_client=await self.memory_manager._get_redis())
+        model_enum = model_router.get_cheapest_model()
+        if not model_enum:
+            logger.warning("No model available for conversation summarization")
+            return None
+        model = model_enum.value
+
+        prompt = SUMMARY_PROMPT.format(
+            summary=summary["content"] if summary else "(none yet)",
+            messages=self._format_messages(messages)
+        )
+
+        provider = get_provider(get_provider_name(model), settings)
+        response = await provider.complete(
+            messages=[ChatMessage(role="user", content=prompt)],
+            model=model,
+            temperature=0.3,
+            max_tokens=800
+        )
+        content = response.content.strip() if response.content else ""
+        return content or None
+
+    def _format_messages(self, messages: List[Dict]) -> str:
+        """Render messages as a plain transcript for the summary prompt"""
+        return "\n\n".join(
+            f"{msg.get('role', 'unknown').capitalize()}: {msg.get('content', '')}"
+            for msg in messages
+        )
@@ -0,0 +1,246 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import time
+import uuid
+import redis.asyncio as redis
+from app.core.config import settings
+from app.core.metrics import TIER_CACHE_REFRESHES, TIER_CACHE_REQUESTS, TIER_LOOKUP_DURATION
+from app.core.redis_keys import read_keys, write_keys
+from app.core.redis_pool import open_pubsub
+
+logger = logging.getLogger(__name__)
+
+TIER_INVALIDATION_CHANNEL = "tier:invalidate"
+
+class TierCache:
+    """Subscription tiers of recently active users
+
+    A lookup (get) tries, in order:
+
+      local   this worker's LRU, used only while it is subscribed to
+              invalidations (as the context cache is)
+      redis   the copy shared by all workers, in the user's tier key
+      loaded  Supabase, queried in a thread so the event loop never waits
+              on it; concurrent lookups of a user share one query
+
+    A tier is trusted for TIER_CACHE_TTL seconds after it was loaded. Once
+    older than TIER_CACHE_REFRESH_AFTER, lookups still return it and reload
+    it in the background. invalidate (called by the Stripe webhook) replaces
+    the shared copy and drops every worker's local one through pub/sub.
+
+    Tiers are cached as their SubscriptionTier values.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or settings.TIER_CACHE_MAX_ENTRIES
+        # user id -> (tier, epoch seconds it was loaded at)
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.loading: Dict[str, asyncio.Future] = {}
+        self.refreshing: Set[asyncio.Task] = set()
+        self.requests = {"local": 0, "redis": 0, "loaded": 0}
+        # Tells this worker's own invalidations apart from other workers'
+        self.origin = uuid.uuid4().hex
+        # Bumped by every invalidation: loads that straddle one aren't cached
+        self.generation = 0
+        self.subscribed = False
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+
+    async def get(self, redis_client: redis.Redis, user_id: str, load: Callable[[str], str]) -> str:
+        """The user's tier; load(user_id) queries it when no cached copy is fresh
+
+        load is blocking and runs in a thread. Its errors are raised here
+        (after the cached copies were found stale or missing).
+        """
+        started = time.perf_counter()
+        now = time.time()
+        entry = self.entries.get(user_id) if self.subscribed else None
+        if entry is not None and now - entry[1] < settings.TIER_CACHE_TTL:
+            self.entries.move_to_end(user_id)
+            result = "local"
+        else:
+            entry = await self._read_shared(redis_client, user_id, now)
+            if entry is not None:
+                self._remember(user_id, entry)
+                result = "redis"
+            else:
+                entry = await self._load(redis_client, user_id, load)
+                result = "loaded"
+
+        tier, loaded_at = entry
+        if result != "loaded" and now - loaded_at > settings.TIER_CACHE_REFRESH_AFTER:
+            self._refresh(redis_client, user_id, load)
+        self.requests[result] += 1
+        TIER_CACHE_REQUESTS.labels(result=result).inc()
+        TIER_LOOKUP_DURATION.labels(result=result).observe(time.perf_counter() - started)
+        return tier
+
+    async def _read_shared(self, redis_client: redis.Redis, user_id: str, now: float) -> Optional[Tuple[str, float]]:
+        try:
+            value = await redis_client.get(read_keys(user_id).tier)
+        except Exception as e:
+            logger.warning(f"Could not read cached tier of {user_id}: {e}")
+            return None
+        if not value:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+        tier, _, loaded_at = value.rpartition(":")
+        try:
+            loaded_at = float(loaded_at)
+        except ValueError:
+            return None
+        if not tier or now - loaded_at >= settings.TIER_CACHE_TTL:
+            return None
+        return tier, loaded_at
+
+    def _load(self, redis_client: redis.Redis, user_id: str, load: Callable[[str], str]) -> asyncio.Future:
+        """The user's tier from Supabase, one query at a time per user"""
+        future = self.loading.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(redis_client, user_id, load))
+            self.loading[user_id] = future
+            future.add_done_callback(lambda _: self.loading.pop(user_id, None))
+        # A cancelled lookup must not cancel the query others wait on
+        return asyncio.shield(future)
+
+    async def _fetch(self, redis_client: redis.Redis, user_id: str, load: Callable[[str], str]) -> Tuple[str, float]:
+        generation = self.generation
+        loaded_at = time.time()
+        tier = await asyncio.to_thread(load, user_id)
+        entry = (tier, loaded_at)
+        if generation != self.generation or settings.TIER_CACHE_TTL <= 0:
+            # Invalidated while loading: the query may predate the change
+            return entry
+        self._remember(user_id, entry)
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for keys in write_keys(user_id):
+                    pipe.set(keys.tier, f"{tier}:{loaded_at}", ex=settings.TIER_CACHE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not cache tier of {user_id}: {e}")
+        return entry
+
+    def _refresh(self, redis_client: redis.Redis, user_id: str, load: Callable[[str], str]):
+        """Reload an aging tier in the background, unless it is already loading"""
+        if user_id in self.loading:
+            return
+
+        async def refresh():
+            try:
+                await self._load(redis_client, user_id, load)
+                TIER_CACHE_REFRESHES.labels(outcome="refreshed").inc()
+            except Exception as e:
+                # The cached tier serves until it expires
+                TIER_CACHE_REFRESHES.labels(outcome="error").inc()
+                logger.warning(f"Could not refresh tier of {user_id}: {e}")
+
+        task = asyncio.create_task(refresh(), name=f"tier-refresh-{user_id}")
+        self.refreshing.add(task)
+        task.add_done_callback(self.refreshing.discard)
+
+    def _remember(self, user_id: str, entry: Tuple[str, float]):
+        if not self.subscribed:
+            return
+        self.entries[user_id] = entry
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def invalidate(self, redis_client: redis.Redis, user_id: str, tier: Optional[str] = None):
+        """Forget a user's cached tier everywhere, after it changed to tier (if known)
+
+        With tier, the shared copy is replaced rather than dropped, so the
+        next lookup needs no query.
+        """
+        self.generation += 1
+        self.entries.pop(user_id, None)
+        message = json.dumps({"origin": self.origin, "user_id": user_id})
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for keys in write_keys(user_id):
+                if tier and settings.TIER_CACHE_TTL > 0:
+                    pipe.set(keys.tier, f"{tier}:{time.time()}", ex=settings.TIER_CACHE_TTL)
+                else:
+                    pipe.delete(keys.tier)
+            pipe.publish(TIER_INVALIDATION_CHANNEL, message)
+            await pipe.execute()
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
+    def start(self, redis_client: redis.Redis):
+        """Subscribe to invalidations in the background"""
+        if self.task is None:
+            self.stopping = False
+            self.task = asyncio.create_task(self._listen(redis_client), name="tier-cache-invalidations")
+
+    async def stop(self):
+        if self.task is not None:
+            # The flag ends the loop even if a poll swallows the cancellation
+            self.stopping = True
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for task in list(self.refreshing):
+            task.cancel()
+        self.subscribed = False
+        self.clear()
+
+    async def _listen(self, redis_client: redis.Redis):
+        backoff = 0.5
+        while not self.stopping:
+            pubsub = open_pubsub(redis_client, ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(TIER_INVALIDATION_CHANNEL)
+                self.clear()
+                self.subscribed = True
+                backoff = 0.5
+                while not self.stopping:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._on_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Tier cache invalidations interrupted: {e}")
+            finally:
+                # Invalidations may be missed until subscribed again
+                self.subscribed = False
+                self.clear()
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            if not self.stopping:
+                await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _on_message(self, data):
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if message.get("origin") != self.origin:
+            self.generation += 1
+            self.entries.pop(message.get("user_id"), None)
+
+    def stats(self) -> Dict:
+        """Cache usage, for health checks"""
+        total = sum(self.requests.values())
+        cached = self.requests["local"] + self.requests["redis"]
+        return {
+            "subscribed": self.subscribed,
+            "entries": len(self.entries),
+            **self.requests,
+            "hit_rate": round(cached / total, 4) if total else None
+        }
+
+tier_cache = TierCache()
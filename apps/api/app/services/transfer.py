@@ -0,0 +1,263 @@
+from typing import AsyncIterable, AsyncIterator, Dict, List, Union
+from datetime import datetime
+import json
+from app.core.redis_keys import read_keys, write_keys
+from app.services.message_codec import decode_message
+
+class ConversationTransfer:
+    """Export and import of a user's conversations in a MemoryManager's Redis
+
+    Conversations move as NDJSON streams, so a history of any size is read
+    and written a bounded batch at a time.
+    """
+
+    def __init__(self, memory_manager):
+        self.memory_manager = memory_manager
+        # Messages read per LRANGE when exporting long conversations
+        self.export_chunk = 1000
+
+    async def export_conversations(self, user_id: str, batch_size: int = 200) -> AsyncIterator[str]:
+        """Stream every conversation of a user as NDJSON
+
+        Lines, each a JSON object with a "type":
+
+          export        first; the user id, format version and export time
+          conversation  id, updated_at (epoch seconds), listing record, raw
+                        summary hash (or null) and whether it was archived
+          message       one per stored message, after its conversation's line
+          end           last; the numbers of conversations and messages, so
+                        a truncated export can be told from a complete one
+
+        The conversation index is walked with ZSCAN, batch_size conversations
+        at a time, each batch read in one pipeline; conversations longer than
+        export_chunk messages take one more LRANGE per chunk. Archived
+        conversations follow, paged from the archive. Memory stays bounded by
+        a batch whatever the size of the history. Chunks of lines are
+        yielded, not single lines. A conversation may be listed twice if the
+        index is resized or the archiver moves it mid-export; importing skips
+        the repeat. A branch is exported whole, its shared messages first, as
+        a conversation of its own.
+        """
+        manager = self.memory_manager
+        redis_client = await manager._get_redis()
+        keys = read_keys(user_id)
+        totals = {"conversations": 0, "messages": 0}
+
+        yield self._export_line({
+            "type": "export",
+            "version": 1,
+            "user_id": user_id,
+            "exported_at": datetime.utcnow().isoformat()
+        })
+
+        cursor = None
+        while cursor != 0:
+            cursor, entries = await redis_client.zscan(keys.conversations, cursor or 0, count=batch_size)
+            if not entries:
+                continue
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for conv_id, _ in entries:
+                    pipe.execute_command(
+                        "LRANGE", keys.conversation(conv_id), 0, self.export_chunk - 1, NEVER_DECODE=True
+                    )
+                    pipe.llen(keys.conversation(conv_id))
+                    pipe.hgetall(keys.summary(conv_id))
+                    pipe.hget(keys.records, conv_id)
+                results = await pipe.execute()
+
+            lines = []
+            for i, (conv_id, score) in enumerate(entries):
+                raw_messages, length, summary, record = results[4 * i:4 * i + 4]
+                record = manager._load_record(record)
+                if not raw_messages and not record.get("parent"):
+                    # Expired or archived (exported from the archive below)
+                    continue
+                lines.append(self._export_line({
+                    "type": "conversation",
+                    "id": conv_id,
+                    "updated_at": score,
+                    "record": self._export_record(record),
+                    "summary": summary or None,
+                    "archived": False
+                }))
+                totals["conversations"] += 1
+                if record.get("parent"):
+                    first_seq = int(record.get("message_count", 0)) - length
+                    async for shared in self._shared_messages(user_id, conv_id, first_seq):
+                        lines.extend(self._export_messages(conv_id, shared))
+                        totals["messages"] += len(shared)
+                        yield "".join(lines)
+                        lines = []
+                lines.extend(self._export_messages(conv_id, raw_messages))
+                totals["messages"] += len(raw_messages)
+
+                # Long conversations: the rest, a chunk at a time
+                for start in range(self.export_chunk, length, self.export_chunk):
+                    yield "".join(lines)
+                    lines = []
+                    raw_messages = await redis_client.execute_command(
+                        "LRANGE", keys.conversation(conv_id), start, start + self.export_chunk - 1, NEVER_DECODE=True
+                    )
+                    lines.extend(self._export_messages(conv_id, raw_messages))
+                    totals["messages"] += len(raw_messages)
+            if lines:
+                yield "".join(lines)
+
+        if manager.archive:
+            lines = []
+            async for conv in manager.archive.iter_conversations(user_id, batch_size):
+                record = conv["record"]
+                lines.append(self._export_line({
+                    "type": "conversation",
+                    "id": conv["conversation_id"],
+                    "updated_at": conv["updated_at"],
+                    "record": self._export_record(record),
+                    "summary": conv["summary"],
+                    "archived": True
+                }))
+                if record.get("parent") and conv["next_seq"] - len(conv["messages"]) <= record["fork"]:
+                    async for shared in self._shared_messages(user_id, record["parent"], record["fork"]):
+                        lines.extend(self._export_messages(conv["conversation_id"], shared))
+                        totals["messages"] += len(shared)
+                lines.extend(self._export_messages(conv["conversation_id"], conv["messages"]))
+                totals["conversations"] += 1
+                totals["messages"] += len(conv["messages"])
+                if len(lines) >= self.export_chunk:
+                    yield "".join(lines)
+                    lines = []
+            if lines:
+                yield "".join(lines)
+
+        yield self._export_line({"type": "end", **totals})
+
+    def _export_line(self, item: Dict) -> str:
+        return json.dumps(item, ensure_ascii=False) + "\n"
+
+    def _export_record(self, record: Dict) -> Dict:
+        """A listing record as exported: branches are exported whole, unlinked"""
+        return {field: value for field, value in record.items() if field not in ("parent", "fork", "branches")}
+
+    async def _shared_messages(self, user_id: str, conversation_id: str, end: int) -> AsyncIterator[List[bytes]]:
+        """Raw messages of a conversation's view with seqs below end, export_chunk at a time
+
+        Started from a branch with end its first own seq, its shared messages.
+        """
+        for low in range(0, end, self.export_chunk):
+            raw_messages = await self.memory_manager._read_view(user_id, conversation_id, low, min(low + self.export_chunk, end) - 1)
+            if raw_messages:
+                yield raw_messages
+
+    def _export_messages(self, conversation_id: str, raw_messages: List[bytes]) -> List[str]:
+        return [
+            self._export_line({"type": "message", "conversation_id": conversation_id, "message": msg})
+            for msg in map(decode_message, raw_messages)
+            if msg is not None
+        ]
+
+    async def import_conversations(
+        self,
+        user_id: str,
+        lines: AsyncIterable[Union[str, bytes]],
+        batch_size: int = 200
+    ) -> Dict[str, int]:
+        """Write conversations from an export_conversations stream to a user
+
+        The user may differ from the exported one. Conversations are written
+        batch_size at a time, each batch as one pipeline of import script
+        calls. A conversation id the user already has (in Redis or archived)
+        is skipped, so an interrupted import can simply be run again.
+        Messages are renumbered from 0 in the current encoding, and the
+        summary's "covered" seq with them. Conversations
+        last updated longer ago than the memory TTL count as updated now, or
+        they would expire right away.
+
+        Raises ValueError on a malformed line; the batches before it have
+        been written.
+        """
+        manager = self.memory_manager
+        redis_client = await manager._get_redis()
+        totals = {"imported": 0, "skipped": 0, "messages": 0}
+        batch: List[Dict] = []
+        pending = 0
+        conv = None
+
+        async def flush():
+            nonlocal batch, pending
+            if not batch:
+                return
+            min_score = datetime.utcnow().timestamp() - manager.memory_ttl
+            layouts = write_keys(user_id)
+            totals["skipped"] += sum(1 for item in batch if not item["messages"])
+            batch = [item for item in batch if item["messages"]]
+            async with manager._pipeline(redis_client, transaction=len(layouts) > 1) as pipe:
+                for item in batch:
+                    messages = [{**msg, "seq": seq} for seq, msg in enumerate(item["messages"])]
+                    encoded = [manager._encode_stored(msg) for msg in messages]
+                    record = {
+                        **self._export_record(item["record"]),
+                        "message_count": len(messages),
+                        "bytes": sum(len(raw) for raw in encoded)
+                    }
+                    summary = item["summary"]
+                    if summary and "covered" in summary:
+                        covered = int(summary["covered"])
+                        summary = {**summary, "covered": sum(
+                            1 for i, seq in enumerate(item["seqs"]) if (i if seq is None else seq) < covered
+                        )}
+                    args = [
+                        item["updated_at"] if item["updated_at"] > min_score else datetime.utcnow().timestamp(),
+                        json.dumps(record),
+                        json.dumps(summary) if summary else "",
+                        len(messages)
+                    ]
+                    documents = manager._search_documents(item["id"], messages)
+                    for keys in layouts:
+                        await manager._queue_script(pipe, manager.import_script, manager._tier_keys(keys, item["id"]), [
+                            item["id"], manager.memory_ttl, *args, keys.search()["postings"], documents, *encoded
+                        ])
+                # The read layout's results tell what was written
+                written = (await pipe.execute())[::len(layouts)]
+            for item, done in zip(batch, written):
+                if done:
+                    totals["imported"] += 1
+                    totals["messages"] += len(item["messages"])
+                else:
+                    totals["skipped"] += 1
+            batch = []
+            pending = 0
+
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                kind = item["type"]
+                if kind == "conversation":
+                    conv = {
+                        "id": str(item["id"]),
+                        "updated_at": float(item.get("updated_at") or datetime.utcnow().timestamp()),
+                        "record": item.get("record") or {},
+                        "summary": item.get("summary"),
+                        "messages": [],
+                        "seqs": []
+                    }
+                    batch.append(conv)
+                elif kind == "message":
+                    if conv is None or item["conversation_id"] != conv["id"]:
+                        raise ValueError("message outside its conversation")
+                    conv["messages"].append({k: v for k, v in item["message"].items() if k != "seq"})
+                    conv["seqs"].append(item["message"].get("seq"))
+                    pending += 1
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                raise ValueError(f"Line {line_number}: {e}") from e
+
+            # Flush before the next conversation once the batch is full
+            if kind == "conversation" and (len(batch) > batch_size or pending >= 10 * self.export_chunk):
+                batch.pop()
+                await flush()
+                batch.append(conv)
+
+        await flush()
+        return totals
@@ -0,0 +1,310 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import numpy as np
+
+class BaseVectorIndex(ABC):
+    """Base class for per-user vector stores
+
+    Vectors are L2-normalized embeddings of stored messages, identified by
+    document ids "{conversation_id}:{seq}". Scores are cosine similarities.
+    """
+
+    @abstractmethod
+    async def add(self, user_id: str, doc_ids: List[str], vectors: np.ndarray):
+        """Add vectors (one row per document id) to a user's index"""
+        pass
+
+    @abstractmethod
+    async def search(
+        self,
+        user_id: str,
+        vector: np.ndarray,
+        k: int,
+        exclude_conversation_id: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """Top-k (document id, score) pairs most similar to a vector"""
+        pass
+
+    @abstractmethod
+    async def delete_conversation(self, user_id: str, conversation_id: str) -> int:
+        """Remove every vector of a conversation; returns how many were removed"""
+        pass
+
+    @abstractmethod
+    async def delete_user(self, user_id: str) -> int:
+        """Remove every vector of a user; returns how many were removed"""
+        pass
+
+    async def close(self):
+        """Release resources held by the index"""
+        pass
+
+class _UserIndex:
+    """Memory-mapped index files of one user
+
+    vectors  rows of dim int8 (or float32) components, appended only
+    scales   one float32 per row (int8 rows are value / scale)
+    ids      one JSON document id per line, aligned with rows
+    deleted  int32 row numbers that were removed
+    """
+
+    def __init__(self, path: str, dim: int, dtype: str):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.int8 if dtype == "int8" else np.float32
+        self.signature = None
+        self.vectors: Optional[np.ndarray] = None
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.doc_ids: List[str] = []
+        self.conversation_ids: List[str] = []
+        self.deleted = np.zeros(0, dtype=bool)
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _signature(self):
+        """Changes whenever any process appended to or rewrote the files"""
+        signature = []
+        for name in ("vectors", "ids", "deleted"):
+            try:
+                stat = os.stat(self.file(name))
+                signature.append((stat.st_ino, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self):
+        """(Re)map the files if they changed since they were last loaded"""
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        self.signature = signature
+
+        try:
+            with open(self.file("ids")) as f:
+                doc_ids = [json.loads(line) for line in f if line.endswith("\n")]
+        except FileNotFoundError:
+            doc_ids = []
+
+        row_size = self.dim * np.dtype(self.dtype).itemsize
+        rows = 0
+        if os.path.exists(self.file("vectors")):
+            rows = os.path.getsize(self.file("vectors")) // row_size
+        # A writer appends vectors before ids, so only rows with an id are complete
+        rows = min(rows, len(doc_ids))
+
+        self.vectors = np.memmap(self.file("vectors"), dtype=self.dtype, mode="r", shape=(rows, self.dim)) if rows else None
+        self.scales = np.fromfile(self.file("scales"), dtype=np.float32, count=rows) if rows else np.zeros(0, dtype=np.float32)
+        self.doc_ids = doc_ids[:rows]
+        self.conversation_ids = [doc_id.rsplit(":", 1)[0] for doc_id in self.doc_ids]
+
+        self.deleted = np.zeros(rows, dtype=bool)
+        if os.path.exists(self.file("deleted")):
+            removed = np.fromfile(self.file("deleted"), dtype=np.int32)
+            self.deleted[removed[removed < rows]] = True
+
+    def lock(self, shared: bool = False):
+        """Lock across worker processes: exclusive for writes, shared for loading"""
+        os.makedirs(self.path, exist_ok=True)
+        handle = open(self.file("lock"), "w")
+        fcntl.flock(handle, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        return handle
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows as stored, plus the scale of each row"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dtype == np.float32:
+            return vectors, np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def append(self, doc_ids: List[str], vectors: np.ndarray):
+        rows, scales = self.encode(vectors)
+        handle = self.lock()
+        try:
+            with open(self.file("vectors"), "ab") as f:
+                f.write(rows.tobytes())
+            with open(self.file("scales"), "ab") as f:
+                f.write(scales.tobytes())
+            with open(self.file("ids"), "a") as f:
+                f.write("".join(json.dumps(doc_id) + "\n" for doc_id in doc_ids))
+        finally:
+            handle.close()
+
+    def remove_conversation(self, conversation_id: str) -> int:
+        handle = self.lock()
+        try:
+            self.refresh()
+            rows = [
+                row for row, conv_id in enumerate(self.conversation_ids)
+                if conv_id == conversation_id and not self.deleted[row]
+            ]
+            if rows:
+                with open(self.file("deleted"), "ab") as f:
+                    f.write(np.asarray(rows, dtype=np.int32).tobytes())
+                self.deleted[rows] = True
+                if self.deleted.sum() * 2 > len(self.deleted):
+                    self._rewrite()
+            return len(rows)
+        finally:
+            handle.close()
+
+    def remove_all(self) -> int:
+        handle = self.lock()
+        try:
+            self.refresh()
+            removed = int((~self.deleted).sum())
+            for name in ("vectors", "scales", "ids", "deleted"):
+                try:
+                    os.remove(self.file(name))
+                except FileNotFoundError:
+                    pass
+            self.signature = None
+            self.refresh()
+            return removed
+        finally:
+            handle.close()
+
+    def _rewrite(self):
+        """Drop removed rows once they make up most of the files (lock held)"""
+        keep = ~self.deleted
+        rows = np.asarray(self.vectors[keep]) if self.vectors is not None else np.zeros((0, self.dim), dtype=self.dtype)
+        scales = self.scales[keep]
+        doc_ids = [doc_id for doc_id, kept in zip(self.doc_ids, keep) if kept]
+
+        for name, data in (("vectors", rows.tobytes()), ("scales", scales.tobytes())):
+            with open(self.file(name + ".tmp"), "wb") as f:
+                f.write(data)
+        with open(self.file("ids.tmp"), "w") as f:
+            f.write("".join(json.dumps(doc_id) + "\n" for doc_id in doc_ids))
+
+        os.replace(self.file("vectors.tmp"), self.file("vectors"))
+        os.replace(self.file("scales.tmp"), self.file("scales"))
+        os.replace(self.file("ids.tmp"), self.file("ids"))
+        if os.path.exists(self.file("deleted")):
+            os.remove(self.file("deleted"))
+        self.signature = None
+        self.refresh()
+
+    def search(
+        self,
+        vector: np.ndarray,
+        k: int,
+        exclude_conversation_id: Optional[str],
+        block_rows: int
+    ) -> List[Tuple[str, float]]:
+        """Exact top-k by brute force, scanning the mapped rows in blocks"""
+        if self._signature() != self.signature:
+            # Don't load halfway through another process rewriting the files
+            handle = self.lock(shared=True)
+            try:
+                self.refresh()
+            finally:
+                handle.close()
+        if self.vectors is None or not len(self.doc_ids):
+            return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        scores = np.empty(len(self.doc_ids), dtype=np.float32)
+        for start in range(0, len(scores), block_rows):
+            block = np.asarray(self.vectors[start:start + block_rows], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        scores *= self.scales
+
+        scores[self.deleted] = -np.inf
+        if exclude_conversation_id:
+            excluded = [row for row, conv_id in enumerate(self.conversation_ids) if conv_id == exclude_conversation_id]
+            scores[excluded] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+class LocalVectorIndex(BaseVectorIndex):
+    """Per-user vector files on local disk, searched by brute force on CPU
+
+    Each user's vectors live in their own memory-mapped files, so only the
+    pages of users actually searched are held in memory. int8 storage (one
+    scale per row) takes a quarter of float32 at a negligible loss of
+    ranking accuracy. Exact search over a few tens of thousands of rows takes
+    milliseconds; a remote or approximate backend can implement
+    BaseVectorIndex for larger corpora.
+    """
+
+    def __init__(self, directory: str, dim: int, dtype: str = "int8", block_rows: int = 16384):
+        self.directory = directory
+        self.dim = dim
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self.users: Dict[str, _UserIndex] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self._check_layout()
+
+    def _check_layout(self):
+        """Refuse to open an index directory built with another layout"""
+        layout = {"dim": self.dim, "dtype": self.dtype}
+        layout_file = os.path.join(self.directory, "index.json")
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(layout_file) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            stored = None
+        if stored is not None and stored != layout:
+            raise ValueError(
+                f"Vector index at {self.directory} was built with {stored}, not {layout}; "
+                "point VECTOR_INDEX_DIR to a new directory"
+            )
+        if stored is None:
+            with open(layout_file, "w") as f:
+                json.dump(layout, f)
+
+    def _user(self, user_id: str) -> _UserIndex:
+        if user_id not in self.users:
+            # Hashed so any user id is a safe directory name
+            name = hashlib.sha256(user_id.encode()).hexdigest()[:32]
+            self.users[user_id] = _UserIndex(os.path.join(self.directory, name), self.dim, self.dtype)
+            self.locks[user_id] = asyncio.Lock()
+        return self.users[user_id]
+
+    async def add(self, user_id: str, doc_ids: List[str], vectors: np.ndarray):
+        if not doc_ids:
+            return
+        index = self._user(user_id)
+        async with self.locks[user_id]:
+            await asyncio.to_thread(index.append, doc_ids, vectors)
+
+    async def search(
+        self,
+        user_id: str,
+        vector: np.ndarray,
+        k: int,
+        exclude_conversation_id: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        index = self._user(user_id)
+        async with self.locks[user_id]:
+            return await asyncio.to_thread(index.search, vector, k, exclude_conversation_id, self.block_rows)
+
+    async def delete_conversation(self, user_id: str, conversation_id: str) -> int:
+        index = self._user(user_id)
+        async with self.locks[user_id]:
+            return await asyncio.to_thread(index.remove_conversation, conversation_id)
+
+    async def delete_user(self, user_id: str) -> int:
+        index = self._user(user_id)
+        async with self.locks[user_id]:
+            return await asyncio.to_thread(index.remove_all)
+
+def get_vector_index(settings, dim: int) -> BaseVectorIndex:
+    """Factory function to get the configured vector index backend"""
+    backend = settings.VECTOR_INDEX_BACKEND.lower()
+    if backend == "local":
+        return LocalVectorIndex(settings.VECTOR_INDEX_DIR, dim, settings.VECTOR_INDEX_DTYPE)
+    raise ValueError(f"Unknown vector index backend: {backend}")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark the per-turn cost of turning stored context into a provider
+payload, on 50-message contexts: the previous path (decoded dicts, copied
+out of the context cache, validated into pydantic models, transformed back
+into dicts) against ChatMessage (decoded straight into slots, shared with
+the context cache, payloads built once per message).
+Run this with: python bench_chat_messages.py [messages] [turns]
+
+Needs no Redis: stored frames are encoded in memory. "cold" turns decode
+the context from its frames (a context cache miss), "warm" turns reuse
+the decoded context (a hit).
+"""
+
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pydantic import BaseModel
+from app.core.messages import ChatMessage
+from app.services.message_codec import decode_chat_message, decode_message, encode_message
+
+WORDS = (
+    "the a to of and in is it for on with as this that you can use your when "
+    "python redis pipeline database migration kubernetes deploy docker async await "
+    "function class generator iterator query index cache latency throughput memory"
+).split()
+
+class LegacyChatMessage(BaseModel):
+    """The pydantic message model chat.py used before ChatMessage"""
+    role: str
+    content: str
+
+def stored_frames(count):
+    rng = random.Random(42)
+    timestamp = datetime.utcnow().isoformat()
+    frames = []
+    for seq in range(count):
+        role = "user" if seq % 2 == 0 else "assistant"
+        words = rng.randint(20, 40) if role == "user" else rng.randint(150, 400)
+        frames.append(encode_message({
+            "role": role,
+            "content": " ".join(rng.choice(WORDS) for _ in range(words)),
+            "id": uuid.uuid4().hex,
+            "timestamp": timestamp,
+            "model": "deepseek-chat" if role == "assistant" else None
+        }, seq))
+    return frames
+
+def legacy_turn(frames, cached):
+    if cached is None:
+        cached = [msg for msg in map(decode_message, frames) if msg is not None]
+    # get_context copied cached dicts; chat.py validated them into models;
+    # providers built their payload dicts from the models
+    context = [dict(msg) for msg in cached]
+    messages = [LegacyChatMessage(**msg) for msg in context]
+    return [{"role": msg.role, "content": msg.content} for msg in messages]
+
+def compact_turn(frames, cached):
+    if cached is None:
+        cached = [msg for msg in map(decode_chat_message, frames) if msg is not None]
+    messages = list(cached)
+    return [msg.payload() for msg in messages]
+
+def time_turns(turn, frames, cached, turns):
+    samples = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        turn(frames, cached)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+def allocations(turn, frames, cached):
+    """Blocks and bytes allocated by one turn and still held by its result"""
+    turn(frames, cached)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = turn(frames, cached)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    del result
+    return sum(s.count_diff for s in stats), sum(s.size_diff for s in stats)
+
+def report(name, samples, blocks, size):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:>14}: mean {statistics.mean(samples):8.1f} µs | p50 {statistics.median(samples):8.1f} µs | "
+          f"p95 {p95:8.1f} µs | {blocks:5d} blocks, {size / 1024:7.1f} KB held")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    print("🚀 Chat message benchmark")
+    print("=" * 50)
+    frames = stored_frames(count)
+    print(f"{count}-message context, {sum(map(len, frames)) / 1024:.1f} KB stored, {turns} turns")
+
+    results = {}
+    for state in ("cold", "warm"):
+        print(f"\n📊 Per-turn context → payload ({state})")
+        for name, turn, decode in [
+            ("dict+pydantic", legacy_turn, decode_message),
+            ("ChatMessage", compact_turn, decode_chat_message)
+        ]:
+            cached = None if state == "cold" else [msg for msg in map(decode, frames) if msg is not None]
+            samples = time_turns(turn, frames, cached, turns)
+            blocks, size = allocations(turn, frames, cached)
+            results[(state, name)] = statistics.mean(samples)
+            report(name, samples, blocks, size)
+        saved = 1 - results[(state, "ChatMessage")] / results[(state, "dict+pydantic")]
+        print(f"{'':>14}  ChatMessage saves {saved:.0%} of the CPU per turn")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-message overhead of the SSE /completions path against the
+/chat/ws WebSocket path.
+Run this after starting the API server with: python bench_chat_transport.py [messages]
+
+For every message it measures the time until the server has finished its
+pre-flight work (subscription check, context fetch, routing, provider setup):
+the response headers for SSE, the "start" frame for WebSocket. Generations
+are aborted right after that point so upstream LLM latency is excluded.
+"""
+
+import asyncio
+import aiohttp
+import statistics
+import sys
+import time
+import uuid
+
+# Benchmark configuration
+API_BASE_URL = "http://localhost:8001/api/v1"
+WS_URL = "ws://localhost:8001/api/v1/chat/ws"
+USER_ID = "test_user_pro"  # ends with _pro, so no usage limits
+MODEL = "deepseek"
+
+def report(name, samples):
+    """Print latency statistics in milliseconds"""
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{name:>10}: mean {statistics.mean(samples):7.2f} ms | "
+          f"p50 {statistics.median(samples):7.2f} ms | p95 {p95:7.2f} ms | n={len(samples)}")
+
+async def bench_sse(session, conversation_id, count):
+    """Time to response headers for each POST /completions"""
+    samples = []
+    for i in range(count):
+        payload = {
+            "messages": [{"role": "user", "content": f"Benchmark message {i}"}],
+            "model": MODEL,
+            "stream": True,
+            "conversation_id": conversation_id,
+            "user_id": USER_ID
+        }
+        start = time.perf_counter()
+        async with session.post(f"{API_BASE_URL}/completions", json=payload) as response:
+            samples.append((time.perf_counter() - start) * 1000)
+            if response.status != 200:
+                print(f"❌ SSE request failed with status {response.status}")
+                return samples
+            # Leaving the context manager aborts the stream
+    return samples
+
+async def bench_ws(session, conversation_id, count):
+    """Time to the "start" frame for each message on one WebSocket"""
+    samples = []
+    async with session.ws_connect(WS_URL) as ws:
+        await ws.send_json({"type": "auth", "user_id": USER_ID})
+        ready = await ws.receive_json()
+        if ready.get("type") != "ready":
+            print(f"❌ WebSocket auth failed: {ready}")
+            return samples
+
+        for i in range(count):
+            message_id = str(uuid.uuid4())
+            start = time.perf_counter()
+            await ws.send_json({
+                "type": "message",
+                "id": message_id,
+                "conversation_id": conversation_id,
+                "model": MODEL,
+                "messages": [{"role": "user", "content": f"Benchmark message {i}"}]
+            })
+            while True:
+                frame = await ws.receive_json()
+                if frame.get("id") != message_id:
+                    continue
+                if frame["type"] == "start":
+                    samples.append((time.perf_counter() - start) * 1000)
+                    await ws.send_json({"type": "cancel", "id": message_id})
+                if frame["type"] in ("cancelled", "done", "error"):
+                    break
+    return samples
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print("🚀 Chat transport benchmark")
+    print("=" * 50)
+
+    async with aiohttp.ClientSession() as session:
+        # Warm up connections and caches on both paths
+        await bench_sse(session, f"bench_{uuid.uuid4()}", 3)
+        await bench_ws(session, f"bench_{uuid.uuid4()}", 3)
+
+        sse_samples = await bench_sse(session, f"bench_{uuid.uuid4()}", count)
+        ws_samples = await bench_ws(session, f"bench_{uuid.uuid4()}", count)
+
+    print("\n📊 Per-message pre-flight latency")
+    if sse_samples:
+        report("SSE", sse_samples)
+    if ws_samples:
+        report("WebSocket", ws_samples)
+    if sse_samples and ws_samples:
+        saved = statistics.mean(sse_samples) - statistics.mean(ws_samples)
+        print(f"\n✅ WebSocket saves {saved:.2f} ms per message on average")
+
+if __name__ == "__main__":
+    asyncio.run(main())
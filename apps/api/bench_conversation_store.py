@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark the conversation store backends on the chat API's hot path:
+concurrent exchange writes, context reads, listings and searches, against
+MemoryManager (Redis) and SQLiteConversationStore.
+Run this against a local Redis with: python bench_conversation_store.py [conversations] [turns] [concurrency]
+
+The synthetic user's Redis keys and the temporary SQLite file are removed afterwards.
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from app.services.memory import MemoryManager
+from app.services.sqlite_store import SQLiteConversationStore
+
+BENCH_USER = f"bench_store_{uuid.uuid4().hex[:8]}"
+QUERIES = ["redis pipeline", "python", "deploy kubernetes", "gener", "latency"]
+VOCABULARY = (
+    "python redis pipeline database migration kubernetes deploy docker async await "
+    "function class generator iterator query index cache latency throughput memory "
+    "the a to of and in is it for on with as this that be are"
+).split()
+
+def report(name, samples):
+    """Print latency statistics in milliseconds"""
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{name:>10}: mean {statistics.mean(samples):8.3f} ms | "
+          f"p50 {statistics.median(samples):8.3f} ms | p95 {p95:8.3f} ms | n={len(samples)}")
+
+def exchange(rng):
+    return [
+        {"role": role, "content": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(8, 60)))}
+        for role in ("user", "assistant")
+    ]
+
+async def timed(samples, call):
+    start = time.perf_counter()
+    await call
+    samples.append((time.perf_counter() - start) * 1000)
+
+async def bench(store, conversations, turns, concurrency):
+    rng = random.Random(42)
+    gate = asyncio.Semaphore(concurrency)
+    writes = []
+
+    async def write_conversation(conv_id):
+        for _ in range(turns):
+            async with gate:
+                await timed(writes, store.store_conversation(conv_id, BENCH_USER, exchange(rng), "deepseek"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[write_conversation(f"conv_{i}") for i in range(conversations)])
+    elapsed = time.perf_counter() - started
+    print(f"Stored {conversations * turns} exchanges in {elapsed:.2f} s "
+          f"({conversations * turns / elapsed:.0f} exchanges/s at concurrency {concurrency})")
+    report("store", writes)
+
+    reads = []
+    await asyncio.gather(*[
+        timed(reads, store.get_context(f"conv_{i % conversations}", BENCH_USER)) for i in range(200)
+    ])
+    report("context", reads)
+
+    listings = []
+    for _ in range(50):
+        await timed(listings, store.get_user_conversations(BENCH_USER))
+    report("list", listings)
+
+    searches = []
+    for i in range(50):
+        await timed(searches, store.search_memories(BENCH_USER, QUERIES[i % len(QUERIES)]))
+    report("search", searches)
+
+async def main():
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+    print("🚀 Conversation store benchmark")
+
+    print("=" * 50)
+    print("Backend: redis")
+    store = MemoryManager()
+    redis_client = await store._get_redis()
+    try:
+        await bench(store, conversations, turns, concurrency)
+    finally:
+        keys = [key async for key in redis_client.scan_iter(match=f"*{BENCH_USER}*")]
+        for i in range(0, len(keys), 500):
+            await redis_client.delete(*keys[i:i + 500])
+
+    print("=" * 50)
+    print("Backend: sqlite")
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteConversationStore(os.path.join(directory, "memory.db"))
+        try:
+            await bench(store, conversations, turns, concurrency)
+        finally:
+            await store.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
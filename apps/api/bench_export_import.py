@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput and memory of streaming a user's whole history out as
+NDJSON and bulk-importing it back.
+Run this against a local Redis with: python bench_export_import.py [conversations] [messages_per_conversation]
+
+A synthetic user with 10,000 conversations (by default) is exported to a
+temporary file, which is then imported into a second user; peak Python
+memory of each phase is traced to show that it doesn't grow with the
+history. Both users' keys are removed afterwards.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from app.services.memory import MemoryManager
+
+BENCH_RUN = uuid.uuid4().hex[:8]
+SOURCE_USER = f"bench_export_{BENCH_RUN}"
+TARGET_USER = f"bench_import_{BENCH_RUN}"
+WORDS = (
+    "python redis pipeline database migration kubernetes deploy docker async await "
+    "function class generator iterator query index cache latency throughput memory "
+    "postgres schema table column transaction lock thread process socket http api"
+).split()
+
+def text(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+async def populate(memory_manager, conversations, per_conversation, concurrency=100):
+    """Store the synthetic history, one append per conversation"""
+    rng = random.Random(42)
+
+    async def store(c):
+        messages = [
+            {"role": "user" if m % 2 == 0 else "assistant", "content": text(rng, 10, 120)}
+            for m in range(per_conversation)
+        ]
+        await memory_manager.store_conversation(f"conv_{c}", SOURCE_USER, messages, "deepseek")
+
+    for start in range(0, conversations, concurrency):
+        await asyncio.gather(*(store(c) for c in range(start, min(start + concurrency, conversations))))
+
+async def export_to(memory_manager, path):
+    size = 0
+    with open(path, "w", encoding="utf-8") as out:
+        async for chunk in memory_manager.export_conversations(SOURCE_USER):
+            out.write(chunk)
+            size += len(chunk.encode())
+    return size
+
+async def file_lines(path):
+    with open(path, encoding="utf-8") as source:
+        for line in source:
+            yield line
+
+async def traced(coro):
+    """Result, seconds and peak traced memory of a coroutine"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = await coro
+        return result, time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+async def cleanup(redis_client):
+    for user_id in (SOURCE_USER, TARGET_USER):
+        keys = [key async for key in redis_client.scan_iter(match=f"*{user_id}*", count=1000)]
+        for i in range(0, len(keys), 1000):
+            await redis_client.delete(*keys[i:i + 1000])
+
+async def main(memory_manager=None):
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    per_conversation = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    memory_manager = memory_manager or MemoryManager()
+    redis_client = await memory_manager._get_redis()
+    fd, path = tempfile.mkstemp(suffix=".ndjson")
+    os.close(fd)
+
+    print("🚀 Conversation export/import benchmark")
+    print("=" * 50)
+    print(f"📝 {conversations} conversations of {per_conversation} messages\n")
+
+    try:
+        start = time.perf_counter()
+        await populate(memory_manager, conversations, per_conversation)
+        print(f"Populated in {time.perf_counter() - start:.1f}s\n")
+
+        size, export_time, export_peak = await traced(export_to(memory_manager, path))
+        totals, import_time, import_peak = await traced(
+            memory_manager.import_conversations(TARGET_USER, file_lines(path))
+        )
+
+        # The closing "end" line carries the exported totals
+        with open(path, "rb") as source:
+            source.seek(max(0, size - 1024))
+            end = json.loads(source.read().splitlines()[-1])
+        messages = conversations * per_conversation
+
+        print(f"{'Phase':>8} | {'time':>7} | {'conv/s':>8} | {'msg/s':>9} | {'MB/s':>6} | peak memory")
+        for name, elapsed, peak in (("export", export_time, export_peak), ("import", import_time, import_peak)):
+            print(f"{name:>8} | {elapsed:6.2f}s | {conversations / elapsed:8.0f} | {messages / elapsed:9.0f} | "
+                  f"{size / 1e6 / elapsed:6.1f} | {peak / 1e6:.1f} MB")
+        print(f"\nExport: {size / 1e6:.1f} MB, {end['conversations']} conversations, {end['messages']} messages")
+        print(f"Import: {totals}")
+
+        ok = (end["conversations"] == conversations and end["messages"] == messages
+              and totals["imported"] == conversations and totals["messages"] == messages)
+        print("\n" + ("✅ Every conversation made the round trip" if ok else "❌ Counts don't match"))
+        return ok
+    finally:
+        os.remove(path)
+        await cleanup(redis_client)
+
+if __name__ == "__main__":
+    raise SystemExit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Report the memory taken by stored messages in each encoding: the legacy JSON
+objects, msgpack frames, and msgpack frames with zstd-compressed contents.
+Run this against a local Redis with: python bench_message_encoding.py [conversations] [messages_per_conversation]
+
+The same synthetic history (short prompts, long markdown answers with code)
+is stored once per encoding under its own user, measured with MEMORY USAGE,
+read back through get_context, and removed afterwards.
+"""
+
+import asyncio
+import random
+import statistics
+import sys
+import time
+import uuid
+from app.core.config import settings
+from app.services.memory import MemoryManager
+from app.services.message_codec import compression_available
+
+BENCH_RUN = uuid.uuid4().hex[:8]
+WORDS = (
+    "the a to of and in is it for on with as this that you can use your when "
+    "python redis pipeline database migration kubernetes deploy docker async await "
+    "function class generator iterator query index cache latency throughput memory "
+    "postgres schema table column transaction lock thread process socket http api "
+    "token model prompt stream websocket frontend react component state hook test"
+).split()
+CODE = [
+    "async def fetch(client, key):\n    value = await client.get(key)\n    return json.loads(value) if value else None\n",
+    "for item in items:\n    if item.ready:\n        results.append(transform(item))\n",
+    "SELECT id, name FROM users WHERE created_at > NOW() - INTERVAL '7 days' ORDER BY id;\n",
+    "const [state, setState] = useState(null);\nuseEffect(() => { load().then(setState); }, []);\n",
+]
+
+def sentence(rng, low, high):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(low, high))]
+    return " ".join(words).capitalize() + "."
+
+def prompt(rng):
+    return " ".join(sentence(rng, 6, 25) for _ in range(rng.randint(1, 3)))
+
+def answer(rng):
+    parts = []
+    for _ in range(rng.randint(2, 8)):
+        draw = rng.random()
+        if draw < 0.25:
+            parts.append("```python\n" + "".join(rng.sample(CODE, rng.randint(1, 3))) + "```")
+        elif draw < 0.45:
+            parts.append("\n".join(f"- {sentence(rng, 4, 12)}" for _ in range(rng.randint(2, 5))))
+        else:
+            parts.append(" ".join(sentence(rng, 8, 30) for _ in range(rng.randint(1, 4))))
+    return "\n\n".join(parts)
+
+async def populate(memory_manager, user_id, conversations, per_conversation):
+    """Store the synthetic history in exchanges, as the chat endpoint would"""
+    rng = random.Random(42)
+    for c in range(conversations):
+        for _ in range(per_conversation // 2):
+            exchange = [{"role": "user", "content": prompt(rng)}, {"role": "assistant", "content": answer(rng)}]
+            await memory_manager.store_conversation(f"conv_{c}", user_id, exchange, "deepseek")
+
+async def measure(redis_client, user_id, conversations):
+    """Payload bytes and Redis memory of the user's message lists"""
+    keys = [f"conv:{user_id}:conv_{c}" for c in range(conversations)]
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.execute_command("LRANGE", key, 0, -1, NEVER_DECODE=True)
+        lists = await pipe.execute()
+    payload = sum(len(item) for items in lists for item in items)
+
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key, samples=0)
+            usage = sum(await pipe.execute())
+    except Exception:
+        usage = None  # MEMORY USAGE is unavailable (e.g. a managed Redis)
+    return payload, usage
+
+async def read_latency(memory_manager, user_id, conversations, rounds=200):
+    rng = random.Random(7)
+    samples = []
+    for _ in range(rounds):
+        conv_id = f"conv_{rng.randrange(conversations)}"
+        start = time.perf_counter()
+        await memory_manager.get_context(conv_id, user_id, max_messages=20)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+async def cleanup(redis_client, user_id):
+    keys = [key async for key in redis_client.scan_iter(match=f"*{user_id}*", count=1000)]
+    for i in range(0, len(keys), 1000):
+        await redis_client.delete(*keys[i:i + 1000])
+
+async def main(memory_manager=None):
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    per_conversation = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    memory_manager = memory_manager or MemoryManager()
+    redis_client = await memory_manager._get_redis()
+
+    encodings = [("JSON (legacy)", "json", 0), ("msgpack", "msgpack", 0)]
+    if compression_available():
+        encodings.append(("msgpack + zstd", "msgpack", 1024))
+    else:
+        print("⚠️  zstandard is not installed; skipping compressed contents")
+
+    print("🚀 Stored message encoding benchmark")
+    print("=" * 50)
+    print(f"📝 {conversations} conversations of {per_conversation} messages per encoding\n")
+
+    saved = (settings.MESSAGE_ENCODING, settings.MESSAGE_COMPRESSION_MIN_BYTES)
+    results = []
+    try:
+        for name, encoding, min_bytes in encodings:
+            settings.MESSAGE_ENCODING, settings.MESSAGE_COMPRESSION_MIN_BYTES = encoding, min_bytes
+            user_id = f"bench_encoding_{BENCH_RUN}_{encoding}_{min_bytes}"
+            try:
+                await populate(memory_manager, user_id, conversations, per_conversation)
+                payload, usage = await measure(redis_client, user_id, conversations)
+                latency = await read_latency(memory_manager, user_id, conversations)
+            finally:
+                await cleanup(redis_client, user_id)
+            results.append((name, payload, usage, latency))
+    finally:
+        settings.MESSAGE_ENCODING, settings.MESSAGE_COMPRESSION_MIN_BYTES = saved
+
+    messages = conversations * (per_conversation // 2) * 2
+    _, base_payload, base_usage, _ = results[0]
+    print(f"{'Encoding':>16} | {'payload':>10} | {'per msg':>8} | {'MEMORY USAGE':>12} | {'vs JSON':>7} | get_context p50")
+    for name, payload, usage, latency in results:
+        usage_text = f"{usage / 1e6:9.2f} MB" if usage is not None else "n/a".rjust(12)
+        ratio = (usage / base_usage) if usage is not None and base_usage else payload / base_payload
+        print(f"{name:>16} | {payload / 1e6:7.2f} MB | {payload / messages:6.0f} B | {usage_text} | "
+              f"{ratio:6.0%} | {latency:.2f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
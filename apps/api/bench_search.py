@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Benchmark conversation search on a large synthetic history: the inverted
+index (BM25) against the previous full scan of every message, and the
+postings budget (SEARCH_MAX_POSTINGS) against scoring every posting.
+Run this against a local Redis with: python bench_search.py [conversations] [messages_per_conversation]
+
+The synthetic user is removed afterwards.
+"""
+
+import asyncio
+import random
+import statistics
+import sys
+import time
+import uuid
+from app.core.config import settings
+from app.services.memory import MemoryManager
+from app.services.message_codec import decode_message
+
+BENCH_USER = f"bench_search_{uuid.uuid4().hex[:8]}"
+QUERIES = ["redis pipeline", "python", "deploy kubernetes", "gener", "word42", "zyxwv"]
+VOCABULARY = (
+    "python redis pipeline database migration kubernetes deploy docker async await "
+    "function class generator iterator query index cache latency throughput memory "
+    "postgres schema table column transaction lock thread process socket http api "
+    "token model prompt stream websocket frontend react component state hook test"
+).split()
+FILLER = "the a to of and in is it for on with as this that be are".split()
+# Long tail of rarer words with a Zipf-like distribution
+TAIL = [f"word{i}" for i in range(5000)]
+TAIL_WEIGHTS = [1 / (i + 1) for i in range(5000)]
+
+def report(name, samples):
+    """Print latency statistics in milliseconds"""
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{name:>12}: mean {statistics.mean(samples):8.2f} ms | "
+          f"p50 {statistics.median(samples):8.2f} ms | p95 {p95:8.2f} ms | n={len(samples)}")
+
+def synthetic_word(rng):
+    draw = rng.random()
+    if draw < 0.2:
+        return rng.choice(VOCABULARY)
+    if draw < 0.6:
+        return rng.choice(FILLER)
+    return rng.choices(TAIL, TAIL_WEIGHTS)[0]
+
+def synthetic_message(rng, role):
+    words = [synthetic_word(rng) for _ in range(rng.randint(8, 60))]
+    return {"role": role, "content": " ".join(words)}
+
+async def populate(memory_manager, conversations, per_conversation):
+    """Store the synthetic history in exchanges, as the chat endpoint would"""
+    rng = random.Random(42)
+    started = time.perf_counter()
+
+    async def write_conversation(conv_id):
+        # Exchanges of one conversation are stored in order
+        for _ in range(per_conversation // 2):
+            exchange = [synthetic_message(rng, "user"), synthetic_message(rng, "assistant")]
+            await memory_manager.store_conversation(conv_id, BENCH_USER, exchange, "deepseek")
+
+    for batch_start in range(0, conversations, 50):
+        await asyncio.gather(*[
+            write_conversation(f"conv_{c}")
+            for c in range(batch_start, min(batch_start + 50, conversations))
+        ])
+    return time.perf_counter() - started
+
+async def full_scan_search(redis_client, query, limit=10):
+    """The previous search: fetch and scan every message of every conversation"""
+    conv_ids = await redis_client.zrange(f"user_convs:{BENCH_USER}", 0, -1)
+    results = []
+    for conv_id in conv_ids:
+        raw_messages = await redis_client.execute_command(
+            "LRANGE", f"conv:{BENCH_USER}:{conv_id}", 0, -1, NEVER_DECODE=True
+        )
+        for msg in filter(None, map(decode_message, raw_messages)):
+            if query.lower() in msg.get("content", "").lower():
+                results.append({"conversation_id": conv_id, "message": msg, "score": 1.0})
+                if len(results) >= limit:
+                    return results
+    return results
+
+async def timed_search(memory_manager, query, max_postings):
+    """Latency in milliseconds and ids of the first page with a postings budget"""
+    settings.SEARCH_MAX_POSTINGS = max_postings
+    start = time.perf_counter()
+    found = await memory_manager.search(BENCH_USER, query, limit=10)
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, [(hit["conversation_id"], hit["message"]["seq"]) for hit in found["results"]]
+
+async def cleanup(redis_client):
+    keys = [key async for key in redis_client.scan_iter(match=f"*{BENCH_USER}*", count=1000)]
+    for i in range(0, len(keys), 1000):
+        await redis_client.delete(*keys[i:i + 1000])
+
+async def main(memory_manager=None):
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_conversation = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rounds = 5
+
+    memory_manager = memory_manager or MemoryManager()
+    redis_client = await memory_manager._get_redis()
+
+    print("🚀 Conversation search benchmark")
+    print("=" * 50)
+
+    try:
+        elapsed = await populate(memory_manager, conversations, per_conversation)
+        total = conversations * (per_conversation // 2) * 2
+        print(f"📝 Stored and indexed {total} messages in {conversations} conversations "
+              f"in {elapsed:.1f}s ({total / elapsed:.0f} messages/s)")
+
+        index_samples, scan_samples = [], []
+        for query in QUERIES:
+            found = await memory_manager.search(BENCH_USER, query, limit=10)
+            print(f"\n🔎 \"{query}\": {found['total']} matches")
+            for hit in found["results"][:3]:
+                print(f"   {hit['score']:7.3f}  {hit['conversation_id']}: {hit['message']['content'][:60]}")
+
+            for _ in range(rounds):
+                start = time.perf_counter()
+                await memory_manager.search(BENCH_USER, query, limit=10)
+                index_samples.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                await full_scan_search(redis_client, query)
+                scan_samples.append((time.perf_counter() - start) * 1000)
+
+        # Deep pages cost the same ranking work as the first one
+        page_samples = []
+        for offset in range(0, 200, 20):
+            start = time.perf_counter()
+            await memory_manager.search(BENCH_USER, "python", limit=20, offset=offset)
+            page_samples.append((time.perf_counter() - start) * 1000)
+
+        # Frequent terms have the longest postings lists
+        budget = settings.SEARCH_MAX_POSTINGS
+        bounded_samples, unbounded_samples, agreement = [], [], []
+        try:
+            for query in QUERIES:
+                for _ in range(rounds):
+                    elapsed, bounded = await timed_search(memory_manager, query, budget)
+                    bounded_samples.append(elapsed)
+                    elapsed, unbounded = await timed_search(memory_manager, query, 10 ** 9)
+                    unbounded_samples.append(elapsed)
+                agreement.append(len(set(bounded) & set(unbounded)) / max(len(unbounded), 1))
+        finally:
+            settings.SEARCH_MAX_POSTINGS = budget
+
+        print("\n📊 Search latency (10 results)")
+        report("Index", index_samples)
+        report("Full scan", scan_samples)
+        report("Pages 1-10", page_samples)
+        print(f"\n📊 Postings budget ({budget} postings per query)")
+        report("Bounded", bounded_samples)
+        report("Unbounded", unbounded_samples)
+        print(f"{'Top 10':>12}: {statistics.mean(agreement) * 100:.0f}% of the unbounded results found")
+        speedup = statistics.median(scan_samples) / statistics.median(index_samples)
+        print(f"\n✅ Indexed search is {speedup:.1f}x faster at the median "
+              "(the full scan returns unranked substring matches)")
+    finally:
+        await cleanup(redis_client)
+
+if __name__ == "__main__":
+    asyncio.run(main())
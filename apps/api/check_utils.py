@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Harness shared by the test scripts: each check is printed as it is made,
+and a script exits non-zero if any of its checks failed.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, List
+
+def check(results: List[bool], name: str, ok: bool, detail: str = ""):
+    """Record one check and print its outcome"""
+    results.append(ok)
+    print(f"{'✅' if ok else '❌'} {name}" + (f": {detail}" if detail else ""))
+
+def header(title: str):
+    print(f"🚀 {title}")
+    print("=" * 50)
+
+def passed(results: List[bool], checks: str) -> bool:
+    """Print how the checks went; True if they all passed"""
+    failures = results.count(False)
+    print("\n" + (f"✅ All {checks} passed" if not failures else f"❌ {failures} check(s) failed"))
+    return failures == 0
+
+async def delete_keys(redis_client, match: str):
+    """Remove the keys matching a pattern, as scripts clean up after their test users"""
+    keys = [key async for key in redis_client.scan_iter(match=match, count=1000)]
+    if keys:
+        await redis_client.unlink(*keys)
+
+def run(main: Callable[[], Awaitable[bool]]):
+    """Run a script's main() and exit with its outcome"""
+    raise SystemExit(0 if asyncio.run(main()) else 1)
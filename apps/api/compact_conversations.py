@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+One-off compaction of conversations stored before writes became append-only.
+Older writes re-pushed the whole context on every turn, duplicating messages.
+Run from apps/api with: python compact_conversations.py [--dry-run] [USER_ID]
+"""
+
+import asyncio
+import sys
+from app.services.memory import MemoryManager
+
+async def main():
+    args = sys.argv[1:]
+    dry_run = "--dry-run" in args
+    args = [arg for arg in args if arg != "--dry-run"]
+    user_id = args[0] if args else None
+
+    print("🧹 Conversation compaction" + (" (dry run)" if dry_run else ""))
+    print("=" * 50)
+    print(f"Scope: {'user ' + user_id if user_id else 'all users'}")
+
+    memory_manager = MemoryManager()
+    totals = await memory_manager.compact_all_conversations(user_id=user_id, dry_run=dry_run)
+
+    removed = totals["before"] - totals["after"]
+    print(f"\n📊 Conversations scanned: {totals['conversations']}")
+    print(f"🔁 Conversations with duplicates: {totals['changed']}")
+    print(f"💬 Messages: {totals['before']} → {totals['after']} ({removed} duplicates)")
+
+    if dry_run:
+        print("\nℹ️  Nothing was written, run without --dry-run to compact")
+    else:
+        print("\n✅ Compaction complete")
+
+if __name__ == "__main__":
+    asyncio.run(main())
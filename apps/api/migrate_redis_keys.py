@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Moves per-user Redis keys to the hash-tagged layout Redis Cluster needs
+(see app/core/redis_keys.py and app/services/key_migration.py for the rollout).
+Run from apps/api, with REDIS_KEY_LAYOUT set as on the workers:
+
+  python migrate_redis_keys.py [USER_ID]            copy legacy keys (layout migrating/migrated)
+  python migrate_redis_keys.py --verify [USER_ID]   count legacy keys without a tagged copy
+  python migrate_redis_keys.py --cleanup [USER_ID]  remove legacy keys (layout tagged)
+"""
+
+import asyncio
+import sys
+from app.core.config import settings
+from app.services.key_migration import KeyMigration
+
+async def main():
+    args = sys.argv[1:]
+    users = [arg for arg in args if not arg.startswith("--")]
+    user_id = users[0] if users else None
+    migration = KeyMigration(user_id=user_id)
+
+    print(f"🔑 Redis key migration (layout: {settings.REDIS_KEY_LAYOUT})")
+    print("=" * 50)
+    print(f"Scope: {'user ' + user_id if user_id else 'all users'}")
+
+    if "--verify" in args:
+        totals = await migration.verify()
+        print(f"\n📊 Legacy keys: {totals['legacy']}")
+        print(f"{'✅' if not totals['missing'] else '❌'} Without a tagged copy: {totals['missing']}")
+    elif "--cleanup" in args:
+        deleted = await migration.cleanup()
+        print(f"\n✅ Removed {deleted} legacy keys")
+    else:
+        totals = await migration.backfill()
+        print(f"\n📊 Keys scanned: {totals['scanned']}")
+        print(f"✅ Legacy keys copied: {totals['copied']}")
+        print("\nℹ️  Verify, then set REDIS_KEY_LAYOUT=migrated on every worker")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Test script to verify admission control: generations beyond the global
+limit queue in order and are shed once the queue is full or they waited too
+long, users over their own limit are refused at once, draining rejects
+queued requests, and streaming responses give their slot back however they
+end.
+Run with: python test_admission.py
+
+A small AdmissionController is used, not the app's; nothing is stored.
+"""
+
+import asyncio
+import gc
+import logging
+import time
+from app.core.admission import AdmissionController, AdmissionRejected, AdmittedStreamingResponse
+from check_utils import check, header, passed, run
+
+SCOPE = {"type": "http", "method": "POST", "path": "/", "headers": []}
+
+def controller(max_in_flight=2, max_per_user=2, max_queue=2, target_ms=50, interval_ms=300):
+    return AdmissionController(
+        max_in_flight=max_in_flight,
+        max_per_user=max_per_user,
+        max_queue=max_queue,
+        queue_target_ms=target_ms,
+        queue_interval_ms=interval_ms,
+        retry_after=3
+    )
+
+async def rejection(acquiring):
+    """The AdmissionRejected an acquire raised, or None if it was admitted"""
+    try:
+        ticket = await acquiring
+    except AdmissionRejected as e:
+        return e
+    ticket.release()
+    return None
+
+async def chunks():
+    yield "data: 1\n\n"
+    yield "data: 2\n\n"
+
+async def never_disconnects():
+    await asyncio.Event().wait()
+
+async def main():
+    results = []
+
+    header("Admission control test")
+
+    # Queueing and shedding
+    admission = controller()
+    first = await admission.acquire("user_a")
+    second = await admission.acquire("user_b")
+    check(results, "Generations within the limit are admitted at once", admission.in_flight == 2)
+
+    queued = [asyncio.create_task(admission.acquire("user_a"))]
+    await asyncio.sleep(0)
+    rejected = await rejection(admission.acquire("user_a"))
+    check(results, "Users over their own limit, queued generations included, get 429 with Retry-After",
+          rejected is not None and rejected.status_code == 429 and rejected.headers["Retry-After"] == "3")
+
+    queued.append(asyncio.create_task(admission.acquire("user_c")))
+    await asyncio.sleep(0)
+    rejected = await rejection(admission.acquire("user_d"))
+    check(results, "Requests beyond the queue are shed with 503",
+          rejected is not None and rejected.status_code == 503 and admission.rejected["queue_full"] == 1)
+
+    second.release()
+    await asyncio.sleep(0.01)
+    check(results, "A released slot goes to the oldest waiter",
+          queued[0].done() and not queued[1].done() and admission.in_flight == 2)
+    first.release()
+    await asyncio.sleep(0.01)
+    check(results, "then to the next one", queued[1].done() and admission.in_flight == 2)
+    tickets = await asyncio.gather(*queued)
+    started = time.monotonic()
+    rejected = await rejection(admission.acquire("user_e"))
+    waited = time.monotonic() - started
+    check(results, "Queued requests are shed after the queue interval",
+          rejected is not None and admission.rejected["queue_timeout"] == 1 and 0.25 < waited < 0.5,
+          f"{waited * 1000:.0f} ms")
+    for ticket in tickets:
+        ticket.release()
+    check(results, "Every slot is back once released", admission.in_flight == 0 and not admission.per_user)
+
+    # A standing queue shortens the wait
+    admission = controller(max_in_flight=1, max_queue=10)
+    ticket = await admission.acquire("user_a")
+    waiting = [asyncio.create_task(rejection(admission.acquire("user_b")))]
+    await asyncio.sleep(0.2)
+    waiting.append(asyncio.create_task(rejection(admission.acquire("user_c"))))
+    await asyncio.sleep(0.15)
+    started = time.monotonic()
+    rejected = await rejection(admission.acquire("user_d"))
+    waited = time.monotonic() - started
+    check(results, "Under sustained overload queued requests are shed after the short target",
+          rejected is not None and waited < 0.2, f"{waited * 1000:.0f} ms")
+    await asyncio.gather(*waiting)
+    ticket.release()
+
+    # Draining
+    admission = controller(max_in_flight=1)
+    ticket = await admission.acquire("user_a")
+    queued = asyncio.create_task(rejection(admission.acquire("user_b")))
+    await asyncio.sleep(0)
+    admission.start_draining()
+    rejected = await queued
+    check(results, "Draining rejects queued requests",
+          rejected is not None and rejected.status_code == 503 and admission.rejected["draining"] == 1)
+    rejected = await rejection(admission.acquire("user_c"))
+    check(results, "and new ones", rejected is not None and admission.rejected["draining"] == 2)
+    idle = asyncio.create_task(admission.wait_idle(5))
+    await asyncio.sleep(0.15)
+    check(results, "while running generations continue", not idle.done())
+    ticket.release()
+    check(results, "until they finish", await idle)
+
+    # Streaming responses
+    admission = controller()
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        await never_disconnects()
+
+    response = AdmittedStreamingResponse(chunks(), await admission.acquire("user_a"), media_type="text/event-stream")
+    await response(SCOPE, receive, send)
+    body = b"".join(message.get("body", b"") for message in sent)
+    check(results, "A streamed response releases its slot once sent",
+          body == b"data: 1\n\ndata: 2\n\n" and admission.in_flight == 0)
+
+    async def gone(message):
+        raise OSError("client gone")
+
+    response = AdmittedStreamingResponse(chunks(), await admission.acquire("user_a"))
+    try:
+        await response(SCOPE, receive, gone)
+    except Exception:
+        pass
+    check(results, "and when the client is gone before the stream started", admission.in_flight == 0)
+
+    async with await admission.acquire("user_a"):
+        held = admission.in_flight
+    check(results, "async with releases a ticket", held == 1 and admission.in_flight == 0)
+
+    warnings = []
+    handler = logging.Handler()
+    handler.emit = warnings.append
+    logging.getLogger("app.core.admission").addHandler(handler)
+    await admission.acquire("user_a")
+    gc.collect()
+    logging.getLogger("app.core.admission").removeHandler(handler)
+    check(results, "A ticket never released is reclaimed with a warning",
+          admission.in_flight == 0 and any(record.levelno == logging.WARNING for record in warnings))
+
+    return passed(results, "admission checks")
+
+if __name__ == "__main__":
+    run(main)
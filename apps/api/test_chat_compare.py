@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test script to verify /completions/compare end to end through the app: the
+stream announces the branches first, multiplexes the models' chunks as they
+come with each model's events in order and ending in done or error, and
+ends with [DONE] once every model finished; each model's answer is stored
+in a "{conversation}:{comparison}:{model}" branch of the conversation,
+which is left as it was.
+Run this against a local Redis with: python test_chat_compare.py
+
+The app runs in FastAPI's TestClient; providers are replaced by a stub
+whose models take turns, so their chunks interleave. The test user's keys
+are removed afterwards.
+"""
+
+import asyncio
+import json
+import types
+import uuid
+from fastapi.testclient import TestClient
+from app.api.v1 import chat
+from app.core.redis_pool import redis_manager
+from app.core.tasks import task_registry
+from app.main import app
+from check_utils import check, delete_keys, header, passed, run
+
+# The _pro suffix makes the user unlimited (see SubscriptionService.get_user_tier)
+TEST_USER = f"test_compare_{uuid.uuid4().hex[:8]}_pro"
+MODELS = {"deepseek": "deepseek-chat", "glm": "glm-4.5", "qwen": "qwen3-235b-a22b"}
+
+# The chunks of deepseek and glm, in the order the stub streams them
+CHUNKS = ["deepseek 1 ", "glm 1 ", "deepseek 2 ", "glm 2 "]
+
+class TurnTakingProvider:
+    """deepseek and glm stream their CHUNKS each waiting for the one before; qwen fails"""
+
+    def __init__(self):
+        self.sent = None
+
+    async def complete(self, messages, model, temperature=0.7):
+        return types.SimpleNamespace(content="A1")
+
+    async def stream(self, messages, model, temperature=0.7):
+        if self.sent is None:
+            self.sent = [asyncio.Event() for _ in CHUNKS]
+        if model == MODELS["qwen"]:
+            raise RuntimeError("qwen unavailable")
+        name = "deepseek" if model == MODELS["deepseek"] else "glm"
+        for i, chunk in enumerate(CHUNKS):
+            if chunk.startswith(name):
+                if i:
+                    await self.sent[i - 1].wait()
+                yield chunk
+                self.sent[i].set()
+
+def events(response):
+    """The data of each SSE event of a response"""
+    data = [line[len("data: "):] for line in response.iter_lines() if line.startswith("data: ")]
+    return [payload if payload == "[DONE]" else json.loads(payload) for payload in data]
+
+async def main():
+    provider = TurnTakingProvider()
+    get_provider = chat.get_provider
+    chat.get_provider = lambda *args: provider
+    results = []
+
+    header("Compare stream test")
+
+    try:
+        with TestClient(app) as client:
+            def stored(conversation_id):
+                context = client.portal.call(chat.memory_manager.get_chat_context, conversation_id, TEST_USER)
+                return [msg.content for msg in context]
+
+            response = client.post("/api/v1/completions", json={
+                "messages": [{"role": "user", "content": "Q1"}],
+                "model": "deepseek",
+                "stream": False,
+                "conversation_id": "conv_cmp",
+                "user_id": TEST_USER
+            })
+            client.portal.call(task_registry.drain, 5)
+            check(results, "The conversation has a stored turn",
+                  response.status_code == 200 and stored("conv_cmp") == ["Q1", "A1"])
+
+            with client.stream("POST", "/api/v1/completions/compare", json={
+                "messages": [
+                    {"role": "user", "content": "Q1"},
+                    {"role": "assistant", "content": "A1"},
+                    {"role": "user", "content": "Q2"}
+                ],
+                "models": list(MODELS),
+                "conversation_id": "conv_cmp",
+                "user_id": TEST_USER
+            }) as response:
+                stream = events(response)
+            client.portal.call(task_registry.drain, 5)
+
+            branches = stream[0].get("branches", {}) if isinstance(stream[0], dict) else {}
+            check(results, "The stream announces one branch per model first", set(branches) == set(MODELS.values()),
+                  str(stream[0]))
+            check(results, "and ends with [DONE]", stream[-1] == "[DONE]")
+
+            body = stream[1:-1]
+            per_model = {model: [event for event in body if event["model"] == model] for model in branches}
+            check(results, "Each model's chunks come in order",
+                  [event.get("content") for event in per_model[MODELS["deepseek"]]] == ["deepseek 1 ", "deepseek 2 ", None]
+                  and [event.get("content") for event in per_model[MODELS["glm"]]] == ["glm 1 ", "glm 2 ", None])
+            check(results, "and end with done, or error for a failing model",
+                  per_model[MODELS["deepseek"]][-1].get("done") and per_model[MODELS["glm"]][-1].get("done")
+                  and per_model[MODELS["qwen"]] == [{"model": MODELS["qwen"], "error": "qwen unavailable"}])
+            chunks = [event["content"] for event in body if "content" in event]
+            check(results, "Models' chunks are multiplexed as they come",
+                  chunks == CHUNKS, str(chunks))
+            check(results, "Every model finishes once, before [DONE]",
+                  sum(1 for event in body if "done" in event or "error" in event) == len(MODELS))
+
+            comparison_id = branches.get(MODELS["deepseek"], "::").split(":")[1]
+            check(results, "Branches are named {conversation}:{comparison}:{model}", comparison_id and all(
+                branch_id == chat.get_branch_conversation_id("conv_cmp", comparison_id, model)
+                for model, branch_id in branches.items()
+            ), str(branches))
+            listed = {
+                conv["id"]: conv
+                for conv in client.portal.call(chat.memory_manager.get_user_conversations, TEST_USER)
+            }
+            check(results, "Each branch is a branch of the conversation",
+                  all(listed.get(branch_id, {}).get("parent") == "conv_cmp" for branch_id in branches.values()),
+                  str({branch_id: listed.get(branch_id, {}).get("parent") for branch_id in branches.values()}))
+            check(results, "holding the history, the new turn and its model's answer",
+                  stored(branches[MODELS["deepseek"]]) == ["Q1", "A1", "Q2", "deepseek 1 deepseek 2 "]
+                  and stored(branches[MODELS["glm"]]) == ["Q1", "A1", "Q2", "glm 1 glm 2 "],
+                  str(stored(branches[MODELS["deepseek"]])))
+            check(results, "The compared conversation is left as it was", stored("conv_cmp") == ["Q1", "A1"])
+
+            client.portal.call(delete_keys, redis_manager.get_client(), f"*{TEST_USER}*")
+    finally:
+        chat.get_provider = get_provider
+
+    return passed(results, "compare stream checks")
+
+if __name__ == "__main__":
+    run(main)
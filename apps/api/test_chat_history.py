@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that chat requests store each turn once: clients send
+the whole conversation with every message, and /completions (streamed or
+not), /completions/compare and WebSocket sessions append only the turns
+the stored conversation doesn't hold yet, and send providers the history
+once.
+Run this against a local Redis with: python test_chat_history.py
+
+Providers are replaced by a fake answering locally. The test user's keys
+are removed afterwards.
+"""
+
+import json
+import types
+import uuid
+from app.api.v1 import chat
+from app.core.messages import ChatMessage
+from app.core.redis_pool import redis_manager
+from app.core.tasks import task_registry
+from check_utils import check, delete_keys, header, passed, run
+
+# The _pro suffix makes the user unlimited (see SubscriptionService.get_user_tier)
+TEST_USER = f"test_history_{uuid.uuid4().hex[:8]}_pro"
+
+class FakeProvider:
+    """Answers every prompt with a numbered answer, recording the prompts"""
+
+    def __init__(self):
+        self.prompts = []
+        self.fail = False
+
+    def answer(self, messages):
+        if self.fail:
+            raise RuntimeError("provider unavailable")
+        self.prompts.append([(msg.role, msg.content) for msg in messages])
+        return f"answer {len(self.prompts)}"
+
+    async def complete(self, messages, model, temperature=0.7):
+        return types.SimpleNamespace(content=self.answer(messages))
+
+    async def stream(self, messages, model, temperature=0.7):
+        yield self.answer(messages)
+
+class FakeWebSocket:
+    """Collects the frames a ChatSession sends"""
+
+    def __init__(self, redis_client):
+        self.app = types.SimpleNamespace(state=types.SimpleNamespace(redis=redis_client))
+        self.frames = []
+
+    async def send_json(self, payload):
+        self.frames.append(payload)
+
+def turns(*contents):
+    """Alternating user and assistant messages"""
+    return [ChatMessage("user" if i % 2 == 0 else "assistant", content) for i, content in enumerate(contents)]
+
+async def stored(conversation_id):
+    context = await chat.memory_manager.get_chat_context(conversation_id, TEST_USER)
+    return [msg.content for msg in context]
+
+async def post(request, req, stream):
+    response = await chat.chat_completions(request, req)
+    if stream:
+        async for _ in response.body_iterator:
+            pass
+    await task_registry.drain(5)
+
+async def main():
+    redis_client = redis_manager.get_client()
+    req = types.SimpleNamespace(app=types.SimpleNamespace(state=types.SimpleNamespace(redis=redis_client)))
+    provider = FakeProvider()
+    get_provider = chat.get_provider
+    chat.get_provider = lambda *args: provider
+    results = []
+
+    header("Chat history test")
+
+    try:
+        for stream in (False, True):
+            conversation_id = f"history_{'stream' if stream else 'complete'}"
+            for history in (turns("q1"), turns("q1", "answer 1", "q2")):
+                provider.prompts.clear()
+                await post(chat.ChatRequest(
+                    messages=history, model="deepseek-chat", stream=stream,
+                    conversation_id=conversation_id, user_id=TEST_USER
+                ), req, stream)
+            label = "Streamed" if stream else "Completed"
+            check(results, f"{label}: a growing history is stored once",
+                  await stored(conversation_id) == ["q1", "answer 1", "q2", "answer 1"],
+                  str(await stored(conversation_id)))
+            check(results, f"{label}: and sent to the provider once",
+                  provider.prompts == [[("user", "q1"), ("assistant", "answer 1"), ("user", "q2")]],
+                  str(provider.prompts))
+
+        # Clients that send only the new turn still have it appended
+        provider.prompts.clear()
+        await post(chat.ChatRequest(
+            messages=turns("q3"), model="deepseek-chat", stream=False,
+            conversation_id="history_complete", user_id=TEST_USER
+        ), req, False)
+        check(results, "A request holding only the new turn appends it",
+              (await stored("history_complete"))[-2:] == ["q3", "answer 1"]
+              and len(await stored("history_complete")) == 6)
+
+        # A history posted again after its answer failed is stored once
+        history = turns("q1", "answer 1", "q2", "answer 1", "q3", "answer 1", "q4")
+        provider.fail = True
+        try:
+            await post(chat.ChatRequest(
+                messages=history, model="deepseek-chat", stream=False,
+                conversation_id="history_complete", user_id=TEST_USER
+            ), req, False)
+        except Exception:
+            pass
+        provider.fail = False
+        await post(chat.ChatRequest(
+            messages=history, model="deepseek-chat", stream=False,
+            conversation_id="history_complete", user_id=TEST_USER
+        ), req, False)
+        check(results, "A history retried after a failed answer is stored once",
+              (await stored("history_complete"))[6:] == ["q4", "answer 2"], str(await stored("history_complete")))
+
+        # WebSocket sessions keep their context locally between messages
+        session = chat.ChatSession(FakeWebSocket(redis_client), TEST_USER)
+        provider.prompts.clear()
+        for i, history in enumerate((turns("w1"), turns("w1", "answer 1", "w2"))):
+            await session.generate(f"m{i}", chat.ChatRequest(
+                messages=history, model="deepseek-chat", conversation_id="history_ws", user_id=TEST_USER
+            ))
+            await task_registry.drain(5)
+        check(results, "WebSocket: a growing history is stored once",
+              await stored("history_ws") == ["w1", "answer 1", "w2", "answer 2"], str(await stored("history_ws")))
+        check(results, "WebSocket: and sent to the provider once",
+              provider.prompts[-1] == [("user", "w1"), ("assistant", "answer 1"), ("user", "w2")])
+
+        # A comparison's branch shares the stored history and adds its own turns
+        provider.prompts.clear()
+        response = await chat.compare_completions(chat.CompareRequest(
+            messages=turns("w1", "answer 1", "w2", "answer 2", "c1"), models=["deepseek-chat"],
+            conversation_id="history_ws", user_id=TEST_USER
+        ), req)
+        events = [chunk async for chunk in response.body_iterator]
+        await task_registry.drain(5)
+        branch_id = json.loads(events[0][len("data: "):])["branches"]["deepseek-chat"]
+        check(results, "Compare: the history is sent to the providers once",
+              provider.prompts == [[(msg.role, msg.content) for msg in turns("w1", "answer 1", "w2", "answer 2", "c1")]],
+              str(provider.prompts))
+        check(results, "Compare: the branch adds only the new turn and its answer",
+              await stored(branch_id) == ["w1", "answer 1", "w2", "answer 2", "c1", "answer 1"], str(await stored(branch_id)))
+    finally:
+        chat.get_provider = get_provider
+        await delete_keys(redis_client, f"*{TEST_USER}*")
+
+    return passed(results, "chat history checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test script to verify WebSocket chat sessions end to end through the app: a
+session keeps each conversation's context across turns, so providers get
+the history once and it is loaded from Redis once, every turn is stored,
+and a client that disconnects mid-stream cancels its generation, which
+gives back its admission slot and stores nothing.
+Run this against a local Redis with: python test_chat_websocket.py
+
+The app runs in FastAPI's TestClient; providers are replaced by a stub
+answering locally. The test user's keys are removed afterwards.
+"""
+
+import asyncio
+import time
+import uuid
+from fastapi.testclient import TestClient
+from app.api.v1 import chat
+from app.core.admission import admission_controller
+from app.core.redis_pool import redis_manager
+from app.core.tasks import task_registry
+from app.main import app
+from check_utils import check, delete_keys, header, passed, run
+
+# The _pro suffix makes the user unlimited (see SubscriptionService.get_user_tier)
+TEST_USER = f"test_ws_{uuid.uuid4().hex[:8]}_pro"
+
+class StubProvider:
+    """Streams a numbered answer in two chunks, recording the prompts
+
+    Prompts containing "hang" stream one chunk and then wait until the
+    generation is cancelled.
+    """
+
+    def __init__(self):
+        self.prompts = []
+        self.cancelled = 0
+
+    async def stream(self, messages, model, temperature=0.7):
+        self.prompts.append([(msg.role, msg.content) for msg in messages])
+        if "hang" in messages[-1].content:
+            yield "partial "
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        yield "answer "
+        yield str(len(self.prompts))
+
+def user(content):
+    return {"role": "user", "content": content}
+
+def assistant(content):
+    return {"role": "assistant", "content": content}
+
+def receive_until(ws, message_id, last="done"):
+    """Frames of one message up to its last frame"""
+    frames = []
+    while True:
+        frame = ws.receive_json()
+        if frame.get("id") == message_id:
+            frames.append(frame)
+            if frame["type"] in (last, "error"):
+                return frames
+
+async def main():
+    provider = StubProvider()
+    get_provider, load_context = chat.get_provider, chat.load_context
+    loads = []
+
+    async def counted_load_context(conversation_id, user_id):
+        loads.append(conversation_id)
+        return await load_context(conversation_id, user_id)
+
+    chat.get_provider = lambda *args: provider
+    chat.load_context = counted_load_context
+    results = []
+
+    header("WebSocket chat test")
+
+    try:
+        with TestClient(app) as client:
+            def stored(conversation_id):
+                client.portal.call(task_registry.drain, 5)
+                context = client.portal.call(chat.memory_manager.get_chat_context, conversation_id, TEST_USER)
+                return [msg.content for msg in context]
+
+            with client.websocket_connect("/api/v1/chat/ws") as ws:
+                ws.send_json({"type": "auth", "user_id": TEST_USER})
+                ready = ws.receive_json()
+                check(results, "The session is ready after auth", ready["type"] == "ready", str(ready))
+
+                # Two turns; the client sends the whole conversation each time
+                ws.send_json({"type": "message", "id": "m1", "conversation_id": "conv_ws",
+                              "model": "deepseek", "messages": [user("Q1")]})
+                frames = receive_until(ws, "m1")
+                check(results, "A turn streams start, chunks and done",
+                      [frame["type"] for frame in frames] == ["start", "chunk", "chunk", "done"]
+                      and "".join(frame.get("content", "") for frame in frames) == "answer 1",
+                      str([frame["type"] for frame in frames]))
+
+                ws.send_json({"type": "message", "id": "m2", "conversation_id": "conv_ws", "model": "deepseek",
+                              "messages": [user("Q1"), assistant("answer 1"), user("Q2")]})
+                frames = receive_until(ws, "m2")
+                check(results, "The next turn completes", frames[-1]["type"] == "done")
+                check(results, "The provider gets the history once",
+                      provider.prompts[-1] == [("user", "Q1"), ("assistant", "answer 1"), ("user", "Q2")],
+                      str(provider.prompts[-1]))
+                check(results, "The session loads a conversation's context once", loads == ["conv_ws"], str(loads))
+                check(results, "Each turn is stored once",
+                      stored("conv_ws") == ["Q1", "answer 1", "Q2", "answer 2"], str(stored("conv_ws")))
+
+                ws.send_json({"type": "ping"})
+                check(results, "The session answers pings between turns", ws.receive_json() == {"type": "pong"})
+
+                # Disconnect mid-stream
+                ws.send_json({"type": "message", "id": "m3", "conversation_id": "conv_gone",
+                              "model": "deepseek", "messages": [user("Please hang")]})
+                frames = receive_until(ws, "m3", last="chunk")
+                check(results, "A generation is streaming", [frame["type"] for frame in frames] == ["start", "chunk"])
+                check(results, "and holds an admission slot", admission_controller.in_flight == 1)
+
+            deadline = time.monotonic() + 5
+            while (provider.cancelled == 0 or admission_controller.in_flight) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            check(results, "Disconnecting cancels the generation", provider.cancelled == 1)
+            check(results, "and gives back its admission slot", admission_controller.in_flight == 0)
+            check(results, "A cancelled generation stores nothing", stored("conv_gone") == [])
+
+            client.portal.call(delete_keys, redis_manager.get_client(), f"*{TEST_USER}*")
+    finally:
+        chat.get_provider, chat.load_context = get_provider, load_context
+
+    return passed(results, "WebSocket chat checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the per-worker context cache: a worker's own appends
+update it write-through, another worker's writes drop it, a write racing an
+invalidation is not cached, and its memory stays under the byte cap.
+Run this against a local Redis with: python test_context_cache.py
+
+The shared context_cache is this worker's; a second ContextCache stands for
+another worker. The test user's keys are removed afterwards.
+"""
+
+import asyncio
+import uuid
+from app.core.messages import ChatMessage
+from app.services.context_cache import MESSAGE_OVERHEAD_BYTES, ContextCache, context_cache
+from app.services.memory import MemoryManager
+from check_utils import check, delete_keys, header, passed, run
+
+TEST_USER = f"test_context_cache_{uuid.uuid4().hex[:8]}"
+
+def turn(text):
+    return [
+        {"role": "user", "content": text},
+        {"role": "assistant", "content": f"Reply to {text.lower()}"}
+    ]
+
+def numbered(contents, first_seq=0):
+    return [
+        ChatMessage.from_dict({"role": "user", "content": content, "seq": first_seq + i})
+        for i, content in enumerate(contents)
+    ]
+
+async def subscribed(*caches):
+    for _ in range(50):
+        if all(cache.subscribed for cache in caches):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+async def main():
+    memory_manager = MemoryManager()
+    redis_client = await memory_manager._get_redis()
+    other_worker = ContextCache()
+    context_cache.start(redis_client)
+    other_worker.start(redis_client)
+    results = []
+
+    header("Context cache test")
+
+    try:
+        check(results, "Both workers subscribe to invalidations", await subscribed(context_cache, other_worker))
+
+        # Write-through
+        await memory_manager.store_conversation("conv_0", TEST_USER, turn("First question"), "deepseek")
+        entry = context_cache.entries.get((TEST_USER, "conv_0"))
+        check(results, "A new conversation is cached by the worker that wrote it",
+              entry is not None and entry.length == 2 and [msg.seq for msg in entry.messages] == [0, 1])
+        hits = context_cache.hits
+        context = await memory_manager.get_chat_context("conv_0", TEST_USER)
+        check(results, "and read from memory", context_cache.hits == hits + 1 and context == entry.messages)
+
+        await memory_manager.store_conversation("conv_0", TEST_USER, turn("Second question"), "deepseek")
+        entry = context_cache.entries.get((TEST_USER, "conv_0"))
+        check(results, "Appends extend the entry",
+              entry is not None and entry.length == 4 and [msg.seq for msg in entry.messages] == [0, 1, 2, 3])
+        context = await memory_manager.get_chat_context("conv_0", TEST_USER)
+        check(results, "and reads still hit", context_cache.hits == hits + 2
+              and [msg.content for msg in context][-2:] == ["Second question", "Reply to second question"])
+
+        # Cross-worker invalidation
+        other_worker.put(TEST_USER, "conv_0", context, len(context), None, other_worker.generation)
+        await memory_manager.store_conversation("conv_0", TEST_USER, turn("Third question"), "deepseek")
+        await asyncio.sleep(0.2)
+        check(results, "A write drops the conversation from other workers",
+              (TEST_USER, "conv_0") not in other_worker.entries)
+        entry = context_cache.entries.get((TEST_USER, "conv_0"))
+        check(results, "but not from the worker that wrote it", entry is not None and entry.length == 6)
+
+        context_cache._on_message(other_worker.invalidation_message(TEST_USER, "conv_0"))
+        check(results, "Another worker's invalidation drops this worker's entry",
+              (TEST_USER, "conv_0") not in context_cache.entries)
+        generation = other_worker.generation
+        other_worker._on_message(context_cache.invalidation_message(TEST_USER, "conv_0"))
+        other_worker.put(TEST_USER, "conv_0", context, len(context), None, generation)
+        check(results, "A read that started before an invalidation is not cached",
+              (TEST_USER, "conv_0") not in other_worker.entries)
+
+        # A write racing another worker's
+        generation = context_cache.generation
+        context_cache._on_message(other_worker.invalidation_message(TEST_USER, "conv_1"))
+        context_cache.append(TEST_USER, "conv_1", numbered(["Created", "and answered"]), 2, generation)
+        check(results, "A new conversation invalidated during its write is not cached",
+              (TEST_USER, "conv_1") not in context_cache.entries)
+        context_cache.append(TEST_USER, "conv_1", numbered(["Created", "and answered"]), 2, context_cache.generation)
+        check(results, "Without an invalidation it is",
+              (TEST_USER, "conv_1") in context_cache.entries)
+        context_cache.append(TEST_USER, "conv_1", numbered(["After a gap"], 5), 6, context_cache.generation)
+        check(results, "An entry that missed a write is dropped",
+              (TEST_USER, "conv_1") not in context_cache.entries)
+
+        # Byte cap
+        content = "x" * 750
+        size = len(content) + MESSAGE_OVERHEAD_BYTES
+        capped = ContextCache(max_bytes=3 * size)
+        capped.subscribed = True
+        for i in range(3):
+            capped.put(TEST_USER, f"conv_{i}", numbered([content]), 1, None, capped.generation)
+        capped.get(TEST_USER, "conv_0", 1)
+        capped.put(TEST_USER, "conv_3", numbered([content]), 1, None, capped.generation)
+        check(results, "The least recently used conversation is evicted at the byte cap",
+              [key[1] for key in capped.entries] == ["conv_2", "conv_0", "conv_3"] and capped.size == 3 * size,
+              f"{capped.size} of {capped.max_bytes} bytes")
+        capped.put(TEST_USER, "conv_4", numbered([content] * 4), 4, None, capped.generation)
+        check(results, "A conversation larger than the cap is not cached",
+              (TEST_USER, "conv_4") not in capped.entries and capped.size == 3 * size)
+    finally:
+        await other_worker.stop()
+        await context_cache.stop()
+        await delete_keys(redis_client, f"*{TEST_USER}*")
+
+    return passed(results, "context cache checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test script to verify idle conversations move to the Postgres archive and
+come back transparently when they are read or continued.
+Run this against a local Redis and the Postgres at DATABASE_URL with: python test_conversation_archive.py
+
+The test user's keys and archived rows are removed afterwards.
+"""
+
+import time
+import uuid
+from app.core.config import settings
+from app.core.redis_keys import read_keys
+from app.services.archive import ConversationArchive
+from app.services.memory import MemoryManager
+from check_utils import check, delete_keys, header, passed, run
+
+TEST_USER = f"test_archive_{uuid.uuid4().hex[:8]}"
+
+async def backdate(redis_client, conversation_ids, days):
+    """Make conversations look idle for `days` days"""
+    score = time.time() - days * 24 * 60 * 60
+    await redis_client.zadd(read_keys(TEST_USER).conversations, {conv_id: score for conv_id in conversation_ids})
+
+async def cleanup(memory_manager, archive):
+    redis_client = await memory_manager._get_redis()
+    await delete_keys(redis_client, f"*{TEST_USER}*")
+    pool = await archive._get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM archived_messages WHERE user_id = $1", TEST_USER)
+        await conn.execute("DELETE FROM archived_conversations WHERE user_id = $1", TEST_USER)
+
+async def main():
+    archive = ConversationArchive()
+    memory_manager = MemoryManager(archive=archive)
+    redis_client = await memory_manager._get_redis()
+    results = []
+
+    header("Conversation archive test")
+
+    try:
+        for i in range(4):
+            await memory_manager.store_conversation(f"conv_{i}", TEST_USER, [
+                {"role": "user", "content": f"Question {i} about postgres archives"},
+                {"role": "assistant", "content": f"Answer {i} " + "with a long explanation " * 100}
+            ], "deepseek")
+        await memory_manager.store_summary("conv_0", TEST_USER, "Earlier talk about archives", 1)
+        await memory_manager.set_title("conv_0", TEST_USER, "Archive design")
+        before = await memory_manager.get_context("conv_0", TEST_USER, include_summary=True)
+
+        # conv_0..2 go idle; conv_3 stays hot
+        await backdate(redis_client, ["conv_0", "conv_1", "conv_2"], days=settings.ARCHIVE_IDLE_SECONDS / 86400 + 1)
+        totals = await memory_manager.archive_idle_conversations(TEST_USER)
+        check(results, "Idle conversations archived", totals["archived"] == 3, str(totals))
+
+        keys = read_keys(TEST_USER)
+        remaining = [key async for key in redis_client.scan_iter(match=keys.conversation("*"))]
+        check(results, "Archived messages left Redis", remaining == [keys.conversation("conv_3")], str(remaining))
+
+        listed = {conv["id"]: conv for conv in await memory_manager.get_user_conversations(TEST_USER)}
+        check(results, "Listing includes archived conversations",
+              len(listed) == 4 and listed["conv_0"]["archived"] and listed["conv_0"]["title"] == "Archive design")
+
+        after = await memory_manager.get_context("conv_0", TEST_USER, include_summary=True)
+        check(results, "get_context rehydrates the same context", after == before)
+        check(results, "Rehydrated conversation is searchable again",
+              any(hit["conversation_id"] == "conv_0" for hit in await memory_manager.search_memories(TEST_USER, "postgres")))
+
+        messages = await memory_manager.get_messages("conv_1", TEST_USER)
+        check(results, "get_messages rehydrates", [msg["seq"] for msg in messages] == [0, 1])
+
+        next_seq = await memory_manager.store_conversation(
+            "conv_2", TEST_USER, [{"role": "user", "content": "Back again"}], "deepseek"
+        )
+        continued = await memory_manager.get_messages("conv_2", TEST_USER)
+        check(results, "Appending continues the archived history",
+              next_seq == 3 and [msg["seq"] for msg in continued] == [0, 1, 2])
+
+        check(results, "Rehydrated conversations leave the archive",
+              await archive.list_conversations(TEST_USER, 10) == [])
+
+        await backdate(redis_client, ["conv_1"], days=settings.ARCHIVE_IDLE_SECONDS / 86400 + 1)
+        await memory_manager.archive_idle_conversations(TEST_USER)
+        await memory_manager.clear_conversation("conv_1", TEST_USER)
+        check(results, "Deleting an archived conversation removes it from the archive",
+              await archive.load(TEST_USER, "conv_1") is None
+              and not await redis_client.sismember(f"archived_convs:{TEST_USER}", "conv_1"))
+    finally:
+        await cleanup(memory_manager, archive)
+        await archive.close()
+
+    return passed(results, "archive checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script to verify copy-on-write conversation branches: a branch stores
+only its own messages and reads the ones it shares from its ancestors, for
+context, pages, search and exports; clearing a conversation hands its
+branches the messages they shared.
+Run this against a local Redis with: python test_conversation_branches.py
+
+The test user's keys are removed afterwards.
+"""
+
+import json
+import uuid
+from app.core.config import settings
+from redis.crc import key_slot
+from app.core.redis_keys import UserKeys, read_keys
+from app.services.memory import MemoryManager
+from check_utils import check, delete_keys, header, passed, run
+
+TEST_USER = f"test_branches_{uuid.uuid4().hex[:8]}"
+
+async def store_turns(memory_manager, conversation_id, tag, count):
+    for i in range(count):
+        await memory_manager.store_conversation(conversation_id, TEST_USER, [
+            {"role": "user", "content": f"{tag} question {i} about forks"},
+            {"role": "assistant", "content": f"{tag} answer {i}"}
+        ], "deepseek")
+
+def contents(messages):
+    return [(msg["seq"], msg["content"].split(" ")[0]) for msg in messages if not msg.get("summary")]
+
+async def stored_bytes(redis_client):
+    keys = read_keys(TEST_USER)
+    records = await redis_client.hvals(keys.records)
+    return int(await redis_client.get(keys.stored_bytes) or 0), sum(json.loads(r).get("bytes", 0) for r in records)
+
+async def main():
+    memory_manager = MemoryManager()
+    redis_client = await memory_manager._get_redis()
+    keys = read_keys(TEST_USER)
+    results = []
+
+    header("Conversation branches test")
+
+    saved = settings.BRANCH_MAX_DEPTH
+    try:
+        # main: seqs 0-5; edit branches it at seq 4, deep branches edit at 5
+        await store_turns(memory_manager, "main", "Main", 3)
+        await memory_manager.store_summary("main", TEST_USER, "First turn", 2)
+        edit = await memory_manager.fork_conversation("main", TEST_USER, fork=4, branch_id="edit")
+        await store_turns(memory_manager, "edit", "Edit", 1)
+        deep = await memory_manager.fork_conversation("edit", TEST_USER, fork=5, branch_id="deep")
+        await store_turns(memory_manager, "deep", "Deep", 1)
+        check(results, "Branches point at their parent and fork",
+              (edit["parent"], edit["fork"], deep["parent"], deep["fork"]) == ("main", 4, "edit", 5))
+
+        check(results, "A branch stores only its own messages",
+              await redis_client.llen(keys.conversation("edit")) == 2
+              and await redis_client.llen(keys.conversation("deep")) == 2)
+        context = await memory_manager.get_context("deep", TEST_USER, max_messages=50)
+        expected = [(0, "Main"), (1, "Main"), (2, "Main"), (3, "Main"), (4, "Edit"), (5, "Deep"), (6, "Deep")]
+        check(results, "Context reads the shared messages first", contents(context) == expected,
+              str(contents(context)))
+        context = await memory_manager.get_context("deep", TEST_USER, max_messages=3)
+        check(results, "Short context stays within the newest messages", contents(context) == expected[-3:])
+        context = await memory_manager.get_context("edit", TEST_USER, max_messages=50, include_summary=True)
+        check(results, "The parent's summary is copied to a branch",
+              context[0].get("summary") and contents(context)[0] == (2, "Main"), str(contents(context)))
+        context = await memory_manager.get_context("main", TEST_USER, max_messages=50)
+        check(results, "The parent is untouched", [c for _, c in contents(context)] == ["Main"] * 6)
+
+        page = await memory_manager.get_message_page("deep", TEST_USER, limit=3)
+        check(results, "Pages of a branch", [msg["seq"] for msg in page["messages"]] == [4, 5, 6]
+              and page["has_more"], str(page["first"]))
+        page = await memory_manager.get_message_page("deep", TEST_USER, limit=3, before=page["first"])
+        check(results, "Pages scroll back into shared messages",
+              contents(page["messages"]) == expected[1:4] and page["has_more"])
+        page = await memory_manager.get_message_page("deep", TEST_USER, limit=10, after=3)
+        check(results, "After cursors read across the fork", contents(page["messages"]) == expected[4:]
+              and not page["has_more"])
+        pending = await memory_manager.get_messages("deep", TEST_USER, start=2)
+        check(results, "Messages by seq", contents(pending) == expected[2:])
+
+        found = await memory_manager.search(TEST_USER, "forks")
+        owners = sorted(hit["conversation_id"] for hit in found["results"])
+        check(results, "Shared messages are indexed once", owners == ["deep", "edit", "main", "main", "main"],
+              str(owners))
+
+        again = await memory_manager.fork_conversation("edit", TEST_USER, fork=2)
+        check(results, "Forking shared messages branches their owner", again["parent"] == "main")
+        for fork, branch_id in [(9, None), (3, "edit")]:
+            try:
+                await memory_manager.fork_conversation("deep", TEST_USER, fork=fork, branch_id=branch_id)
+                check(results, f"Fork {fork} as {branch_id} refused", False)
+            except ValueError as e:
+                check(results, f"Fork {fork} as {branch_id} refused", True, str(e))
+        settings.BRANCH_MAX_DEPTH = 2
+        try:
+            await memory_manager.fork_conversation("deep", TEST_USER, fork=6)
+            check(results, "Branch depth is bounded", False)
+        except ValueError:
+            check(results, "Branch depth is bounded", True)
+        settings.BRANCH_MAX_DEPTH = saved
+
+        listed = {conv["id"]: conv for conv in await memory_manager.get_user_conversations(TEST_USER)}
+        check(results, "Listing names parent and fork", (listed["deep"]["parent"], listed["deep"]["fork"]) == ("edit", 5))
+
+        # Scripts walking a lineage build the ancestors' keys from prefixes
+        tagged = UserKeys(TEST_USER, True)
+        built = [prefix + conversation_id for prefix in tagged.lineage_prefixes for conversation_id in listed]
+        declared = [tagged.records, tagged.conversations, tagged.archived, tagged.conversation("deep")]
+        check(results, "Ancestor keys scripts build share the declared keys' cluster slot",
+              len({key_slot(key.encode()) for key in built + declared}) == 1)
+
+        lines = []
+        async for chunk in memory_manager.export_conversations(TEST_USER):
+            lines.extend(json.loads(line) for line in chunk.splitlines())
+        exported = [line["message"]["content"].split(" ")[0] for line in lines
+                    if line["type"] == "message" and line["conversation_id"] == "deep"]
+        records = {line["id"]: line["record"] for line in lines if line["type"] == "conversation"}
+        check(results, "A branch is exported whole", exported == [c for _, c in expected]
+              and "parent" not in records["deep"], str(exported))
+
+        await memory_manager.clear_conversation("edit", TEST_USER)
+        context = await memory_manager.get_context("deep", TEST_USER, max_messages=50)
+        record = json.loads(await redis_client.hget(keys.records, "deep"))
+        check(results, "Clearing a parent copies what its branch shared", contents(context) == expected
+              and (record["parent"], record["fork"]) == ("main", 4)
+              and await redis_client.llen(keys.conversation("deep")) == 3, str(record))
+        found = await memory_manager.search(TEST_USER, "edit")
+        check(results, "The copied messages are searchable in the branch",
+              [hit["conversation_id"] for hit in found["results"]] == ["deep"], str(found["total"]))
+
+        await memory_manager.clear_conversation("main", TEST_USER)
+        context = await memory_manager.get_context("deep", TEST_USER, max_messages=50)
+        record = json.loads(await redis_client.hget(keys.records, "deep"))
+        check(results, "A branch of a cleared root stands alone", contents(context) == expected
+              and "parent" not in record and await redis_client.llen(keys.conversation("deep")) == 7)
+        total, recorded = await stored_bytes(redis_client)
+        check(results, "Byte counter matches the listing records", total == recorded, f"{total} vs {recorded}")
+    finally:
+        settings.BRANCH_MAX_DEPTH = saved
+        await delete_keys(redis_client, f"*{TEST_USER}*")
+
+    return passed(results, "branch checks")
+
+if __name__ == "__main__":
+    run(main)
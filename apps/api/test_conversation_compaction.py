@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script to verify compaction rebuilds the real conversation from lists
+written before writes became append-only, whether clients sent the whole
+conversation with every message or only the new turn.
+Run this against a local Redis with: python test_conversation_compaction.py
+
+Legacy writes are replayed as they were made: the last CONTEXT messages of
+the list, then the request's messages and the reply, each write stamped
+within one instant. The test user's keys are removed afterwards.
+"""
+
+import json
+import uuid
+from datetime import datetime, timedelta
+from app.core.redis_keys import read_keys
+from app.services.memory import MemoryManager
+from check_utils import check, delete_keys, header, passed, run
+
+TEST_USER = f"test_compaction_{uuid.uuid4().hex[:8]}"
+# Messages of context a legacy write was given (get_context's default then)
+CONTEXT = 20
+
+QUESTIONS = [
+    "How do I reverse a list?",
+    "And a string?",
+    "Go on",
+    "What about a dict?",
+    "Go on",
+    "Can I sort it by value?",
+    "Thanks!"
+]
+
+async def write_legacy(redis_client, conversation_id, questions, full_history, unanswered=()):
+    """Replay legacy writes of a conversation; returns the real conversation
+
+    Questions in unanswered failed: nothing was stored for them, but clients
+    sending the whole conversation kept them in it.
+    """
+    key = read_keys(TEST_USER).conversation(conversation_id)
+    started = datetime.utcnow() - timedelta(days=1)
+    stored, conversation = [], []
+    for i, question in enumerate(questions):
+        conversation.append(("user", question))
+        if question in unanswered:
+            continue
+        answer = ("assistant", f"Answer {i}")
+        request = conversation if full_history else conversation[-1:]
+        write = stored[-CONTEXT:] + request + [answer]
+        stamped = started + timedelta(minutes=i)
+        await redis_client.rpush(key, *[
+            json.dumps({
+                "role": role,
+                "content": content,
+                "timestamp": (stamped + timedelta(microseconds=n)).isoformat(),
+                "model": "deepseek-chat" if role == "assistant" else None
+            })
+            for n, (role, content) in enumerate(write)
+        ])
+        stored += write
+        conversation.append(answer)
+    return conversation
+
+async def compacted(memory_manager, conversation_id):
+    messages = await memory_manager.get_messages(conversation_id, TEST_USER)
+    return [(msg["role"], msg["content"]) for msg in messages], [msg["seq"] for msg in messages]
+
+async def main():
+    memory_manager = MemoryManager()
+    redis_client = await memory_manager._get_redis()
+    results = []
+
+    header("Conversation compaction test")
+
+    try:
+        for full_history in (True, False):
+            label = "whole conversation" if full_history else "new turn only"
+            conversation_id = f"legacy_{'full' if full_history else 'turn'}"
+            conversation = await write_legacy(redis_client, conversation_id, QUESTIONS, full_history)
+
+            before = await redis_client.llen(read_keys(TEST_USER).conversation(conversation_id))
+            dry_run = await memory_manager.compact_conversation(conversation_id, TEST_USER, dry_run=True)
+            check(results, f"Clients sending the {label}: a dry run counts the duplicates",
+                  dry_run == {"before": before, "after": len(conversation)}, str(dry_run))
+            result = await memory_manager.compact_conversation(conversation_id, TEST_USER)
+            messages, seqs = await compacted(memory_manager, conversation_id)
+            check(results, f"Clients sending the {label}: the real conversation is left",
+                  messages == conversation and result == dry_run, f"{before} → {len(messages)} messages")
+            check(results, f"Clients sending the {label}: numbered from 0", seqs == list(range(len(conversation))))
+
+        # A client sending the whole conversation keeps a question that failed
+        conversation = await write_legacy(redis_client, "legacy_failed", QUESTIONS, True, unanswered={"And a string?"})
+        await memory_manager.compact_conversation("legacy_failed", TEST_USER)
+        messages, _ = await compacted(memory_manager, "legacy_failed")
+        check(results, "A failed question the client kept is stored once", messages == conversation,
+              f"{messages.count(('user', 'And a string?'))} copies")
+
+        result = await memory_manager.compact_conversation("legacy_full", TEST_USER)
+        check(results, "Compacting again changes nothing", result["before"] == result["after"] == len(QUESTIONS) * 2)
+    finally:
+        await delete_keys(redis_client, f"*{TEST_USER}*")
+
+    return passed(results, "compaction checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Conformance test of the conversation store backends: the same checks run
+against MemoryManager (Redis) and SQLiteConversationStore, so both keep the
+contract of ConversationStore that the chat API relies on.
+Run this against a local Redis with: python test_conversation_store.py
+Pass "redis" or "sqlite" to test one backend only.
+
+The test users' Redis keys and the temporary SQLite file are removed afterwards.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from app.services.memory import MemoryManager
+from app.services.sqlite_store import SQLiteConversationStore
+from check_utils import check, delete_keys, passed, run
+
+RUN = uuid.uuid4().hex[:8]
+TEST_USER = f"test_store_{RUN}"
+OTHER_USER = f"test_store_other_{RUN}"
+
+LIMITS = {"messages_per_conversation": 10, "conversations": 4, "bytes": 1024 * 1024}
+
+def turn(i, topic="storage"):
+    return [
+        {"role": "user", "content": f"Question {i} about {topic} backends"},
+        {"role": "assistant", "content": f"Answer {i}"}
+    ]
+
+async def conformance(store, results):
+    next_seq = await store.store_conversation("conv_a", TEST_USER, turn(0), "deepseek")
+    check(results, "Appends return the next seq", next_seq == 2, str(next_seq))
+    context = await store.get_context("conv_a", TEST_USER)
+    next_seq = await store.store_conversation("conv_a", TEST_USER, context + turn(1), "deepseek")
+    check(results, "Stored messages passed back are skipped", next_seq == 4, str(next_seq))
+    check(results, "Nothing new stores nothing",
+          await store.store_conversation("conv_a", TEST_USER, context, "deepseek") is None)
+
+    context = await store.get_context("conv_a", TEST_USER, max_messages=3)
+    check(results, "Context is the newest messages, oldest first",
+          [msg["seq"] for msg in context] == [1, 2, 3], str([msg["seq"] for msg in context]))
+    check(results, "Messages keep their fields",
+          context[-1]["content"] == "Answer 1" and context[-1]["model"] == "deepseek"
+          and context[-2]["model"] is None and context[-1]["id"] and context[-1]["timestamp"])
+    check(results, "Unknown conversations have no context",
+          await store.get_context("missing", TEST_USER) == [])
+
+    # Concurrent writers to one conversation get distinct seqs
+    await asyncio.gather(*[
+        store.store_conversation("conv_b", TEST_USER, turn(i, "concurrent"), "glm") for i in range(20)
+    ])
+    context = await store.get_context("conv_b", TEST_USER, max_messages=100)
+    check(results, "Concurrent appends allocate distinct seqs",
+          [msg["seq"] for msg in context] == list(range(40)), f"{len(context)} messages")
+
+    await asyncio.sleep(0.01)
+    await store.store_conversation("conv_c", TEST_USER, turn(0, "listing"), "qwen")
+    await store.set_title("conv_a", TEST_USER, "Backends")
+    listed = await store.get_user_conversations(TEST_USER)
+    check(results, "Listing is newest first", [conv["id"] for conv in listed] == ["conv_c", "conv_b", "conv_a"],
+          str([conv["id"] for conv in listed]))
+    by_id = {conv["id"]: conv for conv in listed}
+    check(results, "Listing records the last message and count",
+          by_id["conv_b"]["message_count"] == 40 and by_id["conv_c"]["last_message"] == "Answer 0"
+          and by_id["conv_c"]["role"] == "assistant")
+    check(results, "Titles are set, or fall back to the last message",
+          by_id["conv_a"]["title"] == "Backends" and by_id["conv_c"]["title"] == "Answer 0")
+    check(results, "Listing is limited", len(await store.get_user_conversations(TEST_USER, limit=2)) == 2)
+
+    await store.store_conversation("conv_x", OTHER_USER, turn(0), "deepseek")
+    found = await store.search_memories(TEST_USER, "storage")
+    check(results, "Search finds the user's messages",
+          sorted(hit["message"]["seq"] for hit in found) == [0, 2] and all(hit["conversation_id"] == "conv_a" for hit in found),
+          str(len(found)))
+    found = await store.search_memories(TEST_USER, "concurr", limit=5)
+    check(results, "Search matches prefixes, up to the limit", len(found) == 5 and found[0]["score"] > 0)
+    check(results, "Search finds nothing for stopwords", await store.search_memories(TEST_USER, "the and") == [])
+
+    for i in range(8):
+        await store.store_conversation("conv_d", TEST_USER, turn(i, "trimming"), "deepseek", LIMITS)
+    context = await store.get_context("conv_d", TEST_USER, max_messages=100)
+    check(results, "Long conversations are trimmed to their cap",
+          len(context) <= LIMITS["messages_per_conversation"] and context[-1]["seq"] == 15, f"{len(context)} messages")
+    for i in range(3):
+        await store.store_conversation(f"conv_e{i}", TEST_USER, turn(i), "deepseek", LIMITS)
+    listed = [conv["id"] for conv in await store.get_user_conversations(TEST_USER)]
+    check(results, "The oldest conversations leave over the conversation cap",
+          len(listed) <= LIMITS["conversations"] and "conv_e2" in listed and "conv_a" not in listed, str(listed))
+
+    await store.clear_conversation("conv_e2", TEST_USER)
+    listed = [conv["id"] for conv in await store.get_user_conversations(TEST_USER)]
+    check(results, "Cleared conversations are gone",
+          "conv_e2" not in listed and await store.get_context("conv_e2", TEST_USER) == []
+          and not any(hit["conversation_id"] == "conv_e2" for hit in await store.search_memories(TEST_USER, "question")))
+    check(results, "Other users are untouched", len(await store.get_context("conv_x", OTHER_USER)) == 2)
+
+async def run_redis(results):
+    store = MemoryManager()
+    redis_client = await store._get_redis()
+    try:
+        await conformance(store, results)
+    finally:
+        for user_id in (TEST_USER, OTHER_USER):
+            await delete_keys(redis_client, f"*{user_id}*")
+
+async def run_sqlite(results):
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteConversationStore(os.path.join(directory, "memory.db"))
+        try:
+            await conformance(store, results)
+        finally:
+            await store.close()
+
+async def main():
+    backends = sys.argv[1:] or ["redis", "sqlite"]
+    results = []
+
+    print("🚀 Conversation store conformance test")
+    for backend in backends:
+        print("=" * 50)
+        print(f"Backend: {backend}")
+        await {"redis": run_redis, "sqlite": run_sqlite}[backend](results)
+
+    return passed(results, "conformance checks")
+
+if __name__ == "__main__":
+    run(main)
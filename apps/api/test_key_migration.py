@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the online move of a user's keys to the hash-tagged
+layout: dual writes, the backfill, reads after each layout switch, a
+rollback, and the cleanup of legacy keys.
+Run this against a local Redis with: python test_key_migration.py
+
+Only the test user's keys are migrated; they are removed afterwards.
+"""
+
+import uuid
+from redis.crc import key_slot
+from app.core.config import settings
+from app.core.redis_keys import parse_user_key
+from app.services.context_cache import context_cache
+from app.services.key_migration import KeyMigration
+from app.services.memory import MemoryManager
+from check_utils import check, delete_keys, header, passed, run
+
+RUN = uuid.uuid4().hex[:8]
+TEST_USER = f"test_keys_{RUN}"
+
+def switch(layout):
+    """Change layout as a worker restart would, with an empty context cache"""
+    settings.REDIS_KEY_LAYOUT = layout
+    context_cache.clear()
+
+async def snapshot(memory_manager):
+    """What the user's reads return, with volatile fields dropped"""
+    conversations = await memory_manager.get_user_conversations(TEST_USER)
+    for conv in conversations:
+        conv.pop("timestamp")
+    return {
+        "conversations": conversations,
+        "context": await memory_manager.get_context("conv_0", TEST_USER, include_summary=True),
+        "page": await memory_manager.get_message_page("conv_1", TEST_USER, limit=3),
+        "search": await memory_manager.search(TEST_USER, "sharding slots")
+    }
+
+async def user_keys(redis_client):
+    keys = [key async for key in redis_client.scan_iter(match=f"*{TEST_USER}*", count=1000)]
+    return [parse_user_key(key) for key in keys if parse_user_key(key)]
+
+async def store(memory_manager, conversation_id, text):
+    await memory_manager.store_conversation(conversation_id, TEST_USER, [
+        {"role": "user", "content": f"{text} about sharding slots"},
+        {"role": "assistant", "content": f"Reply to {text.lower()} on hash tags"}
+    ], "deepseek")
+
+async def main():
+    memory_manager = MemoryManager()
+    redis_client = await memory_manager._get_redis()
+    migration = KeyMigration(redis_client, user_id=TEST_USER)
+    results = []
+
+    header("Redis key layout migration test")
+
+    saved = settings.REDIS_KEY_LAYOUT
+    try:
+        switch("legacy")
+        for i in range(3):
+            await store(memory_manager, f"conv_{i}", f"Question {i}")
+        await memory_manager.store_summary("conv_0", TEST_USER, "Earlier talk about clusters", 1)
+        await memory_manager.set_title("conv_1", TEST_USER, "Sharding")
+
+        switch("migrating")
+        await store(memory_manager, "conv_1", "Follow-up")
+        await store(memory_manager, "conv_3", "Question 3")
+        before = await snapshot(memory_manager)
+        tagged = {key.family for key in await user_keys(redis_client) if key.tagged}
+        check(results, "Dual writes reach the tagged layout", "conversations" in tagged, str(sorted(tagged)))
+
+        totals = await migration.backfill()
+        verified = await migration.verify()
+        check(results, "Backfill copies every legacy key", verified["missing"] == 0 and totals["copied"] > 0,
+              f"{totals['copied']} copied, {verified}")
+
+        switch("migrated")
+        check(results, "Tagged reads match legacy reads", await snapshot(memory_manager) == before)
+
+        await store(memory_manager, "conv_0", "Late question")
+        migrated = await snapshot(memory_manager)
+        switch("migrating")
+        check(results, "Rolling back to legacy reads loses no write", await snapshot(memory_manager) == migrated)
+
+        await memory_manager.clear_conversation("conv_3", TEST_USER)
+        left = [key for key in await user_keys(redis_client) if key.rest == ":conv_3"]
+        check(results, "Clearing a conversation removes both layouts' keys", left == [], str(left))
+        cleared = await snapshot(memory_manager)
+
+        switch("tagged")
+        removed = await migration.cleanup()
+        keys = await user_keys(redis_client)
+        check(results, "Cleanup leaves only tagged keys", removed > 0 and all(key.tagged for key in keys),
+              f"{removed} removed")
+        slots = {key_slot(key.in_layout(True).encode()) for key in keys}
+        check(results, "Every key of the user is in one cluster slot", len(slots) == 1, f"{len(keys)} keys")
+        check(results, "Reads after cleanup are unchanged", await snapshot(memory_manager) == cleared)
+    finally:
+        settings.REDIS_KEY_LAYOUT = saved
+        await delete_keys(redis_client, f"*{TEST_USER}*")
+
+    return passed(results, "migration checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test script to verify every MemoryManager operation costs a constant number
+of Redis round trips, whatever the message or conversation count.
+Run this against a local Redis with: python test_memory_round_trips.py
+
+Round trips are counted at the connection level: a pipeline or a script call
+is one packet sent to Redis and counts once.
+"""
+
+import uuid
+from redis.asyncio.connection import AbstractConnection
+from app.services.memory import MemoryManager
+from check_utils import delete_keys, header, run
+
+TEST_USER = f"test_round_trips_{uuid.uuid4().hex[:8]}"
+SMALL, LARGE = 1, 50
+
+# Expected round trips per call
+EXPECTED = {
+    "store_conversation": 1,
+    "get_context": 1,
+    "get_context (summary)": 1,
+    "get_messages": 1,
+    "get_message_page": 1,
+    "get_summary": 1,
+    "store_summary": 1,
+    "get_user_conversations": 1,
+    "set_title": 1,
+    "search_memories": 2,
+    "compact_conversation": 5,
+    "clear_conversation": 2,
+}
+
+class RoundTripCounter:
+    """Counts packets sent to Redis while active"""
+
+    def __init__(self):
+        self.count = 0
+        self.original = AbstractConnection.send_packed_command
+
+    def __enter__(self):
+        counter = self
+        original = self.original
+
+        async def counting_send(connection, command, check_health=True):
+            counter.count += 1
+            return await original(connection, command, check_health)
+
+        AbstractConnection.send_packed_command = counting_send
+        return self
+
+    def __exit__(self, *exc):
+        AbstractConnection.send_packed_command = self.original
+
+async def count_round_trips(coro):
+    with RoundTripCounter() as counter:
+        await coro
+    return counter.count
+
+def messages(count, tag):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{tag} message {i}"}
+        for i in range(count)
+    ]
+
+async def measure(memory_manager, size):
+    """Round trips of each operation when it touches `size` messages/conversations"""
+    conv_id = f"conv_{size}_{uuid.uuid4().hex[:8]}"
+    counts = {}
+
+    counts["store_conversation"] = await count_round_trips(
+        memory_manager.store_conversation(conv_id, TEST_USER, messages(size, "store"), "deepseek")
+    )
+    # More conversations for the listing and search operations
+    for i in range(size - 1):
+        await memory_manager.store_conversation(
+            f"{conv_id}_{i}", TEST_USER, messages(2, "needle"), "deepseek"
+        )
+
+    counts["get_context"] = await count_round_trips(
+        memory_manager.get_context(conv_id, TEST_USER, max_messages=size)
+    )
+    counts["store_summary"] = await count_round_trips(
+        memory_manager.store_summary(conv_id, TEST_USER, "Summary", max(1, size // 2))
+    )
+    counts["get_context (summary)"] = await count_round_trips(
+        memory_manager.get_context(conv_id, TEST_USER, max_messages=size, include_summary=True)
+    )
+    counts["get_messages"] = await count_round_trips(
+        memory_manager.get_messages(conv_id, TEST_USER)
+    )
+    counts["get_message_page"] = await count_round_trips(
+        memory_manager.get_message_page(conv_id, TEST_USER, limit=size, before=size)
+    )
+    counts["get_summary"] = await count_round_trips(
+        memory_manager.get_summary(conv_id, TEST_USER)
+    )
+    counts["set_title"] = await count_round_trips(
+        memory_manager.set_title(conv_id, TEST_USER, "Title")
+    )
+    counts["get_user_conversations"] = await count_round_trips(
+        memory_manager.get_user_conversations(TEST_USER, limit=size)
+    )
+    counts["search_memories"] = await count_round_trips(
+        memory_manager.search_memories(TEST_USER, "message", limit=size)
+    )
+    counts["compact_conversation"] = await count_round_trips(
+        memory_manager.compact_conversation(conv_id, TEST_USER)
+    )
+    counts["clear_conversation"] = await count_round_trips(
+        memory_manager.clear_conversation(conv_id, TEST_USER)
+    )
+    return counts
+
+async def cleanup(memory_manager):
+    redis_client = await memory_manager._get_redis()
+    await delete_keys(redis_client, f"*{TEST_USER}*")
+
+async def main(memory_manager=None):
+    memory_manager = memory_manager or MemoryManager()
+
+    header("MemoryManager round-trip test")
+
+    # Warm up the connection and load the Lua scripts
+    await memory_manager.store_conversation("warmup", TEST_USER, messages(1, "warmup"), "deepseek")
+    await memory_manager.set_title("warmup", TEST_USER, "Warmup")
+    await memory_manager.get_user_conversations(TEST_USER)
+    await memory_manager.search_memories(TEST_USER, "warmup")
+    await memory_manager.get_messages("warmup", TEST_USER)
+
+    failures = 0
+    try:
+        small = await measure(memory_manager, SMALL)
+        large = await measure(memory_manager, LARGE)
+
+        for operation, expected in EXPECTED.items():
+            ok = small[operation] == large[operation] == expected
+            failures += not ok
+            print(f"{'✅' if ok else '❌'} {operation:>24}: "
+                  f"{small[operation]} round trip(s) at n={SMALL}, "
+                  f"{large[operation]} at n={LARGE} (expected {expected})")
+    finally:
+        await cleanup(memory_manager)
+
+    print("\n" + ("✅ All operations use a constant number of round trips" if not failures
+                  else f"❌ {failures} operation(s) failed"))
+    return failures == 0
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test script to verify conversation memory works on Redis Cluster with the
+hash-tagged key layout: every key of a user lands in one slot, and the Lua
+scripts (including those building a branch's ancestors' keys), pipelines,
+export/import and purges work across the cluster.
+Run this against a local multi-node cluster (e.g. redis/create-cluster, or
+redis-cli --cluster create on ports 7000-7005) with:
+
+  REDIS_CLUSTER_URL=redis://localhost:7000 python test_redis_cluster.py
+
+The test users' keys are removed afterwards.
+"""
+
+import asyncio
+import os
+import uuid
+from redis.asyncio.cluster import RedisCluster
+from app.core.config import settings
+from app.core.redis_keys import parse_user_key
+from app.core.redis_pool import open_pubsub
+from app.services.context_cache import INVALIDATION_CHANNEL
+from app.services.memory import MemoryManager
+from app.services.purge import UserDataPurger
+from check_utils import check, header, passed, run
+
+CLUSTER_URL = os.getenv("REDIS_CLUSTER_URL", "redis://localhost:7000")
+RUN = uuid.uuid4().hex[:8]
+TEST_USERS = [f"test_cluster_{RUN}_{i}" for i in range(4)]
+
+async def user_keys(redis_client, user_id):
+    # scan_iter walks every primary of the cluster
+    keys = []
+    async for key in redis_client.scan_iter(match=f"*{user_id}*", count=1000):
+        parsed = parse_user_key(key)
+        if parsed is not None and parsed.user_id == user_id:
+            keys.append(key)
+    return keys
+
+async def lines_of(chunks):
+    async for chunk in chunks:
+        for line in chunk.splitlines():
+            yield line
+
+async def main():
+    redis_client = RedisCluster.from_url(CLUSTER_URL, decode_responses=True)
+    await redis_client.initialize()
+    saved = settings.REDIS_KEY_LAYOUT
+    settings.REDIS_KEY_LAYOUT = "tagged"
+    memory_manager = MemoryManager(redis_client)
+    results = []
+
+    header("Redis Cluster test")
+    print(f"Nodes: {len(redis_client.get_primaries())} primaries")
+
+    try:
+        for user_id in TEST_USERS[:3]:
+            for i in range(3):
+                await memory_manager.store_conversation(f"conv_{i}", user_id, [
+                    {"role": "user", "content": f"How do hash slots place conversation {i}?"},
+                    {"role": "assistant", "content": f"Hash tags keep conversation {i} with its user"}
+                ], "deepseek")
+            await memory_manager.store_summary("conv_0", user_id, "Talk about slots", 1)
+            await memory_manager.set_title("conv_1", user_id, "Slots")
+
+        # Branches two levels deep: appending, forking and reading them walk
+        # their lineage, building the ancestors' keys in the script
+        user_id = TEST_USERS[0]
+        for parent, branch_id in (("conv_1", "branch"), ("branch", "deep")):
+            await memory_manager.fork_conversation(parent, user_id, branch_id=branch_id)
+            await memory_manager.store_conversation(branch_id, user_id, [
+                {"role": "user", "content": f"Where does the {branch_id} conversation go on?"},
+                {"role": "assistant", "content": f"The {branch_id} conversation goes on with its user"}
+            ], "deepseek")
+        slots = {}
+        for test_user in TEST_USERS[:3]:
+            keys = await user_keys(redis_client, test_user)
+            slots[test_user] = {redis_client.keyslot(key) for key in keys}
+        check(results, "Each user's keys share one slot, branches included", all(len(found) == 1 for found in slots.values()),
+              str({user[-1]: sorted(found) for user, found in slots.items()}))
+        nodes = {redis_client.get_node_from_key(f"user_convs:{{{user}}}").name for user in TEST_USERS[:3]}
+        check(results, "Users spread over nodes", len(nodes) > 1 or len(redis_client.get_primaries()) == 1,
+              f"{len(nodes)} nodes")
+
+        context = await memory_manager.get_context("conv_0", user_id, include_summary=True)
+        check(results, "Context reads back with its summary",
+              len(context) == 2 and context[0].get("summary"), str([msg["role"] for msg in context]))
+        listed = await memory_manager.get_user_conversations(user_id)
+        check(results, "Conversations are listed", len(listed) == 5 and any(c["title"] == "Slots" for c in listed))
+        found = await memory_manager.search(user_id, "hash slots")
+        check(results, "Search runs as one script on the user's node", found["total"] == 6, str(found["total"]))
+        page = await memory_manager.get_message_page("conv_2", user_id, limit=1)
+        check(results, "Pages read back", page["last"] == 1 and page["has_more"])
+        context = await memory_manager.get_context("deep", user_id)
+        check(results, "A branch reads its ancestors' messages", [msg["seq"] for msg in context] == list(range(6)),
+              str([msg["seq"] for msg in context]))
+        ancestors = [f"conv:{{{user_id}}}:{conversation_id}" for conversation_id in ("conv_1", "branch")]
+        for key in ancestors:
+            await redis_client.expire(key, 60)
+        await memory_manager.store_conversation("deep", user_id, [{"role": "user", "content": "And then?"}], "deepseek")
+        ttls = [await redis_client.ttl(key) for key in ancestors]
+        check(results, "Appending to a branch refreshes its ancestors", all(ttl > 60 for ttl in ttls), str(ttls))
+
+        exported = lines_of(memory_manager.export_conversations(user_id))
+        totals = await memory_manager.import_conversations(TEST_USERS[3], exported)
+        check(results, "Export imports into another user", totals["imported"] == 5, str(totals))
+
+        await memory_manager.clear_conversation("conv_2", user_id)
+        left = [key for key in await user_keys(redis_client, user_id) if key.endswith(":conv_2")]
+        check(results, "Clearing a conversation removes its keys", left == [], str(left))
+        await memory_manager.clear_conversation("branch", user_id)
+        context = await memory_manager.get_context("deep", user_id)
+        check(results, "Clearing a parent hands its branch the shared messages",
+              [msg["seq"] for msg in context] == list(range(7)))
+
+        pubsub = open_pubsub(redis_client, ignore_subscribe_messages=True)
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        await redis_client.publish(INVALIDATION_CHANNEL, "{}")
+        message = await pubsub.get_message(timeout=2.0)
+        await pubsub.aclose()
+        check(results, "Invalidations reach a node's subscriber", message is not None)
+
+        purger = UserDataPurger(memory_manager)
+        await purger.start(TEST_USERS[1])
+        while purger.tasks:
+            await asyncio.sleep(0.05)
+        progress = await purger.progress(TEST_USERS[1])
+        check(results, "A purge scans only the user's node", progress["status"] == "done"
+              and not await user_keys(redis_client, TEST_USERS[1]), f"{progress['keys_deleted']} keys")
+        check(results, "Other users survive the purge", len(await user_keys(redis_client, TEST_USERS[2])) > 0)
+    finally:
+        settings.REDIS_KEY_LAYOUT = saved
+        for test_user in TEST_USERS:
+            for key in await user_keys(redis_client, test_user):
+                await redis_client.unlink(key)
+            await redis_client.unlink(f"purge:job:{test_user}")
+        await redis_client.aclose()
+
+    return passed(results, "cluster checks")
+
+if __name__ == "__main__":
+    run(main)
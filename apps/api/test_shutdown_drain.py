@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script to verify SIGTERM drains generations before the server stops
+listening: the server started by app.server keeps answering, /health
+reports draining and new generations are rejected until the running one
+finished, and only then does it close its listeners.
+Run this against a local Redis with: python test_shutdown_drain.py
+
+The server listens on a free local port; SIGTERM is sent to this process.
+"""
+
+import asyncio
+import os
+import signal
+import time
+import httpx
+import uvicorn
+from app.core.admission import AdmissionRejected, admission_controller
+from app.core.config import settings
+from app.main import app
+from app.server import DrainingServer
+from check_utils import check, header, passed, run
+
+HEALTH_GRACE = 0.5
+
+async def health(client, url):
+    """/health's status code, or None once the server stopped listening"""
+    try:
+        return (await client.get(f"{url}/health")).status_code
+    except httpx.TransportError:
+        return None
+
+async def main():
+    results = []
+    grace = settings.SHUTDOWN_HEALTH_GRACE
+    settings.SHUTDOWN_HEALTH_GRACE = HEALTH_GRACE
+    # uvicorn >= 0.29 raises the signals it captured again once stopped
+    default_sigterm = signal.signal(signal.SIGTERM, lambda signum, frame: None)
+
+    header("Shutdown drain test")
+
+    server = DrainingServer(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}"
+
+        async with httpx.AsyncClient(timeout=2) as client:
+            check(results, "Before SIGTERM the server is healthy", await health(client, url) == 200)
+
+            generation = await admission_controller.acquire("test_drain_user")
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(0.2)
+            check(results, "After SIGTERM the server still listens and reports draining",
+                  await health(client, url) == 503 and not serving.done())
+            try:
+                await admission_controller.acquire("test_drain_other")
+                rejected = False
+            except AdmissionRejected as e:
+                rejected = e.status_code == 503
+            check(results, "New generations are rejected", rejected)
+
+            await asyncio.sleep(HEALTH_GRACE * 2)
+            check(results, "It keeps listening past the grace while a generation runs",
+                  await health(client, url) == 503 and not serving.done())
+
+            generation.release()
+            released = time.monotonic()
+            await asyncio.wait_for(serving, timeout=settings.SHUTDOWN_DRAIN_TIMEOUT)
+            check(results, "Once the generation finished the server stops",
+                  time.monotonic() - released < 5, f"{time.monotonic() - released:.1f}s after the release")
+            check(results, "and stops listening", await health(client, url) is None)
+    finally:
+        if not serving.done():
+            server.should_exit = True
+            await serving
+        settings.SHUTDOWN_HEALTH_GRACE = grace
+        signal.signal(signal.SIGTERM, default_sigterm)
+
+    return passed(results, "shutdown drain checks")
+
+if __name__ == "__main__":
+    run(main)
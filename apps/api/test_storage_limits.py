@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script to verify per-tier storage caps: long conversations are trimmed
+after the trim hook has seen their oldest messages, and the least recently
+updated conversations leave Redis once a user has too many or too large ones.
+Run this against a local Redis with: python test_storage_limits.py
+
+The test user's keys are removed afterwards.
+"""
+
+import json
+import uuid
+from app.core.config import settings
+from app.core.redis_keys import read_keys
+from app.services.memory import MemoryManager
+from check_utils import check, delete_keys, header, passed, run
+
+TEST_USER = f"test_storage_{uuid.uuid4().hex[:8]}"
+
+# Small caps, trimmed down to STORAGE_TRIM_RATIO of them
+LIMITS = {"messages_per_conversation": 20, "conversations": 5, "bytes": 64 * 1024}
+
+async def store_turns(memory_manager, conversation_id, count, padding=0):
+    for i in range(count):
+        # Random padding, so compression can't shrink it
+        filler = " ".join(uuid.uuid4().hex for _ in range(padding))
+        await memory_manager.store_conversation(conversation_id, TEST_USER, [
+            {"role": "user", "content": f"Question {i} about trimming {filler}"},
+            {"role": "assistant", "content": f"Answer {i}"}
+        ], "deepseek", LIMITS)
+
+async def stored_bytes(redis_client):
+    """The user's byte counter and the sum of the listing records' sizes"""
+    keys = read_keys(TEST_USER)
+    total = await redis_client.get(keys.stored_bytes)
+    records = await redis_client.hvals(keys.records)
+    return int(total or 0), sum(json.loads(record).get("bytes", 0) for record in records)
+
+async def main():
+    trimmed = []
+
+    async def trim_hook(user_id, conversation_id, messages):
+        trimmed.append((conversation_id, [msg["seq"] for msg in messages]))
+        return True
+
+    memory_manager = MemoryManager(trim_hook=trim_hook)
+    redis_client = await memory_manager._get_redis()
+    keys = read_keys(TEST_USER)
+    ratio = settings.STORAGE_TRIM_RATIO
+    results = []
+
+    header("Storage limits test")
+
+    try:
+        # 12 turns = 24 messages, over the cap of 20
+        await store_turns(memory_manager, "long", 12)
+        await memory_manager.store_summary("long", TEST_USER, "Earlier turns", 6)
+        length = await redis_client.llen(keys.conversation("long"))
+        check(results, "Long conversation trimmed below its cap", length <= LIMITS["messages_per_conversation"],
+              f"{length} messages")
+        check(results, "Trim hook saw the oldest messages first",
+              trimmed and trimmed[0][0] == "long" and trimmed[0][1][0] == 0,
+              str(trimmed[0][1] if trimmed else None))
+
+        page = await memory_manager.get_message_page("long", TEST_USER, limit=3)
+        check(results, "Seqs survive the trim", page["last"] == 23, f"last {page['last']}")
+        first = 24 - length
+        page = await memory_manager.get_message_page("long", TEST_USER, limit=2, after=first)
+        check(results, "Cursors read a trimmed list",
+              [msg["seq"] for msg in page["messages"]] == [first + 1, first + 2], str(page["first"]))
+        found = await memory_manager.search(TEST_USER, "trimming")
+        seqs = sorted(hit["message"]["seq"] for hit in found["results"])
+        check(results, "Trimmed messages left the search index",
+              found["total"] == (24 - first) // 2 and all(seq >= first for seq in seqs), str(found["total"]))
+
+        await store_turns(memory_manager, "long", 3)
+        summary = await memory_manager.get_summary("long", TEST_USER)
+        context = await memory_manager.get_context("long", TEST_USER, max_messages=50, include_summary=True)
+        check(results, "Summary coverage holds across trims", summary["covered"] == 6 and
+              context[1]["seq"] == 30 - await redis_client.llen(keys.conversation("long")), str(summary))
+
+        # Five more conversations: one over the cap of 5
+        for i in range(5):
+            await store_turns(memory_manager, f"conv_{i}", 1)
+        conversations = await redis_client.zrange(keys.conversations, 0, -1)
+        check(results, "Oldest conversations evicted over the conversation cap",
+              len(conversations) == int(LIMITS["conversations"] * ratio) and "long" not in conversations
+              and "conv_4" in conversations, str(conversations))
+        check(results, "Evicted conversations' keys are gone",
+              not await redis_client.exists(keys.conversation("long"), keys.meta("long"), keys.summary("long")))
+
+        # Large messages: over the byte cap
+        for i in range(3):
+            await store_turns(memory_manager, f"big_{i}", 2, padding=700)
+        conversations = await redis_client.zrange(keys.conversations, 0, -1)
+        total, recorded = await stored_bytes(redis_client)
+        check(results, "Stored bytes stay under the byte cap", total <= LIMITS["bytes"], f"{total} bytes")
+        check(results, "Byte counter matches the listing records", total == recorded, f"{total} vs {recorded}")
+        check(results, "Oldest large conversations evicted", conversations == ["big_1", "big_2"], str(conversations))
+
+        await memory_manager.clear_conversation("big_2", TEST_USER)
+        total, recorded = await stored_bytes(redis_client)
+        check(results, "Clearing a conversation releases its bytes", total == recorded, f"{total} vs {recorded}")
+    finally:
+        await delete_keys(redis_client, f"*{TEST_USER}*")
+
+    return passed(results, "storage limit checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the subscription tier cache: tiers are queried once,
+off the event loop, then served from the worker's memory or Redis; aging
+tiers are reloaded in the background; a webhook's invalidation reaches
+every worker at once.
+Run this against a local Redis with: python test_tier_cache.py
+
+Two TierCache instances stand for two workers. Supabase is replaced by a
+slow loader that counts its queries. The test users' keys are removed
+afterwards.
+"""
+
+import asyncio
+import time
+import uuid
+from app.core.config import settings
+from app.core.redis_keys import read_keys
+from app.core.redis_pool import redis_manager
+from app.services.subscription import SubscriptionService, SubscriptionTier
+from app.services.tier_cache import TierCache, tier_cache
+from check_utils import check, header, passed, run
+
+RUN = uuid.uuid4().hex[:8]
+# Not test_ users: those get their tier without a lookup
+TEST_USERS = [f"tier_cache_{RUN}_{i}" for i in range(3)]
+
+class SlowSupabase:
+    """Blocking tier queries, as the Supabase client makes them"""
+
+    def __init__(self):
+        self.tiers = {}
+        self.queries = 0
+        self.fail = False
+
+    def __call__(self, user_id):
+        self.queries += 1
+        time.sleep(0.2)
+        if self.fail:
+            raise ConnectionError("Supabase unavailable")
+        return self.tiers.get(user_id, "FREE")
+
+async def subscribed(*caches):
+    for _ in range(50):
+        if all(cache.subscribed for cache in caches):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+async def main():
+    redis_client = redis_manager.get_client()
+    supabase = SlowSupabase()
+    worker_a, worker_b = TierCache(), TierCache()
+    worker_a.start(redis_client)
+    worker_b.start(redis_client)
+    saved = settings.TIER_CACHE_TTL, settings.TIER_CACHE_REFRESH_AFTER
+    results = []
+
+    header("Tier cache test")
+
+    try:
+        check(results, "Both workers subscribe to invalidations", await subscribed(worker_a, worker_b))
+        user_id = TEST_USERS[0]
+        supabase.tiers[user_id] = "STARTER"
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.create_task(ticker())
+        tiers = await asyncio.gather(*[worker_a.get(redis_client, user_id, supabase) for _ in range(5)])
+        ticking.cancel()
+        check(results, "Concurrent lookups share one query", tiers == ["STARTER"] * 5 and supabase.queries == 1,
+              f"{supabase.queries} queries")
+        check(results, "The query doesn't block the event loop", ticks >= 10, f"{ticks} ticks during the query")
+
+        started = time.perf_counter()
+        tier = await worker_a.get(redis_client, user_id, supabase)
+        elapsed = (time.perf_counter() - started) * 1000
+        check(results, "Lookups are then served from the worker's memory",
+              tier == "STARTER" and supabase.queries == 1 and worker_a.requests["local"] == 1, f"{elapsed:.3f} ms")
+        tier = await worker_b.get(redis_client, user_id, supabase)
+        check(results, "Other workers read the tier from Redis",
+              tier == "STARTER" and supabase.queries == 1 and worker_b.requests["redis"] == 1)
+
+        # The webhook upgrades the user on worker A
+        supabase.tiers[user_id] = "PRO"
+        await worker_a.invalidate(redis_client, user_id, "PRO")
+        await asyncio.sleep(0.2)
+        check(results, "Invalidation drops other workers' copies", user_id not in worker_b.entries)
+        tier = await worker_b.get(redis_client, user_id, supabase)
+        check(results, "The new tier applies everywhere without a query",
+              tier == "PRO" and supabase.queries == 1, tier)
+        await worker_a.invalidate(redis_client, user_id)
+        check(results, "Invalidating without a tier removes the shared copy",
+              not await redis_client.exists(read_keys(user_id).tier))
+
+        # Aging tiers are served while they reload
+        user_id = TEST_USERS[1]
+        await worker_a.get(redis_client, user_id, supabase)
+        queries = supabase.queries
+        settings.TIER_CACHE_REFRESH_AFTER = 0
+        supabase.tiers[user_id] = "STARTER"
+        started = time.perf_counter()
+        tier = await worker_a.get(redis_client, user_id, supabase)
+        elapsed = (time.perf_counter() - started) * 1000
+        check(results, "An aging tier is returned at once", tier == "FREE" and elapsed < 50, f"{elapsed:.1f} ms")
+        await asyncio.gather(*worker_a.refreshing)
+        settings.TIER_CACHE_REFRESH_AFTER = saved[1]
+        tier = await worker_a.get(redis_client, user_id, supabase)
+        check(results, "and reloaded in the background", tier == "STARTER" and supabase.queries == queries + 1)
+
+        settings.TIER_CACHE_TTL = 0
+        tier = await worker_a.get(redis_client, user_id, supabase)
+        check(results, "Expired tiers are queried again", supabase.queries == queries + 2)
+        settings.TIER_CACHE_TTL = saved[0]
+
+        # Supabase down: the service falls back to FREE and caches nothing
+        class Service(SubscriptionService):
+            _query_tier = staticmethod(supabase)
+
+        supabase.fail = True
+        user_id = TEST_USERS[2]
+        tier = await Service(redis_client).get_user_tier(user_id)
+        check(results, "Failed queries fall back to FREE uncached",
+              tier == SubscriptionTier.FREE and user_id not in tier_cache.entries
+              and not await redis_client.exists(read_keys(user_id).tier))
+        supabase.fail = False
+
+        stats = worker_a.stats()
+        check(results, "Hit rate is reported", stats["hit_rate"] is not None and 0 < stats["hit_rate"] < 1, str(stats))
+    finally:
+        settings.TIER_CACHE_TTL, settings.TIER_CACHE_REFRESH_AFTER = saved
+        await worker_a.stop()
+        await worker_b.stop()
+        for user_id in TEST_USERS:
+            await redis_client.delete(read_keys(user_id).tier)
+
+    return passed(results, "tier cache checks")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Test script to verify atomic usage quotas: concurrent requests of a user
+can't pass the daily or monthly limit together, each check-and-reserve is
+one round trip, token and cost quotas deny requests whose estimated input
+doesn't fit and are settled to what answers used in the counters the usage
+report reads, refunds give usage back and every key layout written is
+counted.
+Run this against a local Redis with: python test_usage_quota.py
+
+The test users' counters are removed afterwards.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime
+from app.core.config import settings
+from app.core.redis_keys import UserKeys
+from app.core.redis_pool import redis_manager
+from app.services.subscription import SubscriptionService, SubscriptionTier, TIER_LIMITS, usage_fields
+from check_utils import check, delete_keys, header, passed, run
+
+RUN = uuid.uuid4().hex[:8]
+# Tiers follow from the ids (see SubscriptionService.get_user_tier)
+FREE_USER = f"test_quota_{RUN}"
+STARTER_USER = f"test_quota_{RUN}_starter"
+PRO_USER = f"test_quota_{RUN}_pro"
+TOKENS_USER = f"test_quota_{RUN}_tokens"
+
+async def counters(redis_client, user_id, tagged=False):
+    """The user's (daily, monthly) message counters in a key layout"""
+    keys = UserKeys(user_id, tagged)
+    today = datetime.now().strftime("%Y-%m-%d")
+    daily, monthly = await redis_client.mget(keys.usage_messages(today), keys.usage_monthly)
+    return int(daily or 0), int(monthly or 0)
+
+async def spend(redis_client, user_id):
+    """The user's day's (tokens, cost in micro-dollars) counted against quotas"""
+    keys = UserKeys(user_id, False)
+    tokens, cost = await redis_client.hmget(keys.usage(datetime.now().strftime("%Y-%m-%d")), "total_tokens", "cost")
+    return int(tokens or 0), int(cost or 0)
+
+class CommandCounter:
+    """Counts the commands a client sends, as round trips outside pipelines"""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.count = 0
+        self.original = redis_client.execute_command
+
+    async def __call__(self, *args, **kwargs):
+        self.count += 1
+        return await self.original(*args, **kwargs)
+
+    def __enter__(self):
+        self.redis_client.execute_command = self
+        return self
+
+    def __exit__(self, *exc):
+        self.redis_client.execute_command = self.original
+
+async def main():
+    redis_client = redis_manager.get_client()
+    service = SubscriptionService(redis_client)
+    daily_limit = TIER_LIMITS[SubscriptionTier.FREE]["daily"]
+    monthly_limit = TIER_LIMITS[SubscriptionTier.STARTER]["monthly"]
+    daily_tokens = TIER_LIMITS[SubscriptionTier.FREE]["daily_tokens"]
+    daily_cost = TIER_LIMITS[SubscriptionTier.FREE]["daily_cost"]
+    layout = settings.REDIS_KEY_LAYOUT
+    results = []
+
+    header("Usage quota test")
+
+    try:
+        allowed, remaining, limit = await service.check_usage_limit(FREE_USER)
+        check(results, "A fresh user has the whole daily limit", (allowed, remaining, limit) == (True, daily_limit, daily_limit),
+              f"{remaining} of {limit}")
+        check(results, "Checking counts nothing", await counters(redis_client, FREE_USER) == (0, 0))
+
+        # More concurrent requests than the limit allows
+        reservations = await asyncio.gather(*[
+            service.reserve_usage(FREE_USER, SubscriptionTier.FREE) for _ in range(daily_limit + 30)
+        ])
+        granted = [r for r in reservations if r.allowed]
+        check(results, "Concurrent requests can't pass the limit together", len(granted) == daily_limit,
+              f"{len(granted)} of {len(reservations)} allowed")
+        check(results, "Each is told what remains after it",
+              sorted(r.remaining for r in granted) == list(range(daily_limit)))
+        check(results, "Denied requests count nothing", await counters(redis_client, FREE_USER) == (daily_limit, daily_limit))
+        denied = next(r for r in reservations if not r.allowed)
+        check(results, "and report the limit hit", (denied.remaining, denied.limit, denied.units) == (0, daily_limit, 0))
+
+        await service.refund_usage(FREE_USER, granted[0])
+        check(results, "A failed request's message is given back",
+              await counters(redis_client, FREE_USER) == (daily_limit - 1, daily_limit - 1))
+        reservation = await service.reserve_usage(FREE_USER, SubscriptionTier.FREE)
+        check(results, "and can be used again", reservation.allowed and reservation.remaining == 0)
+
+        with CommandCounter(redis_client) as commands:
+            await service.reserve_usage(FREE_USER, SubscriptionTier.FREE)
+            await service.check_usage_limit(FREE_USER, SubscriptionTier.FREE)
+        check(results, "A reservation or check is one round trip", commands.count == 2, f"{commands.count} commands for both")
+
+        # Several messages at once, as a per-model comparison reserves them
+        await redis_client.set(UserKeys(STARTER_USER, False).usage_monthly, monthly_limit - 2)
+        reservation = await service.reserve_usage(STARTER_USER, SubscriptionTier.STARTER, units=3)
+        check(results, "Too few remaining messages deny the whole reservation",
+              not reservation.allowed and reservation.remaining == 2 and reservation.limit == monthly_limit)
+        reservation = await service.reserve_usage(STARTER_USER, SubscriptionTier.STARTER, units=2)
+        check(results, "Enough of them are reserved together",
+              reservation.allowed and reservation.remaining == 0 and reservation.units == 2
+              and await counters(redis_client, STARTER_USER) == (2, monthly_limit))
+        await service.refund_usage(STARTER_USER, reservation._replace(units=1))
+        check(results, "Part of a reservation can be given back",
+              await counters(redis_client, STARTER_USER) == (1, monthly_limit - 1))
+
+        # Token and cost quotas
+        reservation = await service.reserve_usage(TOKENS_USER, SubscriptionTier.FREE, tokens=daily_tokens + 1)
+        check(results, "An input larger than the token quota is denied",
+              not reservation.allowed and reservation.exceeded == "daily_tokens" and reservation.remaining == daily_tokens
+              and await counters(redis_client, TOKENS_USER) == (0, 0) and await spend(redis_client, TOKENS_USER) == (0, 0))
+        reservation = await service.reserve_usage(TOKENS_USER, SubscriptionTier.FREE, tokens=10, cost=daily_cost * 2)
+        check(results, "and so is one costing more than the budget",
+              not reservation.allowed and reservation.exceeded == "daily_cost" and reservation.limit == daily_cost,
+              f"${reservation.limit}")
+        reservation = await service.reserve_usage(TOKENS_USER, SubscriptionTier.FREE, tokens=1000, cost=0.001)
+        check(results, "The estimated input is reserved with the message",
+              reservation.allowed and await spend(redis_client, TOKENS_USER) == (1000, 1000))
+        with CommandCounter(redis_client) as commands:
+            await service.settle_usage(TOKENS_USER, reservation, 1500, 0.0025, usage_fields("deepseek-chat", 1000, 500))
+        check(results, "and settled to what the answer used in one round trip",
+              await spend(redis_client, TOKENS_USER) == (1500, 2500) and commands.count == 1,
+              str(await spend(redis_client, TOKENS_USER)))
+        usage = await redis_client.hgetall(UserKeys(TOKENS_USER, False).usage(datetime.now().strftime("%Y-%m-%d")))
+        check(results, "The usage report's breakdown is counted with it",
+              (usage.get("input_tokens"), usage.get("output_tokens"), usage.get("model:deepseek-chat:tokens")) == ("1000", "500", "1500"),
+              str(usage))
+        reservation = await service.reserve_usage(TOKENS_USER, SubscriptionTier.FREE, tokens=daily_tokens - 1500)
+        check(results, "The token quota can be used up", reservation.allowed)
+        await service.refund_usage(TOKENS_USER, reservation)
+        check(results, "A refund gives back the reserved tokens",
+              await spend(redis_client, TOKENS_USER) == (1500, 2500) and await counters(redis_client, TOKENS_USER) == (1, 1))
+        await service.increment_usage(TOKENS_USER, units=0, tokens=daily_tokens)
+        reservation = await service.reserve_usage(TOKENS_USER, SubscriptionTier.FREE)
+        allowed, _, limit = await service.check_usage_limit(TOKENS_USER, SubscriptionTier.FREE)
+        check(results, "Once the tokens are used up, so are the messages",
+              not reservation.allowed and reservation.exceeded == "daily_tokens" and not allowed and limit == daily_tokens)
+        usage = await service.get_usage_count(TOKENS_USER)
+        check(results, "Usage counts report tokens and cost",
+              usage["daily_tokens"] == daily_tokens + 1500 and usage["daily_cost"] == 0.0025, str(usage))
+
+        with CommandCounter(redis_client) as commands:
+            reservation = await service.check_usage(PRO_USER, SubscriptionTier.PRO)
+        check(results, "Checking a tier without quotas needs no round trip",
+              reservation.allowed and reservation.units == 0 and commands.count == 0)
+        reservation = await service.reserve_usage(PRO_USER, SubscriptionTier.PRO)
+        check(results, "Unlimited tiers are counted but never limited",
+              reservation.allowed and reservation.remaining == -1 and reservation.limit is None
+              and await counters(redis_client, PRO_USER) == (1, 1))
+        await redis_client.delete(UserKeys(PRO_USER, False).usage_monthly)
+        await service.refund_usage(PRO_USER, reservation)
+        await service.refund_usage(PRO_USER, reservation)
+        check(results, "Refunds never take a counter below zero", await counters(redis_client, PRO_USER) == (0, 0))
+
+        # While keys migrate, both layouts' counters are written
+        settings.REDIS_KEY_LAYOUT = "migrating"
+        reservation = await service.reserve_usage(PRO_USER, SubscriptionTier.PRO)
+        check(results, "Every key layout written is counted",
+              await counters(redis_client, PRO_USER) == (1, 1) and await counters(redis_client, PRO_USER, True) == (1, 1))
+        await service.refund_usage(PRO_USER, reservation)
+        check(results, "and refunded", await counters(redis_client, PRO_USER, True) == (0, 0))
+    finally:
+        settings.REDIS_KEY_LAYOUT = layout
+        for user_id in (FREE_USER, STARTER_USER, PRO_USER, TOKENS_USER):
+            await delete_keys(redis_client, f"usage:*{user_id}*")
+
+    return passed(results, "usage quota checks")
+
+if __name__ == "__main__":
+    run(main)
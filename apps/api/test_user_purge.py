@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Test script to verify a user data purge removes every key family of the
+user, leaves other users alone, and resumes after an interruption.
+Run this against a local Redis with: python test_user_purge.py
+
+Leftover keys of the test users are removed afterwards.
+"""
+
+import asyncio
+import time
+import uuid
+from app.core.config import settings
+from app.core.redis_keys import read_keys
+from app.services.memory import MemoryManager
+from app.services.purge import UserDataPurger, key_family
+from check_utils import check, delete_keys, header, passed, run
+
+RUN = uuid.uuid4().hex[:8]
+TEST_USER = f"test_purge_{RUN}"
+# Shares the test user's id as a prefix, so must survive its purge
+OTHER_USER = f"test_purge_{RUN}0"
+
+async def populate(memory_manager, redis_client, user_id, conversations):
+    """Conversations, summaries, usage counters and a routing decision"""
+    for i in range(conversations):
+        await memory_manager.store_conversation(f"conv_{i}", user_id, [
+            {"role": "user", "content": f"Question {i} about purging redis keys"},
+            {"role": "assistant", "content": f"Answer {i} about unlink batches"}
+        ], "deepseek")
+    await memory_manager.store_summary("conv_0", user_id, "Earlier talk about purges", 1)
+    today = time.strftime("%Y-%m-%d")
+    await redis_client.hset(f"usage:{user_id}:{today}", "total_tokens", 42)
+    await redis_client.set(f"usage:{user_id}:{today}:messages", 3)
+    await redis_client.set(f"usage:{user_id}:monthly", 3)
+    await redis_client.set(f"routing_decision:{user_id}:{int(time.time() * 1000)}", "{}")
+
+async def user_keys(redis_client, user_id):
+    return sorted([key async for key in redis_client.scan_iter(match=f"*{user_id}*", count=1000)
+                   if key_family(key, user_id)])
+
+async def wait(purger):
+    while purger.tasks:
+        await asyncio.sleep(0.05)
+
+async def cleanup(redis_client):
+    await delete_keys(redis_client, f"*test_purge_{RUN}*")
+
+async def main():
+    memory_manager = MemoryManager()
+    redis_client = await memory_manager._get_redis()
+    purger = UserDataPurger(memory_manager)
+    results = []
+
+    header("User data purge test")
+
+    saved = settings.PURGE_SCAN_COUNT, settings.PURGE_BATCH_SIZE
+    try:
+        await populate(memory_manager, redis_client, TEST_USER, 40)
+        await populate(memory_manager, redis_client, OTHER_USER, 5)
+        other_before = await user_keys(redis_client, OTHER_USER)
+        families = {key_family(key, TEST_USER) for key in await user_keys(redis_client, TEST_USER)}
+        check(results, "Test user has every key family", len(families) == 7, str(sorted(families)))
+
+        # Small pages so the purge takes many checkpoints
+        settings.PURGE_SCAN_COUNT, settings.PURGE_BATCH_SIZE = 20, 8
+
+        # Interrupt the key scan after a few pages
+        scan = redis_client.scan
+        calls = 0
+        async def failing_scan(*args, **kwargs):
+            nonlocal calls
+            calls += 1
+            if calls == 3:
+                raise ConnectionError("simulated disconnect")
+            return await scan(*args, **kwargs)
+        redis_client.scan = failing_scan
+        await purger.start(TEST_USER)
+        await wait(purger)
+        redis_client.scan = scan
+        interrupted = await purger.progress(TEST_USER)
+        check(results, "Interrupted purge is reported as failed",
+              interrupted["status"] == "failed" and interrupted["stage"] == "keys", interrupted["error"])
+
+        await purger.start(TEST_USER)
+        await wait(purger)
+        progress = await purger.progress(TEST_USER)
+        check(results, "Resumed purge completes", progress["status"] == "done" and progress["progress"] == 1.0,
+              f"{progress['keys_deleted']} keys: {progress['keys_deleted_by_family']}")
+
+        left = await user_keys(redis_client, TEST_USER)
+        check(results, "No key of the user is left", left == [], str(left[:5]))
+        check(results, "Other users' keys are untouched", await user_keys(redis_client, OTHER_USER) == other_before)
+        check(results, "Other users' conversations still load",
+              len(await memory_manager.get_context("conv_0", OTHER_USER)) == 2)
+
+        await memory_manager.clear_conversation("conv_1", OTHER_USER)
+        check(results, "Deleting a conversation removes its meta hash",
+              not await redis_client.exists(read_keys(OTHER_USER).meta("conv_1")))
+    finally:
+        settings.PURGE_SCAN_COUNT, settings.PURGE_BATCH_SIZE = saved
+        await cleanup(redis_client)
+
+    return passed(results, "purge checks")
+
+if __name__ == "__main__":
+    run(main)